@@ -1,7 +1,7 @@
 from pydantic_settings import BaseSettings
 from sqlmodel import create_engine
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 import pdfkit
 
 class Settings(BaseSettings):
@@ -11,6 +11,107 @@ class Settings(BaseSettings):
     KNOWLEDGE_BASE_DIR: str = "backend/knowledge/"
     DOC_STORAGE_DIR: str = "backend/storage/"
     WKHTMLTOPDF_PATH: Optional[str] = None
+    # Deepseek 请求超时（秒）与连接池：最大连接数、保持的空闲连接数及其存活时间（秒）
+    DEEPSEEK_TIMEOUT: float = 100
+    DEEPSEEK_CONNECT_TIMEOUT: float = 10
+    DEEPSEEK_MAX_CONNECTIONS: int = 20
+    DEEPSEEK_MAX_KEEPALIVE: int = 10
+    DEEPSEEK_KEEPALIVE_EXPIRY: float = 30
+    # 大模型调用并发控制：全局 / 单用户并发上限，以及只留给对话和预览的名额数
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_MAX_PER_USER: int = 2
+    LLM_RESERVED_SLOTS: int = 2
+    # 各优先级排队的最长等待时间（秒），超时返回 503
+    LLM_QUEUE_TIMEOUT: Dict[str, float] = {
+        "interactive": 30,
+        "preview": 60,
+        "grading": 600,
+        "analysis": 1800,
+    }
+    # 大模型响应缓存：有效期（秒，0 表示关闭）、进程内条目上限，以及可选的 SQLite 文件路径
+    LLM_CACHE_TTL: int = 86400
+    LLM_CACHE_MAX_ENTRIES: int = 512
+    LLM_CACHE_SQLITE_PATH: Optional[str] = None
+    # 是否合并同时进行的相同大模型请求（含流式）
+    LLM_SINGLE_FLIGHT: bool = True
+    # 429 / 5xx / 超时的重试次数与指数退避的基础、最大间隔（秒）
+    LLM_RETRY_ATTEMPTS: int = 3
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 30.0
+    # 连续失败多少次后熔断，以及熔断后多少秒再放行探测请求
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_COOLDOWN: float = 30.0
+    # 对冲请求：样本不足时的等待时间、最短等待时间（秒）与线程数
+    LLM_HEDGE_DEFAULT_DELAY: float = 8.0
+    LLM_HEDGE_MIN_DELAY: float = 2.0
+    LLM_HEDGE_WORKERS: int = 8
+    # 大模型调用遥测：是否记录，以及批量写入的条数与间隔（秒）
+    LLM_METRICS_ENABLED: bool = True
+    LLM_METRICS_BATCH: int = 100
+    LLM_METRICS_FLUSH_INTERVAL: float = 5.0
+    # 后台任务：API 进程内是否运行 worker（独立部署 worker 时设为 False）、线程数、
+    # 轮询间隔与租约时长（秒）
+    JOB_WORKER_IN_PROCESS: bool = True
+    JOB_WORKERS: int = 4
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_LEASE_SECONDS: int = 300
+    # 任务失败后的最多尝试次数与指数退避的基础、最大间隔（秒）
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_DELAY: float = 10.0
+    JOB_RETRY_MAX_DELAY: float = 600.0
+    # 单个 worker 进程内各类任务的并发上限，未列出的类型只受 JOB_WORKERS 限制
+    JOB_CONCURRENCY: Dict[str, int] = {
+        "grade_submission": 4,
+        "grade_homework_batch": 2,
+        "render_courseware_pdf": 2,
+        "analyze_student": 1,
+    }
+    # 填空题数值答案本地批改时允许的相对 / 绝对误差
+    GRADING_NUMERIC_TOLERANCE: float = 1e-3
+    # 主观题按作业批量批改：提交后等待窗口（秒）收集同一作业的其它提交，
+    # 每道题一次调用最多包含的学生答案数与答案总字符数（控制 prompt 长度）
+    GRADING_BATCH_ENABLED: bool = True
+    GRADING_BATCH_WINDOW: float = 30.0
+    GRADING_BATCH_SIZE: int = 20
+    GRADING_BATCH_MAX_CHARS: int = 12000
+    # 主观题批改结果按 (题目, 规范化答案) 缓存，相同答案不再调用大模型
+    GRADING_CACHE_ENABLED: bool = True
+    # 编程题本地评测：并行子进程数（0 表示 CPU 核数）、每个用例的 CPU / 墙钟时间（秒）、
+    # 内存（MB）与输出（KB）上限，以及评测结果缓存条数
+    CODE_RUNNER_WORKERS: int = 0
+    CODE_RUNNER_CPU_SECONDS: int = 2
+    CODE_RUNNER_WALL_SECONDS: float = 5.0
+    CODE_RUNNER_MEMORY_MB: int = 256
+    CODE_RUNNER_OUTPUT_KB: int = 64
+    CODE_RUNNER_CACHE_SIZE: int = 2048
+    # 有测试用例的编程题按用例得分；为 True 时另外请大模型生成解析（不影响得分）
+    CODE_GRADING_EXPLAIN: bool = False
+    # 文档索引时每批编码 / 写入的块数
+    EMBED_BATCH_SIZE: int = 64
+    # 文本提取进程池大小（0 表示在请求进程内提取）、单个文件超时（秒）与子进程内存上限（MB）
+    EXTRACT_POOL_SIZE: int = 2
+    EXTRACT_TIMEOUT: int = 120
+    EXTRACT_MEMORY_MB: int = 2048
+    # 切块上限与块间重叠（单位：embedding 模型 token）
+    CHUNK_MAX_TOKENS: int = 250
+    CHUNK_OVERLAP_TOKENS: int = 40
+    # 向量检索后端："numpy"（进程内矩阵缓存）、"faiss" 或 "segment"（内存映射 .npy 段文件）
+    VECTOR_BACKEND: str = "numpy"
+    # 向量写入数据库的格式："float32" / "float16" / "int8"；已有数据会在后台迁移
+    VECTOR_STORAGE_DTYPE: str = "float32"
+    # 进程内矩阵缓存的格式，低于 float32 时检索先在压缩矩阵上粗排
+    VECTOR_CACHE_DTYPE: str = "float32"
+    # 粗排后是否取回候选向量按 float32 精排（仅当存储格式比缓存格式更精确），以及候选数为 top_k 的倍数
+    VECTOR_RESCORE: bool = True
+    VECTOR_RESCORE_CANDIDATES: int = 4
+    # segment 后端合并时，行数少于该值的段会被合并为一个大段
+    SEGMENT_COMPACT_MIN_ROWS: int = 1000
+    # 单个 scope 的向量数超过该值后，FAISS 索引由精确检索切换为近似检索
+    FAISS_ANN_THRESHOLD: int = 20000
+    FAISS_ANN_TYPE: str = "hnsw"  # "hnsw" 或 "ivf"
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_IVF_NPROBE: int = 16
 
     class Config:
         env_file = str(Path(__file__).parent / ".env")
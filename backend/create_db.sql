@@ -99,6 +99,7 @@ CREATE TABLE `submission` (
   `score` int NOT NULL DEFAULT '0',
   `status` varchar(20) NOT NULL DEFAULT 'grading',
   `feedback` json DEFAULT NULL,
+  `grading_claim` varchar(64) DEFAULT NULL,
   `submitted_at` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
   PRIMARY KEY (`id`),
   KEY `homework_id` (`homework_id`),
@@ -176,6 +177,7 @@ CREATE TABLE `chat_message` (
   `session_id` INT NOT NULL,
   `role` VARCHAR(20) NOT NULL,
   `content` LONGTEXT NOT NULL,
+  `truncated` TINYINT(1) NOT NULL DEFAULT 0,
   `created_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
   PRIMARY KEY (`id`),
   KEY `idx_cm_session` (`session_id`),
@@ -267,11 +269,14 @@ CREATE TABLE `document` (
   `owner_id` INT NOT NULL,
   `filename` VARCHAR(255) NOT NULL,
   `filepath` VARCHAR(500) NOT NULL,
+  `content_hash` VARCHAR(64) DEFAULT NULL,
+  `index_error` VARCHAR(500) DEFAULT NULL,
   `is_active` TINYINT(1) NOT NULL DEFAULT 0,
   `is_public` TINYINT(1) NOT NULL DEFAULT 0,
   `uploaded_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
   PRIMARY KEY (`id`),
   KEY `idx_doc_owner` (`owner_id`),
+  KEY `ix_document_content_hash` (`content_hash`),
   CONSTRAINT `fk_doc_owner` FOREIGN KEY (`owner_id`) REFERENCES `user` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
@@ -281,12 +286,35 @@ CREATE TABLE `document_vector` (
   `id` INT NOT NULL AUTO_INCREMENT,
   `doc_id` INT NOT NULL,
   `chunk_index` INT NOT NULL,
-  `vector_blob` LONGBLOB NOT NULL,
+  `vector_blob` LONGBLOB DEFAULT NULL,
+  `vector_dtype` VARCHAR(16) DEFAULT NULL,
+  `vector_scale` FLOAT DEFAULT NULL,
+  `content` TEXT COLLATE utf8mb4_unicode_ci,
+  `start_offset` INT DEFAULT NULL,
+  `end_offset` INT DEFAULT NULL,
+  `token_count` INT DEFAULT NULL,
   PRIMARY KEY (`id`),
   KEY `idx_vec_doc` (`doc_id`),
   CONSTRAINT `fk_vec_doc` FOREIGN KEY (`doc_id`) REFERENCES `document` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
+-- 段落向量表：按空行切分的段落及其 embedding，供段落级检索使用
+DROP TABLE IF EXISTS `document_paragraph`;
+CREATE TABLE `document_paragraph` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `doc_id` INT NOT NULL,
+  `para_index` INT NOT NULL,
+  `content` TEXT COLLATE utf8mb4_unicode_ci,
+  `start_offset` INT NOT NULL,
+  `end_offset` INT NOT NULL,
+  `vector_blob` LONGBLOB NOT NULL,
+  `vector_dtype` VARCHAR(16) DEFAULT NULL,
+  `vector_scale` FLOAT DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_para_doc` (`doc_id`),
+  CONSTRAINT `fk_para_doc` FOREIGN KEY (`doc_id`) REFERENCES `document` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
 -- Per-teacher activation table
 DROP TABLE IF EXISTS `document_activation`;
 CREATE TABLE `document_activation` (
@@ -298,6 +326,51 @@ CREATE TABLE `document_activation` (
   CONSTRAINT `fk_da_doc` FOREIGN KEY (`doc_id`) REFERENCES `document` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
+-- 后台任务表：批改、课件 PDF 渲染、学情分析等，由 worker 按优先级认领
+DROP TABLE IF EXISTS `job`;
+CREATE TABLE `job` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `kind` VARCHAR(64) NOT NULL,
+  `payload` JSON DEFAULT NULL,
+  `priority` INT NOT NULL DEFAULT 100,
+  `status` VARCHAR(16) NOT NULL DEFAULT 'queued',
+  `attempts` INT NOT NULL DEFAULT 0,
+  `max_attempts` INT NOT NULL DEFAULT 3,
+  `run_after` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  `locked_by` VARCHAR(128) DEFAULT NULL,
+  `lease_until` DATETIME(6) DEFAULT NULL,
+  `last_error` VARCHAR(500) DEFAULT NULL,
+  `dedupe_key` VARCHAR(128) DEFAULT NULL,
+  `created_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  `started_at` DATETIME(6) DEFAULT NULL,
+  `finished_at` DATETIME(6) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `ix_job_kind` (`kind`),
+  KEY `ix_job_status` (`status`),
+  KEY `ix_job_run_after` (`run_after`),
+  KEY `ix_job_dedupe_key` (`dedupe_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- 主观题批改结果缓存：同一题目下规范化后相同的答案复用已有的得分与解析
+DROP TABLE IF EXISTS `grading_cache`;
+CREATE TABLE `grading_cache` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `exercise_id` INT NOT NULL,
+  `question_id` VARCHAR(64) NOT NULL,
+  `key_hash` VARCHAR(64) NOT NULL,
+  `answer_hash` VARCHAR(64) NOT NULL,
+  `result` VARCHAR(16) NOT NULL,
+  `score` DOUBLE NOT NULL DEFAULT 0,
+  `explanation` TEXT,
+  `hits` INT NOT NULL DEFAULT 0,
+  `created_at` DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  `last_hit_at` DATETIME(6) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_grading_cache` (`exercise_id`, `question_id`, `key_hash`, `answer_hash`),
+  KEY `ix_grading_cache_exercise_id` (`exercise_id`),
+  CONSTRAINT `grading_cache_ibfk_1` FOREIGN KEY (`exercise_id`) REFERENCES `exercise` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
 
 
 --
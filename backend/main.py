@@ -1,13 +1,13 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import SQLModel, Session
 from sqlalchemy import inspect, text
 from time import perf_counter
 
-from backend.config import engine
-from backend.models import RequestMetric
+from backend.config import engine, settings
+from backend.models import DocumentVector, RequestMetric
 from backend.auth import router as auth_router
 from backend.routers.lesson_router import router as lesson_router
 from backend.routers.exercise_router import router as exercise_router
@@ -17,6 +17,18 @@ from backend.routers.student_router import router, router_practice, router_analy
 from backend.routers.class_router import router as class_router
 from backend.routers.admin_router import router as admin_router
 from backend.routers.doc_router import router as doc_router
+from backend.utils import (
+    deepseek_client,
+    extract_pool,
+    faiss_index,
+    job_queue,
+    llm_resilience,
+    llm_telemetry,
+)
+from backend.utils.llm_resilience import CircuitOpenError
+from backend.utils.llm_scheduler import LLMQueueTimeout
+from backend.services.document_service import start_vector_migration
+from backend.services.job_service import recover_orphaned_submissions
 
 app = FastAPI()
 app.add_middleware(
@@ -28,6 +40,25 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(LLMQueueTimeout)
+async def llm_queue_timeout(request: Request, exc: LLMQueueTimeout):
+    # 大模型并发已满且排队超时，提示前端稍后重试
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "AI 服务繁忙，请稍后重试"},
+        headers={"Retry-After": "10"},
+    )
+
+
+@app.exception_handler(CircuitOpenError)
+async def llm_circuit_open(request: Request, exc: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(settings.LLM_BREAKER_COOLDOWN))},
+    )
+
+
 @app.middleware("http")
 async def record_metrics(request: Request, call_next):
     start = perf_counter()
@@ -43,6 +74,24 @@ async def record_metrics(request: Request, call_next):
         sess.add(metric)
         sess.commit()
     return response
+
+
+def _rebuild_sqlite_table(conn, table) -> None:
+    """
+    SQLite 不能修改已有列的约束：按当前模型重建表，再拷贝两边都有的列。
+    """
+    old = f"{table.name}_old"
+    old_cols = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {old}"))
+    # 索引随表改名保留原名，先删掉以免与新表的索引重名
+    for index in inspect(conn).get_indexes(old):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    table.create(conn)
+    cols = ", ".join(c.name for c in table.columns if c.name in old_cols)
+    conn.execute(text(f"INSERT INTO {table.name} ({cols}) SELECT {cols} FROM {old}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+
 @app.on_event("startup")
 def on_startup():
     SQLModel.metadata.create_all(engine)
@@ -62,6 +111,62 @@ def on_startup():
                 conn.execute(text(
                     "ALTER TABLE homework ADD CONSTRAINT homework_class_fk FOREIGN KEY(class_id) REFERENCES class(id)"
                 ))
+        if "document" in insp.get_table_names():
+            cols = {c["name"] for c in insp.get_columns("document")}
+            if "content_hash" not in cols:
+                conn.execute(text("ALTER TABLE document ADD COLUMN content_hash VARCHAR(64)"))
+                conn.execute(text("CREATE INDEX ix_document_content_hash ON document (content_hash)"))
+            if "index_error" not in cols:
+                conn.execute(text("ALTER TABLE document ADD COLUMN index_error VARCHAR(500)"))
+        if "document_vector" in insp.get_table_names():
+            cols = {c["name"] for c in insp.get_columns("document_vector")}
+            if "content" not in cols:
+                conn.execute(text("ALTER TABLE document_vector ADD COLUMN content TEXT"))
+            for col in ("start_offset", "end_offset", "token_count"):
+                if col not in cols:
+                    conn.execute(text(f"ALTER TABLE document_vector ADD COLUMN {col} INTEGER"))
+        if "submission" in insp.get_table_names():
+            cols = {c["name"] for c in insp.get_columns("submission")}
+            if "grading_claim" not in cols:
+                conn.execute(text("ALTER TABLE submission ADD COLUMN grading_claim VARCHAR(64)"))
+        if "chat_message" in insp.get_table_names():
+            cols = {c["name"] for c in insp.get_columns("chat_message")}
+            if "truncated" not in cols:
+                conn.execute(text("ALTER TABLE chat_message ADD COLUMN truncated BOOLEAN NOT NULL DEFAULT 0"))
+        for table in ("document_vector", "document_paragraph"):
+            if table in insp.get_table_names():
+                cols = {c["name"] for c in insp.get_columns(table)}
+                if "vector_dtype" not in cols:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN vector_dtype VARCHAR(16)"))
+                if "vector_scale" not in cols:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN vector_scale FLOAT"))
+        # segment 后端的块向量不存数据库，vector_blob 须允许 NULL
+        if "document_vector" in insp.get_table_names():
+            blob = next(c for c in insp.get_columns("document_vector") if c["name"] == "vector_blob")
+            if not blob["nullable"]:
+                if conn.dialect.name == "mysql":
+                    conn.execute(text("ALTER TABLE document_vector MODIFY vector_blob LONGBLOB NULL"))
+                elif conn.dialect.name == "sqlite":
+                    _rebuild_sqlite_table(conn, DocumentVector.__table__)
+
+    if settings.VECTOR_BACKEND == "faiss":
+        faiss_index.load_all()
+    # 已有向量按 VECTOR_STORAGE_DTYPE 在后台转换格式
+    start_vector_migration()
+    # 重启前未完成批改的提交重新排队；独立部署 worker 时不在 API 进程内执行任务
+    recover_orphaned_submissions()
+    if settings.JOB_WORKER_IN_PROCESS:
+        job_queue.start_worker()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    job_queue.stop_worker()
+    extract_pool.shutdown()
+    deepseek_client.close()
+    llm_resilience.shutdown()
+    llm_telemetry.shutdown()
+    await deepseek_client.aclose()
 
 app.include_router(auth_router, prefix="/auth")
 app.include_router(lesson_router)
@@ -2,7 +2,7 @@
 from typing import Optional, Any, List
 from datetime import datetime
 from sqlmodel import SQLModel, Field, Relationship
-from sqlalchemy import Column, JSON, LargeBinary, Text, Enum
+from sqlalchemy import Column, JSON, LargeBinary, Text, Enum, UniqueConstraint
 
 
 class Role(SQLModel, table=True):
@@ -78,6 +78,8 @@ class Submission(SQLModel, table=True):
     score: int = Field(default=0)
     status: str = Field(default="grading")
     feedback: Any = Field(sa_column=Column(JSON), default_factory=dict)
+    # 正在批改该提交的任务，防止多个批改任务同时处理同一份提交
+    grading_claim: Optional[str] = Field(default=None, max_length=64)
 
     submitted_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -139,6 +141,8 @@ class ChatMessage(SQLModel, table=True):
     session_id: int = Field(foreign_key="chat_session.id", nullable=False)
     role: str = Field(max_length=20)
     content: str = Field(sa_column=Column(Text(collation="utf8mb4_unicode_ci")))
+    # 流式回答因客户端断开而中途停止，content 只是部分回答
+    truncated: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     session: ChatSession = Relationship(back_populates="messages")
@@ -168,6 +172,10 @@ class Document(SQLModel, table=True):
     owner_id: int = Field(foreign_key="user.id")
     filename: str = Field(max_length=255)
     filepath: str = Field(max_length=500)
+    # 文件内容的 sha256，相同内容的上传共用一份文件和向量
+    content_hash: Optional[str] = Field(default=None, max_length=64, index=True)
+    # 最近一次索引失败的原因（如文本提取超时），成功时为 NULL
+    index_error: Optional[str] = Field(default=None, max_length=500, nullable=True)
     is_active: bool = Field(default=False)
     is_public: bool = Field(default=False)
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
@@ -183,11 +191,39 @@ class DocumentVector(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     doc_id: int = Field(foreign_key="document.id")
     chunk_index: int = Field()
-    vector_blob: bytes = Field(sa_column=Column(LargeBinary))
+    # segment 后端下向量存放在段文件中，此列为 NULL
+    vector_blob: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    # 存储格式：NULL/float32 为原始格式，float16 / int8 见 utils/vector_codec
+    vector_dtype: Optional[str] = Field(default=None, max_length=16, nullable=True)
+    vector_scale: Optional[float] = Field(default=None, nullable=True)
+    # 块文本及其在源文档中的位置，检索时直接返回，无需重新解析文件
+    content: Optional[str] = Field(
+        default=None, sa_column=Column(Text(collation="utf8mb4_unicode_ci"))
+    )
+    start_offset: Optional[int] = Field(default=None)
+    end_offset: Optional[int] = Field(default=None)
+    token_count: Optional[int] = Field(default=None)
 
     document: Document = Relationship(back_populates="vectors")
 
 
+class DocumentParagraph(SQLModel, table=True):
+    """Paragraph-level embeddings used by ``retrieve_paragraphs``."""
+
+    __tablename__ = "document_paragraph"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    doc_id: int = Field(foreign_key="document.id", index=True)
+    para_index: int = Field()
+    content: str = Field(sa_column=Column(Text(collation="utf8mb4_unicode_ci")))
+    start_offset: int = Field()
+    end_offset: int = Field()
+    vector_blob: bytes = Field(sa_column=Column(LargeBinary))
+    # 存储格式：NULL/float32 为原始格式，float16 / int8 见 utils/vector_codec
+    vector_dtype: Optional[str] = Field(default=None, max_length=16, nullable=True)
+    vector_scale: Optional[float] = Field(default=None, nullable=True)
+
+
 class DocumentActivation(SQLModel, table=True):
     """Per-teacher activation state for documents."""
 
@@ -268,6 +304,61 @@ class ClassStudent(SQLModel, table=True):
     class_: Class = Relationship(back_populates="students")
     student: User = Relationship(back_populates="class_memberships")
 
+class Job(SQLModel, table=True):
+    """
+    后台任务：批改、课件 PDF 渲染、学情分析等，由 ``backend.utils.job_queue``
+    的 worker 认领执行。
+    """
+
+    __tablename__ = "job"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str = Field(max_length=64, index=True)
+    payload: Any = Field(sa_column=Column(JSON), default_factory=dict)
+    # 数字越小越先执行
+    priority: int = Field(default=100)
+    # queued / running / done / failed
+    status: str = Field(default="queued", max_length=16, index=True)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    run_after: datetime = Field(default_factory=datetime.utcnow, index=True)
+    # 认领该任务的 worker 及租约到期时间，过期后可被其它 worker 重新认领
+    locked_by: Optional[str] = Field(default=None, max_length=128)
+    lease_until: Optional[datetime] = None
+    last_error: Optional[str] = Field(default=None, max_length=500)
+    # 同一个键只保留一个排队中的任务
+    dedupe_key: Optional[str] = Field(default=None, max_length=128, index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class GradingCache(SQLModel, table=True):
+    """
+    主观题批改结果缓存：同一练习同一题目下，规范化后相同的答案直接复用
+    大模型给出的得分与解析。``key_hash`` 为该题题干、标准答案和分值的摘要，
+    教师修改后旧记录自然失效。
+    """
+
+    __tablename__ = "grading_cache"
+    __table_args__ = (
+        UniqueConstraint("exercise_id", "question_id", "key_hash", "answer_hash", name="uq_grading_cache"),
+        {"mysql_charset": "utf8mb4"},
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    exercise_id: int = Field(foreign_key="exercise.id", index=True)
+    question_id: str = Field(max_length=64)
+    key_hash: str = Field(max_length=64)
+    answer_hash: str = Field(max_length=64)
+    result: str = Field(max_length=16)
+    score: float = Field(default=0)
+    explanation: Optional[str] = Field(default=None, sa_column=Column(Text))
+    hits: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_hit_at: Optional[datetime] = None
+
+
 class RequestMetric(SQLModel, table=True):
     __tablename__ = "request_metric"
 
@@ -277,3 +368,41 @@ class RequestMetric(SQLModel, table=True):
     status_code: int
     duration_ms: float
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class DocumentIndexMetric(SQLModel, table=True):
+    """Per-document indexing timings, used to track ingestion throughput."""
+
+    __tablename__ = "document_index_metric"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    doc_id: int = Field(index=True)
+    chunk_count: int
+    extract_ms: float
+    chunk_ms: float
+    embed_ms: float
+    insert_ms: float
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class LLMCallMetric(SQLModel, table=True):
+    """One LLM call as seen by a call site: latency, tokens and outcome."""
+
+    __tablename__ = "llm_call_metric"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    call_site: str = Field(max_length=32, index=True)
+    model: str = Field(max_length=64)
+    stream: bool = False
+    # api：发起了上游请求；cache：响应缓存命中；coalesced：合并到进行中的相同请求
+    source: str = Field(max_length=16)
+    # ok / error / abandoned（流未读完即被关闭）
+    outcome: str = Field(max_length=16)
+    error: Optional[str] = Field(default=None, max_length=255)
+    latency_ms: float
+    ttft_ms: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    retries: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
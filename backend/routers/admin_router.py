@@ -4,15 +4,16 @@ import io
 from urllib.parse import quote
 
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 from sqlalchemy import func,case
 from pydantic import BaseModel
 from backend.utils.scoring import compute_total_points
 
 from backend.auth import get_current_user
-from backend.config import engine
-from backend.routers.lesson_router import _generate_and_store_pdf
+from backend.config import engine, settings
+from backend.services.courseware_service import enqueue_pdf, generate_and_store_pdf, pdf_pending
 from backend.models import (
     User, Role, Courseware, Exercise, Homework, Submission,
     ChatHistory,
@@ -23,10 +24,22 @@ from backend.models import (
     StudentAnalysis,
     Document,
     RequestMetric,
+    DocumentIndexMetric,
+    LLMCallMetric,
     Class,
     ClassStudent,
     DocumentActivation,
     DocumentVector,
+    DocumentParagraph,
+)
+from backend.utils import (
+    job_queue,
+    llm_cache,
+    llm_resilience,
+    llm_scheduler,
+    segment_store,
+    single_flight,
+    vector_cache,
 )
 from backend.services.document_service import (
     save_public_document,
@@ -75,6 +88,7 @@ class DocumentInfo(BaseModel):
     filepath: str
     is_active: bool
     uploaded_at: datetime
+    index_error: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -146,9 +160,16 @@ def delete_user(uid: int, current: User = Depends(get_current_user)):
         for cs in sess.exec(select(ClassStudent).where(ClassStudent.student_id == uid)):
             sess.delete(cs)
         # 删除用户关联的文档及其向量/激活记录
+        public_docs = []
         for d in sess.exec(select(Document).where(Document.owner_id == uid)):
+            if d.is_public:
+                public_docs.append(d.id)
             for vec in sess.exec(select(DocumentVector).where(DocumentVector.doc_id == d.id)):
                 sess.delete(vec)
+            for para in sess.exec(
+                select(DocumentParagraph).where(DocumentParagraph.doc_id == d.id)
+            ):
+                sess.delete(para)
             for act in sess.exec(
                 select(DocumentActivation).where(DocumentActivation.doc_id == d.id)
             ):
@@ -169,7 +190,12 @@ def delete_user(uid: int, current: User = Depends(get_current_user)):
             sess.delete(c)
         sess.delete(user)
         sess.commit()
-        return {"status": "ok"}
+    if settings.VECTOR_BACKEND == "segment":
+        segment_store.drop_scope(uid)
+        for doc_id in public_docs:
+            segment_store.remove_document(vector_cache.PUBLIC_SCOPE, doc_id)
+    vector_cache.clear()
+    return {"status": "ok"}
 
 
 @router.get("/coursewares", response_model=List[CoursewareMeta])
@@ -241,8 +267,12 @@ def download_courseware(cid: int, current: User = Depends(get_current_user)):
         if not cw:
             raise HTTPException(404, "课件不存在")
         if not cw.pdf:
-            _generate_and_store_pdf(cw.id, cw.markdown)
-            sess.refresh(cw)
+            if not pdf_pending(cw.id):
+                generate_and_store_pdf(cw.id, cw.markdown)
+                sess.refresh(cw)
+            if not cw.pdf:
+                # 课件刚更新，后台任务正在按新内容重新生成
+                return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"status": "generating"})
         raw_name = f"lesson_{cw.topic}.pdf"
         fallback = "lesson.pdf"
         quoted = quote(raw_name, safe="")
@@ -263,11 +293,13 @@ def update_courseware(cid: int, data: CoursewareUpdate, current: User = Depends(
         if not cw:
             raise HTTPException(404, "课件不存在")
         cw.markdown = data.markdown
+        # 旧 PDF 与新内容不符，与 Markdown 一起清空，后台任务重新生成
+        cw.pdf = None
         cw.prep_start = cw.prep_start or datetime.utcnow()
         cw.prep_end = datetime.utcnow()
         sess.add(cw)
         sess.commit()
-        _generate_and_store_pdf(cw.id, cw.markdown)
+        enqueue_pdf(cw.id)
         teacher = sess.get(User, cw.teacher_id)
         return CoursewareMeta(
             id=cw.id,
@@ -290,6 +322,7 @@ def list_public_docs(current: User = Depends(get_current_user)):
             filepath=d.filepath,
             is_active=d.is_active,
             uploaded_at=d.uploaded_at,
+            index_error=d.index_error,
         )
         for d in docs
     ]
@@ -304,7 +337,7 @@ async def upload_public_doc(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员上传")
     data = await file.read()
     try:
-        doc = save_public_document(current.id, file.filename, data)
+        doc = await run_in_threadpool(save_public_document, current.id, file.filename, data)
     except RuntimeError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return DocumentInfo(
@@ -313,6 +346,7 @@ async def upload_public_doc(
         filepath=doc.filepath,
         is_active=doc.is_active,
         uploaded_at=doc.uploaded_at,
+        index_error=doc.index_error,
     )
 
 
@@ -604,6 +638,171 @@ def performance_metrics(current: User = Depends(get_current_user)):
     return {"averageLoadTime": avg_load, "averageErrorRate": error_rate}
 
 
+_PERCENTILES = (0.50, 0.95, 0.99)
+
+
+def _latency_percentiles(sess: Session, site: str, n: int, *conditions) -> List[float]:
+    """
+    Latency percentiles of ``n`` rows of ``site``, each fetched with
+    ORDER BY ... OFFSET instead of loading every latency into memory.
+    """
+    return [
+        sess.exec(
+            select(LLMCallMetric.latency_ms)
+            .where(LLMCallMetric.call_site == site, *conditions)
+            .order_by(LLMCallMetric.latency_ms)
+            .offset(min(n - 1, int(n * q)))
+            .limit(1)
+        ).one()
+        for q in _PERCENTILES
+    ]
+
+
+@router.get("/llm_metrics")
+def llm_metrics(current: User = Depends(get_current_user)):
+    """近 7 天各调用点的大模型耗时分位数、TTFT、token 用量、缓存命中与被放弃的流"""
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    with Session(engine) as sess:
+        totals = sess.exec(
+            select(
+                LLMCallMetric.call_site,
+                func.count(),
+                func.sum(case((LLMCallMetric.outcome == "error", 1), else_=0)),
+                func.sum(case((LLMCallMetric.outcome == "abandoned", 1), else_=0)),
+                func.sum(case((LLMCallMetric.source == "cache", 1), else_=0)),
+                func.sum(case((LLMCallMetric.source == "coalesced", 1), else_=0)),
+                func.sum(LLMCallMetric.retries),
+                func.avg(LLMCallMetric.ttft_ms),
+                func.sum(LLMCallMetric.prompt_tokens),
+                func.sum(LLMCallMetric.completion_tokens),
+                func.sum(LLMCallMetric.cached_tokens),
+            )
+            .where(LLMCallMetric.created_at >= week_ago)
+            .group_by(LLMCallMetric.call_site)
+        ).all()
+        # MySQL 没有通用的 percentile 聚合：先按调用点计数，再用 OFFSET 逐个取分位数
+        ok_api = (
+            LLMCallMetric.created_at >= week_ago,
+            LLMCallMetric.source == "api",
+            LLMCallMetric.outcome == "ok",
+        )
+        latencies = {
+            site: _latency_percentiles(sess, site, n, *ok_api)
+            for site, n in sess.exec(
+                select(LLMCallMetric.call_site, func.count()).where(*ok_api).group_by(LLMCallMetric.call_site)
+            ).all()
+        }
+        # 被放弃的流节省的 token：按同一调用点完整流式回答的平均长度，减去放弃前已输出的部分
+        full_avg = sess.exec(
+            select(LLMCallMetric.call_site, func.avg(LLMCallMetric.completion_tokens))
+            .where(*ok_api, LLMCallMetric.stream == True)
+            .group_by(LLMCallMetric.call_site)
+        ).all()
+        delivered = func.coalesce(LLMCallMetric.completion_tokens, 0)
+        saved = {}
+        for site, avg in full_avg:
+            if not avg:
+                continue
+            avg = float(avg)
+            n, total = sess.exec(
+                select(func.count(), func.coalesce(func.sum(delivered), 0)).where(
+                    LLMCallMetric.created_at >= week_ago,
+                    LLMCallMetric.call_site == site,
+                    LLMCallMetric.source == "api",
+                    LLMCallMetric.outcome == "abandoned",
+                    delivered < avg,
+                )
+            ).one()
+            saved[site] = n * avg - float(total)
+
+    out = {}
+    for site, calls, errors, abandoned, cache_hits, coalesced, retries, ttft, prompt_tk, completion_tk, cached_tk in totals:
+        p50, p95, p99 = latencies.get(site, (0.0, 0.0, 0.0))
+        out[site] = {
+            "calls": calls,
+            "errors": errors or 0,
+            "abandoned": abandoned or 0,
+            "tokensSaved": round(saved.get(site, 0)),
+            "cacheHits": cache_hits or 0,
+            "coalesced": coalesced or 0,
+            "retries": retries or 0,
+            "p50LatencyMs": p50,
+            "p95LatencyMs": p95,
+            "p99LatencyMs": p99,
+            "averageTtftMs": ttft or 0.0,
+            "promptTokens": prompt_tk or 0,
+            "completionTokens": completion_tk or 0,
+            "cachedTokens": cached_tk or 0,
+        }
+    return out
+
+
+@router.get("/indexing_metrics")
+def indexing_metrics(current: User = Depends(get_current_user)):
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    with Session(engine) as sess:
+        docs, chunks, extract_ms, chunk_ms, embed_ms, insert_ms = sess.exec(
+            select(
+                func.count(),
+                func.sum(DocumentIndexMetric.chunk_count),
+                func.sum(DocumentIndexMetric.extract_ms),
+                func.sum(DocumentIndexMetric.chunk_ms),
+                func.sum(DocumentIndexMetric.embed_ms),
+                func.sum(DocumentIndexMetric.insert_ms),
+            ).where(DocumentIndexMetric.created_at >= week_ago)
+        ).one()
+    docs = docs or 0
+    chunks = chunks or 0
+    total_ms = (extract_ms or 0) + (chunk_ms or 0) + (embed_ms or 0) + (insert_ms or 0)
+    return {
+        "documents": docs,
+        "chunks": chunks,
+        "averageExtractMs": (extract_ms or 0) / docs if docs else 0.0,
+        "averageChunkMs": (chunk_ms or 0) / docs if docs else 0.0,
+        "averageEmbedMs": (embed_ms or 0) / docs if docs else 0.0,
+        "averageInsertMs": (insert_ms or 0) / docs if docs else 0.0,
+        "chunksPerSecond": chunks / (total_ms / 1000) if total_ms else 0.0,
+    }
+
+
+@router.get("/llm_scheduler")
+def llm_scheduler_stats(current: User = Depends(get_current_user)):
+    """当前进程的大模型调用队列深度、并发数与各优先级等待时间"""
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+    return llm_scheduler.stats()
+
+
+@router.get("/llm_cache")
+def llm_cache_stats(current: User = Depends(get_current_user)):
+    """当前进程的大模型响应缓存命中情况，以及合并的并发相同请求数"""
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+    return {**llm_cache.stats(), "singleFlight": single_flight.stats()}
+
+
+@router.get("/llm_resilience")
+def llm_resilience_stats(current: User = Depends(get_current_user)):
+    """熔断器状态与状态切换次数、重试与对冲计数"""
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+    return llm_resilience.stats()
+
+
+@router.get("/jobs")
+def job_stats(current: User = Depends(get_current_user)):
+    """后台任务各类型、各状态的数量，以及最早一个待执行任务的等待时间"""
+    if not current.role or current.role.name != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="仅限管理员访问")
+    return job_queue.stats()
+
+
 @router.get("/teacher_stats")
 def teacher_stats(current: User = Depends(get_current_user)):
     if not current.role or current.role.name != "admin":
@@ -1,5 +1,6 @@
 from typing import List
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session
 
 from backend.auth import get_current_user
@@ -29,7 +30,10 @@ async def upload_doc(
         )
     data = await file.read()
     try:
-        doc = save_document(current.id, file.filename, data, is_public=is_public)
+        # 提取与向量化在线程池中执行，不阻塞事件循环
+        doc = await run_in_threadpool(
+            save_document, current.id, file.filename, data, is_public=is_public
+        )
     except RuntimeError as e:
         raise HTTPException(status_code=400, detail=str(e))
     return {
@@ -38,6 +42,7 @@ async def upload_doc(
         "is_active": doc.is_active,
         "is_public": doc.is_public,
         "uploaded_at": doc.uploaded_at,
+        "index_error": doc.index_error,
     }
 
 
@@ -58,6 +63,7 @@ def list_docs(scope: str = "my", current: User = Depends(get_current_user)):
             "is_active": d.is_active,
             "is_public": d.is_public,
             "uploaded_at": d.uploaded_at,
+            "index_error": d.index_error,
         }
         for d in docs
     ]
@@ -21,6 +21,7 @@ from backend.services.exercise_service import (
     stats_for_exercise,
     render_exercise_pdf,
     delete_exercise,
+    update_exercise_answers,
 )
 from backend.auth import get_current_user
 from backend.models import User
@@ -35,6 +36,11 @@ class SaveExerciseRequest(BaseModel):
     points: dict
 
 
+class UpdateAnswersRequest(BaseModel):
+    answers: dict
+    points: dict | None = None
+
+
 class AssignRequest(BaseModel):
     class_id: int | None = None
 
@@ -50,6 +56,8 @@ def api_generate(req: GenerateExerciseRequest, user: User = Depends(get_current_
         num_fill_blank=req.num_fill_blank,
         num_short_answer=req.num_short_answer,
         num_programming=req.num_programming,
+        user_id=user.id,
+        fresh=req.fresh,
     )
     if req.export_pdf:
         pdf = render_exercise_pdf(f"练习：{req.topic}", data.get("questions", []), answers=data.get("answers", {}))
@@ -149,6 +157,14 @@ def api_stats(ex_id: int, user: User = Depends(get_current_user)):
     return stats_for_exercise(ex_id)
 
 
+@router.post("/{ex_id}/answers", response_model=ExerciseOut)
+def api_update_answers(ex_id: int, req: UpdateAnswersRequest, user: User = Depends(get_current_user)):
+    ex = get_exercise(ex_id)
+    if not ex or ex.teacher_id != user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权修改")
+    return update_exercise_answers(ex_id, req.answers, req.points)
+
+
 @router.delete("/{ex_id}")
 def api_delete(ex_id: int, user: User = Depends(get_current_user)):
     if user.role.name != "teacher":
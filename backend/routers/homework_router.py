@@ -1,7 +1,7 @@
 # backend/routers/homework_router.py
 
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from backend.auth import get_current_user
 from backend.schemas.submission_schema import (
     SubmitRequest,
@@ -13,7 +13,7 @@ from backend.schemas.exercise_schema import ExerciseOut, ExerciseQuestionsOut
 from backend.services.submission_service import (
     list_student_homeworks,
     submit_homework,
-    grade_submission,
+    enqueue_submission_grading,
     get_submission_by_hw_student,
     get_homework_exercise,
 )
@@ -40,12 +40,11 @@ def api_hw_exercise(hw_id: int, user=Depends(get_current_user)):
 def api_submit(
     hw_id: int,
     req: SubmitRequest,
-    background_tasks: BackgroundTasks,
     user=Depends(get_current_user)
 ):
     sub = submit_homework(hw_id, user.id, req.answers)
-    # 异步批改
-    background_tasks.add_task(grade_submission, sub.id)
+    # 放入后台任务队列批改
+    enqueue_submission_grading(sub)
     return SubmissionStatusOut(submission_id=sub.id, status=sub.status)
 
 @router.get(
@@ -56,6 +55,8 @@ def api_result(hw_id: int, user=Depends(get_current_user)):
     sub = get_submission_by_hw_student(hw_id, user.id)
     if not sub:
         raise HTTPException(status_code=404, detail="未提交作业")
+    if sub.status == "failed":
+        raise HTTPException(status_code=400, detail="作业批改失败，请联系老师")
     if sub.status != "completed":
         raise HTTPException(status_code=400, detail="作业尚在批改中")
     # sub.homework 及 sub.homework.exercise 已可访问
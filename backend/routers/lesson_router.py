@@ -3,29 +3,32 @@
 import io
 import re
 from urllib.parse import quote
-from typing import Dict, List
+from typing import Dict, List, Tuple
 from datetime import datetime
 
-import markdown as md
-import pdfkit
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlmodel import Session, select
 from pydantic import BaseModel
 
+from backend.services.courseware_service import enqueue_pdf, render_pdf
 from backend.services.lesson_service import generate_lesson, optimize_lesson
 from backend.auth import get_current_user
 from backend.models import User, Courseware
-from backend.db import get_session, SessionLocal
+from backend.db import get_session
+from backend.utils.llm_resilience import CircuitOpenError
+from backend.utils.llm_scheduler import LLMQueueTimeout
 
 router = APIRouter(prefix="/teacher/lesson", tags=["prepare"])
 
-# 缓存：避免重复调用大模型
-lesson_markdown_cache: Dict[str, str] = {}
+# 每位教师各主题最近一次预览 / 优化的教案，保存时使用；重复生成由 llm_cache 负责
+lesson_drafts: Dict[Tuple[int, str], str] = {}
 lesson_prep_start: Dict[int, datetime] = {}
 
 class LessonRequest(BaseModel):
     topic: str
+    # 为 True 时不使用缓存的生成结果
+    fresh: bool = False
 
 class CoursewareMeta(BaseModel):
     id: int
@@ -48,73 +51,6 @@ class LessonOptimizeRequest(BaseModel):
     instruction: str
 
 
-def _strip_outer_fences(md_text: str) -> str:
-    """
-    如果文本以 ``` 开头，以 ``` 结尾，就去掉这两行 fence，
-    避免整个教案都被当作单个代码块。
-    """
-    lines = md_text.splitlines()
-    if len(lines) >= 2 and lines[0].startswith("```") and lines[-1].startswith("```"):
-        return "\n".join(lines[1:-1])
-    return md_text
-
-
-def _generate_and_store_pdf(cw_id: int, md_text: str):
-    """
-    后台任务：把 Markdown 渲染为 HTML（支持标题、列表、表格、代码块等），
-    再生成 PDF 并写回数据库
-    """
-    # 1. 先去掉最外层的 fenced code
-    clean_md = _strip_outer_fences(md_text)
-
-    # 2. Markdown -> HTML，开启常见扩展
-    html_body = md.markdown(
-        clean_md,
-        extensions=[
-            "extra",
-            "sane_lists",
-            "toc",
-            "fenced_code",
-            "tables",
-        ]
-    )
-
-    # 3. 包裹完整 HTML 并内嵌基本 CSS
-    html = f"""
-    <html>
-      <head>
-        <meta charset="utf-8"/>
-        <style>
-          body {{ font-family: sans-serif; padding: 20px; }}
-          h1, h2, h3, h4 {{ font-weight: bold; margin-top: 1em; }}
-          strong {{ font-weight: bold; }}
-          em {{ font-style: italic; }}
-          table {{ border-collapse: collapse; width: 100%; margin: 1em 0; }}
-          table, th, td {{ border: 1px solid #333; padding: 6px; }}
-          pre {{ background: #f5f5f5; padding: 10px; overflow: auto; }}
-          code {{ background: #f0f0f0; padding: 2px 4px; }}
-        </style>
-      </head>
-      <body>
-        {html_body}
-      </body>
-    </html>
-    """
-
-    # 4. 生成 PDF
-    pdf_bytes = pdfkit.from_string(html, False)
-
-    # 5. 写回数据库（覆盖旧 PDF）
-    db = SessionLocal()
-    try:
-        cw = db.get(Courseware, cw_id)
-        cw.pdf = pdf_bytes
-        db.add(cw)
-        db.commit()
-    finally:
-        db.close()
-
-
 @router.post(
     "/prepare",
     summary="生成教案 Markdown 预览",
@@ -131,14 +67,13 @@ async def prepare_lesson(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="topic 不能为空")
 
     lesson_prep_start[current_user.id] = datetime.utcnow()
-    if topic not in lesson_markdown_cache:
-        try:
-            md_text = await generate_lesson(topic, current_user.id)
-        except RuntimeError as e:
-            raise HTTPException(status_code=500, detail=str(e))
-        lesson_markdown_cache[topic] = md_text
-    else:
-        md_text = lesson_markdown_cache[topic]
+    try:
+        md_text = await generate_lesson(topic, current_user.id, fresh=req.fresh)
+    except (LLMQueueTimeout, CircuitOpenError):
+        raise
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    lesson_drafts[(current_user.id, topic)] = md_text
 
     return {"markdown": md_text}
 
@@ -150,7 +85,6 @@ async def prepare_lesson(
 )
 async def save_courseware(
     req: LessonRequest,
-    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
@@ -160,8 +94,10 @@ async def save_courseware(
     if not topic:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="topic 不能为空")
 
-    md_text = lesson_markdown_cache.get(topic) or await generate_lesson(topic, current_user.id)
-    lesson_markdown_cache[topic] = md_text
+    md_text = lesson_drafts.get((current_user.id, topic)) or await generate_lesson(
+        topic, current_user.id, fresh=req.fresh
+    )
+    lesson_drafts[(current_user.id, topic)] = md_text
 
     start_time = lesson_prep_start.pop(current_user.id, None)
     cw = Courseware(
@@ -176,7 +112,7 @@ async def save_courseware(
     session.refresh(cw)
 
     # 后台任务异步生成并存储 PDF（覆盖旧版）
-    background_tasks.add_task(_generate_and_store_pdf, cw.id, md_text)
+    enqueue_pdf(cw.id)
 
     return CoursewareMeta(id=cw.id, topic=cw.topic, created_at=cw.created_at)
 
@@ -201,7 +137,7 @@ async def optimize_courseware(
     new_md = await optimize_lesson(
         req.topic, req.markdown, req.instruction, current_user.id
     )
-    lesson_markdown_cache[req.topic] = new_md
+    lesson_drafts[(current_user.id, req.topic.strip())] = new_md
     return {"markdown": new_md}
 
 
@@ -223,22 +159,7 @@ async def export_pdf(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="课件不存在")
 
     # 直接同步渲染最新 Markdown，覆盖数据库中的 PDF
-    clean_md = _strip_outer_fences(cw.markdown)
-    html_body = md.markdown(
-        clean_md,
-        extensions=["extra", "sane_lists", "toc", "fenced_code", "tables"]
-    )
-    html = f"<html><head><meta charset='utf-8'/><style> \
-            body {{ font-family: sans-serif; padding: 20px; }} \
-            h1, h2, h3, h4 {{ font-weight: bold; margin-top: 1em; }} \
-            strong {{ font-weight: bold; }} \
-            em {{ font-style: italic; }} \
-            table {{ border-collapse: collapse; width: 100%; margin: 1em 0; }} \
-            table, th, td {{ border: 1px solid #333; padding: 6px; }} \
-            pre {{ background: #f5f5f5; padding: 10px; overflow: auto; }} \
-            code {{ background: #f0f0f0; padding: 2px 4px; }} \
-          </style></head><body>{html_body}</body></html>"
-    pdf_bytes = pdfkit.from_string(html, False)
+    pdf_bytes = render_pdf(cw.markdown)
 
     # 覆盖存库
     cw.pdf = pdf_bytes
@@ -304,11 +225,13 @@ def update_courseware(
     if not cw or cw.teacher_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="课件不存在")
     cw.markdown = data.markdown
+    # 旧 PDF 与新内容不符，与 Markdown 一起清空，后台任务重新生成
+    cw.pdf = None
     cw.prep_start = cw.prep_start or datetime.utcnow()
     cw.prep_end = datetime.utcnow()
     session.add(cw)
     session.commit()
-    _generate_and_store_pdf(cw.id, cw.markdown)
+    enqueue_pdf(cw.id)
     return CoursewareMeta(id=cw.id, topic=cw.topic, created_at=cw.created_at)
 
 
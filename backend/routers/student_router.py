@@ -1,5 +1,6 @@
 from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from backend.auth import get_current_user
 from backend.models import User
 from backend.schemas.student_schema import (
@@ -62,7 +63,13 @@ def api_list_sessions(user: User = Depends(get_current_user)):
 @router.get("/session/{sid}", response_model=List[MessageOut])
 def api_get_messages(sid: int, user: User = Depends(get_current_user)):
     msgs = get_messages(user.id, sid)
-    return [MessageOut(id=m.id, session_id=m.session_id, role=m.role, content=m.content, created_at=m.created_at) for m in msgs]
+    return [
+        MessageOut(
+            id=m.id, session_id=m.session_id, role=m.role, content=m.content,
+            truncated=m.truncated, created_at=m.created_at,
+        )
+        for m in msgs
+    ]
 
 
 @router.get("/session/{sid}/suggest", response_model=List[str])
@@ -92,15 +99,24 @@ def _user_from_token(token: str) -> User:
 
 
 @router.get("/session/{sid}/ask_stream")
-def api_ask_in_session_stream(
-    sid: int, question: str, token: str, use_docs: bool = False
+async def api_ask_in_session_stream(
+    request: Request, sid: int, question: str, token: str, use_docs: bool = False
 ):
-    user = _user_from_token(token)
-    gen = ask_in_session_stream(user.id, sid, question, use_docs=use_docs)
+    user = await run_in_threadpool(_user_from_token, token)
+    try:
+        gen = await ask_in_session_stream(user.id, sid, question, use_docs=use_docs)
+    except ValueError:
+        raise HTTPException(404, "session not found")
 
-    def event_gen():
-        for t in gen:
-            yield f"data: {t}\n\n"
+    async def event_gen():
+        try:
+            async for t in gen:
+                # 学生关闭页面后停止读取，上游流随之关闭
+                if await request.is_disconnected():
+                    break
+                yield f"data: {t}\n\n"
+        finally:
+            await gen.aclose()
 
     return StreamingResponse(event_gen(), media_type="text/event-stream")
 
@@ -11,15 +11,32 @@ class GenerateExerciseRequest(BaseModel):
     num_short_answer: int = 0
     num_programming: int = 0
     export_pdf: bool = False
+    # 为 True 时不使用缓存的生成结果
+    fresh: bool = False
 
 
-class QuestionItem(BaseModel):
+class CodeTestCase(BaseModel):
+    input: str = ""                  # 标准输入
+    output: str                      # 期望的标准输出
+
+
+class PublicQuestionItem(BaseModel):
     id: int | str
     question: str
     options: Optional[List[str]] = None  # 选择题时有选项字段
     # 编程题可额外有 code 用于展示
 
 
+class QuestionItem(PublicQuestionItem):
+    # 编程题的测试用例，用于本地评测，不返回给作答中的学生
+    test_cases: Optional[List[CodeTestCase]] = None
+
+
+class PublicQuestionBlock(BaseModel):
+    type: str
+    items: List[PublicQuestionItem]
+
+
 class QuestionBlock(BaseModel):
     type: str                        # e.g. "multiple_choice", "fill_in_blank"...
     items: List[QuestionItem]
@@ -47,7 +64,7 @@ class ExerciseOut(BaseModel):
 class ExerciseQuestionsOut(BaseModel):
     id: int
     subject: str
-    prompt: List[QuestionBlock]
+    prompt: List[PublicQuestionBlock]
 
     class Config:
         from_attributes = True
@@ -30,6 +30,7 @@ class MessageOut(BaseModel):
     session_id: int
     role: str
     content: str
+    truncated: bool = False
     created_at: datetime
 
     class Config:
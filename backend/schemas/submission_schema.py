@@ -10,7 +10,7 @@ class SubmitRequest(BaseModel):
 
 class SubmissionStatusOut(BaseModel):
     submission_id: int = Field(..., description="提交记录 ID")
-    status: str        = Field(..., description="批改状态：grading 或 completed")
+    status: str        = Field(..., description="批改状态：grading、completed 或 failed")
 
     class Config:
         from_attributes = True
@@ -19,7 +19,7 @@ class HomeworkStudentOut(BaseModel):
     homework_id: int
     exercise_id: int
     assigned_at: datetime
-    status: str                    # "not_submitted"/"grading"/"completed"
+    status: str                    # "not_submitted"/"grading"/"completed"/"failed"
     submission_id: Optional[int]
     subject: Optional[str] = None
 
@@ -0,0 +1,79 @@
+# backend/scripts/bench_chunker.py
+
+"""
+对比旧的 nltk 定长切分与按句子/段落的新切分器：块数、块长分布、超出模型
+长度的块数，以及切分 + 编码的耗时。
+
+用法：
+    python -m backend.scripts.bench_chunker                      # 默认 backend/word_files 下的样例
+    python -m backend.scripts.bench_chunker a.docx b.pdf --no-embed
+"""
+
+import argparse
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+from backend.config import settings
+from backend.utils.rag_pipeline import (
+    chunk_text_spans,
+    count_tokens,
+    extract_text,
+    get_model,
+    legacy_chunk_spans,
+)
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / "word_files"
+
+
+def _measure(name, chunker, texts, embed: bool):
+    model = get_model()
+    limit = getattr(model, "max_seq_length", None) or 0
+    chunk_ms = embed_ms = 0.0
+    lengths = []
+    for text in texts:
+        start = perf_counter()
+        chunks = chunker(text)
+        chunk_ms += (perf_counter() - start) * 1000
+        # 统一用模型 tokenizer 计量，新旧切分器可直接比较
+        lengths += [count_tokens(c.text) for c in chunks]
+        if embed and chunks:
+            start = perf_counter()
+            model.encode(
+                [c.text for c in chunks],
+                batch_size=settings.EMBED_BATCH_SIZE,
+                convert_to_numpy=True,
+            )
+            embed_ms += (perf_counter() - start) * 1000
+
+    if not lengths:
+        print(f"{name:7s} no chunks")
+        return
+    over = sum(1 for n in lengths if limit and n > limit - 2)
+    print(
+        f"{name:7s} chunks={len(lengths)} "
+        f"tokens p50={statistics.median(lengths):.0f} max={max(lengths)} "
+        f"stdev={statistics.pstdev(lengths):.0f} over_limit={over} "
+        f"chunk={chunk_ms:.0f}ms embed={embed_ms:.0f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", type=Path)
+    parser.add_argument("--no-embed", action="store_true", help="只统计切分，不编码")
+    args = parser.parse_args()
+
+    # 跳过 Word 打开文件时留下的 ~$ 锁文件
+    files = args.files or sorted(
+        p for p in SAMPLES_DIR.iterdir() if p.is_file() and not p.name.startswith("~$")
+    )
+    texts = [t for t in (extract_text(str(p)) for p in files) if t]
+    print(f"{len(texts)} documents, {sum(len(t) for t in texts)} characters")
+
+    _measure("legacy", legacy_chunk_spans, texts, not args.no_embed)
+    _measure("current", chunk_text_spans, texts, not args.no_embed)
+
+
+if __name__ == "__main__":
+    main()
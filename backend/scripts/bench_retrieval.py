@@ -0,0 +1,81 @@
+# backend/scripts/bench_retrieval.py
+
+"""
+对比 numpy 矩阵缓存与 FAISS 两种检索后端的延迟和结果重合度。
+
+用法：
+    python -m backend.scripts.bench_retrieval --teacher 3 --query "卷积神经网络" --query "模型量化"
+"""
+
+import argparse
+import statistics
+from time import perf_counter
+
+from sqlmodel import Session
+
+from backend.config import engine
+from backend.utils import faiss_index, vector_cache
+from backend.utils.rag_pipeline import get_model
+
+
+def _time(fn, repeat: int):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = fn()
+        durations.append((perf_counter() - start) * 1000)
+    return result, durations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--teacher", type=int, action="append", required=True)
+    parser.add_argument("--query", action="append", required=True)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--include-inactive", action="store_true")
+    args = parser.parse_args()
+
+    if not faiss_index.available():
+        raise SystemExit("faiss 未安装，无法对比")
+
+    model = get_model()
+    with Session(engine) as sess:
+        # 预热两个后端，排除首次构建的开销
+        for q in args.query:
+            q_vec = model.encode(q)
+            vector_cache.search(sess, q_vec, args.teacher, args.top_k, args.include_inactive)
+            faiss_index.search(sess, q_vec, args.teacher, args.top_k, args.include_inactive)
+
+        np_times, faiss_times, overlaps = [], [], []
+        for q in args.query:
+            q_vec = model.encode(q)
+            np_hits, t1 = _time(
+                lambda: vector_cache.search(
+                    sess, q_vec, args.teacher, args.top_k, args.include_inactive
+                ),
+                args.repeat,
+            )
+            faiss_hits, t2 = _time(
+                lambda: faiss_index.search(
+                    sess, q_vec, args.teacher, args.top_k, args.include_inactive
+                ),
+                args.repeat,
+            )
+            np_times += t1
+            faiss_times += t2
+            expected = {(d, c) for d, c, _ in np_hits}
+            got = {(d, c) for d, c, _ in faiss_hits}
+            overlaps.append(len(expected & got) / len(expected) if expected else 1.0)
+
+    for name, times in (("numpy", np_times), ("faiss", faiss_times)):
+        print(
+            f"{name:6s} p50={statistics.median(times):.2f}ms "
+            f"max={max(times):.2f}ms n={len(times)}"
+        )
+    print(f"recall@{args.top_k} (faiss vs numpy): {statistics.mean(overlaps):.3f}")
+
+
+if __name__ == "__main__":
+    main()
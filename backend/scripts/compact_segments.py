@@ -0,0 +1,65 @@
+# backend/scripts/compact_segments.py
+
+"""
+合并 segment 后端的小段文件，并清除已删除文档的行。
+
+用法：
+    python -m backend.scripts.compact_segments                    # 合并所有 scope
+    python -m backend.scripts.compact_segments --scope 3 --scope public --min-rows 500
+    python -m backend.scripts.compact_segments --import-db        # 先为数据库中已有向量的文档生成段文件
+"""
+
+import argparse
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from backend.config import engine
+from backend.models import Document
+from backend.services.document_service import document_dir
+from backend.utils import segment_store, vector_cache, vector_codec
+from backend.utils.vector_cache import PUBLIC_SCOPE
+
+
+def _import_db() -> None:
+    """Write segments for documents whose vectors are still only in the database."""
+    with Session(engine) as sess:
+        for doc in sess.exec(select(Document)).all():
+            scope = vector_cache.scope_of(doc.owner_id, doc.is_public)
+            if segment_store.document_vectors(scope, doc.id) is not None:
+                continue
+            rows = sess.exec(
+                text(
+                    "SELECT vector_blob, vector_dtype, vector_scale FROM document_vector "
+                    f"WHERE doc_id={int(doc.id)} AND vector_blob IS NOT NULL "
+                    "ORDER BY chunk_index"
+                )
+            ).all()
+            if not rows:
+                continue
+            segment_store.write_document(
+                scope, doc.id, document_dir(doc), vector_codec.decode_rows(rows)
+            )
+            print(f"document {doc.id}: {len(rows)} vectors written to segment")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scope", action="append", help="教师 id 或 public，默认全部")
+    parser.add_argument("--min-rows", type=int, default=None)
+    parser.add_argument("--import-db", action="store_true")
+    args = parser.parse_args()
+
+    if args.import_db:
+        _import_db()
+
+    if args.scope:
+        scopes = [PUBLIC_SCOPE if s == PUBLIC_SCOPE else int(s) for s in args.scope]
+    else:
+        scopes = segment_store.scopes()
+    for scope in scopes:
+        merged = segment_store.compact(scope, args.min_rows)
+        print(f"scope {scope}: {merged} segments merged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# backend/scripts/job_worker.py
+
+"""
+独立运行的后台任务 worker，可多开以横向扩展。API 进程中设置
+JOB_WORKER_IN_PROCESS=False 后，批改、PDF 渲染与学情分析只在这里执行。
+
+用法：
+    python -m backend.scripts.job_worker
+    python -m backend.scripts.job_worker --workers 8 --kind grade_submission --kind analyze_student
+"""
+
+import argparse
+import logging
+import signal
+import threading
+
+from sqlmodel import SQLModel
+
+from backend.config import engine
+from backend.services.job_service import recover_orphaned_submissions
+from backend.utils import job_queue
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="后台任务 worker")
+    parser.add_argument("--workers", type=int, help="线程数，默认 JOB_WORKERS")
+    parser.add_argument("--kind", action="append", help="只处理这些类型的任务，可重复")
+    parser.add_argument("--no-recover", action="store_true", help="启动时不恢复遗留的批改任务")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    SQLModel.metadata.create_all(engine)
+    if not args.no_recover:
+        recover_orphaned_submissions()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    worker = job_queue.start_worker(args.workers, args.kind)
+    logging.info("Job worker %s started", worker.id)
+    stop.wait()
+    # 等待执行中的任务完成后再退出
+    job_queue.stop_worker(wait=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+# backend/scripts/mock_deepseek.py
+
+"""
+本地的 Deepseek / OpenAI 兼容模拟服务，用于无网络环境下的联调与压测。
+
+提供 ``POST /v1/chat/completions``（也接受 ``/chat/completions``），支持流式与
+非流式响应，可配置：
+ - 延迟分布（fixed / uniform / lognormal）：非流式为整次响应耗时，流式为首 token 时间；
+ - 流式输出速度（tokens/sec）；
+ - 错误率：按比例返回 500，或带 ``Retry-After`` 的 429。
+
+根据 prompt 返回与各业务调用匹配的内容：练习预览（``preview_exercise``）、
+作业批改（``grade_submission``）、学情分析、建议问题返回对应结构的 JSON，
+其余请求（备课、对话）返回一段 Markdown 文本。
+
+用法：
+    python -m backend.scripts.mock_deepseek --port 8800 --latency lognormal --latency-mean 2 --error-rate 0.05
+    # backend/.env 中设置 DEEPSEEK_ENDPOINT=http://127.0.0.1:8800/v1/chat/completions
+
+测试中也可在进程内启动：
+    server = serve_in_thread(MockConfig(latency_mean=0.1))
+    ...  # 请求 server.endpoint
+    server.stop()
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Literal, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+
+class MockConfig(BaseModel):
+    # 延迟分布；lognormal 的 latency_mean 为中位数，latency_jitter 为对数标准差
+    latency: Literal["fixed", "uniform", "lognormal"] = "lognormal"
+    latency_mean: float = 1.0
+    latency_jitter: float = 0.5
+    # 流式：首 token 时间（秒，按同一分布抖动）和输出速度
+    ttft: float = 0.5
+    tokens_per_sec: float = 40.0
+    # 返回 500 / 429 的比例，以及 429 的 Retry-After（秒）
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    # 默认文本回复的长度（字符）
+    reply_chars: int = 600
+    seed: Optional[int] = None
+
+
+_QUESTION_TYPES = [
+    ("single_choice", "单选题"),
+    ("multiple_choice", "多选题"),
+    ("fill_in_blank", "填空题"),
+    ("short_answer", "简答题"),
+    ("coding", "编程题"),
+]
+
+_FILLER = (
+    "本节围绕核心概念展开，先回顾相关的基础知识，再结合例题说明常见的解题思路，"
+    "最后总结易错点并给出练习建议。"
+)
+
+
+# ---- 按 prompt 生成内容 ----
+def _exercise(prompt: str) -> dict:
+    questions, answers = [], {}
+    qid = 1
+    for qtype, label in _QUESTION_TYPES:
+        m = re.search(rf"生成\s*(\d+)\s*道{label}", prompt)
+        count = int(m.group(1)) if m else 0
+        items = []
+        for _ in range(count):
+            item: Dict[str, Any] = {"id": str(qid), "question": f"模拟{label}第 {qid} 题"}
+            if qtype in ("single_choice", "multiple_choice"):
+                item["options"] = [f"{c}. 选项{c}" for c in "ABCD"]
+            elif qtype == "coding":
+                item["question"] += "：输入两个整数，输出它们的和"
+                item["test_cases"] = [{"input": "1 2", "output": "3"}, {"input": "-4 10", "output": "6"}]
+            items.append(item)
+            answers[str(qid)] = {
+                "single_choice": "A",
+                "multiple_choice": ["A", "B"],
+                "coding": "a, b = map(int, input().split())\nprint(a + b)",
+            }.get(qtype, f"模拟答案 {qid}")
+            qid += 1
+        if items:
+            questions.append({"type": qtype, "items": items})
+    return {"questions": questions, "answers": answers}
+
+
+def _json_after(prompt: str, label: str):
+    m = re.search(rf"{label}:\s*(.*)", prompt)
+    if not m:
+        return None
+    try:
+        return json.loads(m.group(1))
+    except json.JSONDecodeError:
+        return None
+
+
+def _grading(prompt: str) -> dict:
+    blocks = _json_after(prompt, "题目") or []
+    expected = _json_after(prompt, "标准答案") or {}
+    given = _json_after(prompt, "学生答案") or {}
+    m = re.search(r"简答题\s*(\d+(?:\.\d+)?)\s*分", prompt)
+    sa_pt = float(m.group(1)) if m else 1
+    results, scores, explanations = {}, {}, {}
+    for block in blocks:
+        for item in block.get("items", []):
+            qid = str(item.get("id"))
+            if block.get("type") == "short_answer":
+                if given.get(qid):
+                    results[qid], scores[qid] = "partial", sa_pt / 2
+                else:
+                    results[qid], scores[qid] = "wrong", 0
+            else:
+                ok = given.get(qid) == expected.get(qid)
+                results[qid], scores[qid] = ("correct", 1) if ok else ("wrong", 0)
+            explanations[qid] = f"模拟解析：标准答案为 {expected.get(qid)}"
+    return {"results": results, "scores": scores, "explanations": explanations}
+
+
+def _batch_grading(prompt: str) -> dict:
+    given = _json_after(prompt, "各学生答案") or {}
+    expected = _json_after(prompt, "标准答案")
+    m = re.search(r"本题满分\s*(\d+(?:\.\d+)?)\s*分", prompt)
+    full = float(m.group(1)) if m else 1
+    results, scores, explanations = {}, {}, {}
+    for key, ans in given.items():
+        if ans == expected:
+            results[key], scores[key] = "correct", full
+        elif ans:
+            results[key], scores[key] = "partial", full / 2
+        else:
+            results[key], scores[key] = "wrong", 0
+        explanations[key] = f"模拟解析：标准答案为 {expected}"
+    return {"results": results, "scores": scores, "explanations": explanations}
+
+
+def _analysis() -> dict:
+    return {
+        "analysis": "模拟学情分析：整体掌握情况良好，部分知识点仍需巩固。",
+        "weak_points": ["模拟薄弱点一", "模拟薄弱点二"],
+        "recommendation": {
+            "topic": "模拟推荐主题",
+            "num_single_choice": 3,
+            "num_multiple_choice": 2,
+            "num_fill_blank": 2,
+            "num_short_answer": 1,
+            "num_programming": 0,
+        },
+    }
+
+
+def _text(n: int) -> str:
+    body = (_FILLER * (n // len(_FILLER) + 1))[:n]
+    return f"# 模拟回复\n\n{body}"
+
+
+def reply_for(messages: List[dict], config: MockConfig) -> str:
+    """Canned reply matching the business call that produced ``messages``."""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    if "示例结构" in prompt and "questions" in prompt:
+        return json.dumps(_exercise(prompt), ensure_ascii=False)
+    if "各学生答案:" in prompt:
+        return json.dumps(_batch_grading(prompt), ensure_ascii=False)
+    if "学生答案:" in prompt:
+        return json.dumps(_grading(prompt), ensure_ascii=False)
+    if "recommendation" in prompt:
+        return json.dumps(_analysis(), ensure_ascii=False)
+    if "JSON数组" in prompt:
+        m = re.search(r"生成(\d+)个", prompt)
+        num = int(m.group(1)) if m else 3
+        return json.dumps([f"模拟问题 {i + 1}？" for i in range(num)], ensure_ascii=False)
+    return _text(config.reply_chars)
+
+
+def _tokens(text: str) -> List[str]:
+    # 粗略切分：英文按词，中文每两个字一个 token
+    return re.findall(r"[A-Za-z0-9_]+|\s+|[^\sA-Za-z0-9_]{1,2}", text)
+
+
+def _usage(messages: List[dict], completion: str) -> dict:
+    prompt_tokens = sum(len(_tokens(str(m.get("content", "")))) for m in messages)
+    completion_tokens = len(_tokens(completion))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_cache_hit_tokens": 0,
+        "prompt_cache_miss_tokens": prompt_tokens,
+    }
+
+
+# ---- 服务 ----
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    config = config or MockConfig()
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "streams": 0, "errors": 0, "rateLimited": 0}
+    app = FastAPI(title="Mock DeepSeek")
+
+    def sample(mean: float) -> float:
+        if config.latency == "fixed" or mean <= 0:
+            return max(0.0, mean)
+        if config.latency == "uniform":
+            return rng.uniform(max(0.0, mean - config.latency_jitter), mean + config.latency_jitter)
+        return rng.lognormvariate(math.log(mean), config.latency_jitter)
+
+    def injected_error() -> Optional[JSONResponse]:
+        r = rng.random()
+        if r < config.rate_limit_rate:
+            stats["rateLimited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                status_code=429,
+                headers={"Retry-After": str(config.retry_after)},
+            )
+        if r < config.rate_limit_rate + config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "Mock server error", "type": "server_error"}},
+                status_code=500,
+            )
+        return None
+
+    async def completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        messages = body.get("messages") or []
+        model = body.get("model", "deepseek-chat")
+        error = injected_error()
+        if error is not None:
+            await asyncio.sleep(sample(config.ttft))
+            return error
+
+        content = reply_for(messages, config)
+        cid = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = _usage(messages, content)
+
+        if not body.get("stream"):
+            await asyncio.sleep(sample(config.latency_mean))
+            return {
+                "id": cid,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+
+        stats["streams"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish: Optional[str] = None) -> str:
+            data = {
+                "id": cid,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            await asyncio.sleep(sample(config.ttft))
+            yield chunk({"role": "assistant", "content": ""})
+            interval = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+            for i, token in enumerate(_tokens(content)):
+                if i and interval:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if include_usage:
+                data = {"id": cid, "object": "chat.completion.chunk", "created": created,
+                        "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(data)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app.add_api_route("/v1/chat/completions", completions, methods=["POST"])
+    app.add_api_route("/chat/completions", completions, methods=["POST"])
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+class MockServer:
+    """Mock server running in a background thread of the current process."""
+
+    def __init__(self, server: uvicorn.Server, thread: threading.Thread, host: str, port: int):
+        self._server = server
+        self._thread = thread
+        self.url = f"http://{host}:{port}"
+        self.endpoint = f"{self.url}/v1/chat/completions"
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+def serve_in_thread(config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Start the mock server in a daemon thread; ``port=0`` picks a free port."""
+    server = uvicorn.Server(
+        uvicorn.Config(create_app(config), host=host, port=port, log_level="warning", lifespan="off")
+    )
+    thread = threading.Thread(target=server.run, name="mock-deepseek", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("mock DeepSeek server failed to start")
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return MockServer(server, thread, host, port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 Deepseek 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=1.0, help="非流式响应耗时（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.5)
+    parser.add_argument("--ttft", type=float, default=0.5, help="流式首 token 时间（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--reply-chars", type=int, default=600)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_jitter=args.latency_jitter,
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        reply_chars=args.reply_chars,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# backend/scripts/reindex_paragraphs.py
+
+"""
+为上传于段落索引上线之前的文档补建段落级向量。
+
+用法：
+    python -m backend.scripts.reindex_paragraphs          # 只处理缺少段落索引的文档
+    python -m backend.scripts.reindex_paragraphs --all    # 重建全部文档
+"""
+
+import argparse
+
+from sqlmodel import Session, select
+
+from backend.config import engine
+from backend.models import Document, DocumentParagraph
+from backend.services.document_service import reindex_paragraphs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--all", action="store_true", help="重建所有文档的段落索引")
+    args = parser.parse_args()
+
+    with Session(engine) as sess:
+        doc_ids = sess.exec(select(Document.id)).all()
+        if not args.all:
+            indexed = set(sess.exec(select(DocumentParagraph.doc_id).distinct()).all())
+            doc_ids = [d for d in doc_ids if d not in indexed]
+
+    for doc_id in doc_ids:
+        count = reindex_paragraphs(doc_id)
+        print(f"document {doc_id}: {count} paragraphs")
+
+
+if __name__ == "__main__":
+    main()
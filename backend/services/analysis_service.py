@@ -6,7 +6,10 @@ from sqlmodel import Session, select
 
 from backend.config import engine
 from backend.models import Practice, Submission, Homework, Exercise, StudentAnalysis
+from backend.utils import job_queue
 from backend.utils.deepseek_client import call_deepseek_api
+from backend.utils.job_queue import ANALYZE_STUDENT
+from backend.utils.llm_scheduler import ANALYSIS
 from backend.utils.scoring import compute_total_points
 
 
@@ -30,7 +33,9 @@ def analyze_student_practice(student_id: int) -> Dict[str, Any]:
         f"{json.dumps(summary, ensure_ascii=False)}"
     )
     try:
-        resp = call_deepseek_api(prompt)
+        resp = call_deepseek_api(
+            prompt, priority=ANALYSIS, user_id=student_id, call_site="analysis"
+        )
         content = resp["choices"][0]["message"]["content"]
         text = re.sub(r"^```(?:json)?\s*", "", content)
         text = re.sub(r"\s*```$", "", text)
@@ -103,7 +108,9 @@ def analyze_student_homeworks(
         f"{json.dumps(summary, ensure_ascii=False)}"
     )
     try:
-        resp = call_deepseek_api(prompt)
+        resp = call_deepseek_api(
+            prompt, priority=ANALYSIS, user_id=student_id, call_site="analysis"
+        )
         content = resp["choices"][0]["message"]["content"]
         text = re.sub(r"^```(?:json)?\s*", "", content)
         text = re.sub(r"\s*```$", "", text)
@@ -117,6 +124,15 @@ def analyze_student_homeworks(
     return data
 
 
+def enqueue_analysis(student_id: int, teacher_id: Optional[int] = None) -> int:
+    """后台执行 ``analyze_and_save_homeworks``；同一学生排队中的分析只保留一个。"""
+    return job_queue.enqueue(
+        ANALYZE_STUDENT,
+        {"student_id": student_id, "teacher_id": teacher_id},
+        dedupe_key=f"analysis:{student_id}:{teacher_id or ''}",
+    )
+
+
 def analyze_and_save_homeworks(student_id: int, teacher_id: Optional[int] = None) -> str:
     result = analyze_student_homeworks(student_id, teacher_id)
     with Session(engine) as sess:
@@ -1,4 +1,5 @@
-from typing import List, Iterator
+import asyncio
+from typing import AsyncIterator, List
 from sqlmodel import Session, select
 from sqlalchemy import func
 from backend.config import engine
@@ -6,14 +7,17 @@ from backend.models import ChatHistory, ChatSession, ChatMessage, Class, ClassSt
 from backend.utils.deepseek_client import (
     call_deepseek_api,
     call_deepseek_api_chat,
-    call_deepseek_api_chat_stream,
+    acall_deepseek_api_chat_stream,
 )
+from backend.utils.llm_scheduler import INTERACTIVE
 from backend.utils.rag_pipeline import retrieve_from_db
 from datetime import datetime
 import json
 
 def ask_question(student_id: int, question: str) -> ChatHistory:
-    resp = call_deepseek_api(question)
+    resp = call_deepseek_api(
+        question, priority=INTERACTIVE, user_id=student_id, call_site="chat"
+    )
     answer = resp["choices"][0]["message"]["content"]
     with Session(engine) as sess:
         chat = ChatHistory(student_id=student_id, question=question, answer=answer)
@@ -95,7 +99,9 @@ def ask_in_session(
                     system_prompt += f"\n\n以下是教师提供的资料：\n{refs}"
 
         conv.insert(0, {"role": "system", "content": system_prompt})
-        resp = call_deepseek_api_chat(conv)
+        resp = call_deepseek_api_chat(
+            conv, priority=INTERACTIVE, user_id=student_id, call_site="chat"
+        )
         answer = resp["choices"][0]["message"]["content"]
         ai_msg = ChatMessage(session_id=session_id, role="assistant", content=answer)
         sess.add(ai_msg)
@@ -104,15 +110,15 @@ def ask_in_session(
         return ai_msg
 
 
-def ask_in_session_stream(
-    student_id: int,
-    session_id: int,
-    question: str,
-    use_docs: bool = False,
-) -> Iterator[str]:
-    """Ask a question in a session and yield the answer token by token."""
-    sess = Session(engine)
-    try:
+# 保存流式回答的后台任务，保留引用避免被回收
+_finishing: set = set()
+
+
+def _prepare_session_question(
+    student_id: int, session_id: int, question: str, use_docs: bool
+) -> List[dict]:
+    """Store the question and build the conversation sent to the model."""
+    with Session(engine) as sess:
         session = sess.get(ChatSession, session_id)
         if not session or session.student_id != student_id:
             raise ValueError("session not found")
@@ -146,28 +152,69 @@ def ask_in_session_stream(
                     system_prompt += f"\n\n以下是教师提供的资料：\n{refs}"
 
         conv.insert(0, {"role": "system", "content": system_prompt})
-        stream = call_deepseek_api_chat_stream(conv)
+        return conv
 
-        answer_parts: list[str] = []
 
-        def gen() -> Iterator[str]:
-            try:
-                for tok in stream:
-                    answer_parts.append(tok)
-                    yield tok
-            finally:
-                answer = "".join(answer_parts)
-                ai_msg = ChatMessage(
-                    session_id=session_id, role="assistant", content=answer
-                )
-                sess.add(ai_msg)
-                sess.commit()
-                sess.close()
+def _save_answer(session_id: int, answer: str, truncated: bool) -> None:
+    with Session(engine) as sess:
+        sess.add(
+            ChatMessage(
+                session_id=session_id, role="assistant", content=answer, truncated=truncated
+            )
+        )
+        sess.commit()
+
+
+async def _finish_stream(
+    stream: AsyncIterator[str], session_id: int, answer: str, truncated: bool
+) -> None:
+    try:
+        await stream.aclose()
+    finally:
+        await asyncio.to_thread(_save_answer, session_id, answer, truncated)
+
+
+async def ask_in_session_stream(
+    student_id: int,
+    session_id: int,
+    question: str,
+    use_docs: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Ask a question in a session; await to get the answer token by token.
+
+    数据库会话只在准备对话和保存回答时短暂持有。上游流和调度槽位在第一次迭代时
+    才获取，响应开始前客户端就断开时不会占用。调用方提前关闭迭代器（客户端
+    断开）时立即关闭上游流，已生成的部分回答以 ``truncated=True`` 保存。
+    """
+    conv = await asyncio.to_thread(
+        _prepare_session_question, student_id, session_id, question, use_docs
+    )
+
+    async def gen() -> AsyncIterator[str]:
+        stream = await acall_deepseek_api_chat_stream(
+            conv, priority=INTERACTIVE, user_id=student_id, call_site="chat_stream"
+        )
+        answer_parts: list[str] = []
+        try:
+            async for tok in stream:
+                answer_parts.append(tok)
+                yield tok
+        except (GeneratorExit, asyncio.CancelledError):
+            # 请求被取消时当前任务内不能再可靠地 await，关闭上游与保存放到独立任务中
+            task = asyncio.ensure_future(
+                _finish_stream(stream, session_id, "".join(answer_parts), True)
+            )
+            _finishing.add(task)
+            task.add_done_callback(_finishing.discard)
+            raise
+        except Exception:
+            await _finish_stream(stream, session_id, "".join(answer_parts), True)
+            raise
+        # 正常结束时等回答保存后再结束响应，前端随后刷新历史即可看到
+        await _finish_stream(stream, session_id, "".join(answer_parts), False)
 
-        return gen()
-    except Exception:
-        sess.close()
-        raise
+    return gen()
 
 
 def suggest_questions(student_id: int, session_id: int, num: int = 3) -> List[str]:
@@ -189,7 +236,10 @@ def suggest_questions(student_id: int, session_id: int, num: int = 3) -> List[st
         conv.insert(0, {"role": "system", "content": system_prompt})
         conv.append({"role": "user", "content": f"生成{num}个我可能想问的问题。"})
         try:
-            resp = call_deepseek_api_chat(conv)
+            # 建议问题对延迟敏感，慢请求会被对冲
+            resp = call_deepseek_api_chat(
+                conv, priority=INTERACTIVE, user_id=student_id, hedge=True, call_site="suggest"
+            )
             text = resp["choices"][0]["message"]["content"]
         except Exception:
             return []
@@ -0,0 +1,109 @@
+# backend/services/courseware_service.py
+
+"""
+课件 PDF 渲染：Markdown -> HTML -> PDF 并写回 ``Courseware.pdf``。
+
+教师 / 管理员接口和后台任务（``RENDER_COURSEWARE_PDF``）共用这里的实现。
+"""
+
+import markdown as md
+import pdfkit
+from sqlmodel import Session
+
+from backend.config import engine
+from backend.db import SessionLocal
+from backend.models import Courseware
+from backend.utils import job_queue
+from backend.utils.job_queue import RENDER_COURSEWARE_PDF
+
+
+def strip_outer_fences(md_text: str) -> str:
+    """
+    如果文本以 ``` 开头，以 ``` 结尾，就去掉这两行 fence，
+    避免整个教案都被当作单个代码块。
+    """
+    lines = md_text.splitlines()
+    if len(lines) >= 2 and lines[0].startswith("```") and lines[-1].startswith("```"):
+        return "\n".join(lines[1:-1])
+    return md_text
+
+
+def render_pdf(md_text: str) -> bytes:
+    """把 Markdown 渲染为 HTML（支持标题、列表、表格、代码块等），再生成 PDF。"""
+    # 1. 先去掉最外层的 fenced code
+    clean_md = strip_outer_fences(md_text)
+
+    # 2. Markdown -> HTML，开启常见扩展
+    html_body = md.markdown(
+        clean_md,
+        extensions=[
+            "extra",
+            "sane_lists",
+            "toc",
+            "fenced_code",
+            "tables",
+        ]
+    )
+
+    # 3. 包裹完整 HTML 并内嵌基本 CSS
+    html = f"""
+    <html>
+      <head>
+        <meta charset="utf-8"/>
+        <style>
+          body {{ font-family: sans-serif; padding: 20px; }}
+          h1, h2, h3, h4 {{ font-weight: bold; margin-top: 1em; }}
+          strong {{ font-weight: bold; }}
+          em {{ font-style: italic; }}
+          table {{ border-collapse: collapse; width: 100%; margin: 1em 0; }}
+          table, th, td {{ border: 1px solid #333; padding: 6px; }}
+          pre {{ background: #f5f5f5; padding: 10px; overflow: auto; }}
+          code {{ background: #f0f0f0; padding: 2px 4px; }}
+        </style>
+      </head>
+      <body>
+        {html_body}
+      </body>
+    </html>
+    """
+
+    # 4. 生成 PDF
+    return pdfkit.from_string(html, False)
+
+
+def generate_and_store_pdf(cw_id: int, md_text: str) -> None:
+    """渲染 ``md_text`` 并写回数据库（覆盖旧 PDF）。"""
+    pdf_bytes = render_pdf(md_text)
+    db = SessionLocal()
+    try:
+        cw = db.get(Courseware, cw_id)
+        if not cw or cw.markdown != md_text:
+            # 渲染期间课件被删除或再次修改：不写入过期的 PDF，新内容已另行排队
+            return
+        cw.pdf = pdf_bytes
+        db.add(cw)
+        db.commit()
+    finally:
+        db.close()
+
+
+def render_courseware_pdf(courseware_id: int) -> None:
+    """后台任务：按课件当前的 Markdown 重新生成 PDF。"""
+    with Session(engine) as sess:
+        cw = sess.get(Courseware, courseware_id)
+        if not cw:
+            return
+        md_text = cw.markdown
+    generate_and_store_pdf(courseware_id, md_text)
+
+
+def enqueue_pdf(cw_id: int) -> int:
+    """后台生成 PDF；任务执行时读取最新的 Markdown，排队中的重复任务只保留一个。"""
+    return job_queue.enqueue(
+        RENDER_COURSEWARE_PDF, {"courseware_id": cw_id}, dedupe_key=f"pdf:{cw_id}"
+    )
+
+
+def pdf_pending(cw_id: int) -> bool:
+    """Whether a PDF render job for the courseware is queued or running."""
+    return job_queue.has_active(f"pdf:{cw_id}")
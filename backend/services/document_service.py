@@ -1,18 +1,38 @@
 # backend/services/document_service.py
 
+import hashlib
+import uuid
 from pathlib import Path
-from typing import List
+from typing import Iterable, List, Optional, Tuple
 from datetime import datetime
 import logging
+import threading
+from itertools import islice, repeat
+from time import perf_counter
 
 import numpy as np
 from pydantic import BaseModel
 from sqlmodel import Session, select
-from sqlalchemy import delete as sa_delete
+from sqlalchemy import delete as sa_delete, func, insert as sa_insert, text as sa_text
 
 from backend.config import engine, settings
-from backend.models import Document, DocumentVector, DocumentActivation
-from backend.utils.rag_pipeline import get_model, chunk_document
+from backend.models import (
+    Document,
+    DocumentVector,
+    DocumentActivation,
+    DocumentIndexMetric,
+    DocumentParagraph,
+)
+from backend.utils.rag_pipeline import (
+    get_model,
+    ensure_text_cache,
+    file_hash,
+    iter_text_pieces,
+    remove_text_cache,
+    iter_text_chunks,
+)
+from backend.utils.text_chunker import iter_paragraphs
+from backend.utils import faiss_index, segment_store, vector_cache, vector_codec
 
 
 class DocumentWithActivation(BaseModel):
@@ -22,27 +42,394 @@ class DocumentWithActivation(BaseModel):
     uploaded_at: datetime
     is_active: bool
     is_public: bool
+    index_error: Optional[str] = None
 
     class Config:
         from_attributes = True
 
 
-def _index_document(doc_id: int, path: Path) -> None:
-    """Chunk document and store vectors."""
+def _index_document(
+    doc_id: int,
+    path: Path,
+    scope: vector_cache.ScopeKey,
+    doc_dir: Path,
+    content_hash: Optional[str] = None,
+) -> None:
+    """Chunk document, embed chunks in batches and bulk-insert their vectors."""
+    model = get_model()
+    batch_size = max(1, settings.EMBED_BATCH_SIZE)
+    storage_dtype = vector_codec.check_dtype(settings.VECTOR_STORAGE_DTYPE)
+
+    start = perf_counter()
+    # 文本由进程池逐页写入磁盘缓存；失败（超时、超出内存上限等）时抛出
+    # ExtractionError，由调用方记录到文档上
+    cache = ensure_text_cache(str(path), content_hash, strict=True)
+    extract_ms = (perf_counter() - start) * 1000
+
+    # 逐页读取缓存、边切分边按批编码，内存占用与文档大小无关；
+    # 切分耗时只统计取块本身
+    chunks = iter_text_chunks(iter_text_pieces(cache)) if cache else iter(())
+    chunk_ms = embed_ms = insert_ms = 0.0
+    chunk_count = 0
+    use_segments = settings.VECTOR_BACKEND == "segment"
+    keep_vecs = use_segments or settings.VECTOR_BACKEND == "faiss"
+    all_vecs: List[np.ndarray] = []
     with Session(engine, expire_on_commit=False) as sess:
-        model = get_model()
-        chunks = chunk_document(str(path))
-        for idx, ck in enumerate(chunks):
-            vec = model.encode(ck)
-            sess.add(
-                DocumentVector(
-                    doc_id=doc_id,
-                    chunk_index=idx,
-                    vector_blob=vec.astype(np.float32).tobytes(),
-                )
+        while True:
+            start = perf_counter()
+            batch = list(islice(chunks, batch_size))
+            chunk_ms += (perf_counter() - start) * 1000
+            if not batch:
+                break
+            offset = chunk_count
+            chunk_count += len(batch)
+
+            start = perf_counter()
+            vecs = model.encode(
+                [ck.text for ck in batch], batch_size=batch_size, convert_to_numpy=True
+            ).astype(np.float32)
+            embed_ms += (perf_counter() - start) * 1000
+
+            start = perf_counter()
+            # segment 后端只在数据库中保存块文本，向量写入段文件
+            encoded = (
+                repeat((None, None))
+                if use_segments
+                else vector_codec.encode_many(vecs, storage_dtype)
+            )
+            sess.execute(
+                sa_insert(DocumentVector),
+                [
+                    {
+                        "doc_id": doc_id,
+                        "chunk_index": offset + i,
+                        "vector_blob": blob,
+                        "vector_dtype": None if use_segments else storage_dtype,
+                        "vector_scale": scale,
+                        "content": ck.text,
+                        "start_offset": ck.start,
+                        "end_offset": ck.end,
+                        "token_count": ck.token_count,
+                    }
+                    for i, (ck, (blob, scale)) in enumerate(zip(batch, encoded))
+                ],
+            )
+            insert_ms += (perf_counter() - start) * 1000
+            if keep_vecs:
+                all_vecs.append(vecs)
+
+        para_embed_ms, para_insert_ms = _index_paragraphs(
+            sess, doc_id, iter_text_pieces(cache) if cache else []
+        )
+        embed_ms += para_embed_ms
+        insert_ms += para_insert_ms
+
+        start = perf_counter()
+        sess.commit()
+        if use_segments and all_vecs:
+            doc_dir.mkdir(parents=True, exist_ok=True)
+            segment_store.write_document(
+                scope, doc_id, doc_dir, np.concatenate(all_vecs)
             )
+        insert_ms += (perf_counter() - start) * 1000
+
+        sess.add(
+            DocumentIndexMetric(
+                doc_id=doc_id,
+                chunk_count=chunk_count,
+                extract_ms=extract_ms,
+                chunk_ms=chunk_ms,
+                embed_ms=embed_ms,
+                insert_ms=insert_ms,
+            )
+        )
+        sess.commit()
+
+        if settings.VECTOR_BACKEND == "faiss" and all_vecs:
+            ids = sess.exec(
+                select(DocumentVector.id)
+                .where(DocumentVector.doc_id == doc_id)
+                .order_by(DocumentVector.chunk_index)
+            ).all()
+            faiss_index.add_vectors(sess, scope, ids, np.concatenate(all_vecs))
+
+    logging.info(
+        "Indexed document %s: %d chunks, extract %.0fms, chunk %.0fms, "
+        "embed %.0fms, insert %.0fms",
+        doc_id, chunk_count, extract_ms, chunk_ms, embed_ms, insert_ms,
+    )
+
+
+def _index_paragraphs(
+    sess: Session, doc_id: int, pieces: Iterable[str]
+) -> Tuple[float, float]:
+    """Embed blank-line separated paragraphs for paragraph-level retrieval.
+
+    ``pieces`` is the document text, whole or streamed page by page.
+    Returns ``(embed_ms, insert_ms)``; the caller commits.
+    """
+    model = get_model()
+    batch_size = max(1, settings.EMBED_BATCH_SIZE)
+    storage_dtype = vector_codec.check_dtype(settings.VECTOR_STORAGE_DTYPE)
+    paras = iter_paragraphs(pieces)
+    embed_ms = insert_ms = 0.0
+    offset = 0
+    while True:
+        batch = list(islice(paras, batch_size))
+        if not batch:
+            break
+
+        start = perf_counter()
+        vecs = model.encode(
+            [p.text for p in batch], batch_size=batch_size, convert_to_numpy=True
+        ).astype(np.float32)
+        embed_ms += (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        sess.execute(
+            sa_insert(DocumentParagraph),
+            [
+                {
+                    "doc_id": doc_id,
+                    "para_index": offset + i,
+                    "content": p.text,
+                    "start_offset": p.start,
+                    "end_offset": p.end,
+                    "vector_blob": blob,
+                    "vector_dtype": storage_dtype,
+                    "vector_scale": scale,
+                }
+                for i, (p, (blob, scale)) in enumerate(
+                    zip(batch, vector_codec.encode_many(vecs, storage_dtype))
+                )
+            ],
+        )
+        insert_ms += (perf_counter() - start) * 1000
+        offset += len(batch)
+    return embed_ms, insert_ms
+
+
+def reindex_paragraphs(doc_id: int) -> int:
+    """Rebuild the paragraph index of one document; returns the paragraph count."""
+    with Session(engine, expire_on_commit=False) as sess:
+        doc = sess.get(Document, doc_id)
+        if not doc:
+            return 0
+        cache = ensure_text_cache(doc.filepath, doc.content_hash)
+        sess.execute(
+            sa_delete(DocumentParagraph).where(DocumentParagraph.doc_id == doc_id)
+        )
+        _index_paragraphs(sess, doc_id, iter_text_pieces(cache) if cache else [])
+        sess.commit()
+        count = len(
+            sess.exec(
+                select(DocumentParagraph.id).where(DocumentParagraph.doc_id == doc_id)
+            ).all()
+        )
+    vector_cache.invalidate_scope(vector_cache.scope_of(doc.owner_id, doc.is_public))
+    return count
+
+
+def _delete_vectors(sess: Session, doc: Document) -> None:
+    """
+    Delete the chunk and paragraph rows of a document, then drop it from the
+    FAISS index or segment store, if in use.  The rows go first: an index that
+    cannot remove ids (HNSW) is rebuilt from the database in this session.
+    """
+    scope = vector_cache.scope_of(doc.owner_id, doc.is_public)
+    ids = []
+    if settings.VECTOR_BACKEND == "faiss":
+        ids = sess.exec(
+            select(DocumentVector.id).where(DocumentVector.doc_id == doc.id)
+        ).all()
+    sess.execute(sa_delete(DocumentVector).where(DocumentVector.doc_id == doc.id))
+    sess.execute(
+        sa_delete(DocumentParagraph).where(DocumentParagraph.doc_id == doc.id)
+    )
+    if settings.VECTOR_BACKEND == "segment":
+        segment_store.remove_document(scope, doc.id)
+    elif ids:
+        faiss_index.remove_vectors(sess, scope, ids)
+
+
+def document_dir(doc: Document) -> Path:
+    """Per-document directory for derived files (vector segments etc.)."""
+    owner = "public" if doc.is_public else str(doc.owner_id)
+    return Path(settings.DOC_STORAGE_DIR) / owner / str(doc.id)
+
+
+def _store_blob(data: bytes, filename: str) -> Tuple[str, Path]:
+    """Store an upload once under DOC_STORAGE_DIR/blobs/ab/<sha256><suffix>."""
+    digest = hashlib.sha256(data).hexdigest()
+    # 保留扩展名，extract_text 依赖它选择解析方式；提取出的文本缓存在同一目录
+    path = (
+        Path(settings.DOC_STORAGE_DIR)
+        / "blobs"
+        / digest[:2]
+        / (digest + Path(filename).suffix.lower())
+    )
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+    return digest, path
+
+
+def _indexed_duplicate(sess: Session, doc: Document) -> Optional[Document]:
+    """Return an earlier document with the same content that has been indexed."""
+    candidates = sess.exec(
+        select(Document)
+        .where(Document.content_hash == doc.content_hash, Document.id != doc.id)
+        .order_by(Document.id)
+    ).all()
+    for cand in candidates:
+        has_rows = sess.exec(
+            select(DocumentVector.id).where(DocumentVector.doc_id == cand.id).limit(1)
+        ).first()
+        if has_rows is not None:
+            return cand
+    return None
+
+
+_VECTOR_COLUMNS = (
+    "chunk_index, vector_blob, vector_dtype, vector_scale, "
+    "content, start_offset, end_offset, token_count"
+)
+_PARAGRAPH_COLUMNS = (
+    "para_index, content, start_offset, end_offset, "
+    "vector_blob, vector_dtype, vector_scale"
+)
+
+
+def _copy_index(source: Document, doc: Document, doc_dir: Path) -> bool:
+    """
+    Reuse the chunk and paragraph rows (text and vectors) of an identical,
+    already indexed document instead of extracting and embedding again.
+    Returns False when nothing could be reused.
+    """
+    scope = vector_cache.scope_of(doc.owner_id, doc.is_public)
+    segment_vecs = None
+    if settings.VECTOR_BACKEND == "segment":
+        source_scope = vector_cache.scope_of(source.owner_id, source.is_public)
+        segment_vecs = segment_store.document_vectors(source_scope, source.id)
+
+    with Session(engine) as sess:
+        copied = sess.execute(
+            sa_text(
+                f"INSERT INTO document_vector (doc_id, {_VECTOR_COLUMNS}) "
+                f"SELECT :dst, {_VECTOR_COLUMNS} FROM document_vector "
+                "WHERE doc_id=:src"
+            ),
+            {"dst": doc.id, "src": source.id},
+        ).rowcount
+        if not copied:
+            sess.rollback()
+            return False
+        sess.execute(
+            sa_text(
+                f"INSERT INTO document_paragraph (doc_id, {_PARAGRAPH_COLUMNS}) "
+                f"SELECT :dst, {_PARAGRAPH_COLUMNS} FROM document_paragraph "
+                "WHERE doc_id=:src"
+            ),
+            {"dst": doc.id, "src": source.id},
+        )
         sess.commit()
 
+        rows = sess.exec(
+            sa_text(
+                "SELECT id, vector_blob, vector_dtype, vector_scale FROM document_vector "
+                f"WHERE doc_id={int(doc.id)} ORDER BY chunk_index"
+            )
+        ).all()
+        stored = [r for r in rows if r.vector_blob is not None]
+        if settings.VECTOR_BACKEND == "segment":
+            if segment_vecs is None and len(stored) == len(rows):
+                segment_vecs = vector_codec.decode_rows(stored)
+            if segment_vecs is not None:
+                doc_dir.mkdir(parents=True, exist_ok=True)
+                segment_store.write_document(scope, doc.id, doc_dir, segment_vecs)
+        elif settings.VECTOR_BACKEND == "faiss" and stored:
+            faiss_index.add_vectors(
+                sess, scope, [r.id for r in stored], vector_codec.decode_rows(stored)
+            )
+
+    logging.info(
+        "Reused %d indexed chunks of document %s for document %s",
+        copied, source.id, doc.id,
+    )
+    return True
+
+
+def _index_upload(doc: Document, path: Path) -> None:
+    """Index a new upload, reusing the index of identical content if present."""
+    scope = vector_cache.scope_of(doc.owner_id, doc.is_public)
+    doc_dir = document_dir(doc)
+    with Session(engine) as sess:
+        source = _indexed_duplicate(sess, doc)
+    if source is not None and _copy_index(source, doc, doc_dir):
+        return
+    _index_document(doc.id, path, scope, doc_dir, doc.content_hash)
+
+
+def _record_index_error(doc: Document, error: Exception) -> None:
+    """Store why indexing failed on the document so teachers can see it."""
+    doc.index_error = str(error)[:500] or type(error).__name__
+    with Session(engine) as sess:
+        row = sess.get(Document, doc.id)
+        if row:
+            row.index_error = doc.index_error
+            sess.add(row)
+            sess.commit()
+
+
+def _remove_files(sess: Session, doc: Document) -> None:
+    """
+    Delete the files of ``doc``.  Shared blobs and their cached text go once
+    no other document references the content hash.
+    """
+    path = Path(doc.filepath)
+    digest = doc.content_hash
+    if digest is None and path.is_file():
+        # 去重上线前的文档没有记录哈希，但其文本缓存同样按内容哈希存放
+        try:
+            digest = file_hash(str(path))
+        except OSError:
+            digest = None
+    others = 0
+    if digest:
+        others = sess.exec(
+            select(func.count(Document.id)).where(
+                Document.content_hash == digest, Document.id != doc.id
+            )
+        ).one()
+        if not others:
+            remove_text_cache(digest)
+
+    if doc.content_hash:
+        if not others:
+            path.unlink(missing_ok=True)
+        dirs = [document_dir(doc)]
+    else:
+        # 去重上线前上传的文件直接存放在文档目录中
+        try:
+            path.unlink(missing_ok=True)
+        except Exception:
+            pass
+        dirs = list(dict.fromkeys([path.parent, document_dir(doc)]))
+    for d in dirs:
+        if d.exists():
+            # Windows 上仍被映射的段文件删不掉，由 segment_store 稍后重试
+            for p in d.glob("*"):
+                try:
+                    p.unlink(missing_ok=True)
+                except PermissionError:
+                    pass
+            try:
+                d.rmdir()
+            except OSError as exc:
+                logging.warning("Could not remove %s: %s", d, exc)
+
 
 def save_document(
     owner_id: int, filename: str, data: bytes, is_public: bool = False
@@ -59,13 +446,11 @@ def save_document(
         sess.commit()
         sess.refresh(doc)
 
-        # Write file to storage (treat .doc and .docx the same)
-        doc_dir = Path(settings.DOC_STORAGE_DIR) / str(owner_id) / str(doc.id)
-        doc_dir.mkdir(parents=True, exist_ok=True)
-        path = doc_dir / filename
-        path.write_bytes(data)
+        # Store the file content-addressed; identical uploads share one blob
+        digest, path = _store_blob(data, filename)
 
         # Update filepath and initial activation flag
+        doc.content_hash = digest
         doc.filepath = str(path)
         sess.add(doc)
         sess.add(
@@ -73,11 +458,16 @@ def save_document(
         )
         sess.commit()
 
-    # Index the document asynchronously
+    # Index the document, or reuse the index of an identical upload
+    scope = vector_cache.scope_of(owner_id, is_public)
     try:
-        _index_document(doc.id, path)
+        _index_upload(doc, path)
     except Exception as e:
         logging.error("Indexing document %s failed: %s", doc.id, e)
+        _record_index_error(doc, e)
+    vector_cache.invalidate_scope(scope)
+    faiss_index.invalidate_scope(scope)
+    vector_cache.invalidate_activations(owner_id)
 
     return doc
 
@@ -123,6 +513,7 @@ def list_public_documents(teacher_id: int) -> List[DocumentWithActivation]:
                     uploaded_at=doc.uploaded_at,
                     is_active=bool(active) if active is not None else False,
                     is_public=doc.is_public,
+                    index_error=doc.index_error,
                 )
             )
         return result
@@ -145,6 +536,7 @@ def set_activation(doc_id: int, teacher_id: int, is_active: bool) -> bool:
             da.is_active = is_active
             sess.add(da)
         sess.commit()
+        vector_cache.invalidate_activations(teacher_id)
         return True
 
 
@@ -154,8 +546,8 @@ def delete_document(doc_id: int, owner_id: int) -> bool:
         if not doc or doc.owner_id != owner_id or doc.is_public:
             return False
 
-        # 1. Remove all chunk vectors
-        sess.execute(sa_delete(DocumentVector).where(DocumentVector.doc_id == doc_id))
+        # 1. Remove all chunk and paragraph vectors
+        _delete_vectors(sess, doc)
 
         # 2. Remove all activation records
         sess.execute(
@@ -163,20 +555,13 @@ def delete_document(doc_id: int, owner_id: int) -> bool:
         )
 
         # 3. Clean up filesystem
-        path = Path(doc.filepath)
-        if path.exists():
-            try:
-                path.unlink()
-            except Exception:
-                pass
-        if path.parent.exists():
-            for p in path.parent.glob("*"):
-                p.unlink(missing_ok=True)
-            path.parent.rmdir()
+        _remove_files(sess, doc)
 
         # 4. Delete metadata
         sess.delete(doc)
         sess.commit()
+        vector_cache.invalidate_scope(owner_id)
+        vector_cache.invalidate_activations(owner_id)
         return True
 
 
@@ -194,22 +579,23 @@ def save_public_document(owner_id: int, filename: str, data: bytes) -> Document:
         sess.commit()
         sess.refresh(doc)
 
-        # Write file to storage
-        doc_dir = Path(settings.DOC_STORAGE_DIR) / "public" / str(doc.id)
-        doc_dir.mkdir(parents=True, exist_ok=True)
-        path = doc_dir / filename
-        path.write_bytes(data)
+        # Store the file content-addressed
+        digest, path = _store_blob(data, filename)
 
         # Update filepath
+        doc.content_hash = digest
         doc.filepath = str(path)
         sess.add(doc)
         sess.commit()
 
-    # Index the public document
+    # Index the public document, or reuse the index of an identical upload
     try:
-        _index_document(doc.id, path)
+        _index_upload(doc, path)
     except Exception as e:
         logging.error("Indexing public document %s failed: %s", doc.id, e)
+        _record_index_error(doc, e)
+    vector_cache.invalidate_scope(vector_cache.PUBLIC_SCOPE)
+    faiss_index.invalidate_scope(vector_cache.PUBLIC_SCOPE)
 
     return doc
 
@@ -220,22 +606,85 @@ def delete_public_document(doc_id: int) -> bool:
         if not doc or not doc.is_public:
             return False
 
-        # Remove vectors
-        sess.execute(sa_delete(DocumentVector).where(DocumentVector.doc_id == doc_id))
+        # Teachers who activated this document need their cached state refreshed
+        teacher_ids = sess.exec(
+            select(DocumentActivation.teacher_id).where(
+                DocumentActivation.doc_id == doc_id
+            )
+        ).all()
+
+        # Remove vectors and activation records
+        _delete_vectors(sess, doc)
+        sess.execute(
+            sa_delete(DocumentActivation).where(DocumentActivation.doc_id == doc_id)
+        )
 
         # Clean up filesystem
-        path = Path(doc.filepath)
-        if path.exists():
-            try:
-                path.unlink()
-            except Exception:
-                pass
-        if path.parent.exists():
-            for p in path.parent.glob("*"):
-                p.unlink(missing_ok=True)
-            path.parent.rmdir()
+        _remove_files(sess, doc)
 
         # Delete metadata
         sess.delete(doc)
         sess.commit()
+        vector_cache.invalidate_scope(vector_cache.PUBLIC_SCOPE)
+        for tid in teacher_ids:
+            vector_cache.invalidate_activations(tid)
         return True
+
+
+_MIGRATION_BATCH = 500
+
+
+def migrate_vector_storage() -> int:
+    """Re-encode stored vectors into ``VECTOR_STORAGE_DTYPE``; returns rows converted."""
+    target = vector_codec.check_dtype(settings.VECTOR_STORAGE_DTYPE)
+    converted = 0
+    for table in (DocumentVector.__tablename__, DocumentParagraph.__tablename__):
+        last_id = 0
+        while True:
+            # 每批单独开会话并提交，避免长事务阻塞上传与检索
+            with Session(engine) as sess:
+                rows = sess.exec(
+                    sa_text(
+                        f"SELECT id, vector_blob, vector_dtype, vector_scale FROM {table} "
+                        f"WHERE id>{last_id} AND vector_blob IS NOT NULL "
+                        "AND COALESCE(vector_dtype, 'float32')<>:target "
+                        f"ORDER BY id LIMIT {_MIGRATION_BATCH}"
+                    ).bindparams(target=target)
+                ).all()
+                if not rows:
+                    break
+                encoded = vector_codec.encode_many(vector_codec.decode_rows(rows), target)
+                sess.execute(
+                    sa_text(
+                        f"UPDATE {table} SET vector_blob=:blob, vector_dtype=:dtype, "
+                        "vector_scale=:scale WHERE id=:id"
+                    ),
+                    [
+                        {"id": r.id, "blob": blob, "dtype": target, "scale": scale}
+                        for r, (blob, scale) in zip(rows, encoded)
+                    ],
+                )
+                sess.commit()
+            last_id = rows[-1].id
+            converted += len(rows)
+    if converted:
+        vector_cache.clear()
+    return converted
+
+
+def start_vector_migration() -> threading.Thread:
+    """Convert existing vectors to ``VECTOR_STORAGE_DTYPE`` in a background thread."""
+
+    def run() -> None:
+        try:
+            count = migrate_vector_storage()
+            if count:
+                logging.info(
+                    "Migrated %d stored vectors to %s", count, settings.VECTOR_STORAGE_DTYPE
+                )
+        except Exception as e:
+            logging.error("Vector storage migration failed: %s", e)
+
+    thread = threading.Thread(target=run, name="vector-migration", daemon=True)
+    thread.start()
+    return thread
@@ -1,6 +1,6 @@
 import json
 import re
-from typing import Dict, Any, List, Union, Literal
+from typing import Dict, Any, List, Optional, Union, Literal
 from io import BytesIO
 import copy
 from pathlib import Path
@@ -23,7 +23,9 @@ from backend.utils.pdf_utils import (
 )
 from backend.models import Exercise, Homework, Class, Submission
 from backend.utils.deepseek_client import call_deepseek_api
+from backend.utils.llm_scheduler import PREVIEW
 from backend.config import engine
+from backend.services import grading_cache_service
 
 # ———————— 字体注册 ————————
 DEFAULT_FONT = "STSong-Light"
@@ -56,6 +58,7 @@ class Item(BaseModel):
     id: int
     question: str
     options: List[str] = []
+    test_cases: Optional[List[Dict[str, str]]] = None
 
 class QuestionBlock(BaseModel):
     type: Literal[
@@ -113,7 +116,14 @@ def _clean_model_output(raw: Dict[str, Any]) -> ExerciseData:
                 if opts is None:
                     opts = it.get("items", [])
                 opts_clean = [str(o).strip() for o in opts]
-                items.append(Item(id=next_id, question=q_text, options=opts_clean))
+                cases = None
+                if rq.type == "coding" and isinstance(it.get("test_cases"), list):
+                    cases = [
+                        {"input": str(c.get("input") or ""), "output": str(c["output"])}
+                        for c in it["test_cases"]
+                        if isinstance(c, dict) and c.get("output") is not None
+                    ] or None
+                items.append(Item(id=next_id, question=q_text, options=opts_clean, test_cases=cases))
             next_id += 1
         blocks.append(QuestionBlock(type=rq.type, items=items))
 
@@ -129,6 +139,9 @@ def preview_exercise(
     num_fill_blank: int,
     num_short_answer: int,
     num_programming: int,
+    user_id: Optional[int] = None,
+    cache: bool = True,
+    fresh: bool = False,
 ) -> Dict[str, Any]:
     parts: List[str] = []
     if num_single_choice:
@@ -172,7 +185,8 @@ def preview_exercise(
         "    },\n"
         "    {\n"
         '      "type": "coding",\n'
-        '      "items": [ { "id\": \"6\", \"question\": \"这是示例编程\" } ]\n'
+        '      "items": [ { "id\": \"6\", \"question\": \"这是示例编程\", '
+        '\"test_cases\": [ { \"input\": \"1 2\", \"output\": \"3\" } ] } ]\n'
         "    }\n"
         "  ],\n"
         '  "answers": { "1": "B", "2": "D", "3": ["A","B","C"], "4": "示例", "5": "示例", "6": "示例" }\n'
@@ -181,14 +195,19 @@ def preview_exercise(
         "1. 上面只是示例 JSON 结构，示例里的题目数量和具体内容不要照搬。\n"
         "2. 请根据最前面“生成 X 道单选题/多选题/填空题/简答题/编程题”的要求，输出对应数量的题目。\n"
         "3. 严格按照示例的 key、层级和格式输出纯 JSON，不要多余文本、不要 Markdown、不要注释。\n"
+        "4. 编程题要求学生用 Python 从标准输入读取、向标准输出打印，并用 test_cases 给出 3 到 5 组输入 input 与期望输出 output。\n"
     )
 
-    resp = call_deepseek_api(prompt)
+    # 相同主题和题量的预览命中缓存；fresh 为 True 时重新生成
+    resp = call_deepseek_api(
+        prompt, priority=PREVIEW, user_id=user_id, cache=cache, fresh=fresh,
+        call_site="exercise",
+    )
     raw = _parse_model_response(resp)
     clean = _clean_model_output(raw)
     return {
         "topic": topic,
-        "questions": [b.dict() for b in clean.questions],
+        "questions": [b.dict(exclude_none=True) for b in clean.questions],
         "answers": clean.answers,
     }
 
@@ -425,11 +444,34 @@ def stats_for_exercise(exercise_id: int) -> Dict[str, Any]:
         ).all()
         total = len(subs)
         avg = sum(s.score for s in subs) / total if total else 0.0
-        return {"total_submissions": total, "average_score": avg}
+    return {
+        "total_submissions": total,
+        "average_score": avg,
+        "grading_cache": grading_cache_service.stats(exercise_id),
+    }
+
+
+def update_exercise_answers(
+    exercise_id: int, answers: Dict[str, Any], points: Optional[Dict[str, Any]] = None
+) -> Optional[Exercise]:
+    """修改标准答案（及分值），并清除该练习的批改缓存。已完成的批改不会重新计算。"""
+    with Session(engine, expire_on_commit=False) as sess:
+        ex = sess.get(Exercise, exercise_id)
+        if not ex:
+            return None
+        ex.answers = answers
+        if points is not None:
+            ex.points = points
+        sess.add(ex)
+        sess.commit()
+        sess.refresh(ex)
+    grading_cache_service.invalidate(exercise_id)
+    return ex
 
 
 def delete_exercise(exercise_id: int) -> bool:
     """Delete an exercise and all related homework/submissions."""
+    grading_cache_service.invalidate(exercise_id)
     with Session(engine, expire_on_commit=False) as sess:
         ex = sess.get(Exercise, exercise_id)
         if not ex:
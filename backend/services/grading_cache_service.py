@@ -0,0 +1,196 @@
+# backend/services/grading_cache_service.py
+
+"""
+主观题批改结果缓存。
+
+同一个班级里很多学生对同一道题给出相同的答案。批改前先按
+(练习, 题目, 题目摘要, 规范化答案) 查 ``grading_cache`` 表，命中则直接复用
+得分、结果与解析，只有未命中的答案才交给大模型，批改完成后写回缓存。
+
+ - 答案规范化：文本题与 ``grading.normalize_text`` 一致（全角转半角、合并空白、
+   忽略大小写）；编程题只去掉行尾空白，保留缩进；
+ - 失效：题目摘要包含题干、标准答案与分值，任何一项变化都不会再命中旧记录；
+   教师修改标准答案时 ``invalidate`` 会直接删除该练习的缓存；
+ - 命中率：每条记录累计命中次数，``stats`` 按练习汇总。
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from backend.config import engine, settings
+from backend.models import Exercise, GradingCache
+from backend.utils.code_runner import normalize_output
+from backend.utils.grading import normalize_text
+
+
+def _sha256(value: Any) -> str:
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_answer(qtype: Optional[str], value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return [normalize_answer(qtype, v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): normalize_answer(qtype, v) for k, v in value.items()}
+    if value is None:
+        return ""
+    if qtype == "coding":
+        return normalize_output(value)
+    return normalize_text(value)
+
+
+def answer_hash(qtype: Optional[str], value: Any) -> str:
+    return _sha256(normalize_answer(qtype, value))
+
+
+def _questions(ex: Exercise) -> Dict[str, Dict[str, Any]]:
+    """qid -> {type, key_hash}"""
+    point_map = ex.points or {}
+    answer_key = ex.answers or {}
+    meta = {}
+    for block in ex.prompt or []:
+        qtype = block.get("type")
+        for item in block.get("items", []):
+            qid = str(item.get("id"))
+            meta[qid] = {
+                "type": qtype,
+                "key_hash": _sha256({
+                    "item": item,
+                    "answer": answer_key.get(qid),
+                    "points": point_map.get(qid, point_map.get(qtype, 1)),
+                }),
+            }
+    return meta
+
+
+def lookup(ex: Exercise, answers: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Cached grading for ``{qid: answer}``; returns ``{qid: {"result", "score",
+    "explanation"}}`` for the hits and counts them.
+    """
+    return _fetch(ex, {qid: (qid, value, 1) for qid, value in answers.items()})
+
+
+def lookup_question(ex: Exercise, qid: str, answers: Dict[str, Any], weights: Optional[Dict[str, int]] = None):
+    """
+    Like ``lookup`` for several answers to one question, keyed by the caller's
+    tokens. ``weights`` counts how many submissions share each answer.
+    """
+    weights = weights or {}
+    return _fetch(ex, {token: (qid, value, weights.get(token, 1)) for token, value in answers.items()})
+
+
+def _fetch(ex: Exercise, requests: Dict[str, tuple]) -> Dict[str, Dict[str, Any]]:
+    if not settings.GRADING_CACHE_ENABLED or not requests:
+        return {}
+    meta = _questions(ex)
+    wanted: Dict[tuple, list] = {}
+    for token, (qid, value, weight) in requests.items():
+        info = meta.get(qid)
+        if info:
+            wanted.setdefault((qid, info["key_hash"], answer_hash(info["type"], value)), []).append(
+                (token, weight)
+            )
+    if not wanted:
+        return {}
+
+    hits: Dict[str, Dict[str, Any]] = {}
+    with Session(engine) as sess:
+        rows = sess.exec(
+            select(GradingCache).where(
+                GradingCache.exercise_id == ex.id,
+                GradingCache.question_id.in_({qid for qid, _, _ in wanted}),
+                GradingCache.answer_hash.in_({h for _, _, h in wanted}),
+            )
+        ).all()
+        counts: Dict[int, List[int]] = {}  # 命中次数 -> 记录 ID
+        for row in rows:
+            matched = wanted.get((row.question_id, row.key_hash, row.answer_hash))
+            if not matched:
+                continue
+            for token, _ in matched:
+                hits[token] = {"result": row.result, "score": row.score, "explanation": row.explanation}
+            counts.setdefault(sum(w for _, w in matched), []).append(row.id)
+        for n, ids in counts.items():
+            sess.execute(
+                update(GradingCache)
+                .where(GradingCache.id.in_(ids))
+                .values(hits=GradingCache.hits + n, last_hit_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+        if counts:
+            sess.commit()
+    return hits
+
+
+def store(
+    ex: Exercise, qid: str, answer: Any, result: Any, score: Any, explanation: Any, reused: int = 0
+) -> None:
+    """
+    Remember how the LLM graded ``answer`` for question ``qid``. ``reused`` counts
+    other submissions in the same batch that shared the answer, as hits.
+    """
+    if not settings.GRADING_CACHE_ENABLED or result is None:
+        return
+    info = _questions(ex).get(qid)
+    if info is None:
+        return
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return
+    entry = GradingCache(
+        exercise_id=ex.id,
+        question_id=qid,
+        key_hash=info["key_hash"],
+        answer_hash=answer_hash(info["type"], answer),
+        result=str(result)[:16],
+        score=score,
+        explanation=None if explanation is None else str(explanation),
+        hits=reused,
+    )
+    with Session(engine) as sess:
+        sess.add(entry)
+        try:
+            sess.commit()
+        except IntegrityError:
+            # 并发批改的其它 worker 已写入相同答案
+            sess.rollback()
+        except Exception as e:
+            sess.rollback()
+            logging.error("Failed to store grading cache for exercise %s: %s", ex.id, e)
+
+
+def invalidate(exercise_id: int) -> int:
+    """Drop all cached grading of an exercise, e.g. after its answer key changed."""
+    with Session(engine) as sess:
+        result = sess.execute(delete(GradingCache).where(GradingCache.exercise_id == exercise_id))
+        sess.commit()
+        return result.rowcount or 0
+
+
+def stats(exercise_id: int) -> Dict[str, Any]:
+    """
+    缓存条数即交给大模型批改的不同答案数，命中次数为复用的次数，
+    命中率 = 命中 / (命中 + 条数)。
+    """
+    with Session(engine) as sess:
+        entries, hits = sess.exec(
+            select(func.count(GradingCache.id), func.coalesce(func.sum(GradingCache.hits), 0))
+            .where(GradingCache.exercise_id == exercise_id)
+        ).one()
+    hits = int(hits or 0)
+    lookups = hits + entries
+    return {
+        "entries": entries,
+        "hits": hits,
+        "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+    }
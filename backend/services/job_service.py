@@ -0,0 +1,71 @@
+# backend/services/job_service.py
+
+"""
+注册各类后台任务的处理函数，并在启动时恢复遗留任务。
+
+API 进程和独立 worker 进程都需要 import 本模块，保证 worker 认领到的
+任务都有对应的处理函数。
+"""
+
+import logging
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from backend.config import engine
+from backend.models import Submission
+from backend.services.analysis_service import analyze_and_save_homeworks
+from backend.services.courseware_service import render_courseware_pdf
+from backend.services.submission_service import (
+    enqueue_grading,
+    grade_homework_batch,
+    grade_submission,
+    requeue_batch_individually,
+)
+from backend.utils import job_queue
+from backend.utils.job_queue import (
+    ANALYZE_STUDENT,
+    GRADE_HOMEWORK_BATCH,
+    GRADE_SUBMISSION,
+    RENDER_COURSEWARE_PDF,
+)
+
+
+def _grading_failed(submission_id: int) -> None:
+    with Session(engine) as sess:
+        sub = sess.get(Submission, submission_id)
+        if sub and sub.status == "grading":
+            sub.status = "failed"
+            sub.grading_claim = None
+            sess.add(sub)
+            sess.commit()
+
+
+def recover_orphaned_submissions() -> int:
+    """Queue grading for submissions left in ``grading`` without a live job."""
+    with Session(engine) as sess:
+        rows = sess.exec(
+            select(Submission.id, Submission.homework_id).where(Submission.status == "grading")
+        ).all()
+    recovered = 0
+    for sid, hw_id in rows:
+        if not job_queue.has_active(f"grade:{sid}") and not job_queue.has_active(f"grade-batch:{hw_id}"):
+            # 认领它的任务已不在运行，释放后重新排队
+            with Session(engine) as sess:
+                sess.execute(
+                    update(Submission)
+                    .where(Submission.id == sid, Submission.status == "grading")
+                    .values(grading_claim=None)
+                )
+                sess.commit()
+            enqueue_grading(sid)
+            recovered += 1
+    if recovered:
+        logging.warning("Re-queued grading for %d orphaned submissions", recovered)
+    return recovered
+
+
+job_queue.register(GRADE_SUBMISSION, grade_submission, on_failure=_grading_failed)
+job_queue.register(GRADE_HOMEWORK_BATCH, grade_homework_batch, on_failure=requeue_batch_individually)
+job_queue.register(RENDER_COURSEWARE_PDF, render_courseware_pdf)
+job_queue.register(ANALYZE_STUDENT, analyze_and_save_homeworks)
@@ -1,9 +1,11 @@
 # backend/services/lesson_service.py
 
+import asyncio
 from typing import List, Tuple
 
 import backend.utils.deepseek_client as _ds
 from backend.utils import rag_pipeline
+from backend.utils.llm_scheduler import PREVIEW
 from backend.db import get_session
 
 
@@ -46,20 +48,25 @@ def _build_prompt(topic: str, knowledge_texts: List[Tuple[str, str]]) -> str:
         "如有表格，请顶格书写且表格前后留空行。"
     )
 
-async def generate_lesson(topic: str, user_id: int) -> str:
+async def generate_lesson(topic: str, user_id: int, fresh: bool = False) -> str:
     """
     调用 Deepseek API，根据主题生成教案 Markdown 文本。
+    相同主题与知识库片段的结果会被缓存，``fresh`` 为 True 时重新生成。
     """
-    snippets = _retrieve_snippets(topic, user_id)
+    # 检索包含向量编码与数据库查询，放到线程中执行，避免阻塞事件循环
+    snippets = await asyncio.to_thread(_retrieve_snippets, topic, user_id)
     prompt = _build_prompt(topic, snippets)
-    result = _ds.call_deepseek_api(prompt=prompt)
+    result = await _ds.acall_deepseek_api(
+        prompt=prompt, priority=PREVIEW, user_id=user_id, cache=True, fresh=fresh,
+        call_site="lesson",
+    )
     markdown_content = result["choices"][0]["message"]["content"]
     return markdown_content
 
 
 async def optimize_lesson(topic: str, markdown: str, instruction: str, user_id: int) -> str:
     """根据教师的要求和知识库片段优化教案 Markdown。"""
-    snippets = _retrieve_snippets(topic, user_id)
+    snippets = await asyncio.to_thread(_retrieve_snippets, topic, user_id)
     if snippets:
         header = (
             f"以下是与“{topic}”相关的本地知识库片段，共 {len(snippets)} 条（仅供参考）：\n\n"
@@ -78,5 +85,7 @@ async def optimize_lesson(topic: str, markdown: str, instruction: str, user_id:
         f"原教案内容：\n{markdown}\n\n"
         "请直接输出优化后的 Markdown，不要使用 ``` 包裹。"
     )
-    result = _ds.call_deepseek_api(prompt=prompt)
+    result = await _ds.acall_deepseek_api(
+        prompt=prompt, priority=PREVIEW, user_id=user_id, call_site="lesson"
+    )
     return result["choices"][0]["message"]["content"]
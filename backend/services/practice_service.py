@@ -59,6 +59,9 @@ def generate_practice(
         num_fill_blank=num_fill_blank,
         num_short_answer=num_short_answer,
         num_programming=num_programming,
+        user_id=student_id,
+        # 自主练习每次都应出新题，不使用缓存
+        cache=False,
     )
     with Session(engine) as sess:
         practice = Practice(
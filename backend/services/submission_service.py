@@ -1,13 +1,21 @@
 # backend/services/submission_service.py
 import json
+import logging
 import re
+import uuid
 from typing import Dict, Any, List, Optional
+from sqlalchemy import or_, update
 from sqlmodel import Session, select
-from backend.config import engine
+from backend.config import engine, settings
 from backend.models import Exercise, Homework, Submission, ClassStudent, Class
 from backend.utils.deepseek_client import call_deepseek_api
-from backend.services.analysis_service import analyze_and_save_homeworks
+from backend.utils import job_queue
+from backend.utils.job_queue import GRADE_HOMEWORK_BATCH, GRADE_SUBMISSION
+from backend.utils.llm_scheduler import GRADING
+from backend.services import grading_cache_service
+from backend.services.analysis_service import enqueue_analysis
 from backend.utils.scoring import compute_total_points
+from backend.utils.grading import convert_indexed_answers, grade_objective, tested_coding_ids
 
 
 def submit_homework(homework_id: int, student_id: int, answers: Dict[str, Any]) -> Submission:
@@ -27,136 +35,411 @@ def submit_homework(homework_id: int, student_id: int, answers: Dict[str, Any])
         return sub
 
 
+def enqueue_grading(submission_id: int) -> int:
+    """把提交放入后台批改队列。"""
+    return job_queue.enqueue(
+        GRADE_SUBMISSION, {"submission_id": submission_id}, dedupe_key=f"grade:{submission_id}"
+    )
+
+
+def enqueue_submission_grading(sub: Submission) -> int:
+    """按 GRADING_BATCH_ENABLED 选择按作业批量批改或逐份批改。"""
+    if settings.GRADING_BATCH_ENABLED:
+        return enqueue_batch_grading(sub.homework_id)
+    return enqueue_grading(sub.id)
+
+
+def _claim_token() -> str:
+    """当前批改任务的标识；同一任务重试时不变，可重新认领自己名下的提交。"""
+    job_id = job_queue.current_job_id()
+    return f"job:{job_id}" if job_id is not None else uuid.uuid4().hex
+
+
+def _claim(sess: Session, token: str, *conditions) -> List[Submission]:
+    """
+    用条件 UPDATE 把待批改且未被其它任务认领的提交标记为 ``token``，
+    返回本任务认领到的提交。并发的批改任务不会拿到同一份提交。
+    """
+    sess.execute(
+        update(Submission)
+        .where(
+            Submission.status == "grading",
+            or_(Submission.grading_claim.is_(None), Submission.grading_claim == token),
+            *conditions,
+        )
+        .values(grading_claim=token)
+        .execution_options(synchronize_session=False)
+    )
+    sess.commit()
+    return sess.exec(
+        select(Submission).where(
+            Submission.status == "grading", Submission.grading_claim == token, *conditions
+        )
+    ).all()
+
+
+def _release(sess: Session, token: str, *conditions) -> List[int]:
+    """放弃本任务认领的提交，返回其 ID。"""
+    ids = sess.exec(
+        select(Submission.id).where(
+            Submission.status == "grading", Submission.grading_claim == token, *conditions
+        )
+    ).all()
+    if ids:
+        sess.execute(
+            update(Submission)
+            .where(Submission.id.in_(ids), Submission.grading_claim == token)
+            .values(grading_claim=None)
+            .execution_options(synchronize_session=False)
+        )
+        sess.commit()
+    return list(ids)
+
+
+def _grade_with_llm(
+    ex: Exercise, letter_answers: Dict[str, Any], qids: List[str], student_id: int
+) -> Dict[str, Any]:
+    """用大模型批改 ``qids`` 中的题目，返回 results / scores / explanations。"""
+    wanted = set(qids)
+    blocks = []
+    for block in ex.prompt:
+        items = [it for it in block.get("items", []) if str(it.get("id")) in wanted]
+        if items:
+            blocks.append({**block, "items": items})
+    answers = {qid: (ex.answers or {}).get(qid) for qid in qids}
+    given = {qid: letter_answers.get(qid) for qid in qids}
+
+    # 构建批改 prompt（用 letter_answers 而非原始 sub.answers）
+    point_map = ex.points or {}
+    sa_pt = point_map.get("short_answer", 1)
+    sc_pt = point_map.get("single_choice", 1)
+    mc_pt = point_map.get("multiple_choice", 1)
+    fb_pt = point_map.get("fill_in_blank", 1)
+    cd_pt = point_map.get("coding", 1)
+    prompt = (
+        "请根据下面的 JSON：\n"
+        f"题目: {json.dumps(blocks, ensure_ascii=False)}\n"
+        f"标准答案: {json.dumps(answers, ensure_ascii=False)}\n"
+        f"学生答案: {json.dumps(given, ensure_ascii=False)}\n\n"
+        f"请判断学生答案并给出解析。其中简答题按照满分 {sa_pt} 分给出 0 到 {sa_pt} 的得分，"
+        "其他题型判断对错即可。"
+        f"分值说明：单选题 {sc_pt} 分；多选题 {mc_pt} 分；"
+        f"填空题 {fb_pt} 分；简答题 {sa_pt} 分；编程题 {cd_pt} 分。\n"
+        "请严格按照上述分值给出每道题的分数。\n"
+        "返回 JSON：{ \"results\": {qid: 'correct|wrong|partial'}, \"scores\": {qid: number}, "
+        "\"explanations\": {qid: '解析'} }。"
+        "请只返回 JSON，不要有其它任何多余内容，包括任何markdown符号。"
+    )
+
+    # 调用 Deepseek / 大模型 API
+    resp = call_deepseek_api(
+        prompt, model="deepseek-chat", priority=GRADING, user_id=student_id,
+        call_site="grading",
+    )
+    return _parse_grading(resp["choices"][0]["message"]["content"])
+
+
+def _explain_coding(
+    ex: Exercise, letter_answers: Dict[str, Any], explanations: Dict[str, Any], student_id: int
+) -> None:
+    """编程题得分以测试用例为准，CODE_GRADING_EXPLAIN 时请大模型补充解析。"""
+    qids = [qid for qid in tested_coding_ids(ex.prompt) if letter_answers.get(qid)]
+    if not settings.CODE_GRADING_EXPLAIN or not qids:
+        return
+    try:
+        data = _grade_with_llm(ex, letter_answers, qids, student_id)
+    except Exception as e:
+        # 解析只是补充，失败不影响批改结果
+        logging.error("Coding explanation failed for student %s: %s", student_id, e)
+        return
+    for qid in qids:
+        extra = data["explanations"].get(qid)
+        if extra:
+            explanations[qid] = f"{explanations.get(qid, '')}\n{extra}".strip()
+
+
+def _parse_grading(content: str) -> Dict[str, Dict[str, Any]]:
+    """批改结果 JSON -> results / scores / explanations，key 统一为字符串。"""
+    # 提取 JSON 字符串
+    start = content.find("{")
+    end = content.rfind("}")
+    if start == -1 or end == -1 or start > end:
+        # fallback: 去除可能存在的 ```json ``` 标记
+        text = re.sub(r"^```(?:json)?\s*", "", content)
+        text = re.sub(r"\s*```$", "", text)
+    else:
+        text = content[start : end + 1]
+
+    data = json.loads(text)
+    # 模型返回的 key 可能是数字，统一成字符串
+    return {
+        field: {str(k): v for k, v in (data.get(field) or {}).items()}
+        for field in ("results", "scores", "explanations")
+    }
+
+
+def _complete(
+    sess: Session,
+    sub: Submission,
+    hw: Homework,
+    ex: Exercise,
+    results: Dict[str, Any],
+    scores_dict: Dict[str, Any],
+    explanations: Dict[str, Any],
+) -> None:
+    """计算总分、写回 feedback 并标记完成，随后在后台更新学情分析。"""
+    point_map = ex.points or {}
+    # 计算总分：遍历练习的所有题目，按题目ID优先、题型其次的分值累加
+    total_score = 0
+    for block in ex.prompt:
+        qtype = block.get("type")
+        default_base = point_map.get(qtype, 1)
+        for item in block.get("items", []):
+            qid = str(item.get("id"))
+            base = point_map.get(qid, default_base)
+
+            if qid in scores_dict:
+                try:
+                    total_score += float(scores_dict[qid])
+                except (TypeError, ValueError):
+                    pass
+                continue
+
+            if results.get(qid) in ("correct", "正确", "对", True):
+                total_score += base
+
+    sub.score    = int(round(total_score))
+    sub.feedback = {
+        "results": results,
+        "explanations": explanations,
+        "scores": scores_dict,
+    }
+    sub.status   = "completed"
+    sub.grading_claim = None
+
+    sess.add(sub)
+    sess.commit()
+
+    # 批改后在后台更新学情分析
+    enqueue_analysis(sub.student_id)
+    cls = sess.get(Class, hw.class_id) if hw.class_id else None
+    if cls and cls.teacher_id == ex.teacher_id:
+        enqueue_analysis(sub.student_id, teacher_id=cls.teacher_id)
+
+
 def grade_submission(submission_id: int):
     """
-    后台批改：调用大模型，比对标准答案，填充 score、feedback、status=completed。
+    后台批改：客观题本地比对标准答案，带测试用例的编程题在沙箱中运行，其余主观题调用大模型，填充 score、feedback、status=completed。
     """
     with Session(engine) as sess:
-        sub = sess.get(Submission, submission_id)
+        claimed = _claim(sess, _claim_token(), Submission.id == submission_id)
+        if not claimed:
+            # 已批改完成，或正由批量批改任务处理
+            return
+        sub = claimed[0]
         hw  = sess.get(Homework, sub.homework_id)
         ex  = sess.get(Exercise, hw.exercise_id)
 
-        # —— 新增：只处理单选/多选题的索引->字母转换 ——
-        def convert_indexed_answers(prompt_blocks, indexed_answers: Dict[str, Any]) -> Dict[str, Any]:
-            """
-            只对 single_choice / multiple_choice 题型做索引->字母转换，
-            其他题型保持原值。
-            """
-            # 构造 qid -> (qtype, options) 映射
-            meta = {}
-            for block in prompt_blocks:
-                qtype = block.get("type")
-                for item in block.get("items", []):
-                    qid = str(item.get("id"))
-                    meta[qid] = {
-                        "type": qtype,
-                        "options": item.get("options", []),
-                    }
-
-            letter_answers = {}
-            for qid, ans in indexed_answers.items():
-                info = meta.get(qid)
-                # 如果不是选择题或未找到元数据，保持原值
-                if not info or info["type"] not in ("single_choice", "multiple_choice"):
-                    letter_answers[qid] = ans
-                    continue
-
-                opts = info["options"]
-                if isinstance(ans, list):
-                    # 多选题：索引列表 -> 字母列表
-                    letter_answers[qid] = [
-                        opts[i].split(".", 1)[0] for i in ans if 0 <= i < len(opts)
-                    ]
-                else:
-                    # 单选题：单个索引 -> 字母
-                    letter_answers[qid] = (
-                        opts[ans].split(".", 1)[0]
-                        if isinstance(ans, int) and 0 <= ans < len(opts)
-                        else ans
-                    )
-            return letter_answers
-
         # 原始索引答案
         indexed = sub.answers or {}
         # 转换得到字母答案（只影响 single_choice/multiple_choice 题型）
         letter_answers = convert_indexed_answers(ex.prompt, indexed)
 
-        # 构建批改 prompt（用 letter_answers 而非原始 sub.answers）
-        point_map = ex.points or {}
-        sa_pt = point_map.get("short_answer", 1)
-        sc_pt = point_map.get("single_choice", 1)
-        mc_pt = point_map.get("multiple_choice", 1)
-        fb_pt = point_map.get("fill_in_blank", 1)
-        cd_pt = point_map.get("coding", 1)
-        prompt = (
-            "请根据下面的 JSON：\n"
-            f"题目: {json.dumps(ex.prompt, ensure_ascii=False)}\n"
-            f"标准答案: {json.dumps(ex.answers, ensure_ascii=False)}\n"
-            f"学生答案: {json.dumps(letter_answers, ensure_ascii=False)}\n\n"
-            f"请判断学生答案并给出解析。其中简答题按照满分 {sa_pt} 分给出 0 到 {sa_pt} 的得分，"
-            "其他题型判断对错即可。"
-            f"分值说明：单选题 {sc_pt} 分；多选题 {mc_pt} 分；"
-            f"填空题 {fb_pt} 分；简答题 {sa_pt} 分；编程题 {cd_pt} 分。\n"
-            "请严格按照上述分值给出每道题的分数。\n"
-            "返回 JSON：{ \"results\": {qid: 'correct|wrong|partial'}, \"scores\": {qid: number}, "
-            "\"explanations\": {qid: '解析'} }。"
-            "请只返回 JSON，不要有其它任何多余内容，包括任何markdown符号。"
+        # 单选 / 多选 / 填空题直接对照标准答案本地批改
+        results, scores_dict, explanations, pending = grade_objective(
+            ex.prompt, ex.answers or {}, letter_answers, ex.points or {}
         )
+        # 其它学生给出过相同答案的主观题直接复用批改结果
+        cached = grading_cache_service.lookup(ex, {qid: letter_answers.get(qid) for qid in pending})
+        for qid, hit in cached.items():
+            results[qid], scores_dict[qid], explanations[qid] = hit["result"], hit["score"], hit["explanation"]
+        pending = [qid for qid in pending if qid not in cached]
+
+        # 只有简答、编程等主观题交给大模型
+        if pending:
+            data = _grade_with_llm(ex, letter_answers, pending, sub.student_id)
+            for target, field in (
+                (results, "results"),
+                (scores_dict, "scores"),
+                (explanations, "explanations"),
+            ):
+                target.update({qid: v for qid, v in data[field].items() if qid in pending})
+            for qid in pending:
+                grading_cache_service.store(
+                    ex, qid, letter_answers.get(qid),
+                    results.get(qid), scores_dict.get(qid), explanations.get(qid),
+                )
+        _explain_coding(ex, letter_answers, explanations, sub.student_id)
+
+        _complete(sess, sub, hw, ex, results, scores_dict, explanations)
+
+
+# ———————— 按作业批量批改 ————————
+def _question_meta(ex: Exercise) -> Dict[str, Dict[str, Any]]:
+    meta = {}
+    for block in ex.prompt:
+        for item in block.get("items", []):
+            meta[str(item.get("id"))] = {"type": block.get("type"), "item": item}
+    return meta
+
+
+def _batches(answers: List[tuple]) -> List[List[tuple]]:
+    """按 GRADING_BATCH_SIZE 人、GRADING_BATCH_MAX_CHARS 字符切分学生答案。"""
+    batches, current, size = [], [], 0
+    for key, ans in answers:
+        length = len(json.dumps(ans, ensure_ascii=False))
+        if current and (
+            len(current) >= settings.GRADING_BATCH_SIZE
+            or size + length > settings.GRADING_BATCH_MAX_CHARS
+        ):
+            batches.append(current)
+            current, size = [], 0
+        current.append((key, ans))
+        size += length
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _grade_question_batch(
+    ex: Exercise, qtype: str, item: Dict[str, Any], expected: Any, batch: List[tuple]
+) -> Dict[str, Dict[str, Any]]:
+    """一道主观题、多名学生的答案合并成一次大模型调用，结果按学生编号返回。"""
+    point_map = ex.points or {}
+    full = point_map.get(str(item.get("id")), point_map.get(qtype, 1))
+    label = "简答题" if qtype == "short_answer" else "编程题" if qtype == "coding" else "题目"
+    given = {key: ans for key, ans in batch}
+    prompt = (
+        "请根据下面的 JSON 批改同一道题的多份学生答案：\n"
+        f"题目（{label}）: {json.dumps(item, ensure_ascii=False)}\n"
+        f"标准答案: {json.dumps(expected, ensure_ascii=False)}\n"
+        f"各学生答案: {json.dumps(given, ensure_ascii=False)}\n\n"
+        f"本题满分 {full} 分，请对每个编号的答案分别给出 0 到 {full} 的得分和解析，"
+        "各答案之间相互独立。\n"
+        "返回 JSON：{ \"results\": {编号: 'correct|wrong|partial'}, \"scores\": {编号: number}, "
+        "\"explanations\": {编号: '解析'} }。"
+        "请只返回 JSON，不要有其它任何多余内容，包括任何markdown符号。"
+    )
+    resp = call_deepseek_api(
+        prompt, model="deepseek-chat", priority=GRADING, call_site="grading_batch",
+    )
+    return _parse_grading(resp["choices"][0]["message"]["content"])
+
+
+def grade_homework_batch(homework_id: int) -> int:
+    """
+    批量批改一份作业下所有待批改的提交，返回完成的份数。
+
+    客观题逐份本地批改；每道主观题把多名学生的答案合并到一个 prompt 中，
+    题目和标准答案只发送一次，结果再分发回各自的 Submission.feedback。
+    只处理本任务认领到的提交；大模型重试后仍漏掉的答案，对应提交改为逐份批改。
+    """
+    with Session(engine) as sess:
+        hw = sess.get(Homework, homework_id)
+        if not hw:
+            return 0
+        ex = sess.get(Exercise, hw.exercise_id)
+        token = _claim_token()
+        subs = _claim(sess, token, Submission.homework_id == homework_id)
+        if not subs:
+            return 0
 
-        # 调用 Deepseek / 大模型 API
-        resp = call_deepseek_api(prompt, model="deepseek-chat")
-        content = resp["choices"][0]["message"]["content"]
-
-        # 提取 JSON 字符串
-        start = content.find("{")
-        end = content.rfind("}")
-        if start == -1 or end == -1 or start > end:
-            # fallback: 去除可能存在的 ```json ``` 标记
-            text = re.sub(r"^```(?:json)?\s*", "", content)
-            text = re.sub(r"\s*```$", "", text)
-        else:
-            text = content[start : end + 1]
-
-        data = json.loads(text)
-        results      = data.get("results", {})
-        explanations = data.get("explanations", {})
-        scores_dict  = data.get("scores", {})
-
-        # 计算总分：遍历练习的所有题目，按题目ID优先、题型其次的分值累加
-        total_score = 0
-        for block in ex.prompt:
-            qtype = block.get("type")
-            default_base = point_map.get(qtype, 1)
-            for item in block.get("items", []):
-                qid = str(item.get("id"))
-                base = point_map.get(qid, default_base)
-
-                if qid in scores_dict:
-                    try:
-                        total_score += float(scores_dict[qid])
-                    except ValueError:
-                        pass
+        answer_key = ex.answers or {}
+        meta = _question_meta(ex)
+        graded = {}
+        fallback = set()  # 批量结果不完整、改为逐份批改的提交序号
+        pending: List[str] = []
+        for sub in subs:
+            letter_answers = convert_indexed_answers(ex.prompt, sub.answers or {})
+            results, scores, explanations, pending = grade_objective(
+                ex.prompt, answer_key, letter_answers, ex.points or {}
+            )
+            graded[sub.id] = (letter_answers, results, scores, explanations)
+
+        # pending 只取决于练习本身，所有提交相同
+        for qid in pending:
+            info = meta[qid]
+            # 规范化后相同的答案只批改一次，编号 -> 作答的提交序号
+            groups: Dict[str, List[int]] = {}
+            samples: Dict[str, Any] = {}
+            by_hash: Dict[str, str] = {}
+            for i, sub in enumerate(subs):
+                letter_answers, results, scores, explanations = graded[sub.id]
+                ans = letter_answers.get(qid)
+                if ans in (None, "", []):
+                    # 未作答直接记 0 分，不必交给大模型
+                    results[qid], scores[qid], explanations[qid] = "wrong", 0, "未作答"
                     continue
+                h = grading_cache_service.answer_hash(info["type"], ans)
+                if h not in by_hash:
+                    # 用序号而不是提交 ID 标识学生答案
+                    by_hash[h] = str(len(by_hash) + 1)
+                    samples[by_hash[h]] = ans
+                groups.setdefault(by_hash[h], []).append(i)
 
-                if results.get(qid) in ("correct", "正确", "对", True):
-                    total_score += base
+            def fan_out(key: str, result: Any, score: Any, explanation: Any) -> None:
+                for i in groups[key]:
+                    _, results, scores, explanations = graded[subs[i].id]
+                    results[qid], scores[qid], explanations[qid] = result, score, explanation
 
-        sub.score    = int(round(total_score))
-        sub.feedback = {
-            "results": results,
-            "explanations": explanations,
-            "scores": scores_dict,
-        }
-        sub.status   = "completed"
+            cached = grading_cache_service.lookup_question(
+                ex, qid, samples, {key: len(idx) for key, idx in groups.items()}
+            )
+            for key, hit in cached.items():
+                fan_out(key, hit["result"], hit["score"], hit["explanation"])
+            answered = [(key, ans) for key, ans in samples.items() if key not in cached]
+            # 模型偶尔漏掉部分编号：漏掉的答案单独再批一次
+            for _ in range(2):
+                missing = []
+                for batch in _batches(answered):
+                    data = _grade_question_batch(ex, info["type"], info["item"], answer_key.get(qid), batch)
+                    for key, ans in batch:
+                        if key not in data["results"]:
+                            missing.append((key, ans))
+                            continue
+                        entry = [data[field].get(key) for field in ("results", "scores", "explanations")]
+                        fan_out(key, *entry)
+                        grading_cache_service.store(ex, qid, ans, *entry, reused=len(groups[key]) - 1)
+                answered = missing
+            for key, _ in answered:
+                fallback.update(groups[key])
 
-        sess.add(sub)
-        sess.commit()
+        for i, sub in enumerate(subs):
+            if i in fallback:
+                continue
+            letter_answers, results, scores, explanations = graded[sub.id]
+            _explain_coding(ex, letter_answers, explanations, sub.student_id)
+            _complete(sess, sub, hw, ex, results, scores, explanations)
+
+        if fallback:
+            # 已批改的题目都在缓存中，逐份批改只需处理漏掉的答案
+            ids = [subs[i].id for i in fallback]
+            logging.warning("Batch grading of homework %s incomplete, regrading %s individually", homework_id, ids)
+            for sid in _release(sess, token, Submission.id.in_(ids)):
+                enqueue_grading(sid)
+        return len(subs) - len(fallback)
+
+
+def enqueue_batch_grading(homework_id: int) -> int:
+    """
+    等待 GRADING_BATCH_WINDOW 秒收集同一作业的提交后统一批改；
+    窗口内的后续提交复用同一个排队中的任务。
+    """
+    return job_queue.enqueue(
+        GRADE_HOMEWORK_BATCH,
+        {"homework_id": homework_id},
+        dedupe_key=f"grade-batch:{homework_id}",
+        delay=settings.GRADING_BATCH_WINDOW,
+    )
+
+
+def requeue_batch_individually(homework_id: int) -> None:
+    """批量批改多次失败后，本任务认领的剩余提交改为逐份批改。"""
+    with Session(engine) as sess:
+        ids = _release(sess, _claim_token(), Submission.homework_id == homework_id)
+    for sid in ids:
+        enqueue_grading(sid)
 
-        # 批改后触发分析
-        analyze_and_save_homeworks(sub.student_id)
-        cls = sess.get(Class, hw.class_id) if hw.class_id else None
-        if cls and cls.teacher_id == ex.teacher_id:
-            analyze_and_save_homeworks(sub.student_id, teacher_id=cls.teacher_id)
 
 def list_student_homeworks(student_id: int) -> List[Dict[str, Any]]:
     """
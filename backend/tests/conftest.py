@@ -0,0 +1,170 @@
+# backend/tests/conftest.py
+
+"""
+测试公共配置：在 import backend 之前设置必需的环境变量，数据库使用临时 SQLite。
+
+backend.config 的 engine 带有 MySQL 专用的连接参数，需要数据库的测试用
+``sqlite_engine`` 建表，再用 ``use_engine`` 替换各模块引用的 engine。
+"""
+
+import os
+import tempfile
+from types import SimpleNamespace
+
+_TMP = tempfile.mkdtemp(prefix="edu-platform-tests-")
+os.environ["MYSQL_URI"] = f"sqlite:///{_TMP}/unused.db"
+os.environ.setdefault("DEEPSEEK_API_KEY", "test-key")
+# 没有服务监听的端口：需要大模型的测试改用进程内的模拟服务
+os.environ["DEEPSEEK_ENDPOINT"] = "http://127.0.0.1:9/v1/chat/completions"
+os.environ["DOC_STORAGE_DIR"] = os.path.join(_TMP, "storage")
+os.environ["LLM_METRICS_ENABLED"] = "false"
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import create_engine
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    """Factory: a fresh SQLite engine with the given model tables created."""
+
+    def make(*models):
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+        )
+
+        @event.listens_for(engine, "connect")
+        def _collation(dbapi_conn, _):
+            # 模型中的 Text 列声明了 MySQL 排序规则
+            dbapi_conn.create_collation("utf8mb4_unicode_ci", lambda a, b: (a > b) - (a < b))
+
+        for model in models:
+            model.__table__.create(engine, checkfirst=True)
+        return engine
+
+    return make
+
+
+@pytest.fixture
+def use_engine(monkeypatch):
+    """Point the ``engine`` global of each given module at ``engine``."""
+
+    def apply(engine, *modules):
+        for module in modules:
+            monkeypatch.setattr(module, "engine", engine)
+
+    return apply
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    """
+    Factory: start the in-process mock DeepSeek server (``MockConfig`` fields as
+    keyword arguments, fast by default) and point the client at it. The
+    response cache and circuit breaker start fresh.
+    """
+    from backend.config import settings
+    from backend.scripts.mock_deepseek import MockConfig, serve_in_thread
+    from backend.utils import deepseek_client, llm_cache, llm_resilience
+
+    servers = []
+
+    def start(**config):
+        config = {"latency": "fixed", "latency_mean": 0.01, "ttft": 0.0, "tokens_per_sec": 0, "seed": 0, **config}
+        server = serve_in_thread(MockConfig(**config))
+        servers.append(server)
+        monkeypatch.setattr(settings, "DEEPSEEK_ENDPOINT", server.endpoint)
+        return server
+
+    llm_cache.clear()
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(
+        llm_resilience, "_breaker",
+        llm_resilience.CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN),
+    )
+    yield start
+    deepseek_client.close()
+    for server in servers:
+        server.stop()
+    llm_cache.clear()
+
+
+class FakeEmbedder:
+    """
+    Deterministic stand-in for the SentenceTransformer model: each word
+    (or CJK character) adds to one hashed dimension, so texts sharing words
+    score higher.  ``calls`` counts encoded texts.
+    """
+
+    dim = 64
+    max_seq_length = 256
+    tokenizer = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **_):
+        import re
+        import zlib
+
+        import numpy as np
+
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        self.calls += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in zip(out, texts):
+            for word in re.findall(r"[\u4e00-\u9fff]|\w+", text.lower()):
+                row[zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        return out[0] if single else out
+
+
+@pytest.fixture
+def documents(sqlite_engine, use_engine, monkeypatch, tmp_path):
+    """
+    ``document_service`` on SQLite with storage under ``tmp_path``, inline
+    text extraction and ``FakeEmbedder``; yields ``service``, ``engine`` and
+    ``model``.  Vector caches start empty.
+    """
+    pytest.importorskip("textract")
+    pytest.importorskip("sentence_transformers")
+    from backend import models
+    from backend.config import settings
+    from backend.services import document_service
+    from backend.utils import faiss_index, rag_pipeline, segment_store, vector_cache
+
+    engine = sqlite_engine(
+        models.Document, models.DocumentVector, models.DocumentParagraph,
+        models.DocumentActivation, models.DocumentIndexMetric,
+    )
+    use_engine(engine, document_service)
+    model = FakeEmbedder()
+    monkeypatch.setattr(rag_pipeline, "get_model", lambda: model)
+    monkeypatch.setattr(document_service, "get_model", lambda: model)
+    monkeypatch.setattr(settings, "DOC_STORAGE_DIR", str(tmp_path / "storage"))
+    monkeypatch.setattr(settings, "EXTRACT_POOL_SIZE", 0)
+    monkeypatch.setattr(settings, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(faiss_index, "_indexes", {})
+    monkeypatch.setattr(segment_store, "_manifests", {})
+    monkeypatch.setattr(segment_store, "_arrays", {})
+    monkeypatch.setattr(segment_store, "_pending", set())
+    vector_cache.clear()
+    yield SimpleNamespace(service=document_service, engine=engine, model=model, settings=settings)
+    vector_cache.clear()
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Factory: write a PDF with one line of text per page, return its path."""
+    canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+
+    def make(pages, name="pages.pdf"):
+        path = tmp_path / name
+        c = canvas.Canvas(str(path))
+        for line in pages:
+            c.drawString(72, 720, line)
+            c.showPage()
+        c.save()
+        return path
+
+    return make
@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+from sqlmodel import Session, select
+
+from backend.config import settings
+from backend.models import Class, Exercise, Homework, Job, Submission
+from backend.services import submission_service
+from backend.utils import job_queue
+
+
+@pytest.fixture
+def env(sqlite_engine, use_engine, monkeypatch):
+    """
+    Batch grading on SQLite with the LLM replaced by ``env.batch`` and
+    ``env.single``; records analysis and individual grading enqueues.
+    """
+    engine = sqlite_engine(Class, Exercise, Homework, Submission, Job)
+    use_engine(engine, submission_service, job_queue)
+    monkeypatch.setattr(settings, "GRADING_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "CODE_GRADING_EXPLAIN", False)
+
+    class Env:
+        analysis, regrade, batch_calls, single_calls = [], [], [], []
+        drop = set()  # 批量结果中漏掉的答案编号
+        lock = threading.Lock()
+
+        @staticmethod
+        def batch(ex, qtype, item, expected, batch):
+            time.sleep(0.1)  # 让并发的批量任务有机会重叠
+            keys = [key for key, _ in batch if key not in Env.drop]
+            with Env.lock:
+                Env.batch_calls.append([key for key, _ in batch])
+            return {
+                "results": {k: "partial" for k in keys},
+                "scores": {k: 2 for k in keys},
+                "explanations": {k: "部分正确" for k in keys},
+            }
+
+        @staticmethod
+        def single(ex, letter_answers, qids, student_id):
+            Env.single_calls.append(student_id)
+            return {
+                "results": {q: "correct" for q in qids},
+                "scores": {q: 4 for q in qids},
+                "explanations": {q: "正确" for q in qids},
+            }
+
+        @staticmethod
+        def homework(answers):
+            with Session(engine) as sess:
+                ex = Exercise(
+                    teacher_id=1,
+                    subject="数学",
+                    prompt=[
+                        {"type": "single_choice", "items": [{"id": 1, "question": "1+1=?", "options": ["A. 1", "B. 2"]}]},
+                        {"type": "short_answer", "items": [{"id": 2, "question": "为什么？"}]},
+                    ],
+                    answers={"1": "B", "2": "因为"},
+                    points={"single_choice": 1, "short_answer": 4},
+                )
+                sess.add(ex)
+                sess.commit()
+                hw = Homework(exercise_id=ex.id)
+                sess.add(hw)
+                sess.commit()
+                for i, text in enumerate(answers):
+                    sess.add(Submission(homework_id=hw.id, student_id=100 + i, answers={"1": 1, "2": text}))
+                sess.commit()
+                return hw.id
+
+        @staticmethod
+        def submissions(hw_id):
+            with Session(engine) as sess:
+                return sess.exec(
+                    select(Submission).where(Submission.homework_id == hw_id).order_by(Submission.id)
+                ).all()
+
+    monkeypatch.setattr(submission_service, "_grade_question_batch", Env.batch)
+    monkeypatch.setattr(submission_service, "_grade_with_llm", Env.single)
+    monkeypatch.setattr(submission_service, "enqueue_analysis", lambda sid, teacher_id=None: Env.analysis.append(sid))
+    monkeypatch.setattr(submission_service, "enqueue_grading", Env.regrade.append)
+    yield Env
+    job_queue._current.job_id = None
+
+
+def _as_job(job_id, fn, *args):
+    """Run ``fn`` as the handler of job ``job_id`` would."""
+    job_queue._current.job_id = job_id
+    try:
+        return fn(*args)
+    finally:
+        job_queue._current.job_id = None
+
+
+def test_batch_grades_every_submission_with_one_call_per_answer(env):
+    hw = env.homework(["答案甲", "答案乙", " 答案甲 "])
+    assert _as_job(1, submission_service.grade_homework_batch, hw) == 3
+    # 规范化后相同的答案只批改一次
+    assert env.batch_calls == [["1", "2"]]
+    subs = env.submissions(hw)
+    assert [(s.status, s.score, s.grading_claim) for s in subs] == [("completed", 3, None)] * 3
+    assert subs[0].feedback["results"] == {"1": "correct", "2": "partial"}
+    assert sorted(env.analysis) == [100, 101, 102]
+
+
+def test_concurrent_batch_jobs_never_grade_a_submission_twice(env):
+    # 回归：两个批量任务同时读到全部 grading 提交，导致重复批改、重复学情分析
+    hw = env.homework([f"答案{i}" for i in range(6)])
+    done = {}
+    threads = [
+        threading.Thread(target=lambda j=j: done.update({j: _as_job(j, submission_service.grade_homework_batch, hw)}))
+        for j in (1, 2)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert sum(done.values()) == 6
+    assert sorted(env.analysis) == list(range(100, 106))
+    graded = [key for call in env.batch_calls for key in call]
+    assert len(graded) == 6
+    assert all(s.status == "completed" for s in env.submissions(hw))
+
+
+def test_individual_grading_skips_submissions_claimed_by_a_batch(env):
+    hw = env.homework(["答案"])
+    [sub] = env.submissions(hw)
+    with Session(submission_service.engine) as sess:
+        claimed = submission_service._claim(sess, "job:1", Submission.id == sub.id)
+    assert [s.id for s in claimed] == [sub.id]
+
+    _as_job(2, submission_service.grade_submission, sub.id)
+    assert env.single_calls == []
+    assert env.submissions(hw)[0].status == "grading"
+
+    # 同一任务重试时可以重新认领自己名下的提交
+    assert _as_job(1, submission_service.grade_homework_batch, hw) == 1
+    assert env.submissions(hw)[0].status == "completed"
+
+
+def test_grade_submission_completes_and_clears_the_claim(env):
+    hw = env.homework(["答案"])
+    [sub] = env.submissions(hw)
+    _as_job(5, submission_service.grade_submission, sub.id)
+    [sub] = env.submissions(hw)
+    assert (sub.status, sub.score, sub.grading_claim) == ("completed", 5, None)
+    assert env.single_calls == [100]
+    # 已完成的提交不会被再次批改
+    submission_service.grade_submission(sub.id)
+    assert env.single_calls == [100]
+
+
+def test_answers_missing_from_the_batch_reply_are_retried_once(env, monkeypatch):
+    hw = env.homework(["甲", "乙", "丙"])
+    calls = []
+
+    def flaky(ex, qtype, item, expected, batch):
+        calls.append([key for key, _ in batch])
+        keys = [key for key, _ in batch][1:] if len(calls) == 1 else [key for key, _ in batch]
+        return {"results": {k: "correct" for k in keys}, "scores": {k: 4 for k in keys}, "explanations": {k: "好" for k in keys}}
+
+    monkeypatch.setattr(submission_service, "_grade_question_batch", flaky)
+    assert _as_job(1, submission_service.grade_homework_batch, hw) == 3
+    assert calls == [["1", "2", "3"], ["1"]]
+    assert env.regrade == []
+    assert all(s.status == "completed" and s.score == 5 for s in env.submissions(hw))
+
+
+def test_answers_still_missing_fall_back_to_individual_grading(env):
+    hw = env.homework(["甲", "乙", "甲"])
+    env.drop = {"1"}
+    assert _as_job(1, submission_service.grade_homework_batch, hw) == 1
+    subs = env.submissions(hw)
+    assert [s.status for s in subs] == ["grading", "completed", "grading"]
+    # 漏掉的提交释放认领并改为逐份批改，不会被记 0 分
+    assert sorted(env.regrade) == [subs[0].id, subs[2].id]
+    assert all(s.grading_claim is None for s in subs)
+    assert env.analysis == [101]
+
+
+def test_requeue_batch_individually_releases_only_its_own_claims(env):
+    hw = env.homework(["甲", "乙"])
+    subs = env.submissions(hw)
+    with Session(submission_service.engine) as sess:
+        submission_service._claim(sess, "job:1", Submission.id == subs[0].id)
+        submission_service._claim(sess, "job:2", Submission.id == subs[1].id)
+    _as_job(1, submission_service.requeue_batch_individually, hw)
+    assert env.regrade == [subs[0].id]
+    assert [s.grading_claim for s in env.submissions(hw)] == [None, "job:2"]
@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.models import ChatMessage, ChatSession
+from backend.routers import student_router
+from backend.services import chat_service
+from backend.utils import deepseek_client, llm_scheduler
+
+
+@pytest.fixture
+def chat(sqlite_engine, use_engine, mock_llm):
+    engine = sqlite_engine(ChatSession, ChatMessage)
+    use_engine(engine, chat_service)
+    # 限速输出：关闭时上游仍在生成
+    server = mock_llm(reply_chars=150, tokens_per_sec=100)
+    with Session(engine) as sess:
+        session = ChatSession(student_id=1)
+        sess.add(session)
+        sess.commit()
+        sid = session.id
+
+    def answers():
+        with Session(engine) as sess:
+            return sess.exec(
+                select(ChatMessage).where(ChatMessage.session_id == sid, ChatMessage.role == "assistant")
+            ).all()
+
+    return SimpleNamespace(sid=sid, server=server, answers=answers)
+
+
+def _run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            # 断开后的关闭与保存在独立任务中进行
+            await asyncio.gather(*chat_service._finishing)
+            await deepseek_client.aclose()
+
+    return asyncio.run(main())
+
+
+def test_completed_stream_saves_the_whole_answer(chat):
+    async def read():
+        gen = await chat_service.ask_in_session_stream(1, chat.sid, "讲讲分数")
+        return "".join([tok async for tok in gen])
+
+    answer = _run(read())
+    [saved] = chat.answers()
+    assert (saved.content, saved.truncated) == (answer, False)
+    assert llm_scheduler.stats()["active"] == 0
+
+
+def test_closing_early_closes_upstream_and_saves_partial_answer(chat):
+    async def read():
+        gen = await chat_service.ask_in_session_stream(1, chat.sid, "讲讲分数")
+        tokens = [await gen.__anext__() for _ in range(3)]
+        await gen.aclose()
+        return "".join(tokens)
+
+    partial = _run(read())
+    # 上游流已关闭，调度槽位立即释放
+    assert llm_scheduler.stats()["active"] == 0
+    [saved] = chat.answers()
+    assert (saved.content, saved.truncated) == (partial, True)
+
+
+def test_closing_before_first_token_opens_no_stream(chat):
+    async def close():
+        gen = await chat_service.ask_in_session_stream(1, chat.sid, "讲讲分数")
+        await gen.aclose()
+
+    _run(close())
+    assert httpx.get(chat.server.url + "/stats").json()["streams"] == 0
+    assert chat.answers() == []
+
+
+def test_endpoint_stops_reading_when_client_disconnects(chat, monkeypatch):
+    monkeypatch.setattr(student_router, "_user_from_token", lambda token: SimpleNamespace(id=1))
+    checks = []
+
+    async def is_disconnected():
+        checks.append(1)
+        return len(checks) > 2
+
+    async def read():
+        resp = await student_router.api_ask_in_session_stream(
+            SimpleNamespace(is_disconnected=is_disconnected), chat.sid, "讲讲分数", "token"
+        )
+        return [event async for event in resp.body_iterator]
+
+    events = _run(read())
+    assert len(events) == 2
+    assert llm_scheduler.stats()["active"] == 0
+    [saved] = chat.answers()
+    assert saved.truncated
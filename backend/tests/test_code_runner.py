@@ -0,0 +1,159 @@
+import os
+import sys
+
+import pytest
+
+from backend.config import settings
+from backend.utils import code_runner
+from backend.utils.code_runner import OUTPUT_LIMIT, PASSED, RUNTIME_ERROR, TIMEOUT, WRONG_ANSWER
+
+_SUM = "a, b = map(int, input().split())\nprint(a + b)\n"
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(code_runner, "_cache", type(code_runner._cache)())
+    monkeypatch.setattr(settings, "CODE_RUNNER_CPU_SECONDS", 2)
+    monkeypatch.setattr(settings, "CODE_RUNNER_WALL_SECONDS", 5.0)
+    monkeypatch.setattr(settings, "CODE_RUNNER_OUTPUT_KB", 64)
+
+
+def _run(code, case=None):
+    [result] = code_runner.run_tests(code, [case or {"input": "", "output": ""}])["cases"]
+    return result
+
+
+def test_normalize_output_ignores_trailing_whitespace():
+    assert code_runner.normalize_output("1  \r\n2\t\n\n\n") == "1\n2"
+    assert code_runner.normalize_output("  a") == "  a"
+
+
+def test_cases_pass_and_fail():
+    run = code_runner.run_tests(_SUM, [
+        {"input": "1 2\n", "output": "3\n"},
+        {"input": "2 2", "output": "5"},
+    ])
+    assert (run["passed"], run["total"]) == (1, 2)
+    assert [c["status"] for c in run["cases"]] == [PASSED, WRONG_ANSWER]
+
+
+def test_runtime_error_reports_the_exception_type_only():
+    assert _run("print(1 / 0)") == {"status": RUNTIME_ERROR, "error": "ZeroDivisionError"}
+    assert _run("raise KeyError('secret detail')") == {"status": RUNTIME_ERROR, "error": "KeyError"}
+
+
+def test_syntax_error():
+    assert _run("def f(:\n")["error"] == "SyntaxError"
+
+
+def test_wall_clock_timeout(monkeypatch):
+    monkeypatch.setattr(settings, "CODE_RUNNER_WALL_SECONDS", 0.5)
+    assert _run("import time\ntime.sleep(30)\n") == {"status": TIMEOUT}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="RLIMIT_CPU is Unix only")
+def test_cpu_limit(monkeypatch):
+    monkeypatch.setattr(settings, "CODE_RUNNER_CPU_SECONDS", 1)
+    assert _run("while True:\n    pass\n") == {"status": TIMEOUT}
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="RLIMIT_FSIZE is Unix only")
+def test_output_limit(monkeypatch):
+    monkeypatch.setattr(settings, "CODE_RUNNER_OUTPUT_KB", 1)
+    assert _run("while True:\n    print('x' * 100)\n") == {"status": OUTPUT_LIMIT}
+
+
+def test_results_are_cached(monkeypatch):
+    calls = []
+    run_case = code_runner._run_case
+
+    def counting(*args):
+        calls.append(1)
+        return run_case(*args)
+
+    monkeypatch.setattr(code_runner, "_run_case", counting)
+    cases = [{"input": "1 2", "output": "3"}]
+    first = code_runner.run_tests(_SUM, cases)
+    first["cases"].clear()
+    assert code_runner.run_tests(_SUM, cases)["passed"] == 1
+    assert len(calls) == 1
+
+
+def test_stdlib_imports_work_in_the_sandbox():
+    code = "import json, collections, math\nprint(json.dumps(collections.Counter('aab')['a'] + math.floor(1.5)))\n"
+    assert _run(code, {"input": "", "output": "3"}) == {"status": PASSED}
+
+
+def test_files_inside_the_workdir_are_usable():
+    code = "open('tmp.txt', 'w').write('ok')\nprint(open('tmp.txt').read())\n"
+    assert _run(code, {"input": "", "output": "ok"}) == {"status": PASSED}
+
+
+# ---- 回归：沙箱逃逸 ----
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "secret.txt"
+    path.write_text("top-secret")
+    return path
+
+
+def test_cannot_read_files_outside_the_workdir(secret):
+    code = f"print(open({str(secret)!r}).read())\n"
+    result = _run(code, {"input": "", "output": "top-secret"})
+    # 读到的内容既不能让用例通过，也不能出现在错误信息里
+    assert result == {"status": RUNTIME_ERROR, "error": "PermissionError"}
+
+
+def test_error_message_cannot_leak_file_contents(secret):
+    code = (
+        "try:\n"
+        f"    data = open({str(secret)!r}).read()\n"
+        "except Exception as e:\n"
+        "    data = repr(e)\n"
+        "raise ValueError(data)\n"
+    )
+    result = _run(code)
+    assert result == {"status": RUNTIME_ERROR, "error": "ValueError"}
+
+
+def test_cannot_write_outside_the_workdir(tmp_path):
+    target = tmp_path / "planted.txt"
+    assert _run(f"open({str(target)!r}, 'w').write('x')\n")["error"] == "PermissionError"
+    assert not target.exists()
+
+
+def test_cannot_remove_files(secret):
+    code = f"import os\nos.remove({str(secret)!r})\n"
+    assert _run(code)["error"] == "PermissionError"
+    assert secret.exists()
+
+
+def test_cannot_list_directories_outside_the_workdir(secret):
+    code = f"import os\nprint(os.listdir({str(secret.parent)!r}))\n"
+    assert _run(code)["error"] == "PermissionError"
+
+
+def test_cannot_start_processes():
+    assert _run("import subprocess\nsubprocess.run(['echo', 'hi'])\n")["error"] == "PermissionError"
+    assert _run("import os\nos.system('echo hi')\n")["error"] == "PermissionError"
+
+
+def test_cannot_open_sockets():
+    code = "import socket\nsocket.create_connection(('127.0.0.1', 80), timeout=1)\n"
+    assert _run(code)["error"] == "PermissionError"
+
+
+def test_cannot_remove_the_audit_hook():
+    code = "import gc\nprint(gc.get_objects()[:1])\n"
+    assert _run(code)["error"] == "PermissionError"
+
+
+def test_cannot_import_site_packages():
+    # -S：pytest 等第三方包不可导入
+    assert _run("import pytest\n")["error"] == "ModuleNotFoundError"
+
+
+def test_workdir_is_removed_afterwards(monkeypatch, tmp_path):
+    monkeypatch.setattr(code_runner.tempfile, "tempdir", str(tmp_path))
+    _run("print(1)\n", {"input": "", "output": "1"})
+    assert not [p for p in os.listdir(tmp_path) if p.startswith("code-runner-")]
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlmodel import Session
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.models import Courseware, Job, Role, User
+from backend.routers import admin_router, lesson_router
+from backend.services import courseware_service
+from backend.utils import job_queue
+
+_ADMIN = SimpleNamespace(id=1, role=SimpleNamespace(name="admin"))
+_TEACHER = SimpleNamespace(id=2, role=SimpleNamespace(name="teacher"))
+
+
+@pytest.fixture
+def engine(sqlite_engine, use_engine, monkeypatch):
+    engine = sqlite_engine(Role, User, Courseware, Job)
+    use_engine(engine, admin_router, courseware_service, job_queue)
+    monkeypatch.setattr(courseware_service, "SessionLocal", lambda: Session(engine))
+    # 不依赖 wkhtmltopdf：PDF 内容即 Markdown
+    monkeypatch.setattr(courseware_service, "render_pdf", lambda md_text: f"PDF:{md_text}".encode())
+    return engine
+
+
+@pytest.fixture
+def courseware(engine):
+    with Session(engine) as sess:
+        cw = Courseware(teacher_id=_TEACHER.id, topic="t", markdown="old", pdf=b"PDF:old")
+        sess.add(cw)
+        sess.commit()
+        return cw.id
+
+
+def _pdf(engine, cw_id):
+    with Session(engine) as sess:
+        return sess.get(Courseware, cw_id).pdf
+
+
+def _download(cw_id):
+    resp = admin_router.download_courseware(cw_id, current=_ADMIN)
+
+    async def body():
+        return b"".join([chunk async for chunk in resp.body_iterator])
+
+    return resp.status_code, asyncio.run(body()) if hasattr(resp, "body_iterator") else resp.body
+
+
+def test_admin_download_after_update_does_not_return_old_pdf(engine, courseware):
+    admin_router.update_courseware(courseware, admin_router.CoursewareUpdate(markdown="new"), current=_ADMIN)
+    assert _pdf(engine, courseware) is None
+    assert _download(courseware) == (202, b'{"status":"generating"}')
+
+    courseware_service.render_courseware_pdf(courseware)
+    assert _download(courseware) == (200, b"PDF:new")
+
+
+def test_teacher_update_clears_pdf(engine, courseware):
+    with Session(engine) as sess:
+        lesson_router.update_courseware(
+            courseware, lesson_router.CoursewareUpdate(markdown="new"), session=sess, current_user=_TEACHER
+        )
+    assert _pdf(engine, courseware) is None
+    assert courseware_service.pdf_pending(courseware)
+
+
+def test_download_renders_missing_pdf_without_pending_job(engine, courseware):
+    with Session(engine) as sess:
+        cw = sess.get(Courseware, courseware)
+        cw.pdf = None
+        sess.add(cw)
+        sess.commit()
+    assert _download(courseware) == (200, b"PDF:old")
+
+
+def test_stale_render_is_not_stored(engine, courseware):
+    admin_router.update_courseware(courseware, admin_router.CoursewareUpdate(markdown="new"), current=_ADMIN)
+    # 更新前开始的渲染晚于更新完成
+    courseware_service.generate_and_store_pdf(courseware, "old")
+    assert _pdf(engine, courseware) is None
@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend.config import settings
+from backend.utils import deepseek_client, llm_scheduler
+from backend.utils.llm_resilience import DeepseekAPIError
+
+
+def _content(resp: dict) -> str:
+    return resp["choices"][0]["message"]["content"]
+
+
+def test_calls_share_one_pooled_client(mock_llm):
+    server = mock_llm(reply_chars=40)
+    replies = [_content(deepseek_client.call_deepseek_api(f"问题 {i}")) for i in range(3)]
+    assert all(r.startswith("# 模拟回复") for r in replies)
+    client = deepseek_client.get_client()
+    assert deepseek_client.get_client() is client
+    # 顺序调用复用同一个 keep-alive 连接
+    assert len(client._transport._pool.connections) == 1
+    assert httpx.get(server.url + "/stats").json()["requests"] == 3
+
+
+def test_stream_yields_the_whole_reply(mock_llm):
+    mock_llm(reply_chars=80)
+    full = _content(deepseek_client.call_deepseek_api("讲讲分数"))
+    tokens = list(deepseek_client.call_deepseek_api_chat_stream([{"role": "user", "content": "讲讲分数"}]))
+    assert len(tokens) > 1
+    assert "".join(tokens) == full
+    assert llm_scheduler.stats()["active"] == 0
+
+
+def test_async_variants(mock_llm):
+    mock_llm(reply_chars=60)
+
+    async def run():
+        try:
+            resp = await deepseek_client.acall_deepseek_api("异步问题")
+            stream = await deepseek_client.acall_deepseek_api_chat_stream(
+                [{"role": "user", "content": "异步问题"}]
+            )
+            tokens = [t async for t in stream]
+            return _content(resp), "".join(tokens)
+        finally:
+            await deepseek_client.aclose()
+
+    full, streamed = asyncio.run(run())
+    assert full.startswith("# 模拟回复") and streamed == full
+
+
+def test_error_status_raises_api_error(mock_llm, monkeypatch):
+    mock_llm(error_rate=1.0)
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 0)
+    with pytest.raises(DeepseekAPIError) as info:
+        deepseek_client.call_deepseek_api("会失败的问题")
+    assert info.value.status_code == 500
+    assert llm_scheduler.stats()["active"] == 0
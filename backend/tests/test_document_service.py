@@ -0,0 +1,83 @@
+import math
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sqlmodel import Session, select
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.models import DocumentIndexMetric, DocumentParagraph, DocumentVector
+from backend.utils import vector_codec
+from backend.utils.rag_pipeline import text_cache_path
+
+_PARAGRAPHS = [
+    "Triangle angles sum to one hundred eighty degrees in plane geometry.",
+    "Water molecules contain hydrogen and oxygen atoms bonded together.",
+    "Cells divide by mitosis and share their chromosomes equally.",
+    "Light bends when it passes from air into water or glass.",
+    "Prime numbers have exactly two divisors, one and themselves.",
+]
+_TEXT = "\n\n".join(_PARAGRAPHS)
+
+
+def _rows(documents, model, doc_id):
+    with Session(documents.engine) as sess:
+        return sess.exec(select(model).where(model.doc_id == doc_id)).all()
+
+
+def test_chunks_are_embedded_in_batches_and_bulk_inserted(documents, monkeypatch):
+    monkeypatch.setattr(documents.settings, "EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(documents.settings, "CHUNK_MAX_TOKENS", 16)
+    monkeypatch.setattr(documents.settings, "CHUNK_OVERLAP_TOKENS", 0)
+    batches = []
+    encode = documents.model.encode
+    monkeypatch.setattr(
+        documents.model, "encode", lambda texts, **kw: batches.append(len(texts)) or encode(texts, **kw)
+    )
+
+    doc = documents.service.save_document(1, "a.txt", _TEXT.encode("utf-8"))
+    assert doc.index_error is None
+    chunks = sorted(_rows(documents, DocumentVector, doc.id), key=lambda r: r.chunk_index)
+    paras = _rows(documents, DocumentParagraph, doc.id)
+    assert len(chunks) >= len(_PARAGRAPHS) and len(paras) == len(_PARAGRAPHS)
+    # 块和段落各自按 EMBED_BATCH_SIZE 分批编码
+    assert max(batches) == 2
+    assert len(batches) == math.ceil(len(chunks) / 2) + math.ceil(len(paras) / 2)
+    assert [r.chunk_index for r in chunks] == list(range(len(chunks)))
+    for r in chunks:
+        stored = vector_codec.decode(r.vector_blob, r.vector_dtype, r.vector_scale)
+        assert np.allclose(stored, encode(r.content))
+
+    [metric] = _rows(documents, DocumentIndexMetric, doc.id)
+    assert metric.chunk_count == len(chunks)
+    assert min(metric.extract_ms, metric.chunk_ms, metric.embed_ms, metric.insert_ms) >= 0
+
+
+def test_identical_upload_reuses_blob_and_index(documents):
+    first = documents.service.save_document(1, "a.txt", _TEXT.encode("utf-8"))
+    calls = documents.model.calls
+    second = documents.service.save_document(2, "copy.txt", _TEXT.encode("utf-8"))
+    assert second.index_error is None
+    assert second.content_hash == first.content_hash and second.filepath == first.filepath
+    # 不再提取和编码，直接复制块与段落
+    assert documents.model.calls == calls
+    for model in (DocumentVector, DocumentParagraph):
+        src = sorted((r.content, r.vector_blob) for r in _rows(documents, model, first.id))
+        dst = sorted((r.content, r.vector_blob) for r in _rows(documents, model, second.id))
+        assert src and dst == src
+
+
+def test_shared_blob_is_removed_with_the_last_document(documents):
+    first = documents.service.save_document(1, "a.txt", _TEXT.encode("utf-8"))
+    second = documents.service.save_document(2, "copy.txt", _TEXT.encode("utf-8"))
+    blob, cache = Path(first.filepath), text_cache_path(first.content_hash)
+    assert blob.exists() and cache.exists()
+
+    assert documents.service.delete_document(first.id, 1)
+    assert blob.exists() and cache.exists()
+    assert _rows(documents, DocumentVector, second.id)
+
+    assert documents.service.delete_document(second.id, 2)
+    assert not blob.exists() and not cache.exists()
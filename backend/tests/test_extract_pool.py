@@ -0,0 +1,53 @@
+import mmap
+import time
+
+import pytest
+
+pytest.importorskip("textract")
+
+from backend.config import settings
+from backend.utils import extract_pool
+from backend.utils.text_extract import ExtractionError
+
+
+def _allocate(path: str) -> int:
+    # 子进程中按值导入执行
+    return len(bytearray(64 * 1024 * 1024))
+
+
+def _hang(path: str) -> None:
+    time.sleep(60)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(settings, "EXTRACT_POOL_SIZE", 1)
+    extract_pool.shutdown()
+    yield extract_pool
+    extract_pool.shutdown()
+
+
+@pytest.mark.skipif(extract_pool.resource is None, reason="RLIMIT_AS needs Unix")
+def test_memory_cap_below_parent_address_space(pool, monkeypatch, tmp_path):
+    # 父进程占用的地址空间远超子进程上限；fork 出的子进程会因此任何分配都失败
+    reserved = mmap.mmap(-1, 2 * 1024 ** 3)
+    try:
+        monkeypatch.setattr(settings, "EXTRACT_MEMORY_MB", 1024)
+        assert pool._run(_allocate, str(tmp_path / "a.txt"), timeout=60) == 64 * 1024 * 1024
+    finally:
+        reserved.close()
+
+
+def test_extract_text_in_pool(pool, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("hello pool", encoding="utf-8")
+    assert "hello pool" in pool.extract(str(path), timeout=60)
+
+
+def test_timeout_discards_stuck_worker(pool, tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("after timeout", encoding="utf-8")
+    with pytest.raises(ExtractionError, match="timed out"):
+        pool._run(_hang, str(path), timeout=1)
+    # 进程池被重建，后续文件照常提取
+    assert "after timeout" in pool.extract(str(path), timeout=60)
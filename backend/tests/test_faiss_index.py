@@ -0,0 +1,82 @@
+import pytest
+from sqlmodel import Session, select
+
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.models import DocumentVector
+from backend.utils import faiss_index, rag_pipeline
+
+_GEOMETRY = "triangle angles sum to one hundred eighty degrees in plane geometry"
+_CHEMISTRY = "water molecules contain hydrogen and oxygen atoms bonded together"
+
+
+@pytest.fixture
+def faiss_docs(documents, monkeypatch):
+    monkeypatch.setattr(documents.settings, "VECTOR_BACKEND", "faiss")
+    return documents
+
+
+def _upload(documents, owner_id, text, name="a.txt"):
+    doc = documents.service.save_document(owner_id, name, text.encode("utf-8"))
+    assert doc.index_error is None
+    documents.service.set_activation(doc.id, owner_id, True)
+    return doc
+
+
+def _search(documents, text, teacher_ids=(1,), top_k=5):
+    with Session(documents.engine) as sess:
+        q = documents.model.encode(text)
+        return rag_pipeline.search_chunks(sess, q, list(teacher_ids), top_k)
+
+
+def _vector_ids(documents, doc_id):
+    with Session(documents.engine) as sess:
+        return set(sess.exec(select(DocumentVector.id).where(DocumentVector.doc_id == doc_id)).all())
+
+
+def _indexed_ids(documents, scope):
+    with Session(documents.engine) as sess:
+        index = faiss_index._get(sess, scope)
+    return set(faiss.vector_to_array(index.id_map).tolist())
+
+
+def test_uploads_are_searchable(faiss_docs):
+    geo = _upload(faiss_docs, 1, _GEOMETRY)
+    chem = _upload(faiss_docs, 1, _CHEMISTRY, "b.txt")
+    assert _search(faiss_docs, "triangle angles")[0][0] == geo.id
+    assert _search(faiss_docs, "hydrogen oxygen")[0][0] == chem.id
+    # 其它教师看不到私有文档
+    assert _search(faiss_docs, "triangle angles", teacher_ids=(2,)) == []
+
+
+@pytest.mark.parametrize("ann_type", ["flat", "hnsw"])
+def test_deleted_document_leaves_the_index(faiss_docs, monkeypatch, ann_type):
+    if ann_type == "hnsw":
+        # 阈值为 0：任何 scope 都建为 HNSW，而 HNSW 不支持按 id 删除
+        monkeypatch.setattr(faiss_docs.settings, "FAISS_ANN_THRESHOLD", 0)
+        monkeypatch.setattr(faiss_docs.settings, "FAISS_ANN_TYPE", "hnsw")
+    geo = _upload(faiss_docs, 1, _GEOMETRY)
+    chem = _upload(faiss_docs, 1, _CHEMISTRY, "b.txt")
+    assert {hit[0] for hit in _search(faiss_docs, _GEOMETRY)} == {geo.id, chem.id}
+    kept = _vector_ids(faiss_docs, chem.id)
+
+    assert faiss_docs.service.delete_document(geo.id, 1)
+    assert [hit[0] for hit in _search(faiss_docs, _GEOMETRY)] == [chem.id]
+    # 索引本身（包括持久化的文件）不再含有已删除文档的向量
+    assert _indexed_ids(faiss_docs, 1) == kept
+    faiss_index.invalidate_scope(1)
+    assert _indexed_ids(faiss_docs, 1) == kept
+
+
+def test_deleted_public_document_leaves_the_hnsw_index(faiss_docs, monkeypatch):
+    monkeypatch.setattr(faiss_docs.settings, "FAISS_ANN_THRESHOLD", 0)
+    service = faiss_docs.service
+    geo = service.save_public_document(9, "a.txt", _GEOMETRY.encode("utf-8"))
+    chem = service.save_public_document(9, "b.txt", _CHEMISTRY.encode("utf-8"))
+    for doc in (geo, chem):
+        service.set_activation(doc.id, 1, True)
+    assert service.delete_public_document(geo.id)
+    assert [hit[0] for hit in _search(faiss_docs, _GEOMETRY)] == [chem.id]
+    assert _indexed_ids(faiss_docs, "public") == _vector_ids(faiss_docs, chem.id)
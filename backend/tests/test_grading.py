@@ -0,0 +1,120 @@
+import pytest
+
+from backend.utils import grading
+
+_PROMPT = [
+    {"type": "single_choice", "items": [
+        {"id": 1, "question": "1+1=?", "options": ["A. 1", "B. 2", "C. 3"]},
+    ]},
+    {"type": "multiple_choice", "items": [
+        {"id": 2, "question": "哪些是质数？", "options": ["A. 2", "B. 4", "C. 5", "D. 9"]},
+    ]},
+    {"type": "fill_in_blank", "items": [
+        {"id": 3, "question": "圆周率约为 ____"},
+        {"id": 4, "question": "中国的首都是 ____，最大的城市是 ____"},
+    ]},
+    {"type": "short_answer", "items": [{"id": 5, "question": "解释什么是函数"}]},
+    {"type": "coding", "items": [
+        {"id": 6, "question": "输出两数之和", "test_cases": [
+            {"input": "1 2\n", "output": "3"},
+            {"input": "5 7\n", "output": "12"},
+        ]},
+        {"id": 7, "question": "写一个排序函数"},
+    ]},
+]
+_KEY = {"1": "B", "2": ["A", "C"], "3": "3.14", "4": ["北京", "上海"], "5": "把输入映射到输出的规则"}
+_POINTS = {"single_choice": 2, "multiple_choice": 4, "fill_in_blank": 3, "4": 6, "coding": 10}
+
+_SUM = "a, b = map(int, input().split())\nprint(a + b)\n"
+
+
+def test_convert_indexed_answers_maps_choice_indexes_to_letters():
+    converted = grading.convert_indexed_answers(
+        _PROMPT, {"1": 1, "2": [0, 2, 9], "3": "3.14", "5": "文本", "99": 0}
+    )
+    assert converted == {"1": "B", "2": ["A", "C"], "3": "3.14", "5": "文本", "99": 0}
+
+
+def test_convert_indexed_answers_keeps_out_of_range_values():
+    assert grading.convert_indexed_answers(_PROMPT, {"1": 7, "2": []}) == {"1": 7, "2": []}
+
+
+@pytest.mark.parametrize("given", ["B", "b", "B. 2", "Ｂ", ["B"]])
+def test_single_choice_variants(given):
+    assert grading.is_correct("single_choice", "B", given)
+
+
+@pytest.mark.parametrize("given, ok", [
+    (["C", "A"], True), ("A,C", True), ("AC", True), (["A"], False), (["A", "C", "D"], False), (None, False),
+])
+def test_multiple_choice_needs_the_exact_set(given, ok):
+    assert grading.is_correct("multiple_choice", ["A", "C"], given) is ok
+
+
+@pytest.mark.parametrize("expected, given, ok", [
+    ("Paris", " paris ", True),
+    ("ＡＢＣ", "abc", True),
+    ("x + 1", "x+1", True),
+    ("0.5", "1/2", True),
+    ("0.5", "50%", True),
+    ("1000", "1,000", True),
+    ("3.14", "3.1400001", True),
+    ("3.14", "3.15", False),
+    ("北京", "", False),
+    ("北京", None, False),
+    ("1/0", "1/0", True),
+    ("2", "1/0", False),
+])
+def test_fill_blank_normalization_and_numbers(expected, given, ok):
+    assert grading.fill_blank_matches(expected, given) is ok
+
+
+def test_fill_blank_matches_several_blanks_in_order():
+    assert grading.fill_blank_matches(["北京", "上海"], "北京；上海")
+    assert grading.fill_blank_matches(["北京", "上海"], ["北京", " 上海 "])
+    assert grading.fill_blank_matches("北京,上海", "北京、上海")
+    assert not grading.fill_blank_matches(["北京", "上海"], "上海；北京")
+    assert not grading.fill_blank_matches(["北京", "上海"], "北京")
+
+
+def test_is_correct_rejects_subjective_types():
+    with pytest.raises(ValueError):
+        grading.is_correct("short_answer", "x", "x")
+
+
+def test_grade_objective_grades_locally_and_leaves_the_rest_pending():
+    answers = grading.convert_indexed_answers(
+        _PROMPT, {"1": 1, "2": [0, 1], "3": "3.14", "4": "北京，上海", "5": "规则", "6": _SUM, "7": "def f(): pass"}
+    )
+    results, scores, explanations, pending = grading.grade_objective(_PROMPT, _KEY, answers, _POINTS)
+    assert results == {"1": "correct", "2": "wrong", "3": "correct", "4": "correct", "6": "correct"}
+    assert scores == {"1": 2, "2": 0, "3": 3, "4": 6, "6": 10}
+    assert explanations["2"] == "回答错误，标准答案：A、C"
+    assert explanations["6"] == "通过 2/2 个测试用例"
+    # 简答题交给大模型；没有测试用例、也没有标准答案的编程题同样如此
+    assert pending == ["5", "7"]
+
+
+def test_grade_objective_without_a_key_is_pending():
+    results, _, _, pending = grading.grade_objective(_PROMPT[:1], {}, {"1": "B"}, _POINTS)
+    assert results == {}
+    assert pending == ["1"]
+
+
+def test_grade_coding_gives_partial_credit():
+    code = "a, b = map(int, input().split())\nprint(a + b if a < 5 else 0)\n"
+    result, score, explanation = grading.grade_coding(code, _PROMPT[4]["items"][0]["test_cases"], 10)
+    assert (result, score) == ("partial", 5.0)
+    assert explanation == "通过 1/2 个测试用例；用例 2 输出错误"
+
+
+def test_grade_coding_reports_only_the_error_type():
+    code = "raise ValueError(open('/etc/hostname').read())\n"
+    result, score, explanation = grading.grade_coding(code, [{"input": "", "output": "x"}], 10)
+    assert (result, score) == ("wrong", 0)
+    assert explanation.startswith("通过 0/1 个测试用例；用例 1 运行出错")
+    assert "/etc" not in explanation
+
+
+def test_grade_coding_unanswered():
+    assert grading.grade_coding("  ", [{"input": "", "output": "1"}], 10) == ("wrong", 0, "未作答")
@@ -0,0 +1,143 @@
+import pytest
+from sqlmodel import Session, select
+
+from backend.config import settings
+from backend.models import Class, Exercise, GradingCache, Homework, Submission
+from backend.services import grading_cache_service as cache
+from backend.services import submission_service
+
+
+@pytest.fixture
+def engine(sqlite_engine, use_engine, monkeypatch):
+    engine = sqlite_engine(Class, Exercise, Homework, Submission, GradingCache)
+    use_engine(engine, cache, submission_service)
+    monkeypatch.setattr(settings, "GRADING_CACHE_ENABLED", True)
+    return engine
+
+
+def _exercise(engine, answer="光合作用产生氧气", points=4) -> Exercise:
+    with Session(engine) as sess:
+        ex = Exercise(
+            teacher_id=1,
+            subject="生物",
+            prompt=[
+                {"type": "short_answer", "items": [{"id": 1, "question": "光合作用的产物？"}]},
+                {"type": "coding", "items": [{"id": 2, "question": "打印 hello"}]},
+            ],
+            answers={"1": answer, "2": "print('hello')"},
+            points={"short_answer": points, "coding": 5},
+        )
+        sess.add(ex)
+        sess.commit()
+        sess.refresh(ex)
+        return ex
+
+
+def _hits(engine):
+    with Session(engine) as sess:
+        return sorted(row.hits for row in sess.exec(select(GradingCache)).all())
+
+
+def test_normalize_answer():
+    assert cache.normalize_answer("short_answer", "  Ｏｘｙｇｅｎ\n\t气体 ") == "oxygen 气体"
+    # 编程题保留缩进，只去掉行尾空白
+    assert cache.normalize_answer("coding", "def f():\n    return 1   \n\n") == "def f():\n    return 1"
+    assert cache.normalize_answer("short_answer", ["A ", None]) == ["a", ""]
+    assert cache.normalize_answer("short_answer", {1: " X"}) == {"1": "x"}
+
+
+def test_answer_hash_matches_equivalent_answers():
+    assert cache.answer_hash("short_answer", "Oxygen") == cache.answer_hash("short_answer", " oxygen ")
+    assert cache.answer_hash("coding", "if x:\n  y") != cache.answer_hash("coding", "if x:\ny")
+
+
+def test_store_then_lookup_counts_hits(engine):
+    ex = _exercise(engine)
+    assert cache.lookup(ex, {"1": "氧气"}) == {}
+    cache.store(ex, "1", "氧气", "partial", "2", "只答了氧气")
+    hit = cache.lookup(ex, {"1": " 氧气 ", "2": "print(1)", "99": "x"})
+    assert hit == {"1": {"result": "partial", "score": 2.0, "explanation": "只答了氧气"}}
+    assert _hits(engine) == [1]
+    assert cache.stats(ex.id) == {"entries": 1, "hits": 1, "hit_ratio": 0.5}
+
+
+def test_lookup_question_weights_hits_by_shared_submissions(engine):
+    ex = _exercise(engine)
+    cache.store(ex, "1", "氧气", "partial", 2, "e", reused=2)
+    hits = cache.lookup_question(ex, "1", {"a": "氧气", "b": "葡萄糖"}, {"a": 3, "b": 1})
+    assert list(hits) == ["a"]
+    assert _hits(engine) == [5]
+
+
+def test_store_ignores_unusable_results(engine):
+    ex = _exercise(engine)
+    cache.store(ex, "1", "x", None, 1, "e")
+    cache.store(ex, "1", "x", "wrong", "n/a", "e")
+    cache.store(ex, "99", "x", "wrong", 0, "e")
+    assert cache.stats(ex.id)["entries"] == 0
+
+
+def test_duplicate_store_keeps_the_first_result(engine):
+    ex = _exercise(engine)
+    cache.store(ex, "1", "氧气", "partial", 2, "第一次")
+    cache.store(ex, "1", " 氧气", "correct", 4, "第二次")
+    assert cache.lookup(ex, {"1": "氧气"})["1"]["explanation"] == "第一次"
+
+
+def test_changing_the_key_or_points_misses_old_entries(engine):
+    ex = _exercise(engine)
+    cache.store(ex, "1", "氧气", "partial", 2, "e")
+    ex.answers = {**ex.answers, "1": "氧气和葡萄糖"}
+    assert cache.lookup(ex, {"1": "氧气"}) == {}
+    ex.answers = {**ex.answers, "1": "光合作用产生氧气"}
+    ex.points = {**ex.points, "short_answer": 6}
+    assert cache.lookup(ex, {"1": "氧气"}) == {}
+
+
+def test_invalidate_and_disabled_cache(engine, monkeypatch):
+    ex = _exercise(engine)
+    other = _exercise(engine)
+    cache.store(ex, "1", "氧气", "partial", 2, "e")
+    cache.store(other, "1", "氧气", "partial", 2, "e")
+    assert cache.invalidate(ex.id) == 1
+    assert cache.stats(ex.id) == {"entries": 0, "hits": 0, "hit_ratio": 0.0}
+    assert cache.stats(other.id)["entries"] == 1
+
+    monkeypatch.setattr(settings, "GRADING_CACHE_ENABLED", False)
+    assert cache.lookup(other, {"1": "氧气"}) == {}
+
+
+def test_second_identical_submission_skips_the_llm(engine, monkeypatch):
+    ex = _exercise(engine)
+    llm_calls = []
+
+    def fake_llm(ex, letter_answers, qids, student_id):
+        llm_calls.append(student_id)
+        return {
+            "results": {q: "correct" for q in qids},
+            "scores": {"1": 4, "2": 5},
+            "explanations": {q: "很好" for q in qids},
+        }
+
+    monkeypatch.setattr(submission_service, "_grade_with_llm", fake_llm)
+    monkeypatch.setattr(submission_service, "enqueue_analysis", lambda *a, **k: None)
+    with Session(engine) as sess:
+        hw = Homework(exercise_id=ex.id)
+        sess.add(hw)
+        sess.commit()
+        subs = [
+            Submission(homework_id=hw.id, student_id=sid, answers={"1": text, "2": "print('hello')"})
+            for sid, text in ((1, "产生氧气"), (2, "  产生氧气"))
+        ]
+        sess.add_all(subs)
+        sess.commit()
+        ids = [s.id for s in subs]
+
+    for sid in ids:
+        submission_service.grade_submission(sid)
+    assert llm_calls == [1]
+    with Session(engine) as sess:
+        graded = [sess.get(Submission, sid) for sid in ids]
+        assert [s.score for s in graded] == [9, 9]
+        assert graded[1].feedback["explanations"]["1"] == "很好"
+    assert cache.stats(ex.id) == {"entries": 2, "hits": 2, "hit_ratio": 0.5}
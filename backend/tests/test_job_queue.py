@@ -0,0 +1,206 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlmodel import Session
+
+from backend.config import settings
+from backend.models import Job
+from backend.utils import job_queue
+from backend.utils.job_queue import DONE, FAILED, QUEUED, RUNNING, Worker
+
+
+@pytest.fixture
+def engine(sqlite_engine, use_engine, monkeypatch):
+    engine = sqlite_engine(Job)
+    use_engine(engine, job_queue)
+    monkeypatch.setattr(job_queue, "_handlers", {})
+    monkeypatch.setattr(job_queue, "_worker", None)
+    monkeypatch.setattr(settings, "JOB_CONCURRENCY", {})
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 3)
+    return engine
+
+
+@pytest.fixture
+def worker(engine):
+    workers = []
+
+    def make(size=4):
+        w = Worker(size)
+        workers.append(w)
+        return w
+
+    yield make
+    for w in workers:
+        w.stop(wait=True)
+
+
+def _job(engine, job_id) -> Job:
+    with Session(engine) as sess:
+        return sess.get(Job, job_id)
+
+
+def _run(w: Worker):
+    """Claim and execute synchronously, as the dispatch loop would."""
+    jobs = w._claim()
+    for job in jobs:
+        with w._lock:
+            w._running[job.id] = job.kind
+        w._execute(job)
+    return [job.id for job in jobs]
+
+
+def test_enqueue_uses_kind_priority_and_dedupes_queued_jobs(engine):
+    job_queue.register(job_queue.ANALYZE_STUDENT, lambda **_: None)
+    first = job_queue.enqueue(job_queue.ANALYZE_STUDENT, {"student_id": 1}, dedupe_key="analysis:1")
+    again = job_queue.enqueue(job_queue.ANALYZE_STUDENT, {"student_id": 1}, dedupe_key="analysis:1")
+    other = job_queue.enqueue("custom", {})
+    assert first == again != other
+    assert _job(engine, first).priority == 30
+    assert _job(engine, other).priority == 100
+    assert job_queue.has_active("analysis:1")
+    assert not job_queue.has_active("analysis:2")
+
+
+def test_jobs_are_claimed_by_priority(engine, worker):
+    order = []
+    job_queue.register("task", lambda name: order.append(name))
+    job_queue.enqueue("task", {"name": "low"}, priority=50)
+    job_queue.enqueue("task", {"name": "high"}, priority=1)
+    job_queue.enqueue("task", {"name": "later"}, priority=1, delay=60)
+    w = worker(size=1)
+    _run(w)
+    _run(w)
+    assert order == ["high", "low"]
+    assert _run(w) == []  # run_after 未到
+
+
+def test_per_kind_concurrency_limit(engine, worker, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_CONCURRENCY", {"pdf": 1})
+    job_queue.register("pdf", lambda: None)
+    job_queue.register("task", lambda: None)
+    for _ in range(3):
+        job_queue.enqueue("pdf")
+        job_queue.enqueue("task")
+    claimed = worker(size=4)._claim()
+    assert sorted(job.kind for job in claimed) == ["pdf", "task", "task", "task"]
+
+
+def test_a_job_is_claimed_by_one_worker_only(engine, worker):
+    job_queue.register("task", lambda: None)
+    ids = {job_queue.enqueue("task") for _ in range(20)}
+    workers = [worker(size=20) for _ in range(4)]
+    claimed = []
+    barrier = threading.Barrier(len(workers))
+
+    def claim(w):
+        barrier.wait()
+        claimed.extend(job.id for job in w._claim())
+
+    threads = [threading.Thread(target=claim, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_success_marks_done_and_exposes_the_job_id(engine, worker):
+    seen = []
+    job_queue.register("task", lambda value: seen.append((value, job_queue.current_job_id())))
+    job_id = job_queue.enqueue("task", {"value": 7})
+    _run(worker())
+    assert seen == [(7, job_id)]
+    assert job_queue.current_job_id() is None
+    job = _job(engine, job_id)
+    assert (job.status, job.attempts) == (DONE, 1)
+    assert job.finished_at is not None
+
+
+def test_failures_are_retried_with_backoff_then_fail(engine, worker):
+    hooked = []
+
+    def fail(student_id):
+        raise ValueError("boom")
+
+    job_queue.register("task", fail, on_failure=lambda student_id: hooked.append(student_id))
+    job_id = job_queue.enqueue("task", {"student_id": 3}, max_attempts=2)
+    w = worker()
+
+    _run(w)
+    job = _job(engine, job_id)
+    assert (job.status, job.attempts, job.locked_by) == (QUEUED, 1, None)
+    assert job.last_error == "ValueError: boom"
+    assert job.run_after > datetime.utcnow()
+    assert hooked == []
+
+    with Session(engine) as sess:
+        job = sess.get(Job, job_id)
+        job.run_after = datetime.utcnow() - timedelta(seconds=1)
+        sess.add(job)
+        sess.commit()
+    _run(w)
+    job = _job(engine, job_id)
+    assert (job.status, job.attempts) == (FAILED, 2)
+    assert hooked == [3]
+
+
+def test_expired_lease_is_reclaimed_and_the_old_worker_cannot_finish(engine, worker):
+    job_queue.register("task", lambda: None)
+    job_id = job_queue.enqueue("task")
+    stale, fresh = worker(), worker()
+    [job] = stale._claim()
+    assert fresh._claim() == []  # 租约未过期
+
+    with Session(engine) as sess:
+        row = sess.get(Job, job_id)
+        row.lease_until = datetime.utcnow() - timedelta(seconds=1)
+        sess.add(row)
+        sess.commit()
+    [again] = fresh._claim()
+    assert again.attempts == 2
+
+    # 原 worker 不能覆盖新租约持有者的状态
+    assert not stale._finish(job, status=DONE)
+    assert _job(engine, job_id).locked_by == fresh.id
+    fresh._execute(again)
+    assert _job(engine, job_id).status == DONE
+
+
+def test_job_interrupted_too_often_is_given_up(engine, worker):
+    calls, hooked = [], []
+    job_queue.register("task", lambda: calls.append(1), on_failure=lambda: hooked.append(1))
+    job_id = job_queue.enqueue("task", max_attempts=1)
+    with Session(engine) as sess:
+        row = sess.get(Job, job_id)
+        row.status, row.attempts = RUNNING, 1
+        row.lease_until = datetime.utcnow() - timedelta(seconds=1)
+        sess.add(row)
+        sess.commit()
+    _run(worker())
+    job = _job(engine, job_id)
+    assert job.status == FAILED
+    assert "多次中断" in job.last_error
+    assert calls == []
+    assert hooked == [1]
+
+
+def test_started_worker_runs_enqueued_jobs(engine, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_POLL_INTERVAL", 0.05)
+    done = threading.Event()
+    job_queue.register("task", lambda: done.set())
+    w = job_queue.start_worker(workers=2)
+    try:
+        assert job_queue.start_worker() is w
+        job_id = job_queue.enqueue("task")
+        assert done.wait(5)
+        deadline = time.monotonic() + 5
+        while _job(engine, job_id).status != DONE:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        stats = job_queue.stats()
+        assert stats["jobs"] == {"task": {DONE: 1}}
+        assert stats["worker"] == w.id
+    finally:
+        job_queue.stop_worker(wait=True)
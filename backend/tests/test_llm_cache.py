@@ -0,0 +1,113 @@
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+from backend.config import settings
+from backend.utils import deepseek_client, llm_cache
+
+_MESSAGES = [{"role": "user", "content": "什么是质数？"}]
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Empty module state, memory tier only unless a test sets the SQLite path."""
+    monkeypatch.setattr(llm_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(llm_cache, "_counters", dict.fromkeys(llm_cache._counters, 0))
+    monkeypatch.setattr(llm_cache, "_db", None)
+    monkeypatch.setattr(llm_cache, "_db_failed", False)
+    monkeypatch.setattr(settings, "LLM_CACHE_SQLITE_PATH", None)
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL", 3600)
+    monkeypatch.setattr(settings, "LLM_CACHE_MAX_ENTRIES", 512)
+    yield llm_cache
+    if llm_cache._db is not None:
+        llm_cache._db.close()
+
+
+def _response(text: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+def test_make_key_covers_every_request_field():
+    key = llm_cache.make_key(_MESSAGES, "deepseek-chat", 0.7, 100)
+    assert key == llm_cache.make_key([dict(_MESSAGES[0])], "deepseek-chat", 0.7, 100)
+    others = {
+        llm_cache.make_key([{"role": "user", "content": "什么是合数？"}], "deepseek-chat", 0.7, 100),
+        llm_cache.make_key(_MESSAGES, "deepseek-reasoner", 0.7, 100),
+        llm_cache.make_key(_MESSAGES, "deepseek-chat", 0.2, 100),
+        llm_cache.make_key(_MESSAGES, "deepseek-chat", 0.7, 200),
+    }
+    assert key not in others
+    assert len(others) == 4
+
+
+def test_get_returns_a_copy_of_what_was_put(cache):
+    key = cache.make_key(_MESSAGES, "deepseek-chat", 0.7, 100)
+    assert cache.get(key) is None
+    cache.put(key, _response("质数只有 1 和它本身两个因数"))
+    first = cache.get(key)
+    assert first == _response("质数只有 1 和它本身两个因数")
+    first["choices"].clear()
+    assert cache.get(key)["choices"]
+    stats = cache.stats()
+    assert (stats["misses"], stats["memoryHits"], stats["stores"]) == (1, 2, 1)
+    assert stats["hitRate"] == pytest.approx(2 / 3)
+    assert stats["sqlite"] is False
+
+
+def test_entries_expire_after_ttl(cache, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL", 0)
+    cache.put("k", _response("a"))
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_evicts_the_least_recently_used(cache, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_MAX_ENTRIES", 2)
+    cache.put("a", _response("a"))
+    cache.put("b", _response("b"))
+    assert cache.get("a") is not None  # a 变为最近使用
+    cache.put("c", _response("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_sqlite_tier_survives_a_cleared_memory_tier(cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LLM_CACHE_SQLITE_PATH", str(tmp_path / "cache" / "llm.db"))
+    cache.put("k", _response("持久化"))
+    cache._memory.clear()  # 模拟另一个进程 / 重启后只剩 SQLite
+    assert cache.get("k") == _response("持久化")
+    assert cache.get("k") == _response("持久化")
+    stats = cache.stats()
+    assert (stats["diskHits"], stats["memoryHits"]) == (1, 1)
+    assert stats["sqlite"] is True
+
+    cache.clear()
+    assert cache.get("k") is None
+
+
+def test_unusable_sqlite_path_falls_back_to_memory(cache, monkeypatch, tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(settings, "LLM_CACHE_SQLITE_PATH", str(blocker / "llm.db"))
+    cache.put("k", _response("x"))
+    assert cache.get("k") == _response("x")
+    assert cache.stats()["sqlite"] is False
+
+
+def test_client_serves_repeated_requests_from_cache(cache, mock_llm):
+    server = mock_llm(reply_chars=30)
+    first = deepseek_client.call_deepseek_api_chat(_MESSAGES, cache=True)
+    second = deepseek_client.call_deepseek_api_chat(_MESSAGES, cache=True)
+    assert first == second
+    assert httpx.get(server.url + "/stats").json()["requests"] == 1
+
+    # fresh=True 跳过缓存，cache=False 不读缓存
+    deepseek_client.call_deepseek_api_chat(_MESSAGES, cache=True, fresh=True)
+    deepseek_client.call_deepseek_api_chat(_MESSAGES)
+    assert httpx.get(server.url + "/stats").json()["requests"] == 3
+    assert cache.stats()["memoryHits"] == 1
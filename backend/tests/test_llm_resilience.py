@@ -0,0 +1,217 @@
+import asyncio
+import time
+from collections import deque
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from backend.config import settings
+from backend.utils import deepseek_client, llm_resilience
+from backend.utils.llm_resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, DeepseekAPIError, parse_retry_after,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "_breaker", CircuitBreaker(3, 30))
+    monkeypatch.setattr(llm_resilience, "_counters", dict.fromkeys(llm_resilience._counters, 0))
+    monkeypatch.setattr(llm_resilience, "_latencies", deque(maxlen=llm_resilience._LATENCY_SAMPLES))
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "LLM_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(settings, "LLM_RETRY_MAX_DELAY", 1.0)
+    yield
+    llm_resilience.shutdown()
+
+
+def _failing(*statuses, result="ok"):
+    """fn raising DeepseekAPIError for each status in turn, then returning ``result``."""
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(statuses):
+            raise DeepseekAPIError(statuses[len(calls) - 1], "boom")
+        return result
+
+    return fn, calls
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-4") == 0.0
+    assert parse_retry_after("soon") is None
+    assert 50 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(3, cooldown=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(True)
+    breaker.before_call()
+    breaker.record(False)  # 成功清零计数
+    for _ in range(3):
+        assert breaker.state == CLOSED
+        breaker.before_call()
+        breaker.record(True)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.rejected == 1
+    assert breaker.transitions == {"closed->open": 1}
+
+
+def test_local_errors_do_not_count_towards_the_breaker():
+    breaker = CircuitBreaker(1, cooldown=30)
+    breaker.before_call()
+    breaker.record(None)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(1, cooldown=0)
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.state == OPEN
+
+    breaker.before_call()  # 冷却结束：放行一个探测请求
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(True)  # 探测失败，再次熔断
+    assert breaker.state == OPEN
+
+    breaker.before_call()
+    breaker.record(False)  # 探测成功，恢复
+    assert breaker.state == CLOSED
+    assert breaker.transitions == {"closed->open": 1, "open->half_open": 2, "half_open->open": 1, "half_open->closed": 1}
+
+
+def test_call_retries_retryable_statuses():
+    fn, calls = _failing(500, 429)
+    assert llm_resilience.call(fn) == "ok"
+    assert len(calls) == 3
+    stats = llm_resilience.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 2)
+    assert stats["breaker"]["state"] == CLOSED
+
+
+def test_call_gives_up_after_the_retry_budget(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 1)
+    fn, calls = _failing(500, 500, 500)
+    with pytest.raises(DeepseekAPIError):
+        llm_resilience.call(fn)
+    assert len(calls) == 2
+
+
+def test_client_errors_are_not_retried_or_counted():
+    fn, calls = _failing(400)
+    with pytest.raises(DeepseekAPIError):
+        llm_resilience.call(fn)
+    assert len(calls) == 1
+    assert llm_resilience.stats()["failures"] == 0
+
+
+def test_retry_after_beyond_the_cap_is_not_retried():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise DeepseekAPIError(429, "slow down", retry_after=60)
+
+    with pytest.raises(DeepseekAPIError):
+        llm_resilience.call(fn)
+    assert len(calls) == 1
+
+
+def test_retry_waits_at_least_retry_after():
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise DeepseekAPIError(429, "slow down", retry_after=0.1)
+        return "ok"
+
+    assert llm_resilience.call(fn) == "ok"
+    assert calls[1] - calls[0] >= 0.1
+
+
+def test_open_breaker_rejects_without_calling():
+    fn, calls = _failing(500, 500, 500, 500)
+    # 第三次失败后熔断，剩下的重试直接被拒绝
+    with pytest.raises(CircuitOpenError):
+        llm_resilience.call(fn)
+    assert len(calls) == 3
+    with pytest.raises(CircuitOpenError):
+        llm_resilience.call(fn)
+    assert len(calls) == 3
+
+
+def test_acall_retries_and_records_cancellation_as_neutral():
+    fn, calls = _failing(502)
+
+    async def afn():
+        return fn()
+
+    async def slow():
+        await asyncio.sleep(5)
+
+    async def run():
+        assert await llm_resilience.acall(afn) == "ok"
+        task = asyncio.ensure_future(llm_resilience.acall(slow))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    # 取消后探测标记被清除，下一次调用不会被拒绝
+    llm_resilience.call(lambda: "ok")
+
+
+def test_hedged_call_takes_the_faster_copy(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE_DEFAULT_DELAY", 0.05)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(1)
+            return "slow"
+        return "fast"
+
+    assert llm_resilience.call(fn, hedge=True) == "fast"
+    stats = llm_resilience.stats()
+    assert (stats["hedged"], stats["hedgeWins"]) == (1, 1)
+
+
+def test_client_retries_mock_server_errors(mock_llm, monkeypatch):
+    server = mock_llm(rate_limit_rate=1.0, retry_after=0.01)
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 2)
+    monkeypatch.setattr(llm_resilience, "_breaker", CircuitBreaker(10, 30))
+    with pytest.raises(DeepseekAPIError) as exc:
+        deepseek_client.call_deepseek_api("问题")
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after == pytest.approx(0.01)
+    stats = httpx.get(server.url + "/stats").json()
+    assert stats["rateLimited"] == 3
+
+
+def test_client_trips_the_breaker_on_repeated_500s(mock_llm, monkeypatch):
+    server = mock_llm(error_rate=1.0)
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 5)
+    monkeypatch.setattr(llm_resilience, "_breaker", CircuitBreaker(2, 30))
+    with pytest.raises(CircuitOpenError):
+        deepseek_client.call_deepseek_api("问题")
+    with pytest.raises(CircuitOpenError):
+        deepseek_client.call_deepseek_api("问题")
+    assert httpx.get(server.url + "/stats").json()["errors"] == 2
+    assert llm_resilience.stats()["breaker"]["state"] == OPEN
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.utils.llm_scheduler import (
+    ANALYSIS, GRADING, INTERACTIVE, PREVIEW, LLMQueueTimeout, Scheduler,
+)
+
+_TIMEOUTS = {INTERACTIVE: 5, PREVIEW: 5, GRADING: 5, ANALYSIS: 5}
+
+
+def _scheduler(max_concurrency=2, max_per_user=2, reserved=0):
+    return Scheduler(max_concurrency, max_per_user, reserved, _TIMEOUTS)
+
+
+def _wait_until(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def _waiter(s, priority, user_id=None, *, order=None, hold=None):
+    """
+    Queue a blocking ``acquire`` in a thread and return once it is queued or
+    granted. The slot is released right away unless ``hold`` (an Event) is given.
+    """
+    box = {}
+
+    def run():
+        try:
+            token = s.acquire(priority, user_id)
+        except LLMQueueTimeout as e:
+            box["error"] = e
+            return
+        box["token"] = token
+        if order is not None:
+            order.append((priority, user_id))
+        if hold is not None:
+            hold.wait(5)
+        s.release(token)
+
+    before = s.stats()["queued"]
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    _wait_until(lambda: "token" in box or s.stats()["queued"] > before)
+    return t, box
+
+
+def test_free_slots_are_granted_immediately():
+    s = _scheduler()
+    a = s.acquire(GRADING)
+    b = s.acquire(INTERACTIVE, user_id=1)
+    assert s.stats()["active"] == 2
+    s.release(a)
+    s.release(b)
+    stats = s.stats()
+    assert stats["active"] == 0
+    assert stats["queued"] == 0
+    assert stats["classes"][GRADING]["admitted"] == 1
+    assert stats["classes"][INTERACTIVE]["active"] == 0
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        _scheduler().acquire("urgent")
+
+
+def test_highest_priority_first_then_fifo():
+    s = _scheduler(max_concurrency=1)
+    holder = s.acquire(INTERACTIVE)
+    order = []
+    threads = [
+        _waiter(s, ANALYSIS, order=order),
+        _waiter(s, GRADING, 1, order=order),
+        _waiter(s, PREVIEW, order=order),
+        _waiter(s, GRADING, 2, order=order),
+        _waiter(s, INTERACTIVE, order=order),
+    ]
+    assert s.stats()["queued"] == 5
+    s.release(holder)
+    for t, _ in threads:
+        t.join(5)
+    assert order == [
+        (INTERACTIVE, None), (PREVIEW, None), (GRADING, 1), (GRADING, 2), (ANALYSIS, None),
+    ]
+    assert s.stats()["active"] == 0
+
+
+def test_reserved_slots_are_kept_for_interactive_and_preview():
+    s = _scheduler(max_concurrency=3, reserved=1)
+    hold = threading.Event()
+    graders = [_waiter(s, GRADING, hold=hold) for _ in range(3)]
+    # 只有两个批改请求拿到名额，第三个排队
+    assert s.stats()["active"] == 2
+    assert s.stats()["classes"][GRADING]["queued"] == 1
+    # 保留的名额仍可给交互请求
+    token = s.acquire(INTERACTIVE, timeout=0.5)
+    assert s.stats()["active"] == 3
+    s.release(token)
+    assert s.stats()["classes"][GRADING]["queued"] == 1
+    hold.set()
+    for t, box in graders:
+        t.join(5)
+        assert "token" in box
+    assert s.stats()["active"] == 0
+
+
+def test_reserved_is_capped_below_max_concurrency():
+    s = _scheduler(max_concurrency=2, reserved=5)
+    assert s.reserved == 1
+    token = s.acquire(ANALYSIS, timeout=0.5)
+    s.release(token)
+
+
+def test_per_user_limit_does_not_block_other_users():
+    s = _scheduler(max_concurrency=3, max_per_user=1)
+    first = s.acquire(INTERACTIVE, user_id=1)
+    order = []
+    t1, box1 = _waiter(s, INTERACTIVE, 1, order=order)
+    assert "token" not in box1
+    # 用户 1 排在前面，但用户 2 的请求不受影响
+    other = s.acquire(GRADING, user_id=2, timeout=0.5)
+    assert s.stats()["active"] == 2
+    s.release(other)
+    assert order == []
+    s.release(first)
+    t1.join(5)
+    assert order == [(INTERACTIVE, 1)]
+
+
+def test_timeout_raises_and_leaves_the_queue():
+    s = _scheduler(max_concurrency=1)
+    holder = s.acquire(INTERACTIVE)
+    with pytest.raises(LLMQueueTimeout):
+        s.acquire(GRADING, timeout=0.05)
+    stats = s.stats()
+    assert stats["queued"] == 0
+    assert stats["classes"][GRADING]["timeouts"] == 1
+    s.release(holder)
+    assert s.stats()["active"] == 0
+
+
+def test_default_timeout_comes_from_settings_per_priority():
+    s = Scheduler(1, 1, 0, {GRADING: 0.05})
+    holder = s.acquire(INTERACTIVE)
+    start = time.monotonic()
+    with pytest.raises(LLMQueueTimeout):
+        s.acquire(GRADING)
+    assert time.monotonic() - start < 2
+    s.release(holder)
+
+
+def test_async_acquire_shares_the_queue_with_threads():
+    s = _scheduler(max_concurrency=1)
+    holder = s.acquire(GRADING)
+
+    async def run():
+        task = asyncio.ensure_future(s.aacquire(INTERACTIVE))
+        await asyncio.sleep(0.02)
+        assert s.stats()["queued"] == 1
+        # 名额在其它线程中释放
+        threading.Thread(target=s.release, args=(holder,)).start()
+        token = await asyncio.wait_for(task, 2)
+        s.release(token)
+
+        with pytest.raises(LLMQueueTimeout):
+            blocker = s.acquire(GRADING)
+            try:
+                await s.aacquire(ANALYSIS, timeout=0.05)
+            finally:
+                s.release(blocker)
+
+    asyncio.run(run())
+    stats = s.stats()
+    assert stats["active"] == 0
+    assert stats["queued"] == 0
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    s = _scheduler(max_concurrency=1)
+    holder = s.acquire(GRADING)
+
+    async def run():
+        task = asyncio.ensure_future(s.aacquire(INTERACTIVE))
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert s.stats()["queued"] == 0
+    s.release(holder)
+    assert s.stats()["active"] == 0
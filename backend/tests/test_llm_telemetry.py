@@ -0,0 +1,104 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlmodel import Session, select
+
+from backend.config import settings
+from backend.models import LLMCallMetric
+from backend.utils import deepseek_client, llm_telemetry
+
+
+@pytest.fixture
+def metrics(sqlite_engine, use_engine, monkeypatch):
+    engine = sqlite_engine(LLMCallMetric)
+    use_engine(engine, llm_telemetry)
+    monkeypatch.setattr(settings, "LLM_METRICS_ENABLED", True)
+
+    def rows(**filters):
+        llm_telemetry.flush()
+        with Session(engine) as sess:
+            query = select(LLMCallMetric).order_by(LLMCallMetric.id)
+            for name, value in filters.items():
+                query = query.where(getattr(LLMCallMetric, name) == value)
+            return sess.exec(query).all()
+
+    yield rows
+    llm_telemetry.shutdown()
+
+
+def test_calls_record_latency_and_usage(mock_llm, metrics):
+    mock_llm(reply_chars=40)
+    deepseek_client.call_deepseek_api("问题", cache=True, call_site="lesson")
+    deepseek_client.call_deepseek_api("问题", cache=True, call_site="lesson")
+
+    api, hit = metrics(call_site="lesson")
+    assert (api.source, api.outcome, api.retries, api.stream) == ("api", "ok", 0, False)
+    assert api.latency_ms > 0 and api.prompt_tokens > 0 and api.completion_tokens > 0
+    assert api.cached_tokens == 0
+    # 缓存命中不计 token
+    assert (hit.source, hit.prompt_tokens, hit.completion_tokens) == ("cache", None, None)
+
+
+def test_streams_record_ttft_and_abandonment(mock_llm, metrics):
+    # 限速输出：关闭时上游尚未发出 usage
+    mock_llm(reply_chars=80, tokens_per_sec=100)
+    messages = [{"role": "user", "content": "讲讲分数"}]
+    tokens = list(deepseek_client.call_deepseek_api_chat_stream(messages, call_site="chat"))
+    stream = deepseek_client.call_deepseek_api_chat_stream(
+        [{"role": "user", "content": "另一个问题"}], call_site="chat"
+    )
+    next(stream)
+    next(stream)
+    stream.close()
+
+    done, abandoned = metrics(call_site="chat")
+    assert (done.stream, done.outcome) == (True, "ok")
+    assert done.ttft_ms is not None and done.ttft_ms <= done.latency_ms
+    assert done.completion_tokens >= len([t for t in tokens if t])
+    # 提前关闭的流没有 usage，completion 按已输出的增量计
+    assert (abandoned.outcome, abandoned.completion_tokens, abandoned.prompt_tokens) == ("abandoned", 2, None)
+
+
+def test_errors_are_recorded(mock_llm, metrics, monkeypatch):
+    mock_llm(error_rate=1.0)
+    monkeypatch.setattr(settings, "LLM_RETRY_ATTEMPTS", 1)
+    with pytest.raises(Exception):
+        deepseek_client.call_deepseek_api("会失败的问题", call_site="grading")
+    [row] = metrics(call_site="grading")
+    assert row.outcome == "error" and row.retries == 1
+    assert row.error.startswith("DeepseekAPIError")
+
+
+def test_disabled_metrics_are_not_buffered(metrics, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_METRICS_ENABLED", False)
+    llm_telemetry.start("other", "deepseek-chat").finish()
+    assert metrics() == []
+
+
+def test_admin_summary(metrics, use_engine):
+    pytest.importorskip("textract")
+    pytest.importorskip("sentence_transformers")
+    from backend.routers import admin_router
+
+    now = datetime.utcnow()
+    base = dict(call_site="chat", model="m", created_at=now)
+    rows = [LLMCallMetric(**base, source="api", outcome="ok", latency_ms=float(ms)) for ms in range(1, 101)]
+    rows += [
+        LLMCallMetric(**base, stream=True, source="api", outcome="ok", latency_ms=5.0, completion_tokens=100),
+        LLMCallMetric(**base, stream=True, source="api", outcome="abandoned", latency_ms=1.0, completion_tokens=30),
+        LLMCallMetric(**base, source="cache", outcome="ok", latency_ms=0.1),
+    ]
+    engine = llm_telemetry.engine
+    use_engine(engine, admin_router)
+    with Session(engine) as sess:
+        sess.add_all(rows)
+        sess.commit()
+
+    summary = admin_router.llm_metrics(current=SimpleNamespace(role=SimpleNamespace(name="admin")))["chat"]
+    assert summary["calls"] == 103
+    assert (summary["abandoned"], summary["cacheHits"]) == (1, 1)
+    # 分位数只统计成功的上游调用（含流式）
+    latencies = sorted([*range(1, 101), 5])
+    assert summary["p50LatencyMs"] == latencies[50] and summary["p99LatencyMs"] == latencies[99]
+    assert summary["tokensSaved"] == 70
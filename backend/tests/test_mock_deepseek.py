@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.scripts.mock_deepseek import MockConfig, create_app, reply_for
+
+_FAST = dict(latency="fixed", latency_mean=0.0, ttft=0.0, tokens_per_sec=0, seed=0)
+
+
+def _client(**config) -> TestClient:
+    return TestClient(create_app(MockConfig(**{**_FAST, **config})))
+
+
+def _ask(client, content="讲讲分数", **body):
+    return client.post(
+        "/v1/chat/completions",
+        json={"model": "deepseek-chat", "messages": [{"role": "user", "content": content}], **body},
+    )
+
+
+def test_completion_has_reply_and_usage():
+    client = _client(reply_chars=50)
+    data = _ask(client).json()
+    content = data["choices"][0]["message"]["content"]
+    assert content.startswith("# 模拟回复") and len(content) > 50
+    usage = data["usage"]
+    assert usage["prompt_tokens"] > 0 and usage["completion_tokens"] > 0
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+    assert client.get("/stats").json() == {"requests": 1, "streams": 0, "errors": 0, "rateLimited": 0}
+
+
+def test_stream_sends_deltas_and_usage_on_request():
+    client = _client(reply_chars=50)
+    full = _ask(client).json()["choices"][0]["message"]["content"]
+    resp = _ask(client, stream=True, stream_options={"include_usage": True})
+    events = [line[len("data: "):] for line in resp.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(e) for e in events[:-1]]
+    deltas = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+    assert deltas == full
+    assert chunks[-1]["choices"] == [] and chunks[-1]["usage"]["completion_tokens"] > 0
+    assert client.get("/stats").json()["streams"] == 1
+
+
+@pytest.mark.parametrize(
+    "config, status",
+    [(dict(error_rate=1.0), 500), (dict(rate_limit_rate=1.0, retry_after=2.5), 429)],
+)
+def test_injected_errors(config, status):
+    client = _client(**config)
+    resp = _ask(client)
+    assert resp.status_code == status
+    stats = client.get("/stats").json()
+    if status == 429:
+        assert resp.headers["Retry-After"] == "2.5" and stats["rateLimited"] == 1
+    else:
+        assert stats["errors"] == 1
+
+
+def test_replies_match_the_business_call():
+    config = MockConfig(**_FAST)
+    exercise = json.loads(reply_for(
+        [{"role": "user", "content": "生成 2 道单选题，生成 1 道编程题，按示例结构输出 questions"}], config
+    ))
+    assert [b["type"] for b in exercise["questions"]] == ["single_choice", "coding"]
+    assert exercise["answers"]["1"] == "A" and "print(a + b)" in exercise["answers"]["3"]
+    assert exercise["questions"][1]["items"][0]["test_cases"]
+
+    grading = json.loads(reply_for([{"role": "user", "content": (
+        '题目: [{"type": "single_choice", "items": [{"id": "1"}, {"id": "2"}]}]\n'
+        '标准答案: {"1": "A", "2": "B"}\n'
+        '学生答案: {"1": "A", "2": "C"}'
+    )}], config))
+    assert grading["results"] == {"1": "correct", "2": "wrong"}
+
+    assert json.loads(reply_for([{"role": "user", "content": "生成3个问题，返回JSON数组"}], config)) == [
+        "模拟问题 1？", "模拟问题 2？", "模拟问题 3？"
+    ]
@@ -0,0 +1,154 @@
+from pathlib import Path
+
+import pytest
+from sqlmodel import Session, select
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.models import DocumentVector
+from backend.utils import extract_pool, rag_pipeline
+from backend.utils.text_extract import ExtractionError
+
+_TEXT = (
+    "Triangle angles sum to one hundred eighty degrees in plane geometry.\n\n"
+    "Water molecules contain hydrogen and oxygen atoms bonded together.\n\n"
+    "Cells divide by mitosis and share their chromosomes equally."
+)
+
+
+def _upload(documents, text, name="a.txt", owner_id=1):
+    doc = documents.service.save_document(owner_id, name, text.encode("utf-8"))
+    assert doc.index_error is None
+    documents.service.set_activation(doc.id, owner_id, True)
+    return doc
+
+
+def _retrieve(documents, query, top_k=1):
+    with Session(documents.engine) as sess:
+        return rag_pipeline.retrieve_from_db(query, 1, sess, top_k=top_k)
+
+
+def test_chunk_text_is_stored_and_returned_without_reparsing(documents, monkeypatch):
+    monkeypatch.setattr(documents.settings, "CHUNK_MAX_TOKENS", 20)
+    monkeypatch.setattr(documents.settings, "CHUNK_OVERLAP_TOKENS", 0)
+    doc = _upload(documents, _TEXT)
+    with Session(documents.engine) as sess:
+        rows = sess.exec(
+            select(DocumentVector).where(DocumentVector.doc_id == doc.id).order_by(DocumentVector.chunk_index)
+        ).all()
+    assert len(rows) > 1
+    assert [r.chunk_index for r in rows] == list(range(len(rows)))
+    for r in rows:
+        assert r.content and _TEXT[r.start_offset:r.end_offset] == r.content
+        assert r.token_count > 0
+
+    # 源文件和文本缓存都不在了，检索仍直接返回存储的块文本
+    Path(doc.filepath).unlink()
+    rag_pipeline.remove_text_cache(doc.content_hash)
+    monkeypatch.setattr(extract_pool, "extract_to_file", pytest.fail)
+    [(doc_id, content)] = _retrieve(documents, "hydrogen oxygen water")
+    assert doc_id == doc.id and "hydrogen and oxygen" in content
+
+
+def test_paragraphs_are_indexed_at_upload_and_retrieved_by_query(documents):
+    doc = _upload(documents, _TEXT)
+    other = documents.service.save_document(1, "b.txt", b"Photosynthesis turns light into sugar.")
+    calls = documents.model.calls
+    with Session(documents.engine) as sess:
+        hits = rag_pipeline.retrieve_paragraphs("hydrogen oxygen water", 1, sess, top_k=2)
+        # 查询只编码问题本身
+        assert documents.model.calls == calls + 1
+        assert hits[0] == (
+            doc.id, "Water molecules contain hydrogen and oxygen atoms bonded together."
+        )
+        assert len(hits) == 2 and {h[0] for h in hits} == {doc.id}
+
+        # 未激活的文档默认不参与
+        assert rag_pipeline.retrieve_paragraphs("photosynthesis light sugar", 1, sess, top_k=1)[0][0] == doc.id
+        assert rag_pipeline.retrieve_paragraphs(
+            "photosynthesis light sugar", 1, sess, top_k=1, include_inactive=True
+        ) == [(other.id, "Photosynthesis turns light into sugar.")]
+
+
+def test_reindex_paragraphs_rebuilds_the_index(documents):
+    doc = _upload(documents, _TEXT)
+    assert documents.service.reindex_paragraphs(doc.id) == 3
+    with Session(documents.engine) as sess:
+        assert rag_pipeline.retrieve_paragraphs("mitosis chromosomes", 1, sess, top_k=1) == [
+            (doc.id, "Cells divide by mitosis and share their chromosomes equally.")
+        ]
+
+
+@pytest.fixture
+def extractions(documents, monkeypatch):
+    """Record the paths actually extracted (text-cache misses)."""
+    paths = []
+    extract = extract_pool.extract_to_file
+
+    def counting(path, out_path, timeout=None):
+        paths.append(path)
+        return extract(path, out_path, timeout)
+
+    monkeypatch.setattr(extract_pool, "extract_to_file", counting)
+    return paths
+
+
+def test_text_cache_hit_skips_extraction(documents, extractions):
+    doc = _upload(documents, _TEXT)
+    assert extractions == [doc.filepath]
+    assert documents.service.reindex_paragraphs(doc.id) == 3
+    assert rag_pipeline.extract_text_cached(doc.filepath) == _TEXT
+    assert extractions == [doc.filepath]
+
+
+def test_text_cache_is_keyed_by_extractor_version(documents, extractions, monkeypatch):
+    doc = _upload(documents, _TEXT)
+    old = rag_pipeline.text_cache_path(doc.content_hash)
+    monkeypatch.setattr(rag_pipeline, "EXTRACTOR_VERSION", rag_pipeline.EXTRACTOR_VERSION + 1)
+    assert rag_pipeline.extract_text_cached(doc.filepath, doc.content_hash) == _TEXT
+    assert len(extractions) == 2
+    assert rag_pipeline.text_cache_path(doc.content_hash) != old
+
+    # 删除缓存时清除所有版本
+    rag_pipeline.remove_text_cache(doc.content_hash)
+    assert not old.exists() and not rag_pipeline.text_cache_path(doc.content_hash).exists()
+
+
+def test_failed_extraction_is_not_cached(documents, tmp_path, monkeypatch):
+    path = tmp_path / "broken.txt"
+    path.write_text("some text", encoding="utf-8")
+
+    def fail(path, out_path, timeout=None):
+        raise ExtractionError("timed out")
+
+    monkeypatch.setattr(extract_pool, "extract_to_file", fail)
+    assert rag_pipeline.ensure_text_cache(str(path)) is None
+    with pytest.raises(ExtractionError):
+        rag_pipeline.ensure_text_cache(str(path), strict=True)
+    cache = rag_pipeline.text_cache_path(rag_pipeline.file_hash(str(path)))
+    assert not list(cache.parent.iterdir())
+
+
+def test_pdf_upload_is_chunked_from_the_page_stream(documents, monkeypatch, make_pdf):
+    monkeypatch.setattr(documents.settings, "CHUNK_MAX_TOKENS", 16)
+    monkeypatch.setattr(documents.settings, "CHUNK_OVERLAP_TOKENS", 0)
+    pages = _TEXT.split("\n\n")
+    path = make_pdf(pages)
+
+    doc = documents.service.save_document(1, "pages.pdf", path.read_bytes())
+    assert doc.index_error is None
+    documents.service.set_activation(doc.id, 1, True)
+    cache = rag_pipeline.text_cache_path(doc.content_hash)
+    # 文本缓存逐页写入，读取时也逐页产出
+    pieces = list(rag_pipeline.iter_text_pieces(cache))
+    assert len(pieces) == len(pages)
+    assert all(piece.endswith("\f") for piece in pieces[:-1])
+    # 块的位置是整份文本中的偏移
+    text = "".join(pieces)
+    with Session(documents.engine) as sess:
+        rows = sess.exec(select(DocumentVector).where(DocumentVector.doc_id == doc.id)).all()
+    assert rows and all(text[r.start_offset:r.end_offset] == r.content for r in rows)
+    assert [(doc.id, pages[1])] == [
+        (doc_id, content.strip()) for doc_id, content in _retrieve(documents, "hydrogen oxygen water")
+    ]
@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy import inspect, text
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend import main
+from backend.models import DocumentVector
+
+
+def test_sqlite_vector_blob_becomes_nullable(sqlite_engine):
+    engine = sqlite_engine()
+    with engine.begin() as conn:
+        # 升级前的表结构：vector_blob NOT NULL，没有块文本等新列
+        conn.execute(text(
+            "CREATE TABLE document_vector (id INTEGER PRIMARY KEY, doc_id INTEGER NOT NULL, "
+            "chunk_index INTEGER NOT NULL, vector_blob BLOB NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX ix_document_vector_doc_id ON document_vector (doc_id)"))
+        conn.execute(text("INSERT INTO document_vector VALUES (1, 7, 0, x'0000803f')"))
+
+    with engine.begin() as conn:
+        main._rebuild_sqlite_table(conn, DocumentVector.__table__)
+
+    with engine.begin() as conn:
+        blob = next(c for c in inspect(conn).get_columns("document_vector") if c["name"] == "vector_blob")
+        assert blob["nullable"]
+        assert conn.execute(text("SELECT id, doc_id, vector_blob FROM document_vector")).all() == [
+            (1, 7, b"\x00\x00\x80?")
+        ]
+        # segment 后端写入不带向量的行
+        conn.execute(text(
+            "INSERT INTO document_vector (doc_id, chunk_index, vector_blob, content) VALUES (7, 1, NULL, 'x')"
+        ))
+        assert "document_vector_old" not in inspect(conn).get_table_names()
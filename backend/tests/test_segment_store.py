@@ -0,0 +1,149 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sqlmodel import Session
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.scripts import compact_segments
+from backend.utils import rag_pipeline, segment_store
+
+_GEOMETRY = "triangle angles sum to one hundred eighty degrees in plane geometry"
+_CHEMISTRY = "water molecules contain hydrogen and oxygen atoms bonded together"
+_BIOLOGY = "cells divide by mitosis and share their chromosomes equally"
+
+
+@pytest.fixture
+def segment_docs(documents, monkeypatch):
+    monkeypatch.setattr(documents.settings, "VECTOR_BACKEND", "segment")
+    return documents
+
+
+def _upload(documents, text, name, owner_id=1):
+    doc = documents.service.save_document(owner_id, name, text.encode("utf-8"))
+    assert doc.index_error is None
+    documents.service.set_activation(doc.id, owner_id, True)
+    return doc
+
+
+def _search(documents, text, top_k=5):
+    with Session(documents.engine) as sess:
+        return rag_pipeline.search_chunks(sess, documents.model.encode(text), [1], top_k)
+
+
+def _manifest(documents, scope=1):
+    path = Path(documents.settings.DOC_STORAGE_DIR) / "segments" / f"{scope}.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _files(documents, manifest):
+    root = Path(documents.settings.DOC_STORAGE_DIR)
+    return [root / p for seg in manifest["segments"] for p in (seg["path"], seg.get("ids")) if p]
+
+
+def test_upload_writes_a_segment_per_document(segment_docs):
+    geo = _upload(segment_docs, _GEOMETRY, "a.txt")
+    chem = _upload(segment_docs, _CHEMISTRY, "b.txt")
+    manifest = _manifest(segment_docs)
+    assert [seg["doc_id"] for seg in manifest["segments"]] == [geo.id, chem.id]
+    assert all(path.exists() for path in _files(segment_docs, manifest))
+
+    assert _search(segment_docs, "triangle angles")[0][0] == geo.id
+    # 检索直接读内存映射的段文件
+    assert segment_store._arrays
+    assert all(isinstance(arr, np.memmap) for arr in segment_store._arrays.values())
+
+
+def test_compact_merges_and_tombstones_deleted_documents(segment_docs):
+    docs = [
+        _upload(segment_docs, text, f"{i}.txt")
+        for i, text in enumerate((_GEOMETRY, _CHEMISTRY, _BIOLOGY))
+    ]
+    before = {doc.id: segment_store.document_vectors(1, doc.id) for doc in docs}
+    old_files = _files(segment_docs, _manifest(segment_docs))
+
+    assert segment_store.compact(1, min_rows=100) == 3
+    manifest = _manifest(segment_docs)
+    assert len(manifest["segments"]) == 1 and "ids" in manifest["segments"][0]
+    assert not any(path.exists() for path in old_files)
+    for doc in docs:
+        np.testing.assert_allclose(segment_store.document_vectors(1, doc.id), before[doc.id])
+    assert _search(segment_docs, "hydrogen oxygen")[0][0] == docs[1].id
+
+    # 已合并的文档删除后只记入 deleted，检索随即排除
+    assert segment_docs.service.delete_document(docs[1].id, 1)
+    assert _manifest(segment_docs)["deleted"] == [docs[1].id]
+    assert docs[1].id not in {hit[0] for hit in _search(segment_docs, _CHEMISTRY)}
+    assert segment_store.document_vectors(1, docs[1].id) is None
+
+    # 再次合并时清除这些行
+    merged = _files(segment_docs, _manifest(segment_docs))
+    assert segment_store.compact(1, min_rows=0) == 1
+    manifest = _manifest(segment_docs)
+    assert manifest["deleted"] == []
+    assert manifest["segments"][0]["rows"] == sum(len(before[d.id]) for d in (docs[0], docs[2]))
+    assert not any(path.exists() for path in merged)
+    assert {hit[0] for hit in _search(segment_docs, _CHEMISTRY)} <= {docs[0].id, docs[2].id}
+
+
+def test_mapped_segment_file_is_removed_later(segment_docs, monkeypatch):
+    geo = _upload(segment_docs, _GEOMETRY, "a.txt")
+    _upload(segment_docs, _CHEMISTRY, "b.txt")
+    _search(segment_docs, _GEOMETRY)
+    path = _files(segment_docs, _manifest(segment_docs))[0]
+
+    # 模拟 Windows：仍被映射的文件不能删除
+    unlink = Path.unlink
+
+    def locked_unlink(self, missing_ok=False):
+        if self == path:
+            raise PermissionError(13, "file is mapped", str(self))
+        return unlink(self, missing_ok=missing_ok)
+
+    monkeypatch.setattr(Path, "unlink", locked_unlink)
+    assert segment_docs.service.delete_document(geo.id, 1)
+    assert not any(key[0].endswith(f"/{geo.id}/vectors.npy") for key in segment_store._arrays)
+    assert path.exists() and segment_store._pending == {path}
+
+    # 下一次更新清单时重试
+    monkeypatch.setattr(Path, "unlink", unlink)
+    segment_store.compact(1)
+    assert not path.exists() and not segment_store._pending
+
+
+def test_manifest_lock_uses_msvcrt_without_fcntl(segment_docs, monkeypatch):
+    calls = []
+
+    class FakeMsvcrt:
+        LK_LOCK, LK_UNLCK = 1, 0
+
+        @staticmethod
+        def locking(fd, mode, nbytes):
+            calls.append((mode, nbytes))
+
+    monkeypatch.setattr(segment_store, "fcntl", None)
+    monkeypatch.setattr(segment_store, "msvcrt", FakeMsvcrt)
+    _upload(segment_docs, _GEOMETRY, "a.txt")
+    assert calls == [(FakeMsvcrt.LK_LOCK, 1), (FakeMsvcrt.LK_UNLCK, 1)]
+
+
+def test_import_db_writes_segments_for_stored_vectors(documents, use_engine, monkeypatch):
+    # 先用 numpy 后端上传：向量只在数据库里
+    geo = _upload(documents, _GEOMETRY, "a.txt")
+    chem = _upload(documents, _CHEMISTRY, "b.txt")
+    monkeypatch.setattr(documents.settings, "VECTOR_BACKEND", "segment")
+    assert _search(documents, _GEOMETRY) == []
+
+    use_engine(documents.engine, compact_segments)
+    monkeypatch.setattr(sys, "argv", ["compact_segments", "--import-db", "--min-rows", "100"])
+    compact_segments.main()
+
+    manifest = _manifest(documents)
+    assert len(manifest["segments"]) == 1
+    assert segment_store.document_vectors(1, geo.id) is not None
+    assert _search(documents, "triangle angles")[0][0] == geo.id
+    assert _search(documents, "hydrogen oxygen")[0][0] == chem.id
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.config import settings
+from backend.utils import single_flight
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_SINGLE_FLIGHT", True)
+    monkeypatch.setattr(single_flight, "_flights", {})
+    monkeypatch.setattr(single_flight, "_streams", {})
+    monkeypatch.setattr(single_flight, "_astreams", {})
+    monkeypatch.setattr(single_flight, "_counters", dict.fromkeys(single_flight._counters, 0))
+
+
+def _wait_until(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+class _Upstream:
+    """
+    Closeable fake upstream, like ``deepseek_client._Upstream``: yields
+    ``count`` tokens, each after ``gate`` is set (when given).
+    """
+
+    def __init__(self, count=5, gate=None, delay=0.0):
+        self.count = count
+        self.gate = gate
+        self.delay = delay
+        self.read = 0
+        self.closed = threading.Event()
+
+    def _next(self):
+        if self.read >= self.count:
+            return None
+        self.read += 1
+        return f"t{self.read} "
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.gate is not None:
+            self.gate.wait(5)
+        time.sleep(self.delay)
+        token = self._next()
+        if token is None:
+            raise StopIteration
+        return token
+
+    def close(self):
+        self.closed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(self.delay)
+        token = self._next()
+        if token is None:
+            raise StopAsyncIteration
+        return token
+
+    async def aclose(self):
+        self.closed.set()
+
+
+def _expected(count):
+    return [f"t{i} " for i in range(1, count + 1)]
+
+
+# ---- do / ado ----
+def test_do_coalesces_concurrent_identical_calls():
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": [1, 2]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight.do("k", fn))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: single_flight.stats()["coalesced"] == 2)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert results == [{"answer": [1, 2]}] * 3
+    # 每个等待者拿到独立的副本
+    assert len({id(r) for r in results}) == 3
+    assert single_flight.stats()["inFlight"] == 0
+
+
+def test_do_shares_the_leaders_error():
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do("k", fn)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for t in threads:
+        t.start()
+    _wait_until(lambda: single_flight.stats()["coalesced"] == 1)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(errors) == 2
+    # 失败的调用不会留在表里，下一次重新发起
+    assert single_flight.do("k", lambda: {"ok": True}) == {"ok": True}
+
+
+def test_do_without_single_flight_calls_every_time(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_SINGLE_FLIGHT", False)
+    calls = []
+    single_flight.do("k", lambda: calls.append(1) or {})
+    single_flight.do("k", lambda: calls.append(1) or {})
+    assert len(calls) == 2
+    assert single_flight.stats()["calls"] == 0
+
+
+def test_ado_survives_cancellation_of_its_initiator():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def run():
+        leader = asyncio.ensure_future(single_flight.ado("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.ado("k", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == {"answer": 42}
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert single_flight.stats()["coalesced"] == 1
+    assert single_flight.stats()["inFlight"] == 0
+
+
+# ---- stream / astream ----
+def test_stream_replays_earlier_tokens_to_late_subscribers():
+    gate = threading.Event()
+    upstream = _Upstream(count=5, gate=gate)
+    opened = []
+
+    def open_fn():
+        opened.append(1)
+        return upstream
+
+    leader = single_flight.stream("k", open_fn)
+    gate.set()
+    first = [next(leader), next(leader)]
+    follower = single_flight.stream("k", open_fn)
+    assert first + list(leader) == _expected(5)
+    assert list(follower) == _expected(5)
+    assert len(opened) == 1
+    assert upstream.closed.wait(2)
+    assert single_flight.stats()["streamsCoalesced"] == 1
+    _wait_until(lambda: single_flight.stats()["streamsInFlight"] == 0)
+
+
+def test_stream_open_error_raises_in_the_caller():
+    def open_fn():
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        single_flight.stream("k", open_fn)
+    assert single_flight.stats()["streamsInFlight"] == 0
+
+
+def test_stream_stops_reading_when_all_subscribers_leave():
+    upstream = _Upstream(count=1000, delay=0.005)
+    leader = single_flight.stream("k", lambda: upstream)
+    follower = single_flight.stream("k", lambda: upstream)
+    next(leader)
+    leader.close()
+    next(follower)
+    follower.close()
+    assert upstream.closed.wait(2)
+    assert upstream.read < 1000
+    _wait_until(lambda: single_flight.stats()["streamsInFlight"] == 0)
+
+
+def test_leader_closing_before_reading_releases_the_upstream():
+    # 回归：leader 还没读取就关闭时，上游响应（及其并发名额）必须被释放
+    upstream = _Upstream(count=1000, delay=0.005)
+    sub = single_flight.stream("k", lambda: upstream)
+    sub.close()
+    assert upstream.closed.wait(2)
+    assert upstream.read < 1000
+    _wait_until(lambda: single_flight.stats()["streamsInFlight"] == 0)
+
+
+def test_astream_replays_and_coalesces():
+    upstream = _Upstream(count=5, delay=0.005)
+    opened = []
+
+    async def open_fn():
+        opened.append(1)
+        return upstream
+
+    async def run():
+        leader = await single_flight.astream("k", open_fn)
+        first = await leader.__anext__()
+        follower = await single_flight.astream("k", open_fn)
+        rest = [t async for t in leader]
+        return [first] + rest, [t async for t in follower]
+
+    lead, follow = asyncio.run(run())
+    assert lead == follow == _expected(5)
+    assert len(opened) == 1
+    assert upstream.closed.is_set()
+    assert single_flight.stats()["streamsInFlight"] == 0
+
+
+def test_async_leader_closing_before_reading_releases_the_upstream():
+    # 回归：读取任务尚未开始时 leader 就关闭，不能把任务取消在 finally 之前
+    upstream = _Upstream(count=1000, delay=0.005)
+
+    async def open_fn():
+        return upstream
+
+    async def run():
+        sub = await single_flight.astream("k", open_fn)
+        await sub.aclose()
+        for _ in range(200):
+            if upstream.closed.is_set():
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert upstream.closed.is_set()
+    assert upstream.read == 0
+    assert single_flight.stats()["streamsInFlight"] == 0
+
+
+def test_async_follower_keeps_the_stream_after_the_leader_leaves():
+    upstream = _Upstream(count=20, delay=0.002)
+
+    async def open_fn():
+        return upstream
+
+    async def run():
+        leader = await single_flight.astream("k", open_fn)
+        follower = await single_flight.astream("k", open_fn)
+        await leader.aclose()
+        return [t async for t in follower]
+
+    assert asyncio.run(run()) == _expected(20)
+    assert upstream.closed.is_set()
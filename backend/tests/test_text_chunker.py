@@ -0,0 +1,53 @@
+from backend.utils.text_chunker import estimate_tokens, iter_chunks, iter_paragraphs
+
+
+def test_estimate_tokens_counts_cjk_chars_words_and_punctuation():
+    assert estimate_tokens("你好，world 2024!") == 6
+
+
+def test_chunks_respect_max_tokens_and_offsets():
+    text = "".join(f"第{i}句话讲的是一个知识点。" for i in range(200))
+    chunks = list(iter_chunks([text], max_tokens=50, overlap_tokens=10))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.token_count <= 50
+        assert text[chunk.start : chunk.end] == chunk.text
+        # 块在句末结束
+        assert chunk.text.endswith("。")
+
+
+def test_consecutive_chunks_overlap_by_sentences():
+    text = " ".join(f"Sentence number {i} is here." for i in range(60))
+    chunks = list(iter_chunks([text], max_tokens=30, overlap_tokens=8))
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.start < prev.end
+
+
+def test_streamed_pieces_match_whole_text():
+    text = "第一段第一句。第一段第二句！\n\n第二段 English sentence. 还有一句？" * 20
+    pieces = [text[i : i + 7] for i in range(0, len(text), 7)]
+    assert list(iter_chunks(pieces, max_tokens=40, overlap_tokens=5)) == list(
+        iter_chunks([text], max_tokens=40, overlap_tokens=5)
+    )
+
+
+def test_overlong_sentence_is_hard_split():
+    text = "字" * 300
+    chunks = list(iter_chunks([text], max_tokens=100, overlap_tokens=0))
+    assert [c.token_count for c in chunks] == [100, 100, 100]
+    assert "".join(c.text for c in chunks) == text
+
+
+def test_paragraphs_with_offsets_across_pieces():
+    text = "first para\nline two\n\n  second para  \n\n\nthird"
+    pieces = [text[i : i + 5] for i in range(0, len(text), 5)]
+    paras = list(iter_paragraphs(pieces))
+    assert [p.text for p in paras] == ["first para\nline two", "second para", "third"]
+    for p in paras:
+        assert text[p.start : p.end] == p.text
+
+
+def test_paragraph_without_break_is_bounded():
+    paras = list(iter_paragraphs(["x" * 50] * 3, max_chars=60))
+    assert "".join(p.text for p in paras) == "x" * 150
+    assert all(len(p.text) <= 100 for p in paras)
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("textract")
+
+from backend.utils import text_extract
+from backend.utils.text_extract import ExtractionError
+
+_PAGES = [
+    "Triangle angles sum to one hundred eighty degrees.",
+    "Water molecules contain hydrogen and oxygen atoms.",
+    "Cells divide by mitosis and share their chromosomes.",
+]
+
+
+@pytest.fixture
+def pdf_path(make_pdf):
+    return make_pdf(_PAGES)
+
+
+def test_pdf_is_extracted_page_by_page(pdf_path, tmp_path):
+    out = tmp_path / "out.txt"
+    written = text_extract.extract_to_file(str(pdf_path), str(out))
+    text = out.read_text(encoding="utf-8")
+    assert written == len(text)
+    pages = text.split("\f")
+    assert [p.strip() for p in pages] == _PAGES
+
+
+def test_pdf_pages_are_read_lazily(pdf_path):
+    pages = text_extract.iter_pdf_pages(str(pdf_path))
+    assert next(pages).strip() == _PAGES[0]
+    assert [p.strip() for p in pages] == _PAGES[1:]
+
+
+def test_broken_pdf_raises_extraction_error(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf")
+    with pytest.raises(ExtractionError):
+        text_extract.extract_to_file(str(path), str(tmp_path / "out.txt"))
@@ -0,0 +1,101 @@
+import pytest
+from sqlmodel import Session
+
+pytest.importorskip("textract")
+pytest.importorskip("sentence_transformers")
+
+from backend.utils import vector_cache
+from backend.utils.vector_codec import FLOAT16, FLOAT32, INT8
+
+_GEOMETRY = "triangle angles sum to one hundred eighty degrees in plane geometry"
+_CHEMISTRY = "water molecules contain hydrogen and oxygen atoms bonded together"
+
+
+def _upload(documents, text, name, owner_id=1):
+    doc = documents.service.save_document(owner_id, name, text.encode("utf-8"))
+    assert doc.index_error is None
+    documents.service.set_activation(doc.id, owner_id, True)
+    return doc
+
+
+def _search(documents, text, teacher_ids=(1,), top_k=5):
+    with Session(documents.engine) as sess:
+        q = documents.model.encode(text)
+        return vector_cache.search(sess, q, list(teacher_ids), top_k)
+
+
+@pytest.mark.parametrize(
+    "storage, cache, rescored",
+    [
+        (FLOAT32, INT8, True),
+        (FLOAT16, INT8, True),
+        (INT8, INT8, False),
+        (FLOAT16, FLOAT16, False),
+        (FLOAT32, FLOAT32, False),
+    ],
+)
+def test_rescore_only_with_more_precise_storage(documents, monkeypatch, storage, cache, rescored):
+    monkeypatch.setattr(documents.settings, "VECTOR_STORAGE_DTYPE", storage)
+    monkeypatch.setattr(documents.settings, "VECTOR_CACHE_DTYPE", cache)
+    geo = _upload(documents, _GEOMETRY, "a.txt")
+    _upload(documents, _CHEMISTRY, "b.txt")
+
+    calls = []
+    exact = vector_cache._exact_scores
+    monkeypatch.setattr(
+        vector_cache, "_exact_scores", lambda *args: calls.append(args) or exact(*args)
+    )
+    assert _search(documents, "triangle angles")[0][0] == geo.id
+    assert bool(calls) is rescored
+
+
+@pytest.fixture
+def scope_loads(monkeypatch):
+    """Record the scopes each search had to load from the database."""
+    loads = []
+    load = vector_cache._load_scope
+
+    def counting(session, scope, granularity):
+        loads.append(scope)
+        return load(session, scope, granularity)
+
+    monkeypatch.setattr(vector_cache, "_load_scope", counting)
+    return loads
+
+
+def test_scope_matrix_is_cached_until_its_scope_changes(documents, scope_loads):
+    geo = _upload(documents, _GEOMETRY, "a.txt")
+    _upload(documents, _CHEMISTRY, "b.txt", owner_id=2)
+    _search(documents, "triangle angles", teacher_ids=(1, 2))
+    _search(documents, "hydrogen oxygen", teacher_ids=(1, 2))
+    assert sorted(scope_loads, key=str) == [1, 2, "public"]
+
+    # 教师 1 上传新文档只重建其 scope
+    scope_loads.clear()
+    chem = _upload(documents, _CHEMISTRY, "c.txt")
+    assert {hit[0] for hit in _search(documents, "hydrogen oxygen", teacher_ids=(1, 2))} >= {chem.id}
+    assert scope_loads == [1]
+
+    # 激活状态单独缓存：停用文档后立即不可见，矩阵无需重建
+    scope_loads.clear()
+    documents.service.set_activation(geo.id, 1, False)
+    assert geo.id not in {hit[0] for hit in _search(documents, "triangle angles")}
+    assert scope_loads == []
+
+
+def test_build_racing_an_invalidation_is_not_cached(documents, monkeypatch):
+    _upload(documents, _GEOMETRY, "a.txt")
+    load = vector_cache._load_scope
+
+    def racing(session, scope, granularity):
+        built = load(session, scope, granularity)
+        vector_cache.invalidate_scope(scope)  # 构建期间有新上传
+        return built
+
+    monkeypatch.setattr(vector_cache, "_load_scope", racing)
+    _search(documents, "triangle angles")
+    monkeypatch.setattr(vector_cache, "_load_scope", load)
+    with Session(documents.engine) as sess:
+        assert (vector_cache.CHUNKS, 1) not in vector_cache._scopes
+        vector_cache.get_scope(sess, 1)
+    assert (vector_cache.CHUNKS, 1) in vector_cache._scopes
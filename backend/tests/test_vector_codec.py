@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from backend.utils import vector_codec
+from backend.utils.vector_codec import FLOAT16, FLOAT32, INT8
+
+Row = namedtuple("Row", "vector_blob vector_dtype vector_scale")
+
+
+@pytest.fixture
+def mat():
+    rng = np.random.default_rng(0)
+    m = rng.standard_normal((50, 32)).astype(np.float32)
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("dtype, tol", [(FLOAT32, 0), (FLOAT16, 1e-3), (INT8, 1e-2)])
+def test_compress_roundtrip(mat, dtype, tol):
+    cm = vector_codec.compress(mat, dtype)
+    assert np.allclose(vector_codec.decompress(cm), mat, atol=tol)
+
+
+def test_compressed_sizes(mat):
+    full = vector_codec.nbytes(vector_codec.compress(mat, FLOAT32))
+    assert vector_codec.nbytes(vector_codec.compress(mat, FLOAT16)) == full // 2
+    # int8 另有每行一个 float32 缩放系数
+    assert vector_codec.nbytes(vector_codec.compress(mat, INT8)) == full // 4 + 4 * len(mat)
+
+
+@pytest.mark.parametrize("dtype", [FLOAT32, FLOAT16, INT8])
+def test_scores_match_float32_ranking(mat, dtype, monkeypatch):
+    monkeypatch.setattr(vector_codec, "_BLOCK_ROWS", 7)  # 覆盖分块路径
+    q = mat[3]
+    got = vector_codec.scores(vector_codec.compress(mat, dtype), q)
+    assert np.allclose(got, mat @ q, atol=2e-2)
+    assert int(np.argmax(got)) == 3
+
+
+@pytest.mark.parametrize("dtype", [FLOAT32, FLOAT16, INT8])
+def test_encode_decode_rows(mat, dtype):
+    rows = [Row(blob, dtype, scale) for blob, scale in vector_codec.encode_many(mat, dtype)]
+    assert np.allclose(vector_codec.decode_rows(rows), mat, atol=1e-2)
+    blob, scale = vector_codec.encode(mat[0], dtype)
+    assert np.allclose(vector_codec.decode(blob, dtype, scale), mat[0], atol=1e-2)
+
+
+def test_legacy_rows_without_dtype_are_float32(mat):
+    assert np.array_equal(vector_codec.decode(mat[0].tobytes(), None, None), mat[0])
+
+
+def test_zero_vector_and_unknown_dtype():
+    cm = vector_codec.compress(np.zeros((1, 4), dtype=np.float32), INT8)
+    assert np.array_equal(vector_codec.decompress(cm), np.zeros((1, 4)))
+    with pytest.raises(ValueError):
+        vector_codec.check_dtype("float64")
+
+
+def test_more_precise():
+    assert vector_codec.more_precise(FLOAT32, INT8)
+    assert vector_codec.more_precise(FLOAT16, INT8)
+    assert vector_codec.more_precise(None, FLOAT16)  # 旧数据按 float32
+    assert not vector_codec.more_precise(INT8, INT8)
+    assert not vector_codec.more_precise(FLOAT16, FLOAT32)
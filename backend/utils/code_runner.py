@@ -0,0 +1,308 @@
+# backend/utils/code_runner.py
+
+"""
+编程题本地评测：在受限子进程中运行学生的 Python 代码，逐个比对测试用例。
+
+每个测试用例形如 ``{"input": "标准输入", "output": "期望的标准输出"}``，
+各用例在线程池中并行执行（CODE_RUNNER_WORKERS，默认 CPU 核数），每个用例
+一个独立的子进程：
+ - ``python -I -S`` 隔离模式启动（只能导入标准库），工作目录为临时目录，环境变量清空；
+ - CPU 时间（CODE_RUNNER_CPU_SECONDS）、地址空间（CODE_RUNNER_MEMORY_MB）、
+   输出文件大小（CODE_RUNNER_OUTPUT_KB）由 rlimit 限制，禁止创建子进程（仅 Unix）；
+   墙钟时间（CODE_RUNNER_WALL_SECONDS）超时后直接杀掉进程；
+ - 无网络：Linux 上尽量进入独立的 network namespace，另外通过 audit hook
+   拒绝创建 socket、启动进程和加载 ctypes；
+ - 文件系统：audit hook 只允许读写临时目录、只读标准库，拒绝删除 / 重命名等
+   修改操作，也拒绝 gc / settrace 以免学生代码拿到钩子；
+ - 运行出错时只返回异常类型名，不把 stderr 原样交给学生。
+
+比对时忽略行尾空白和末尾空行。结果按 (代码, 测试用例, 限制) 的 sha256 缓存在
+进程内 LRU 中（CODE_RUNNER_CACHE_SIZE 条），同样的代码不会重复运行。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from backend.config import settings
+PASSED = "passed"
+WRONG_ANSWER = "wrong_answer"
+RUNTIME_ERROR = "runtime_error"
+TIMEOUT = "timeout"
+OUTPUT_LIMIT = "output_limit"
+
+# 评测逻辑变化时递增，使旧的缓存结果失效
+RUNNER_VERSION = 2
+
+# 子进程入口：先施加限制，再执行工作目录中的 solution.py。argv[1] 为限制参数
+_BOOTSTRAP = r"""
+import json, os, sys, sysconfig
+cfg = json.loads(sys.argv[1])
+if sys.platform.startswith("linux"):
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        # CLONE_NEWNET；非 root 时同时创建 user namespace
+        if libc.unshare(0x40000000) != 0:
+            libc.unshare(0x10000000 | 0x40000000)
+    except Exception:
+        pass
+try:
+    import resource
+    limits = [("RLIMIT_NPROC", 0, 0), ("RLIMIT_CORE", 0, 0)]
+    if cfg["cpu"] > 0:
+        limits.append(("RLIMIT_CPU", cfg["cpu"], cfg["cpu"] + 1))
+    if cfg["memory"] > 0:
+        limits.append(("RLIMIT_AS", cfg["memory"], cfg["memory"]))
+    if cfg["fsize"] > 0:
+        limits.append(("RLIMIT_FSIZE", cfg["fsize"], cfg["fsize"]))
+    for name, soft, hard in limits:
+        if hasattr(resource, name):
+            try:
+                resource.setrlimit(getattr(resource, name), (soft, hard))
+            except (ValueError, OSError):
+                pass
+except ImportError:
+    pass
+
+
+def _install(workdir, read_roots):
+    # 钩子只引用这里的局部变量，学生代码改不到（gc / settrace 也被拒绝）
+    _type, _str, _bytes, _int, _perm = type, str, bytes, int, PermissionError
+    windows = os.sep == "\\"
+    write_flags = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND
+    denied = (
+        "socket.", "subprocess.", "_posixsubprocess", "os.system", "os.exec", "os.fork",
+        "os.forkpty", "os.posix_spawn", "os.spawn", "os.startfile", "os.kill", "os.killpg",
+        "ctypes.", "gc.", "sys._current_frames", "sys.settrace",
+        "sys.setprofile", "shutil.", "os.remove", "os.unlink", "os.rename", "os.replace",
+        "os.rmdir", "os.removedirs", "os.mkdir", "os.makedirs", "os.chmod", "os.chown",
+        "os.chflags", "os.lchflags", "os.lchown", "os.link", "os.symlink", "os.truncate",
+        "os.utime", "os.chdir", "os.fchdir", "os.chroot", "os.mkfifo", "os.mknod",
+        "os.putenv", "os.unsetenv", "os.setxattr", "os.removexattr", "winreg.", "msvcrt.",
+    )
+
+    def norm(path):
+        # 纯字符串运算，不依赖可被替换的 os.path 函数
+        if windows:
+            path = path.replace("\\", "/").lower()
+            absolute = path[1:3] == ":/"
+        else:
+            absolute = path.startswith("/")
+        if not absolute:
+            path = workdir + "/" + path
+        parts = []
+        for part in path.split("/"):
+            if part == "" or part == ".":
+                continue
+            if part == "..":
+                if parts:
+                    parts.pop()
+                continue
+            parts.append(part)
+        return "/" + "/".join(parts) + "/"
+
+    def inside(path, roots):
+        path = norm(path)
+        for root in roots:
+            if path.startswith(root):
+                return True
+        return False
+
+    def allowed(path, write):
+        if path is None or _type(path) is _int:
+            return True
+        if _type(path) is _bytes:
+            path = path.decode("utf-8", "surrogateescape")
+        elif _type(path) is not _str:
+            # 自定义 PathLike 可能每次返回不同的路径
+            return False
+        if inside(path, (workdir_root,)):
+            return True
+        return not write and inside(path, read_roots)
+
+    workdir_root = norm(workdir)
+    read_roots = tuple(norm(r) for r in read_roots)
+
+    def guard(event, args):
+        if event.startswith(denied):
+            raise _perm(f"{event} is not allowed")
+        if event == "open":
+            path, mode, flags = args
+            write = (_type(flags) is _int and flags & write_flags) or (
+                _type(mode) is _str and ("w" in mode or "a" in mode or "x" in mode or "+" in mode)
+            )
+            if not allowed(path, write):
+                raise _perm("file access outside the sandbox is not allowed")
+        elif event in ("os.listdir", "os.scandir", "glob.glob"):
+            if not allowed(args[0], False):
+                raise _perm("file access outside the sandbox is not allowed")
+
+    sys.addaudithook(guard)
+
+
+_roots = set()
+for _name in ("stdlib", "platstdlib"):
+    _roots.add(sysconfig.get_path(_name))
+    _roots.add(os.path.realpath(sysconfig.get_path(_name)))
+_install(os.path.realpath(cfg["workdir"]), _roots)
+del _install, _roots, _name, cfg, json, sysconfig
+with open("solution.py", encoding="utf-8") as fh:
+    source = fh.read()
+sys.argv = ["solution.py"]
+exec(compile(source, "solution.py", "exec"), {"__name__": "__main__", "__builtins__": __builtins__})
+"""
+
+_lock = threading.Lock()
+_cache: "OrderedDict[str, dict]" = OrderedDict()
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=settings.CODE_RUNNER_WORKERS or os.cpu_count() or 1,
+                thread_name_prefix="code-runner",
+            )
+        return _pool
+
+
+def normalize_output(text: str) -> str:
+    """忽略行尾空白与末尾空行。"""
+    lines = [line.rstrip() for line in str(text).replace("\r\n", "\n").split("\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+def _limits() -> Dict[str, int]:
+    return {
+        "cpu": int(settings.CODE_RUNNER_CPU_SECONDS),
+        "memory": settings.CODE_RUNNER_MEMORY_MB * 1024 * 1024,
+        "fsize": settings.CODE_RUNNER_OUTPUT_KB * 1024,
+    }
+
+
+def _error_name(path: str) -> str:
+    """
+    只报告异常类型名。stderr 的其余内容由学生代码控制（例如把读到的文件
+    内容放进异常信息），不能原样返回给学生。
+    """
+    try:
+        with open(path, encoding="utf-8", errors="replace") as fh:
+            lines = [line for line in fh.read().splitlines() if line.strip()]
+    except OSError:
+        return "RuntimeError"
+    m = re.match(r"([A-Za-z_][\w.]*)(:|$)", lines[-1]) if lines else None
+    return m.group(1).rsplit(".", 1)[-1][:64] if m else "RuntimeError"
+
+
+def _run_case(code: str, case: Dict[str, Any], limits: Dict[str, int]) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="code-runner-")
+    try:
+        config = dict(limits, workdir=workdir)
+        src = os.path.join(workdir, "solution.py")
+        with open(src, "w", encoding="utf-8") as fh:
+            fh.write(code)
+        stdin_path = os.path.join(workdir, "stdin.txt")
+        with open(stdin_path, "w", encoding="utf-8") as fh:
+            fh.write(str(case.get("input") or ""))
+        out_path = os.path.join(workdir, "stdout.txt")
+        err_path = os.path.join(workdir, "stderr.txt")
+
+        # 输出写入文件，RLIMIT_FSIZE 才能限制其大小
+        with open(stdin_path, "rb") as stdin, open(out_path, "wb") as stdout, open(err_path, "wb") as stderr:
+            proc = subprocess.Popen(
+                # -S：不加载 site-packages，只能导入标准库
+                [sys.executable, "-I", "-S", "-X", "utf8", "-c", _BOOTSTRAP, json.dumps(config)],
+                stdin=stdin,
+                stdout=stdout,
+                stderr=stderr,
+                cwd=workdir,
+                env={"PATH": os.defpath},
+                start_new_session=True,
+            )
+            try:
+                returncode = proc.wait(timeout=settings.CODE_RUNNER_WALL_SECONDS)
+            except subprocess.TimeoutExpired:
+                if hasattr(os, "killpg"):
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                proc.kill()
+                proc.wait()
+                return {"status": TIMEOUT}
+
+        # Python 忽略 SIGXFSZ，超出输出上限表现为写入失败
+        if os.path.getsize(out_path) >= limits["fsize"] > 0:
+            return {"status": OUTPUT_LIMIT}
+        if returncode != 0:
+            # 超出 CPU 时间先收到 SIGXCPU，超过硬限制被 SIGKILL
+            if returncode in (-getattr(signal, "SIGXCPU", 0), -getattr(signal, "SIGKILL", 0)):
+                return {"status": TIMEOUT}
+            if returncode == -getattr(signal, "SIGXFSZ", 0):
+                return {"status": OUTPUT_LIMIT}
+            return {"status": RUNTIME_ERROR, "error": _error_name(err_path)}
+        with open(out_path, encoding="utf-8", errors="replace") as fh:
+            actual = fh.read()
+        if normalize_output(actual) == normalize_output(case.get("output", "")):
+            return {"status": PASSED}
+        return {"status": WRONG_ANSWER}
+    except OSError as e:
+        logging.error("Code runner failed: %s", e)
+        return {"status": RUNTIME_ERROR, "error": type(e).__name__}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _key(code: str, test_cases: List[Dict[str, Any]], limits: Dict[str, int]) -> str:
+    raw = json.dumps(
+        {"code": code, "tests": test_cases, "limits": limits, "version": RUNNER_VERSION},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def run_tests(code: str, test_cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run ``code`` against every case and return
+    ``{"passed": int, "total": int, "cases": [{"status": ..., "error"?: ...}]}``.
+    """
+    limits = _limits()
+    key = _key(code, test_cases, limits)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return json.loads(json.dumps(hit))
+
+    pool = _get_pool()
+    futures = [pool.submit(_run_case, code, case, limits) for case in test_cases]
+    cases = [f.result() for f in futures]
+    result = {
+        "passed": sum(1 for c in cases if c["status"] == PASSED),
+        "total": len(cases),
+        "cases": cases,
+    }
+
+    with _lock:
+        _cache[key] = result
+        _cache.move_to_end(key)
+        while len(_cache) > settings.CODE_RUNNER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return json.loads(json.dumps(result))
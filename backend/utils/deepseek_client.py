@@ -1,115 +1,561 @@
 # backend/utils/deepseek_client.py
 
+"""
+Deepseek 聊天接口客户端。
+
+同步与异步调用各共用一个 httpx 客户端（连接池 + keep-alive），避免每次调用
+重新建立 TCP / TLS 连接。async 接口（如备课）使用 ``acall_*`` 系列，不阻塞
+事件循环；其余同步代码路径继续使用 ``call_*``。应用关闭时调用
+``close`` / ``aclose`` 释放连接。
+
+每次调用先经 ``llm_scheduler`` 排队取得并发名额；``priority`` 为调用的优先级
+（interactive / preview / grading / analysis），``user_id`` 用于单用户并发限制。
+流式调用在整个流读完或关闭前一直占用名额。
+
+非流式调用可传 ``cache=True`` 使用 ``llm_cache`` 中相同请求的结果，命中时
+不排队也不请求接口；``fresh=True`` 跳过读取缓存但仍写入新结果。
+同时进行的相同请求经 ``single_flight`` 合并为一次上游调用，流式结果分发给
+所有等待者；合并后的上游调用按第一个请求的优先级排队。
+上游请求经 ``llm_resilience`` 重试、熔断，``hedge=True`` 时对冲慢请求；每次
+重试重新排队取得名额，退避等待期间不占用并发。
+
+``call_site`` 标识调用点（grading / analysis / chat / lesson / exercise / suggest），
+每次调用的耗时、TTFT、token 用量与结果经 ``llm_telemetry`` 记录。
+"""
+
 import json
-import requests
+import logging
+import threading
+from time import perf_counter
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
+
+import httpx
+
 from backend.config import settings
+from backend.utils import llm_cache, llm_resilience, llm_scheduler, llm_telemetry, single_flight
+from backend.utils.llm_resilience import DeepseekAPIError
+from backend.utils.llm_scheduler import PREVIEW
+from backend.utils.llm_telemetry import CallRecord
 
-def call_deepseek_api(prompt: str, model: str = "deepseek-chat", temperature: float = 0.7, max_tokens: int = 4096):
-    """
-    调用 Deepseek 聊天接口，返回完整 JSON 响应。
-    """
-    url = settings.DEEPSEEK_ENDPOINT  # 例如 "https://api.deepseek.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": model,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": temperature,
-        "max_tokens": max_tokens
-    }
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
 
-    # 打印调试信息（可根据需要注释）
-    print(">>> Deepseek 请求 URL：", url)
-    print(">>> Deepseek 请求头：", headers)
-    print(">>> Deepseek 请求体：", data)
 
-    resp = requests.post(url, headers=headers, json=data, timeout=100, allow_redirects=False)
-    print(">>> Deepseek 返回状态码：", resp.status_code)
-    print(">>> Deepseek 返回体：", resp.text)
+def _timeout() -> httpx.Timeout:
+    # 连接超时单独设置，provider 不可达时尽快失败并重试
+    return httpx.Timeout(settings.DEEPSEEK_TIMEOUT, connect=settings.DEEPSEEK_CONNECT_TIMEOUT)
 
-    if resp.status_code == 200:
-        return resp.json()
-    else:
-        raise Exception(f"API 请求失败，状态码: {resp.status_code}, 错误信息: {resp.text}")
 
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.DEEPSEEK_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.DEEPSEEK_MAX_KEEPALIVE,
+        keepalive_expiry=settings.DEEPSEEK_KEEPALIVE_EXPIRY,
+    )
 
-def call_deepseek_api_chat(messages, model: str = "deepseek-chat", temperature: float = 0.7, max_tokens: int = 4096):
-    """调用 Deepseek 聊天接口（多轮对话）"""
-    url = settings.DEEPSEEK_ENDPOINT
-    headers = {
+
+def get_client() -> httpx.Client:
+    """Shared sync client; redirects are not followed (as before)."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(
+                timeout=_timeout(), limits=_limits(), follow_redirects=False
+            )
+        return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Shared async client, bound to the event loop that first uses it."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=_timeout(), limits=_limits(), follow_redirects=False
+        )
+    return _async_client
+
+
+def close() -> None:
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+async def aclose() -> None:
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.aclose()
+
+
+def _headers() -> dict:
+    return {
         "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
     }
+
+
+def _payload(messages, model: str, temperature: float, max_tokens: int, stream: bool = False) -> dict:
     data = {
         "model": model,
         "messages": messages,
         "temperature": temperature,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
     }
-    print(">>> Deepseek 请求 URL：", url)
-    print(">>> Deepseek 请求头：", headers)
-    print(">>> Deepseek 请求体：", data)
-    resp = requests.post(url, headers=headers, json=data, timeout=100, allow_redirects=False)
-    print(">>> Deepseek 返回状态码：", resp.status_code)
-    print(">>> Deepseek 返回体：", resp.text)
+    if stream:
+        data["stream"] = True
+        # 流的最后一个 chunk 附带 usage
+        data["stream_options"] = {"include_usage": True}
+    return data
+
+
+def _api_error(resp: httpx.Response, text: str) -> DeepseekAPIError:
+    # 只记录状态码和截断的响应体，不输出请求头（含 API key）
+    logging.error("Deepseek API returned %s: %s", resp.status_code, text[:500])
+    retry_after = llm_resilience.parse_retry_after(resp.headers.get("Retry-After"))
+    return DeepseekAPIError(resp.status_code, text[:500], retry_after)
+
+
+def _result(resp: httpx.Response) -> dict:
     if resp.status_code == 200:
         return resp.json()
-    else:
-        raise Exception(f"API 请求失败，状态码: {resp.status_code}, 错误信息: {resp.text}")
+    raise _api_error(resp, resp.text)
 
 
-def call_deepseek_api_chat_stream(
+def _cached(key: str, cache: bool, fresh: bool) -> Optional[dict]:
+    if not cache or fresh or settings.LLM_CACHE_TTL <= 0:
+        return None
+    return llm_cache.get(key)
+
+
+def _store(key: str, cache: bool, result: dict) -> dict:
+    if cache and settings.LLM_CACHE_TTL > 0:
+        llm_cache.put(key, result)
+    return result
+
+
+def _parse_line(line: str, on_usage: Callable[[dict], None]) -> Optional[str]:
+    """Content delta of one SSE line; None marks the end of the stream."""
+    if not line.startswith("data: "):
+        return ""
+    payload = line[6:]
+    if payload.strip() == "[DONE]":
+        return None
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return ""
+    if data.get("usage"):
+        on_usage(data["usage"])
+    try:
+        return data["choices"][0]["delta"].get("content", "") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def _iter_deltas(lines: Iterable[str], on_usage: Callable[[dict], None]) -> Iterator[str]:
+    for line in lines:
+        delta = _parse_line(line, on_usage)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+
+async def _aiter_deltas(lines: AsyncIterator[str], on_usage: Callable[[dict], None]) -> AsyncIterator[str]:
+    async for line in lines:
+        delta = _parse_line(line, on_usage)
+        if delta is None:
+            break
+        if delta:
+            yield delta
+
+
+class _Upstream:
+    """
+    Deltas of an open streaming response. The connection and the scheduler
+    slot are returned once it is read to the end or closed, even unread.
+    """
+
+    def __init__(self, resp: httpx.Response, slot, deltas: Iterator[str]):
+        self._resp = resp
+        self._slot = slot
+        self._deltas = deltas
+        self._closed = False
+
+    def __iter__(self) -> "_Upstream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._deltas)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._deltas.close()
+            self._resp.close()
+        finally:
+            llm_scheduler.release(self._slot)
+
+    def __del__(self):
+        self.close()
+
+
+class _AsyncUpstream:
+    """Async ``_Upstream``."""
+
+    def __init__(self, resp: httpx.Response, slot, deltas: AsyncIterator[str]):
+        self._resp = resp
+        self._slot = slot
+        self._deltas = deltas
+        self._closed = False
+
+    def __aiter__(self) -> "_AsyncUpstream":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._deltas.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._deltas.aclose()
+            await self._resp.aclose()
+        finally:
+            llm_scheduler.release(self._slot)
+
+
+class _TrackedStream:
+    """
+    Record TTFT and outcome of a stream as the caller consumes it; closing
+    this iterator early (even before the first token) closes the upstream
+    stream too.
+    """
+
+    def __init__(self, rec: CallRecord, tokens: Iterator[str]):
+        self._rec = rec
+        self._tokens = tokens
+        self._closed = False
+
+    def __iter__(self) -> "_TrackedStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            tok = next(self._tokens)
+        except StopIteration:
+            self._close("ok")
+            raise
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self._rec.fail(e)
+            self._close("abandoned")
+            raise
+        self._rec.token()
+        return tok
+
+    def close(self) -> None:
+        self._close("abandoned")
+
+    def _close(self, outcome: str) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._rec.finish(outcome)
+        close = getattr(self._tokens, "close", None)
+        if close is not None:
+            close()
+
+
+class _AsyncTrackedStream:
+    """Async ``_TrackedStream``."""
+
+    def __init__(self, rec: CallRecord, tokens: AsyncIterator[str]):
+        self._rec = rec
+        self._tokens = tokens
+        self._closed = False
+
+    def __aiter__(self) -> "_AsyncTrackedStream":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            tok = await self._tokens.__anext__()
+        except StopAsyncIteration:
+            await self._close("ok")
+            raise
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self._rec.fail(e)
+            await self._close("abandoned")
+            raise
+        self._rec.token()
+        return tok
+
+    async def aclose(self) -> None:
+        await self._close("abandoned")
+
+    async def _close(self, outcome: str) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._rec.finish(outcome)
+        aclose = getattr(self._tokens, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def call_deepseek_api_chat(
     messages,
     model: str = "deepseek-chat",
     temperature: float = 0.7,
     max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    cache: bool = False,
+    fresh: bool = False,
+    hedge: bool = False,
+    call_site: str = "other",
 ):
+    """调用 Deepseek 聊天接口（多轮对话）"""
+    rec = llm_telemetry.start(call_site, model)
+    key = llm_cache.make_key(messages, model, temperature, max_tokens)
+    cached = _cached(key, cache, fresh)
+    if cached is not None:
+        rec.finish(source="cache")
+        return cached
+
+    def attempt() -> dict:
+        rec.attempt()
+        data = _payload(messages, model, temperature, max_tokens)
+        with llm_scheduler.slot(priority, user_id):
+            start = perf_counter()
+            resp = get_client().post(settings.DEEPSEEK_ENDPOINT, headers=_headers(), json=data)
+        result = _result(resp)
+        llm_resilience.record_latency(perf_counter() - start)
+        return result
+
+    def request() -> dict:
+        return _store(key, cache, llm_resilience.call(attempt, hedge=hedge))
+
+    try:
+        result = single_flight.do(key, request)
+    except Exception as e:
+        rec.fail(e)
+        raise
+    rec.set_usage(result.get("usage"))
+    rec.finish()
+    return result
+
+
+def call_deepseek_api(
+    prompt: str,
+    model: str = "deepseek-chat",
+    temperature: float = 0.7,
+    max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    cache: bool = False,
+    fresh: bool = False,
+    hedge: bool = False,
+    call_site: str = "other",
+):
+    """
+    调用 Deepseek 聊天接口，返回完整 JSON 响应。
+    """
+    messages = [{"role": "user", "content": prompt}]
+    return call_deepseek_api_chat(
+        messages, model, temperature, max_tokens,
+        priority=priority, user_id=user_id, cache=cache, fresh=fresh, hedge=hedge,
+        call_site=call_site,
+    )
+
+
+def call_deepseek_api_chat_stream(
+    messages,
+    model: str = "deepseek-chat",
+    temperature: float = 0.7,
+    max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    call_site: str = "other",
+) -> Iterator[str]:
     """调用 Deepseek 聊天接口，流式返回 token"""
+    rec = llm_telemetry.start(call_site, model, stream=True)
+    key = "stream:" + llm_cache.make_key(messages, model, temperature, max_tokens)
+    try:
+        tokens = single_flight.stream(
+            key, lambda: _open_stream(messages, model, temperature, max_tokens, priority, user_id, rec)
+        )
+    except Exception as e:
+        rec.fail(e)
+        raise
+    return _TrackedStream(rec, tokens)
+
+
+def _open_stream(messages, model, temperature, max_tokens, priority, user_id, rec: CallRecord) -> Iterator[str]:
+    # 只重试建立连接阶段；开始输出 token 后的错误直接抛给调用方
+    return llm_resilience.call(
+        lambda: _open_stream_once(messages, model, temperature, max_tokens, priority, user_id, rec)
+    )
+
+
+def _open_stream_once(messages, model, temperature, max_tokens, priority, user_id, rec: CallRecord) -> Iterator[str]:
+    rec.attempt()
+    data = _payload(messages, model, temperature, max_tokens, stream=True)
+
+    token = llm_scheduler.acquire(priority, user_id)
+    try:
+        client = get_client()
+        request = client.build_request("POST", settings.DEEPSEEK_ENDPOINT, headers=_headers(), json=data)
+        resp = client.send(request, stream=True)
+        if resp.status_code != 200:
+            try:
+                text = resp.read().decode("utf-8", errors="ignore")
+            finally:
+                resp.close()
+            raise _api_error(resp, text)
+    except BaseException:
+        llm_scheduler.release(token)
+        raise
+
+    # 连接与并发名额在流读完或被关闭时归还
+    return _Upstream(resp, token, _iter_deltas(resp.iter_lines(), rec.set_usage))
+
+
+async def acall_deepseek_api_chat(
+    messages,
+    model: str = "deepseek-chat",
+    temperature: float = 0.7,
+    max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    cache: bool = False,
+    fresh: bool = False,
+    hedge: bool = False,
+    call_site: str = "other",
+):
+    """``call_deepseek_api_chat`` 的异步版本"""
+    rec = llm_telemetry.start(call_site, model)
+    key = llm_cache.make_key(messages, model, temperature, max_tokens)
+    cached = _cached(key, cache, fresh)
+    if cached is not None:
+        rec.finish(source="cache")
+        return cached
+
+    async def attempt() -> dict:
+        rec.attempt()
+        data = _payload(messages, model, temperature, max_tokens)
+        async with llm_scheduler.aslot(priority, user_id):
+            start = perf_counter()
+            resp = await get_async_client().post(settings.DEEPSEEK_ENDPOINT, headers=_headers(), json=data)
+        result = _result(resp)
+        llm_resilience.record_latency(perf_counter() - start)
+        return result
+
+    async def request() -> dict:
+        return _store(key, cache, await llm_resilience.acall(attempt, hedge=hedge))
+
+    try:
+        result = await single_flight.ado(key, request)
+    except Exception as e:
+        rec.fail(e)
+        raise
+    rec.set_usage(result.get("usage"))
+    rec.finish()
+    return result
 
-    url = settings.DEEPSEEK_ENDPOINT
-    headers = {
-        "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "stream": True,
-    }
-    print(">>> Deepseek 请求 URL：", url)
-    print(">>> Deepseek 请求头：", headers)
-    print(">>> Deepseek 请求体：", data)
 
-    resp = requests.post(
-        url, headers=headers, json=data, timeout=100, stream=True, allow_redirects=False
+async def acall_deepseek_api(
+    prompt: str,
+    model: str = "deepseek-chat",
+    temperature: float = 0.7,
+    max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    cache: bool = False,
+    fresh: bool = False,
+    hedge: bool = False,
+    call_site: str = "other",
+):
+    """``call_deepseek_api`` 的异步版本"""
+    messages = [{"role": "user", "content": prompt}]
+    return await acall_deepseek_api_chat(
+        messages, model, temperature, max_tokens,
+        priority=priority, user_id=user_id, cache=cache, fresh=fresh, hedge=hedge,
+        call_site=call_site,
     )
-    print(">>> Deepseek 返回状态码：", resp.status_code)
-    if resp.status_code != 200:
-        text = resp.text
-        print(">>> Deepseek 返回体：", text)
-        raise Exception(
-            f"API 请求失败，状态码: {resp.status_code}, 错误信息: {text}"
+
+
+async def acall_deepseek_api_chat_stream(
+    messages,
+    model: str = "deepseek-chat",
+    temperature: float = 0.7,
+    max_tokens: int = 4096,
+    *,
+    priority: str = PREVIEW,
+    user_id: Optional[int] = None,
+    call_site: str = "other",
+) -> AsyncIterator[str]:
+    """
+    ``call_deepseek_api_chat_stream`` 的异步版本：await 后得到逐 token 的
+    异步迭代器，状态码错误在 await 时即抛出。
+    """
+    rec = llm_telemetry.start(call_site, model, stream=True)
+    key = "stream:" + llm_cache.make_key(messages, model, temperature, max_tokens)
+    try:
+        tokens = await single_flight.astream(
+            key, lambda: _aopen_stream(messages, model, temperature, max_tokens, priority, user_id, rec)
         )
+    except Exception as e:
+        rec.fail(e)
+        raise
+    return _AsyncTrackedStream(rec, tokens)
+
+
+async def _aopen_stream(messages, model, temperature, max_tokens, priority, user_id, rec: CallRecord) -> AsyncIterator[str]:
+    return await llm_resilience.acall(
+        lambda: _aopen_stream_once(messages, model, temperature, max_tokens, priority, user_id, rec)
+    )
+
+
+async def _aopen_stream_once(messages, model, temperature, max_tokens, priority, user_id, rec: CallRecord) -> AsyncIterator[str]:
+    rec.attempt()
+    data = _payload(messages, model, temperature, max_tokens, stream=True)
+
+    token = await llm_scheduler.aacquire(priority, user_id)
+    try:
+        client = get_async_client()
+        request = client.build_request("POST", settings.DEEPSEEK_ENDPOINT, headers=_headers(), json=data)
+        resp = await client.send(request, stream=True)
+        if resp.status_code != 200:
+            try:
+                text = (await resp.aread()).decode("utf-8", errors="ignore")
+            finally:
+                await resp.aclose()
+            raise _api_error(resp, text)
+    except BaseException:
+        llm_scheduler.release(token)
+        raise
 
-    def gen():
-        for line in resp.iter_lines():
-            if not line:
-                continue
-            decoded = line.decode("utf-8")
-            if decoded.startswith("data: "):
-                payload = decoded[6:]
-                if payload.strip() == "[DONE]":
-                    break
-                try:
-                    data = json.loads(payload)
-                    delta = data["choices"][0]["delta"].get("content", "")
-                except Exception:
-                    delta = ""
-                if delta:
-                    yield delta
-
-    return gen()
+    return _AsyncUpstream(resp, token, _aiter_deltas(resp.aiter_lines(), rec.set_usage))
@@ -0,0 +1,121 @@
+# backend/utils/extract_pool.py
+
+"""
+在独立进程池中提取文档文本。
+
+textract 解析异常文件时可能长时间占用 CPU 或内存，放到 ProcessPoolExecutor
+中执行：每个文件有超时（EXTRACT_TIMEOUT），子进程有地址空间上限
+（EXTRACT_MEMORY_MB，仅 Unix）。超时后终止整个进程池并重建，
+EXTRACT_POOL_SIZE 为 0 时退回在当前进程中提取。
+
+子进程用 spawn 启动：fork 出的子进程会继承父进程已加载的 torch、向量模型等，
+地址空间早已超过 EXTRACT_MEMORY_MB，设上限后任何分配都会 MemoryError。
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from backend.config import settings
+from backend.utils import text_extract
+from backend.utils.text_extract import ExtractionError, extract_text_strict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _limit_memory(memory_mb: int) -> None:
+    """Pool initializer: cap the address space of the worker process."""
+    if resource is None or memory_mb <= 0:
+        return
+    limit = memory_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logging.error("Failed to limit extraction memory: %s", e)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.EXTRACT_POOL_SIZE,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_memory,
+                initargs=(settings.EXTRACT_MEMORY_MB,),
+            )
+        return _pool
+
+
+def _discard(pool: ProcessPoolExecutor) -> None:
+    """Kill the workers of ``pool`` (e.g. one stuck on a file) and forget it."""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    # 卡住的子进程不会响应 shutdown，只能直接终止
+    procs = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in procs:
+        proc.terminate()
+
+
+def shutdown() -> None:
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn, path: str, *args, timeout: Optional[float] = None):
+    timeout = settings.EXTRACT_TIMEOUT if timeout is None else timeout
+    # 其它文件超时导致进程池被终止时，本文件会收到 BrokenProcessPool，重试一次
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            future = pool.submit(fn, path, *args)
+        except (BrokenProcessPool, RuntimeError):
+            _discard(pool)
+            continue
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            _discard(pool)
+            raise ExtractionError(f"Text extraction timed out after {timeout}s: {path}")
+        except BrokenProcessPool:
+            _discard(pool)
+            if attempt:
+                raise ExtractionError(
+                    f"Extraction worker died (memory limit {settings.EXTRACT_MEMORY_MB}MB?): {path}"
+                )
+    raise ExtractionError(f"Extraction pool unavailable: {path}")
+
+
+def extract(path: str, timeout: Optional[float] = None) -> str:
+    """
+    Extract text from ``path`` in the process pool.
+
+    Raises ``ExtractionError`` when extraction fails, times out or the worker
+    dies (e.g. by hitting the memory cap).
+    """
+    if settings.EXTRACT_POOL_SIZE <= 0:
+        return extract_text_strict(path)
+    return _run(extract_text_strict, path, timeout=timeout)
+
+
+def extract_to_file(path: str, out_path: str, timeout: Optional[float] = None) -> int:
+    """Like ``extract`` but streams the text into ``out_path``; returns its length."""
+    if settings.EXTRACT_POOL_SIZE <= 0:
+        return text_extract.extract_to_file(path, out_path)
+    return _run(text_extract.extract_to_file, path, out_path, timeout=timeout)
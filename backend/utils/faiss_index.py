@@ -0,0 +1,243 @@
+# backend/utils/faiss_index.py
+
+"""
+基于 FAISS 的文档向量索引。
+
+与 vector_cache 使用相同的 scope 划分：每个教师的私有文档一个索引，
+所有公共文档共用一个索引。索引 id 即 document_vector.id。
+向量数较少时使用精确的 IndexFlatIP，超过 FAISS_ANN_THRESHOLD 后重建为
+HNSW 或 IVF 近似索引。索引持久化在 DOC_STORAGE_DIR/faiss/ 下，启动时加载；
+其它进程写入的新索引文件会在检索时按修改时间自动重新加载。
+没有向量的 scope 也会缓存（索引为 None），直到写入向量或 ``invalidate_scope``。
+"""
+
+import logging
+import math
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from backend.config import settings
+from backend.utils import vector_cache, vector_codec
+from backend.utils.vector_cache import PUBLIC_SCOPE, ScopeKey
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+_lock = threading.RLock()
+# scope -> (index, 加载时的文件 mtime)；没有向量的 scope 为 (None, None)
+_indexes: Dict[ScopeKey, Tuple[Optional["faiss.Index"], Optional[float]]] = {}
+
+
+def available() -> bool:
+    return faiss is not None
+
+
+def _index_dir() -> Path:
+    return Path(settings.DOC_STORAGE_DIR) / "faiss"
+
+
+def _index_path(scope: ScopeKey) -> Path:
+    return _index_dir() / f"{scope}.index"
+
+
+def _new_index(dim: int, size: int) -> "faiss.Index":
+    """Flat index for small scopes, HNSW/IVF once ``size`` passes the threshold."""
+    if size <= settings.FAISS_ANN_THRESHOLD:
+        base = faiss.IndexFlatIP(dim)
+    elif settings.FAISS_ANN_TYPE == "ivf":
+        nlist = max(1, int(4 * math.sqrt(size)))
+        base = faiss.IndexIVFFlat(
+            faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT
+        )
+        base.nprobe = settings.FAISS_IVF_NPROBE
+    else:
+        base = faiss.IndexHNSWFlat(dim, settings.FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+    return faiss.IndexIDMap2(base)
+
+
+def _is_flat(index: "faiss.Index") -> bool:
+    return isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+
+
+def _persist(scope: ScopeKey, index: "faiss.Index") -> float:
+    path = _index_path(scope)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 临时文件名唯一，多个进程同时写同一 scope 时不会互相覆盖
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        faiss.write_index(index, str(tmp))
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path.stat().st_mtime
+
+
+def _build(session, scope: ScopeKey) -> Optional["faiss.Index"]:
+    rows = session.exec(
+        text(
+            "SELECT v.id, v.vector_blob, v.vector_dtype, v.vector_scale "
+            "FROM document_vector v "
+            "JOIN document d ON v.doc_id=d.id "
+            f"WHERE {vector_cache.scope_filter(scope)} AND v.vector_blob IS NOT NULL"
+        )
+    ).all()
+    if not rows:
+        return None
+    mat = vector_cache.normalize(vector_codec.decode_rows(rows))
+    dim = mat.shape[1]
+    ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=len(rows))
+
+    index = _new_index(dim, len(rows))
+    if not index.is_trained:
+        index.train(mat)
+    index.add_with_ids(mat, ids)
+    return index
+
+
+def rebuild(session, scope: ScopeKey) -> None:
+    """Rebuild the index of ``scope`` from the database and persist it."""
+    with _lock:
+        index = _build(session, scope)
+        if index is None:
+            _drop(scope)
+            return
+        _indexes[scope] = (index, _persist(scope, index))
+
+
+def _drop(scope: ScopeKey) -> None:
+    _indexes[scope] = (None, None)
+    _index_path(scope).unlink(missing_ok=True)
+
+
+def invalidate_scope(scope: ScopeKey) -> None:
+    """Forget the in-memory index of ``scope``; the next search reloads or rebuilds it."""
+    with _lock:
+        _indexes.pop(scope, None)
+
+
+def _get(session, scope: ScopeKey) -> Optional["faiss.Index"]:
+    with _lock:
+        path = _index_path(scope)
+        mtime = path.stat().st_mtime if path.exists() else None
+        cached = _indexes.get(scope)
+        if cached is not None and (mtime is None or cached[1] == mtime):
+            return cached[0]
+        if mtime is not None:
+            index = faiss.read_index(str(path))
+            _indexes[scope] = (index, mtime)
+            return index
+        index = _build(session, scope)
+        # 空 scope 同样缓存，避免每次检索都查询数据库
+        _indexes[scope] = (index, None if index is None else _persist(scope, index))
+        return index
+
+
+def load_all() -> None:
+    """Load every persisted index into memory (called at startup)."""
+    if not available() or not _index_dir().exists():
+        return
+    with _lock:
+        for path in _index_dir().glob("*.index"):
+            scope: ScopeKey = path.stem
+            if scope != PUBLIC_SCOPE:
+                scope = int(scope)
+            try:
+                _indexes[scope] = (faiss.read_index(str(path)), path.stat().st_mtime)
+            except Exception as e:
+                logging.error("Loading FAISS index %s failed: %s", path, e)
+
+
+def add_vectors(session, scope: ScopeKey, ids: Sequence[int], vecs: np.ndarray) -> None:
+    """Incrementally add freshly indexed chunk vectors to ``scope``."""
+    if not available() or not len(ids):
+        return
+    with _lock:
+        if _indexes.get(scope, (None,))[0] is None and not _index_path(scope).exists():
+            # 首次建立索引：直接从数据库构建，已包含刚写入的向量
+            rebuild(session, scope)
+            return
+        index = _get(session, scope)
+        if _is_flat(index) and index.ntotal + len(ids) > settings.FAISS_ANN_THRESHOLD:
+            rebuild(session, scope)
+            return
+        index.add_with_ids(
+            vector_cache.normalize(np.asarray(vecs, dtype=np.float32)),
+            np.asarray(ids, dtype=np.int64),
+        )
+        _indexes[scope] = (index, _persist(scope, index))
+
+
+def remove_vectors(session, scope: ScopeKey, ids: Sequence[int]) -> None:
+    """Remove deleted chunk vectors from ``scope``."""
+    if not available() or not len(ids):
+        return
+    with _lock:
+        index = _get(session, scope)
+        if index is None:
+            return
+        try:
+            index.remove_ids(np.asarray(ids, dtype=np.int64))
+        except RuntimeError:
+            # HNSW 不支持删除，直接按数据库重建
+            rebuild(session, scope)
+            return
+        _indexes[scope] = (index, _persist(scope, index))
+
+
+def search(
+    session,
+    q_vec: np.ndarray,
+    teacher_ids: Sequence[int],
+    top_k: int = 5,
+    include_inactive: bool = False,
+) -> List[Tuple[int, int, float]]:
+    """Same contract as :func:`vector_cache.search`, served from FAISS indexes."""
+    allowed = vector_cache.allowed_documents(session, teacher_ids, include_inactive)
+    if not allowed or top_k <= 0:
+        return []
+    q = vector_cache.normalize(np.asarray(q_vec, dtype=np.float32).reshape(1, -1))
+
+    hits: List[Tuple[int, int, float]] = []
+    for scope in [*dict.fromkeys(teacher_ids), PUBLIC_SCOPE]:
+        index = _get(session, scope)
+        if index is None or index.ntotal == 0:
+            continue
+        # 未激活文档的向量也在索引中，先多取再过滤；不够时扩大范围
+        k = min(index.ntotal, top_k * 4)
+        while True:
+            scores, ids = index.search(q, k)
+            found = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+            meta = _vector_meta(session, [i for i, _ in found])
+            scoped = [
+                (meta[i][0], meta[i][1], s)
+                for i, s in found
+                if i in meta and meta[i][0] in allowed
+            ]
+            if len(scoped) >= top_k or k >= index.ntotal:
+                break
+            k = min(index.ntotal, k * 4)
+        hits.extend(scoped)
+
+    hits.sort(key=lambda h: h[2], reverse=True)
+    return hits[:top_k]
+
+
+def _vector_meta(session, ids: Sequence[int]) -> Dict[int, Tuple[int, int]]:
+    if not ids:
+        return {}
+    id_clause = ",".join(str(int(i)) for i in ids)
+    rows = session.exec(
+        text(
+            "SELECT id, doc_id, chunk_index FROM document_vector "
+            f"WHERE id IN ({id_clause})"
+        )
+    ).all()
+    return {r.id: (r.doc_id, r.chunk_index) for r in rows}
@@ -0,0 +1,240 @@
+# backend/utils/grading.py
+
+"""
+客观题本地批改。
+
+单选、多选、填空题的标准答案已保存在 ``Exercise.answers`` 中，直接比对即可，
+无需调用大模型：
+ - 选择题：学生提交的选项索引先由 ``convert_indexed_answers`` 转成字母，再与
+   标准答案的字母（集合）比较；
+ - 填空题：先做规范化（全角转半角、去除首尾及多余空白、忽略大小写），数值答案
+   按 GRADING_NUMERIC_TOLERANCE 的相对 / 绝对误差比较。多个空的答案需逐空匹配。
+
+带测试用例（``test_cases``）的编程题在沙箱中运行学生代码，按通过的用例比例
+给分（见 ``code_runner``）。
+
+简答题、没有测试用例的编程题以及缺少标准答案的题目由调用方交给大模型批改。
+"""
+
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.config import settings
+from backend.utils import code_runner
+
+CHOICE_TYPES = ("single_choice", "multiple_choice")
+OBJECTIVE_TYPES = CHOICE_TYPES + ("fill_in_blank",)
+
+# 多个空的答案写在一个字符串里时使用的分隔符
+_BLANK_SEPARATORS = re.compile(r"[;；,，、|]")
+_NUMBER = re.compile(r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?")
+
+
+def convert_indexed_answers(prompt_blocks, indexed_answers: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    只对 single_choice / multiple_choice 题型做索引->字母转换，
+    其他题型保持原值。
+    """
+    # 构造 qid -> (qtype, options) 映射
+    meta = {}
+    for block in prompt_blocks:
+        qtype = block.get("type")
+        for item in block.get("items", []):
+            qid = str(item.get("id"))
+            meta[qid] = {
+                "type": qtype,
+                "options": item.get("options", []),
+            }
+
+    letter_answers = {}
+    for qid, ans in indexed_answers.items():
+        info = meta.get(qid)
+        # 如果不是选择题或未找到元数据，保持原值
+        if not info or info["type"] not in CHOICE_TYPES:
+            letter_answers[qid] = ans
+            continue
+
+        opts = info["options"]
+        if isinstance(ans, list):
+            # 多选题：索引列表 -> 字母列表
+            letter_answers[qid] = [
+                opts[i].split(".", 1)[0] for i in ans if isinstance(i, int) and 0 <= i < len(opts)
+            ]
+        else:
+            # 单选题：单个索引 -> 字母
+            letter_answers[qid] = (
+                opts[ans].split(".", 1)[0]
+                if isinstance(ans, int) and 0 <= ans < len(opts)
+                else ans
+            )
+    return letter_answers
+
+
+def _letters(value: Any) -> frozenset:
+    """Option letters in ``value``: "B", "B. xxx", ["A", "C"] or "A,C"."""
+    if value is None:
+        return frozenset()
+    if isinstance(value, (list, tuple, set)):
+        return frozenset(l for v in value for l in _letters(v))
+    text = normalize_text(str(value)).upper()
+    if re.fullmatch(r"[A-Z]([.．、:：)）].*)?", text, re.S):
+        return frozenset(text[0])
+    return frozenset(re.findall(r"[A-Z]", text))
+
+
+def normalize_text(value: Any) -> str:
+    """全角转半角、合并空白、忽略大小写。"""
+    text = unicodedata.normalize("NFKC", str(value))
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def _number(text: str) -> Optional[float]:
+    text = text.replace(" ", "")
+    if "/" in text:
+        num, _, den = text.partition("/")
+        if _NUMBER.fullmatch(num) and _NUMBER.fullmatch(den) and float(den) != 0:
+            return float(num) / float(den)
+        return None
+    if text.endswith("%") and _NUMBER.fullmatch(text[:-1]):
+        return float(text[:-1]) / 100
+    if _NUMBER.fullmatch(text.replace(",", "")):
+        return float(text.replace(",", ""))
+    return None
+
+
+def blank_matches(expected: Any, given: Any) -> bool:
+    """One blank: normalized text equality, or numeric equality within tolerance."""
+    if given is None:
+        return False
+    exp, got = normalize_text(expected), normalize_text(given)
+    if not got:
+        return False
+    if exp == got or exp.replace(" ", "") == got.replace(" ", ""):
+        return True
+    a, b = _number(exp), _number(got)
+    if a is None or b is None:
+        return False
+    tol = settings.GRADING_NUMERIC_TOLERANCE
+    return math.isclose(a, b, rel_tol=tol, abs_tol=tol)
+
+
+def _blanks(value: Any) -> List[Any]:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return _BLANK_SEPARATORS.split(str(value))
+
+
+def fill_blank_matches(expected: Any, given: Any) -> bool:
+    """Whole answer first; then blank by blank when the key has several blanks."""
+    if not isinstance(expected, (list, tuple)) and blank_matches(expected, given):
+        return True
+    exp, got = _blanks(expected), _blanks(given)
+    if len(exp) <= 1 or len(exp) != len(got):
+        return False
+    return all(blank_matches(e, g) for e, g in zip(exp, got))
+
+
+def is_correct(qtype: str, expected: Any, given: Any) -> bool:
+    """Whether ``given`` (letters for choice questions) matches the answer key."""
+    if qtype == "single_choice":
+        exp = _letters(expected)
+        return len(exp) == 1 and _letters(given) == exp
+    if qtype == "multiple_choice":
+        exp = _letters(expected)
+        return bool(exp) and _letters(given) == exp
+    if qtype == "fill_in_blank":
+        return fill_blank_matches(expected, given)
+    raise ValueError(f"{qtype} 不是客观题")
+
+
+_CASE_LABELS = {
+    code_runner.WRONG_ANSWER: "输出错误",
+    code_runner.RUNTIME_ERROR: "运行出错",
+    code_runner.TIMEOUT: "超时",
+    code_runner.OUTPUT_LIMIT: "输出超限",
+}
+
+
+def test_cases(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The usable test cases of a coding item (each needs an ``output``)."""
+    cases = item.get("test_cases") or []
+    if not isinstance(cases, list):
+        return []
+    return [c for c in cases if isinstance(c, dict) and c.get("output") is not None]
+
+
+def tested_coding_ids(prompt_blocks) -> List[str]:
+    """IDs of coding items graded by running their test cases."""
+    return [
+        str(item.get("id"))
+        for block in prompt_blocks
+        if block.get("type") == "coding"
+        for item in block.get("items", [])
+        if test_cases(item)
+    ]
+
+
+def grade_coding(code: Any, cases: List[Dict[str, Any]], full: float) -> Tuple[str, float, str]:
+    """按通过的测试用例比例给分，返回 ``(result, score, explanation)``。"""
+    if not isinstance(code, str) or not code.strip():
+        return "wrong", 0, "未作答"
+    run = code_runner.run_tests(code, cases)
+    passed, total = run["passed"], run["total"]
+    score = round(full * passed / total, 2) if total else 0
+    result = "correct" if passed == total else "partial" if passed else "wrong"
+    explanation = f"通过 {passed}/{total} 个测试用例"
+    for i, case in enumerate(run["cases"], 1):
+        if case["status"] != code_runner.PASSED:
+            explanation += f"；用例 {i} {_CASE_LABELS.get(case['status'], case['status'])}"
+            if case.get("error"):
+                # 只有异常类型名，见 code_runner._error_name
+                explanation += f"：{case['error']}"
+            break
+    return result, score, explanation
+
+
+def _display(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return "、".join(str(v) for v in value)
+    return str(value)
+
+
+def grade_objective(
+    prompt_blocks,
+    answer_key: Dict[str, Any],
+    letter_answers: Dict[str, Any],
+    point_map: Dict[str, Any],
+) -> Tuple[Dict[str, str], Dict[str, float], Dict[str, str], List[str]]:
+    """
+    批改所有能本地判定的题目。
+
+    返回 ``(results, scores, explanations, pending)``，前三项与大模型批改的
+    feedback 格式一致；``pending`` 为需要交给大模型的题目 ID（简答、没有测试
+    用例的编程题及没有标准答案的题目）。
+    """
+    results, scores, explanations = {}, {}, {}
+    pending: List[str] = []
+    for block in prompt_blocks:
+        qtype = block.get("type")
+        default_base = point_map.get(qtype, 1)
+        for item in block.get("items", []):
+            qid = str(item.get("id"))
+            cases = test_cases(item) if qtype == "coding" else []
+            if cases:
+                results[qid], scores[qid], explanations[qid] = grade_coding(
+                    letter_answers.get(qid), cases, point_map.get(qid, default_base)
+                )
+                continue
+            expected = answer_key.get(qid)
+            if qtype not in OBJECTIVE_TYPES or expected in (None, "", []):
+                pending.append(qid)
+                continue
+            ok = is_correct(qtype, expected, letter_answers.get(qid))
+            results[qid] = "correct" if ok else "wrong"
+            scores[qid] = point_map.get(qid, default_base) if ok else 0
+            explanations[qid] = f"{'回答正确' if ok else '回答错误'}，标准答案：{_display(expected)}"
+    return results, scores, explanations, pending
@@ -0,0 +1,348 @@
+# backend/utils/job_queue.py
+
+"""
+基于数据库的后台任务队列，替代进程内的 BackgroundTasks。
+
+任务写入 ``job`` 表后由 worker 认领执行，进程重启不会丢失：
+ - 认领：按 priority（小的先）、run_after 顺序挑选可执行的任务，用带条件的
+   UPDATE 抢占（SQLite / MySQL 通用），成功者获得 JOB_LEASE_SECONDS 的租约，
+   执行期间定期续约；worker 异常退出后租约过期，任务可被其它 worker 重新认领；
+ - 重试：处理函数抛异常时按指数退避加抖动重新排队，超过 max_attempts 标记为
+   failed 并调用注册时提供的 ``on_failure``；
+ - 并发：每个 worker 最多 JOB_WORKERS 个线程，各类任务另受 JOB_CONCURRENCY 限制。
+
+worker 可以随 API 进程启动（JOB_WORKER_IN_PROCESS），也可以单独运行
+``python -m backend.scripts.job_worker``。处理函数通过 ``register`` 注册，
+以 ``payload`` 作为关键字参数调用。
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, update
+from sqlmodel import Session, select
+
+from backend.config import engine, settings
+from backend.models import Job
+
+GRADE_SUBMISSION = "grade_submission"
+GRADE_HOMEWORK_BATCH = "grade_homework_batch"
+RENDER_COURSEWARE_PDF = "render_courseware_pdf"
+ANALYZE_STUDENT = "analyze_student"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 各类任务的默认优先级，数字越小越先执行
+_DEFAULT_PRIORITY = {
+    GRADE_SUBMISSION: 10,
+    GRADE_HOMEWORK_BATCH: 10,
+    RENDER_COURSEWARE_PDF: 20,
+    ANALYZE_STUDENT: 30,
+}
+
+_handlers: Dict[str, "_Handler"] = {}
+_current = threading.local()
+_worker: Optional["Worker"] = None
+_worker_lock = threading.Lock()
+
+
+class _Handler:
+    def __init__(self, fn: Callable[..., Any], on_failure: Optional[Callable[..., Any]]):
+        self.fn = fn
+        self.on_failure = on_failure
+
+
+def register(kind: str, fn: Callable[..., Any], on_failure: Optional[Callable[..., Any]] = None) -> None:
+    """Run ``fn(**payload)`` for jobs of ``kind``; ``on_failure(**payload)`` once retries are exhausted."""
+    _handlers[kind] = _Handler(fn, on_failure)
+
+
+def enqueue(
+    kind: str,
+    payload: Optional[Dict[str, Any]] = None,
+    *,
+    priority: Optional[int] = None,
+    dedupe_key: Optional[str] = None,
+    max_attempts: Optional[int] = None,
+    delay: float = 0,
+) -> int:
+    """
+    Add a job and return its id. With ``dedupe_key``, an identical job that is
+    still queued is reused instead of adding another one.
+    """
+    with Session(engine) as sess:
+        if dedupe_key is not None:
+            existing = sess.exec(
+                select(Job.id).where(Job.dedupe_key == dedupe_key, Job.status == QUEUED)
+            ).first()
+            if existing is not None:
+                return existing
+        job = Job(
+            kind=kind,
+            payload=payload or {},
+            priority=_DEFAULT_PRIORITY.get(kind, 100) if priority is None else priority,
+            max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+            run_after=datetime.utcnow() + timedelta(seconds=delay),
+            dedupe_key=dedupe_key,
+        )
+        sess.add(job)
+        sess.commit()
+        job_id = job.id
+    # 同进程内的 worker 立即开始处理，不必等下一次轮询
+    if _worker is not None:
+        _worker.wakeup()
+    return job_id
+
+
+def current_job_id() -> Optional[int]:
+    """ID of the job whose handler (or ``on_failure``) runs on this thread."""
+    return getattr(_current, "job_id", None)
+
+
+def has_active(dedupe_key: str) -> bool:
+    """Whether a job with ``dedupe_key`` is queued or running."""
+    with Session(engine) as sess:
+        return (
+            sess.exec(
+                select(Job.id).where(Job.dedupe_key == dedupe_key, Job.status.in_((QUEUED, RUNNING)))
+            ).first()
+            is not None
+        )
+
+
+class _Claim:
+    """Snapshot of a claimed job, independent of the session that claimed it."""
+
+    __slots__ = ("id", "kind", "payload", "attempts", "max_attempts")
+
+    def __init__(self, job: Job):
+        self.id = job.id
+        self.kind = job.kind
+        self.payload = job.payload or {}
+        self.attempts = job.attempts
+        self.max_attempts = job.max_attempts
+
+
+def _backoff(attempts: int) -> float:
+    cap = settings.JOB_RETRY_MAX_DELAY
+    delay = min(cap, settings.JOB_RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+class Worker:
+    """Claims jobs from the table and runs them on a thread pool."""
+
+    def __init__(self, workers: Optional[int] = None, kinds: Optional[List[str]] = None):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.size = max(1, workers or settings.JOB_WORKERS)
+        self.kinds = kinds
+        self._pool = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._running: Dict[int, str] = {}  # job id -> kind
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_renew = datetime.utcnow()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="job-dispatch", daemon=True)
+        self._thread.start()
+
+    def wakeup(self) -> None:
+        self._wakeup.set()
+
+    def stop(self, wait: bool = True) -> None:
+        """Stop claiming; running jobs finish first when ``wait``, otherwise their leases expire."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    # ---- 认领 ----
+    def _capacity(self) -> Dict[str, int]:
+        kinds = self.kinds or list(_handlers)
+        with self._lock:
+            free = self.size - len(self._running)
+            busy: Dict[str, int] = {}
+            for kind in self._running.values():
+                busy[kind] = busy.get(kind, 0) + 1
+        if free <= 0:
+            return {}
+        capacity = {}
+        for kind in kinds:
+            if kind not in _handlers:
+                continue
+            limit = settings.JOB_CONCURRENCY.get(kind, self.size)
+            n = min(free, limit - busy.get(kind, 0))
+            if n > 0:
+                capacity[kind] = n
+        return capacity
+
+    def _claim(self) -> List[_Claim]:
+        capacity = self._capacity()
+        if not capacity:
+            return []
+        now = datetime.utcnow()
+        claimable = or_(
+            and_(Job.status == QUEUED, Job.run_after <= now),
+            and_(Job.status == RUNNING, Job.lease_until < now),
+        )
+        claimed: List[_Claim] = []
+        with Session(engine) as sess:
+            candidates = sess.exec(
+                select(Job)
+                .where(claimable, Job.kind.in_(list(capacity)))
+                .order_by(Job.priority, Job.run_after, Job.id)
+                .limit(sum(capacity.values()) * 2)
+            ).all()
+            for job in candidates:
+                if capacity.get(job.kind, 0) <= 0:
+                    continue
+                # 条件 UPDATE 保证同一任务只被一个 worker 认领
+                result = sess.execute(
+                    update(Job)
+                    .where(Job.id == job.id, claimable)
+                    .values(
+                        status=RUNNING,
+                        locked_by=self.id,
+                        lease_until=now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                        attempts=Job.attempts + 1,
+                        started_at=now,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                sess.commit()
+                if result.rowcount != 1:
+                    continue
+                sess.refresh(job)
+                capacity[job.kind] -= 1
+                claimed.append(_Claim(job))
+        return claimed
+
+    def _renew_leases(self) -> None:
+        now = datetime.utcnow()
+        if (now - self._last_renew).total_seconds() < settings.JOB_LEASE_SECONDS / 3:
+            return
+        self._last_renew = now
+        with self._lock:
+            ids = list(self._running)
+        if not ids:
+            return
+        with Session(engine) as sess:
+            sess.execute(
+                update(Job)
+                .where(Job.id.in_(ids), Job.locked_by == self.id, Job.status == RUNNING)
+                .values(lease_until=now + timedelta(seconds=settings.JOB_LEASE_SECONDS))
+                .execution_options(synchronize_session=False)
+            )
+            sess.commit()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._renew_leases()
+                for job in self._claim():
+                    with self._lock:
+                        self._running[job.id] = job.kind
+                    self._pool.submit(self._execute, job)
+            except Exception as e:
+                logging.error("Job worker %s: %s", self.id, e)
+            self._wakeup.wait(settings.JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    # ---- 执行 ----
+    def _finish(self, job: _Claim, **values) -> bool:
+        with Session(engine) as sess:
+            result = sess.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.locked_by == self.id, Job.status == RUNNING)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            sess.commit()
+            # 租约已被别的 worker 接手时不覆盖其状态
+            return result.rowcount == 1
+
+    def _execute(self, job: _Claim) -> None:
+        handler = _handlers[job.kind]
+        payload = job.payload
+        _current.job_id = job.id
+        try:
+            if job.attempts > job.max_attempts:
+                # 多次认领都没能执行完（如执行中进程崩溃），不再尝试
+                raise RuntimeError("任务多次中断，已放弃")
+            handler.fn(**payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:500]
+            logging.error("Job %s (%s) attempt %d failed: %s", job.id, job.kind, job.attempts, error)
+            if job.attempts < job.max_attempts:
+                self._finish(
+                    job,
+                    status=QUEUED,
+                    locked_by=None,
+                    lease_until=None,
+                    last_error=error,
+                    run_after=datetime.utcnow() + timedelta(seconds=_backoff(job.attempts)),
+                )
+            else:
+                failed = self._finish(
+                    job, status=FAILED, lease_until=None, last_error=error, finished_at=datetime.utcnow()
+                )
+                if failed and handler.on_failure is not None:
+                    try:
+                        handler.on_failure(**payload)
+                    except Exception as hook_error:
+                        logging.error("Job %s on_failure failed: %s", job.id, hook_error)
+        else:
+            self._finish(job, status=DONE, lease_until=None, finished_at=datetime.utcnow())
+        finally:
+            _current.job_id = None
+            with self._lock:
+                self._running.pop(job.id, None)
+            self._wakeup.set()
+
+
+def start_worker(workers: Optional[int] = None, kinds: Optional[List[str]] = None) -> Worker:
+    """Start the worker of this process (once)."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = Worker(workers, kinds)
+            _worker.start()
+        return _worker
+
+
+def stop_worker(wait: bool = False) -> None:
+    global _worker
+    with _worker_lock:
+        worker, _worker = _worker, None
+    if worker is not None:
+        worker.stop(wait)
+
+
+def stats() -> dict:
+    """Job counts by kind and status, plus the oldest runnable queued job."""
+    with Session(engine) as sess:
+        rows = sess.exec(select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status)).all()
+        oldest = sess.exec(
+            select(func.min(Job.run_after)).where(Job.status == QUEUED, Job.run_after <= datetime.utcnow())
+        ).one()
+    counts: Dict[str, Dict[str, int]] = {}
+    for kind, status, n in rows:
+        counts.setdefault(kind, {})[status] = n
+    return {
+        "jobs": counts,
+        "oldestQueuedSeconds": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        "worker": _worker.id if _worker is not None else None,
+    }
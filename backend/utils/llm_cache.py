@@ -0,0 +1,146 @@
+# backend/utils/llm_cache.py
+
+"""
+大模型响应缓存。
+
+键为 (model, messages, temperature, max_tokens) 的 sha256，值为 Deepseek 返回的
+完整 JSON。两级存储：
+ - 进程内 LRU，最多 LLM_CACHE_MAX_ENTRIES 条；
+ - 可选的 SQLite 文件（LLM_CACHE_SQLITE_PATH），多进程 / 重启后共享。
+两级都按 LLM_CACHE_TTL 过期。是否使用缓存由调用方决定（``cache=True``）。
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from backend.config import settings
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, json 文本)
+_db: Optional[sqlite3.Connection] = None
+_db_failed = False
+_counters = {"memoryHits": 0, "diskHits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+# 每写入多少次清理一次 SQLite 中的过期行
+_PURGE_EVERY = 256
+_puts = 0
+
+
+def make_key(messages, model: str, temperature: float, max_tokens: int) -> str:
+    raw = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _get_db() -> Optional[sqlite3.Connection]:
+    """SQLite tier, or None when disabled or unavailable (调用方持锁)."""
+    global _db, _db_failed
+    if _db is not None or _db_failed or not settings.LLM_CACHE_SQLITE_PATH:
+        return _db
+    try:
+        path = Path(settings.LLM_CACHE_SQLITE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(path), check_same_thread=False, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        db.commit()
+        _db = db
+    except (OSError, sqlite3.Error) as e:
+        logging.error("LLM cache: cannot open %s: %s", settings.LLM_CACHE_SQLITE_PATH, e)
+        _db_failed = True
+    return _db
+
+
+def _remember(key: str, expires_at: float, raw: str) -> None:
+    _memory[key] = (expires_at, raw)
+    _memory.move_to_end(key)
+    while len(_memory) > settings.LLM_CACHE_MAX_ENTRIES:
+        _memory.popitem(last=False)
+        _counters["evictions"] += 1
+
+
+def get(key: str) -> Optional[dict]:
+    """Cached response for ``key``, or None on a miss."""
+    now = time.time()
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _memory.move_to_end(key)
+                _counters["memoryHits"] += 1
+                return json.loads(entry[1])
+            del _memory[key]
+
+        db = _get_db()
+        if db is not None:
+            try:
+                row = db.execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key=?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.error("LLM cache read failed: %s", e)
+                row = None
+            if row is not None and row[1] > now:
+                _remember(key, row[1], row[0])
+                _counters["diskHits"] += 1
+                return json.loads(row[0])
+
+        _counters["misses"] += 1
+        return None
+
+
+def put(key: str, response: dict) -> None:
+    global _puts
+    raw = json.dumps(response, ensure_ascii=False)
+    expires_at = time.time() + settings.LLM_CACHE_TTL
+    with _lock:
+        _remember(key, expires_at, raw)
+        _counters["stores"] += 1
+        db = _get_db()
+        if db is None:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, raw, expires_at),
+            )
+            _puts += 1
+            if _puts % _PURGE_EVERY == 0:
+                db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            db.commit()
+        except sqlite3.Error as e:
+            logging.error("LLM cache write failed: %s", e)
+
+
+def clear() -> None:
+    with _lock:
+        _memory.clear()
+        db = _get_db()
+        if db is not None:
+            db.execute("DELETE FROM llm_cache")
+            db.commit()
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = _counters["memoryHits"] + _counters["diskHits"] + _counters["misses"]
+        hits = lookups - _counters["misses"]
+        return {
+            **_counters,
+            "entries": len(_memory),
+            "hitRate": hits / lookups if lookups else 0.0,
+            "sqlite": bool(settings.LLM_CACHE_SQLITE_PATH) and not _db_failed,
+        }
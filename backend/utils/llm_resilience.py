@@ -0,0 +1,308 @@
+# backend/utils/llm_resilience.py
+
+"""
+Deepseek 调用的容错层。
+
+ - 重试：429 / 5xx / 超时 / 连接错误按指数退避加随机抖动重试，最多
+   LLM_RETRY_ATTEMPTS 次；响应带 ``Retry-After`` 时至少等待该时长，超过
+   LLM_RETRY_MAX_DELAY 则不再重试。
+ - 熔断：连续 LLM_BREAKER_FAILURES 次上游失败后熔断 LLM_BREAKER_COOLDOWN 秒，
+   期间直接抛出 ``CircuitOpenError``；冷却后放行一个探测请求（half-open），
+   成功则恢复，失败则再次熔断。
+ - 对冲：``hedge=True`` 的调用在等待超过近期 p95 延迟后再发一份相同请求，
+   取先返回的结果，用于 ``suggest_questions`` 等对延迟敏感的调用。
+
+``stats`` 返回熔断状态、状态切换次数与重试 / 对冲计数。
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from backend.config import settings
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# 最近多少次成功调用的耗时用于估计 p95
+_LATENCY_SAMPLES = 200
+
+
+class DeepseekAPIError(Exception):
+    """Non-200 response from the DeepSeek API."""
+
+    def __init__(self, status_code: int, text: str, retry_after: Optional[float] = None):
+        super().__init__(f"API 请求失败，状态码: {status_code}, 错误信息: {text}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while the circuit breaker is open."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """``Retry-After`` in seconds; accepts delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _classify(e: BaseException):
+    """(is_provider_failure, retryable) for an exception from one attempt."""
+    if isinstance(e, DeepseekAPIError):
+        failed = e.status_code in RETRY_STATUSES
+        return failed, failed
+    if isinstance(e, (httpx.TimeoutException, httpx.TransportError)):
+        return True, True
+    # 排队超时等本地错误：不计入熔断，也不重试
+    return None, False
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.transitions = {}
+        self.rejected = 0
+
+    def _move(self, state: str) -> None:
+        if state == self.state:
+            return
+        key = f"{self.state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logging.warning("DeepSeek circuit breaker %s", key)
+        self.state = state
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    raise CircuitOpenError("AI 服务暂时不可用，请稍后重试")
+                self._move(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError("AI 服务暂时不可用，请稍后重试")
+                self._probing = True
+
+    def record(self, failed: Optional[bool]) -> None:
+        with self._lock:
+            probing, self._probing = self._probing, False
+            if failed is None:
+                return
+            if not failed:
+                self._failures = 0
+                self._move(CLOSED)
+                return
+            self._failures += 1
+            if probing or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._move(OPEN)
+
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+
+_breaker = CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_COOLDOWN)
+_lock = threading.Lock()
+_latencies = deque(maxlen=_LATENCY_SAMPLES)
+_counters = {"attempts": 0, "retries": 0, "failures": 0, "hedged": 0, "hedgeWins": 0}
+_hedge_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _counters[name] += 1
+
+
+def record_latency(seconds: float) -> None:
+    """Record the duration of a successful upstream request."""
+    with _lock:
+        _latencies.append(seconds)
+
+
+def _p95() -> Optional[float]:
+    with _lock:
+        if len(_latencies) < 20:
+            return None
+        ordered = sorted(_latencies)
+    return ordered[int(len(ordered) * 0.95) - 1]
+
+
+def hedge_delay() -> float:
+    """Wait this long before hedging; the default until enough samples exist."""
+    p95 = _p95()
+    if p95 is None:
+        return settings.LLM_HEDGE_DEFAULT_DELAY
+    return max(settings.LLM_HEDGE_MIN_DELAY, p95)
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> Optional[float]:
+    """Delay before retry ``attempt`` (0-based); None when not worth retrying."""
+    cap = settings.LLM_RETRY_MAX_DELAY
+    delay = random.uniform(0, min(cap, settings.LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        if retry_after > cap:
+            return None
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _on_failure(e: BaseException, attempt: int) -> Optional[float]:
+    """Record a failed attempt; return the retry delay or None to give up."""
+    failed, retryable = _classify(e)
+    _breaker.record(failed)
+    if failed:
+        _count("failures")
+    if not retryable or attempt >= settings.LLM_RETRY_ATTEMPTS:
+        return None
+    delay = _backoff(attempt, getattr(e, "retry_after", None))
+    if delay is not None:
+        _count("retries")
+    return delay
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    with _lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(
+                max_workers=settings.LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge"
+            )
+        return _hedge_pool
+
+
+def _hedged(fn: Callable[[], T]) -> T:
+    pool = _get_hedge_pool()
+    first = pool.submit(fn)
+    done, _ = wait([first], timeout=hedge_delay())
+    if done or not _breaker.is_closed():
+        return first.result()
+    _count("hedged")
+    # 先返回的请求若失败，再等另一个；落后的同步请求无法取消，结果直接丢弃
+    pending = {first, pool.submit(fn)}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                if f is not first:
+                    _count("hedgeWins")
+                return f.result()
+        if not pending:
+            return next(iter(done)).result()
+
+
+async def _ahedged(fn: Callable[[], Awaitable[T]]) -> T:
+    first = asyncio.ensure_future(fn())
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay())
+    if done or not _breaker.is_closed():
+        return await first
+    _count("hedged")
+    pending = {first, asyncio.ensure_future(fn())}
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not first:
+                        _count("hedgeWins")
+                    return f.result()
+            if not pending:
+                return next(iter(done)).result()
+    finally:
+        for f in pending:
+            f.cancel()
+
+
+def call(fn: Callable[[], T], hedge: bool = False) -> T:
+    """Run one upstream request ``fn`` with breaker, retries and optional hedging."""
+    attempt = 0
+    while True:
+        _breaker.before_call()
+        _count("attempts")
+        try:
+            result = _hedged(fn) if hedge else fn()
+        except Exception as e:
+            delay = _on_failure(e, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _breaker.record(False)
+        return result
+
+
+async def acall(fn: Callable[[], Awaitable[T]], hedge: bool = False) -> T:
+    """Async ``call``."""
+    attempt = 0
+    while True:
+        _breaker.before_call()
+        _count("attempts")
+        try:
+            result = await (_ahedged(fn) if hedge else fn())
+        except asyncio.CancelledError:
+            _breaker.record(None)
+            raise
+        except Exception as e:
+            delay = _on_failure(e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        _breaker.record(False)
+        return result
+
+
+def shutdown() -> None:
+    global _hedge_pool
+    with _lock:
+        pool, _hedge_pool = _hedge_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stats() -> dict:
+    p95 = _p95()
+    with _lock:
+        counters = dict(_counters)
+    with _breaker._lock:
+        breaker = {
+            "state": _breaker.state,
+            "transitions": dict(_breaker.transitions),
+            "rejected": _breaker.rejected,
+        }
+    return {
+        **counters,
+        "breaker": breaker,
+        "p95LatencyMs": p95 * 1000 if p95 is not None else None,
+        "hedgeDelayMs": hedge_delay() * 1000,
+    }
@@ -0,0 +1,256 @@
+# backend/utils/llm_scheduler.py
+
+"""
+大模型调用的准入控制。
+
+所有 Deepseek 请求先在这里排队拿到并发名额再发出：
+ - 全局并发上限 LLM_MAX_CONCURRENCY，单个用户并发上限 LLM_MAX_PER_USER；
+ - 优先级 interactive（学生对话）> preview（备课 / 出题预览）> grading（作业批改）
+   > analysis（学情分析），空出的名额总是先给优先级最高、最早排队的请求；
+ - LLM_RESERVED_SLOTS 个名额只留给 interactive / preview，批改高峰不会占满全部并发；
+ - 每个优先级有排队期限（LLM_QUEUE_TIMEOUT），超时抛出 ``LLMQueueTimeout``。
+
+同步调用用 ``slot``，async 调用用 ``aslot``，两者共用同一个队列。
+``stats`` 返回各优先级的队列深度、并发数与等待时间。
+"""
+
+import asyncio
+import bisect
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Optional
+
+from backend.config import settings
+
+INTERACTIVE = "interactive"
+PREVIEW = "preview"
+GRADING = "grading"
+ANALYSIS = "analysis"
+PRIORITIES = (INTERACTIVE, PREVIEW, GRADING, ANALYSIS)
+_RANK = {p: i for i, p in enumerate(PRIORITIES)}
+
+# 每个优先级保留最近多少次等待时间用于计算 p95
+_WAIT_SAMPLES = 1000
+
+
+class LLMQueueTimeout(RuntimeError):
+    """Raised when a call waits longer than its deadline for a concurrency slot."""
+
+
+class _Waiter:
+    __slots__ = ("key", "priority", "user_id", "enqueued", "granted", "wake")
+
+    def __init__(self, seq: int, priority: str, user_id: Optional[int], wake: Callable[[], None]):
+        self.key = (_RANK[priority], seq)
+        self.priority = priority
+        self.user_id = user_id
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.wake = wake
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return self.key < other.key
+
+
+class _ClassStats:
+    def __init__(self):
+        self.active = 0
+        self.admitted = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.waits = deque(maxlen=_WAIT_SAMPLES)
+
+    def admit(self, wait: float) -> None:
+        self.active += 1
+        self.admitted += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.waits.append(wait)
+
+    def snapshot(self, queued: int) -> dict:
+        waits = sorted(self.waits)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "queued": queued,
+            "active": self.active,
+            "admitted": self.admitted,
+            "timeouts": self.timeouts,
+            "avgWaitMs": self.wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            "p95WaitMs": p95 * 1000,
+            "maxWaitMs": self.wait_max * 1000,
+        }
+
+
+class Scheduler:
+    def __init__(self, max_concurrency: int, max_per_user: int, reserved: int, timeouts: Dict[str, float]):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_per_user = max(1, max_per_user)
+        self.reserved = min(max(0, reserved), self.max_concurrency - 1)
+        self.timeouts = timeouts
+        self._lock = threading.Lock()
+        self._queue: list = []  # 按 (优先级, 排队顺序) 有序
+        self._seq = itertools.count()
+        self._active = 0
+        self._per_user: Dict[int, int] = defaultdict(int)
+        self._stats = {p: _ClassStats() for p in PRIORITIES}
+
+    # ---- 调度（均在持锁时调用） ----
+    def _admissible(self, w: _Waiter) -> bool:
+        limit = self.max_concurrency
+        if _RANK[w.priority] > _RANK[PREVIEW]:
+            limit -= self.reserved
+        if self._active >= limit:
+            return False
+        return w.user_id is None or self._per_user[w.user_id] < self.max_per_user
+
+    def _grant(self, w: _Waiter) -> None:
+        w.granted = True
+        self._active += 1
+        if w.user_id is not None:
+            self._per_user[w.user_id] += 1
+        self._stats[w.priority].admit(time.monotonic() - w.enqueued)
+        w.wake()
+
+    def _dispatch(self) -> None:
+        # 用户达到并发上限时跳过其请求，后面的请求仍可获得名额
+        kept = []
+        for w in self._queue:
+            if self._active < self.max_concurrency and self._admissible(w):
+                self._grant(w)
+            else:
+                kept.append(w)
+        self._queue = kept
+
+    def _release(self, w: _Waiter) -> None:
+        self._active -= 1
+        self._stats[w.priority].active -= 1
+        if w.user_id is not None:
+            self._per_user[w.user_id] -= 1
+            if not self._per_user[w.user_id]:
+                del self._per_user[w.user_id]
+        self._dispatch()
+
+    def _abandon(self, w: _Waiter) -> bool:
+        """Drop a waiter that gave up; False if it was granted meanwhile."""
+        if w.granted:
+            return False
+        self._queue.remove(w)
+        return True
+
+    # ---- 对外接口 ----
+    def _enqueue(self, priority: str, user_id: Optional[int], wake: Callable[[], None]) -> _Waiter:
+        if priority not in _RANK:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        with self._lock:
+            w = _Waiter(next(self._seq), priority, user_id, wake)
+            bisect.insort(self._queue, w)
+            self._dispatch()
+            return w
+
+    def _timeout(self, priority: str, timeout: Optional[float]) -> float:
+        return self.timeouts.get(priority, 60) if timeout is None else timeout
+
+    def _timed_out(self, w: _Waiter, timeout: float) -> None:
+        self._stats[w.priority].timeouts += 1
+        raise LLMQueueTimeout(
+            f"LLM {w.priority} request waited more than {timeout}s for a slot"
+        )
+
+    def acquire(self, priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None) -> _Waiter:
+        timeout = self._timeout(priority, timeout)
+        event = threading.Event()
+        w = self._enqueue(priority, user_id, event.set)
+        event.wait(timeout)
+        with self._lock:
+            if self._abandon(w):
+                self._timed_out(w, timeout)
+        return w
+
+    async def aacquire(self, priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None) -> _Waiter:
+        timeout = self._timeout(priority, timeout)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+
+        def resolve():
+            if not fut.done():
+                fut.set_result(None)
+
+        # 名额可能在其它线程中释放，经 call_soon_threadsafe 唤醒
+        w = self._enqueue(priority, user_id, lambda: loop.call_soon_threadsafe(resolve))
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._abandon(w):
+                    self._timed_out(w, timeout)
+        except asyncio.CancelledError:
+            with self._lock:
+                if not self._abandon(w):
+                    self._release(w)
+            raise
+        return w
+
+    def release(self, w: _Waiter) -> None:
+        with self._lock:
+            self._release(w)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = defaultdict(int)
+            for w in self._queue:
+                queued[w.priority] += 1
+            return {
+                "maxConcurrency": self.max_concurrency,
+                "maxPerUser": self.max_per_user,
+                "reservedSlots": self.reserved,
+                "active": self._active,
+                "queued": len(self._queue),
+                "classes": {p: self._stats[p].snapshot(queued[p]) for p in PRIORITIES},
+            }
+
+
+_scheduler = Scheduler(
+    settings.LLM_MAX_CONCURRENCY,
+    settings.LLM_MAX_PER_USER,
+    settings.LLM_RESERVED_SLOTS,
+    settings.LLM_QUEUE_TIMEOUT,
+)
+
+
+def acquire(priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None) -> _Waiter:
+    """Block until a slot is free; pair with ``release``."""
+    return _scheduler.acquire(priority, user_id, timeout)
+
+
+async def aacquire(priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None) -> _Waiter:
+    return await _scheduler.aacquire(priority, user_id, timeout)
+
+
+def release(token: _Waiter) -> None:
+    _scheduler.release(token)
+
+
+@contextmanager
+def slot(priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None):
+    token = _scheduler.acquire(priority, user_id, timeout)
+    try:
+        yield
+    finally:
+        _scheduler.release(token)
+
+
+@asynccontextmanager
+async def aslot(priority: str, user_id: Optional[int] = None, timeout: Optional[float] = None):
+    token = await _scheduler.aacquire(priority, user_id, timeout)
+    try:
+        yield
+    finally:
+        _scheduler.release(token)
+
+
+def stats() -> dict:
+    return _scheduler.stats()
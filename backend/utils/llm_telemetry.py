@@ -0,0 +1,144 @@
+# backend/utils/llm_telemetry.py
+
+"""
+大模型调用的遥测记录。
+
+每次调用由 ``start`` 创建一个 ``CallRecord``，记录调用点、总耗时、流式调用的
+首 token 时间（TTFT）、接口返回的 ``usage``（prompt / completion / 缓存命中
+token 数）、重试次数与结果。记录先放入内存缓冲，由后台线程每
+LLM_METRICS_FLUSH_INTERVAL 秒或攒满 LLM_METRICS_BATCH 条时批量写入
+``llm_call_metric`` 表，请求路径上不做数据库写入。
+"""
+
+import logging
+import threading
+from time import perf_counter
+from typing import List, Optional
+
+from sqlmodel import Session
+
+from backend.config import engine, settings
+from backend.models import LLMCallMetric
+
+_lock = threading.Lock()
+_buffer: List[dict] = []
+_wakeup = threading.Event()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _cached_tokens(usage: dict) -> Optional[int]:
+    # Deepseek 返回 prompt_cache_hit_tokens，OpenAI 兼容格式为 prompt_tokens_details.cached_tokens
+    if "prompt_cache_hit_tokens" in usage:
+        return usage["prompt_cache_hit_tokens"]
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens")
+
+
+class CallRecord:
+    """Measurements of one call; submitted once by ``finish`` or ``fail``."""
+
+    def __init__(self, call_site: str, model: str, stream: bool):
+        self.call_site = call_site
+        self.model = model
+        self.stream = stream
+        # 真正发起上游请求时改为 "api"，否则为合并到其它请求
+        self.source = "coalesced"
+        self.attempts = 0
+        self.usage: Optional[dict] = None
+        self.streamed = 0
+        self._start = perf_counter()
+        self._ttft: Optional[float] = None
+        self._done = False
+
+    def attempt(self) -> None:
+        self.source = "api"
+        self.attempts += 1
+
+    def token(self) -> None:
+        """A streamed delta reached the caller."""
+        if self._ttft is None:
+            self._ttft = perf_counter() - self._start
+        self.streamed += 1
+
+    def set_usage(self, usage: Optional[dict]) -> None:
+        if usage:
+            self.usage = usage
+
+    def finish(self, outcome: str = "ok", error: Optional[BaseException] = None, source: Optional[str] = None) -> None:
+        if self._done:
+            return
+        self._done = True
+        if source is not None:
+            self.source = source
+        # 只有发起上游请求的一方计入 token，避免合并 / 缓存命中重复统计
+        usage = (self.usage or {}) if self.source == "api" else {}
+        if outcome == "abandoned" and self.source == "api" and not usage:
+            # 提前关闭的流拿不到 usage，completion 按已输出的增量数近似
+            usage = {"completion_tokens": self.streamed}
+        _submit(
+            {
+                "call_site": self.call_site,
+                "model": self.model,
+                "stream": self.stream,
+                "source": self.source,
+                "outcome": outcome,
+                "error": f"{type(error).__name__}: {error}"[:255] if error is not None else None,
+                "latency_ms": (perf_counter() - self._start) * 1000,
+                "ttft_ms": self._ttft * 1000 if self._ttft is not None else None,
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "cached_tokens": _cached_tokens(usage) if usage else None,
+                "retries": max(0, self.attempts - 1),
+            }
+        )
+
+    def fail(self, error: BaseException) -> None:
+        self.finish("error", error)
+
+
+def start(call_site: str, model: str, stream: bool = False) -> CallRecord:
+    return CallRecord(call_site, model, stream)
+
+
+def _submit(row: dict) -> None:
+    global _thread
+    if not settings.LLM_METRICS_ENABLED:
+        return
+    with _lock:
+        _buffer.append(row)
+        full = len(_buffer) >= settings.LLM_METRICS_BATCH
+        if _thread is None or not _thread.is_alive():
+            _stop.clear()
+            _thread = threading.Thread(target=_run, name="llm-telemetry", daemon=True)
+            _thread.start()
+    if full:
+        _wakeup.set()
+
+
+def flush() -> None:
+    """Write buffered records to the database."""
+    with _lock:
+        rows = _buffer[:]
+        del _buffer[:]
+    if not rows:
+        return
+    try:
+        with Session(engine) as sess:
+            sess.add_all([LLMCallMetric(**row) for row in rows])
+            sess.commit()
+    except Exception as e:
+        logging.error("Failed to write %d LLM call metrics: %s", len(rows), e)
+
+
+def _run() -> None:
+    while not _stop.is_set():
+        _wakeup.wait(settings.LLM_METRICS_FLUSH_INTERVAL)
+        _wakeup.clear()
+        flush()
+
+
+def shutdown() -> None:
+    _stop.set()
+    _wakeup.set()
+    flush()
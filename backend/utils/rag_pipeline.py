@@ -1,26 +1,20 @@
 # backend/utils/rag_pipeline.py
 
-import os
-import re
+import hashlib
 import logging
-import platform
+import uuid
 from pathlib import Path
-from typing import List, Tuple, Sequence, Union
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Sequence, Union
 
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from nltk.tokenize import word_tokenize
-from sqlalchemy import select, text
-import textract
+from sqlalchemy import text
 
-from backend.models import Document, DocumentActivation
-
-# Try to import pywin32 COM if available
-try:
-    import win32com.client
-    from win32com.client import gencache, constants
-except ImportError:
-    win32com = None
+from backend.config import settings
+from backend.utils import extract_pool, faiss_index, segment_store, vector_cache
+from backend.utils.text_extract import ExtractionError, extract_text
+from backend.utils.text_chunker import Chunk, estimate_tokens, iter_chunks, iter_paragraphs
 
 # Initialize the embedding model once
 _model = None
@@ -34,82 +28,196 @@ def get_model() -> SentenceTransformer:
     return _model
 
 
-def extract_text(path: str) -> str:
+# 提取逻辑（textract 参数、.doc 转换等）变化时递增，旧版本的文本缓存随之失效
+# 2: PDF 改用 pdfminer 逐页提取
+EXTRACTOR_VERSION = 2
+
+
+def file_hash(path: str) -> str:
+    """sha256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_cache_path(content_hash: str) -> Path:
+    """Cached plain text of a blob, stored next to it in DOC_STORAGE_DIR/blobs."""
+    return (
+        Path(settings.DOC_STORAGE_DIR)
+        / "blobs"
+        / content_hash[:2]
+        / f"{content_hash}.text-v{EXTRACTOR_VERSION}.txt"
+    )
+
+
+def ensure_text_cache(
+    path: str, content_hash: Optional[str] = None, strict: bool = False
+) -> Optional[Path]:
     """
-    Extract plain text from a document.
-     - .txt/.md: read directly
-     - .doc: on Windows, convert to .docx via COM then use textract
-     - others (.docx, .pdf, etc.): use textract directly
+    Make sure the extracted text of ``path`` is in the disk cache keyed by
+    content hash and ``EXTRACTOR_VERSION``, and return the cache file (None
+    when the document has no text).  Extraction runs in the process pool and
+    streams into the file, PDFs page by page.  Pass the document's
+    ``content_hash`` when known; otherwise the file is hashed.  Failed
+    extractions are not cached; with ``strict`` they raise
+    ``ExtractionError``, otherwise they are logged and None is returned.
     """
-    suffix = Path(path).suffix.lower()
-
-    if suffix in {".txt", ".md"}:
-        try:
-            return Path(path).read_text(encoding="utf-8", errors="ignore")
-        except Exception as e:
-            logging.error("Failed to read %s: %s", path, e)
-            return ""
-
-    if suffix == ".doc":
-        if platform.system() != "Windows" or win32com is None:
-            logging.error("Cannot extract .doc on non-Windows or missing pywin32: %s", path)
-            return ""
-        tmp_path = str(path) + "x"  # abc.doc -> abc.docx
-        word = None
-        doc = None
+    try:
+        digest = content_hash or file_hash(path)
+        cache = text_cache_path(digest)
+        if cache.exists():
+            return cache
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache.with_name(f"{cache.name}.{uuid.uuid4().hex}.tmp")
         try:
-            word = gencache.EnsureDispatch("Word.Application")
-            word.Visible = False
-            doc = word.Documents.Open(os.path.abspath(path), ReadOnly=True)
-            doc.SaveAs(os.path.abspath(tmp_path), FileFormat=constants.wdFormatXMLDocument)
-            doc.Close(False)
-            text_bytes = textract.process(tmp_path)
-            return text_bytes.decode("utf-8", errors="ignore")
-        except Exception as e:
-            logging.error("Failed to extract from .doc %s: %s", path, e)
-            return ""
+            if not extract_pool.extract_to_file(path, str(tmp)):
+                return None
+            tmp.replace(cache)
         finally:
-            if doc:
-                try:
-                    doc.Close(False)
-                except Exception:
-                    pass
-            if word:
-                try:
-                    word.Quit()
-                except Exception:
-                    pass
-            if os.path.exists(tmp_path):
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
-
-    # fallback for .docx, .pdf, etc.
-    try:
-        raw = textract.process(path)
-        return raw.decode("utf-8", errors="ignore")
-    except Exception as e:
-        logging.error("textract failed on %s: %s", path, e)
+            tmp.unlink(missing_ok=True)
+        return cache
+    except OSError as e:
+        if strict:
+            raise ExtractionError(f"Failed to read {path}: {e}") from e
+        logging.error("Failed to read %s: %s", path, e)
+        return None
+    except ExtractionError as e:
+        if strict:
+            raise
+        logging.error("%s", e)
+        return None
+
+
+def iter_text_pieces(cache: Path, block_size: int = 1 << 16) -> Iterator[str]:
+    """Read a cached text file lazily, a page ("\\f"-terminated) or block at a time."""
+    with open(cache, encoding="utf-8", newline="") as fh:
+        buf = ""
+        for block in iter(lambda: fh.read(block_size), ""):
+            buf += block
+            *pages, buf = buf.split("\f")
+            for page in pages:
+                yield page + "\f"
+            if len(buf) >= block_size:
+                yield buf
+                buf = ""
+        if buf:
+            yield buf
+
+
+def extract_text_cached(
+    path: str, content_hash: Optional[str] = None, strict: bool = False
+) -> str:
+    """Whole extracted text of ``path`` via ``ensure_text_cache``."""
+    cache = ensure_text_cache(path, content_hash, strict)
+    if cache is None:
         return ""
+    with open(cache, encoding="utf-8", newline="") as fh:
+        return fh.read()
+
+
+def remove_text_cache(content_hash: str) -> None:
+    """Delete the cached text of a blob, for every extractor version."""
+    folder = text_cache_path(content_hash).parent
+    for p in folder.glob(f"{content_hash}.text-v*.txt"):
+        p.unlink(missing_ok=True)
+
+
+def count_tokens(text: str) -> int:
+    """Count embedding-model tokens in ``text`` (estimate if no tokenizer)."""
+    tokenizer = getattr(get_model(), "tokenizer", None)
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def _max_chunk_tokens() -> int:
+    """Chunk size limit, never above what the embedding model can encode."""
+    limit = settings.CHUNK_MAX_TOKENS
+    max_seq = getattr(get_model(), "max_seq_length", None)
+    if max_seq:
+        # 预留 [CLS] / [SEP] 两个特殊 token
+        limit = min(limit, max_seq - 2)
+    return limit
+
+
+def iter_text_chunks(pieces: Iterable[str]) -> Iterator[Chunk]:
+    """Lazily chunk a stream of text pieces on sentence/paragraph boundaries."""
+    return iter_chunks(
+        pieces,
+        count_tokens=count_tokens,
+        max_tokens=_max_chunk_tokens(),
+        overlap_tokens=settings.CHUNK_OVERLAP_TOKENS,
+    )
+
+
+def chunk_text_spans(text: str) -> List[Chunk]:
+    """Split text into token-bounded chunks, keeping offsets."""
+    return list(iter_text_chunks([text])) if text else []
 
 
-def _chunk_text(text: str, size: int = 400, overlap: int = 50) -> List[str]:
-    """Tokenize and split text into overlapping chunks."""
+def _chunk_text(text: str) -> List[str]:
+    """Split text into token-bounded chunks."""
+    return [c.text for c in chunk_text_spans(text)]
+
+
+def iter_document_chunks(path: str, content_hash: Optional[str] = None) -> Iterator[Chunk]:
+    """Extract (or load cached) text then lazily yield its chunks."""
+    cache = ensure_text_cache(path, content_hash)
+    if cache is not None:
+        yield from iter_text_chunks(iter_text_pieces(cache))
+
+
+def chunk_document_spans(path: str) -> List[Chunk]:
+    """Extract text then chunk it, returning chunks with offsets and token counts."""
+    return list(iter_document_chunks(path))
+
+
+def chunk_document(path: str) -> List[str]:
+    """Extract text then chunk it into token-bounded segments."""
+    return [c.text for c in iter_document_chunks(path)]
+
+
+def legacy_chunk_spans(text: str, size: int = 400, overlap: int = 50) -> List[Chunk]:
+    """
+    Chunker used before the sentence-aware one: ``size`` nltk tokens per
+    chunk with ``overlap``.  Kept to resolve chunk indices of documents
+    indexed before chunk text was stored, and for benchmarking.
+    """
     tokens = word_tokenize(text)
-    chunks = []
+
+    # 逐个定位 token 在原文中的位置；word_tokenize 会改写引号，找不到时沿用上一个位置
+    spans: List[Tuple[int, int]] = []
+    cursor = 0
+    for tok in tokens:
+        pos = text.find(tok, cursor)
+        if pos == -1:
+            spans.append((cursor, cursor))
+        else:
+            cursor = pos + len(tok)
+            spans.append((pos, cursor))
+
+    chunks: List[Chunk] = []
     step = size - overlap
     for i in range(0, len(tokens), step):
         part = tokens[i : i + size]
         if part:
-            chunks.append(" ".join(part))
+            start = spans[i][0]
+            end = spans[i + len(part) - 1][1]
+            chunks.append(Chunk(" ".join(part), start, end, len(part)))
     return chunks
 
 
-def chunk_document(path: str) -> List[str]:
-    """Extract text then chunk it into fixed-size segments."""
-    text = extract_text(path)
-    return _chunk_text(text) if text else []
+def legacy_chunk_document(path: str, content_hash: Optional[str] = None) -> List[str]:
+    """Re-chunk a document the way it was chunked before chunk text was stored."""
+    text = extract_text_cached(path, content_hash)
+    return [c.text for c in legacy_chunk_spans(text)] if text else []
+
+
+def split_paragraphs(text: str) -> List[Chunk]:
+    """Split text into paragraphs on blank lines, keeping offsets."""
+    return list(iter_paragraphs([text]))
 
 
 def retrieve_paragraphs(
@@ -126,42 +234,54 @@ def retrieve_paragraphs(
     ``True`` then all documents associated with the teacher will be
     used regardless of activation state.
 
+    Paragraph embeddings are computed once at upload time, so a query
+    only costs one encode plus a lookup in the paragraph index.  The
+    global top_k paragraphs are returned, possibly several from the
+    same document.
+
     Returns a list of ``(doc_id, paragraph_text)`` tuples.
     """
-    model = get_model()
-    q_vec = model.encode(query)
-
-    # fetch documents for this teacher
-    stmt = (
-        select(Document)
-        .join(DocumentActivation, DocumentActivation.doc_id == Document.id)
-        .where(DocumentActivation.teacher_id == user_id)
+    q_vec = get_model().encode(query)
+    hits = vector_cache.search(
+        session,
+        q_vec,
+        [user_id],
+        top_k=top_k,
+        include_inactive=include_inactive,
+        granularity=vector_cache.PARAGRAPHS,
     )
-    if not include_inactive:
-        stmt = stmt.where(DocumentActivation.is_active == 1)
-    docs = session.exec(stmt).scalars().all()
-
-    candidates: List[Tuple[int, str, float]] = []
-    for doc in docs:
-        full_text = extract_text(doc.filepath)
-        if not full_text:
-            continue
+    if not hits:
+        return []
 
-        # split into paragraphs on blank lines
-        paras = [p.strip() for p in full_text.split("\n\n") if p.strip()]
-        if not paras:
-            continue
+    doc_clause = ",".join(str(doc_id) for doc_id in {h[0] for h in hits})
+    para_clause = ",".join(str(idx) for idx in {h[1] for h in hits})
+    rows = session.exec(
+        text(
+            "SELECT doc_id, para_index, content FROM document_paragraph "
+            f"WHERE doc_id IN ({doc_clause}) AND para_index IN ({para_clause})"
+        )
+    ).all()
+    by_key = {(r.doc_id, r.para_index): r.content for r in rows}
+    return [
+        (doc_id, by_key[(doc_id, idx)])
+        for doc_id, idx, _ in hits
+        if (doc_id, idx) in by_key
+    ]
 
-        # embed all paragraphs
-        para_vecs = model.encode(paras)
-        sims = para_vecs @ q_vec  # inner product similarity
-        best_idx = int(np.argmax(sims))
-        candidates.append((doc.id, paras[best_idx], float(sims[best_idx])))
 
-    # sort by similarity score and return top_k
-    candidates.sort(key=lambda x: x[2], reverse=True)
-    top = candidates[:top_k]
-    return [(doc_id, para) for doc_id, para, _ in top]
+def search_chunks(
+    session,
+    q_vec: np.ndarray,
+    teacher_ids: Sequence[int],
+    top_k: int = 5,
+    include_inactive: bool = False,
+) -> List[Tuple[int, int, float]]:
+    """Return ``(doc_id, chunk_index, score)`` hits using the configured backend."""
+    if settings.VECTOR_BACKEND == "faiss" and faiss_index.available():
+        return faiss_index.search(session, q_vec, teacher_ids, top_k, include_inactive)
+    if settings.VECTOR_BACKEND == "segment":
+        return segment_store.search(session, q_vec, teacher_ids, top_k, include_inactive)
+    return vector_cache.search(session, q_vec, teacher_ids, top_k, include_inactive)
 
 
 def retrieve_from_db(
@@ -184,29 +304,38 @@ def retrieve_from_db(
         return []
 
     q_vec = get_model().encode(query)
-    id_clause = ",".join(str(int(uid)) for uid in ids)
-    sql = (
-        "SELECT v.doc_id, v.chunk_index, v.vector_blob, d.filepath "
-        "FROM document_vector v "
-        "JOIN document d ON v.doc_id=d.id "
-        "JOIN document_activation a ON a.doc_id=d.id "
-        f"WHERE a.teacher_id IN ({id_clause})"
+    hits = search_chunks(
+        session, q_vec, ids, top_k=top_k, include_inactive=include_inactive
     )
-    if not include_inactive:
-        sql += " AND a.is_active=1"
-    stmt = text(sql)
-    rows = session.exec(stmt).all()
-    if not rows:
+    if not hits:
         return []
 
-    vectors = [np.frombuffer(r.vector_blob, dtype=np.float32) for r in rows]
-    sims = np.array(vectors) @ q_vec
-    idxs = sims.argsort()[-top_k:][::-1]
+    # 只为命中的块取回文本
+    doc_clause = ",".join(str(doc_id) for doc_id in {h[0] for h in hits})
+    chunk_clause = ",".join(str(ck) for ck in {h[1] for h in hits})
+    rows = session.exec(
+        text(
+            "SELECT v.doc_id, v.chunk_index, v.content, d.filepath, d.content_hash "
+            "FROM document_vector v "
+            "JOIN document d ON v.doc_id=d.id "
+            f"WHERE v.doc_id IN ({doc_clause}) AND v.chunk_index IN ({chunk_clause})"
+        )
+    ).all()
+    by_key = {(r.doc_id, r.chunk_index): r for r in rows}
 
     results: List[Tuple[int, str]] = []
-    for i in idxs:
-        r = rows[i]
-        chunks = chunk_document(r.filepath)
-        text_chunk = chunks[r.chunk_index] if r.chunk_index < len(chunks) else ""
-        results.append((r.doc_id, text_chunk))
+    # 旧数据没有存储块文本时才回退到重新切分源文件（每个文件最多一次）
+    legacy_chunks: Dict[str, List[str]] = {}
+    for doc_id, chunk_index, _ in hits:
+        r = by_key.get((doc_id, chunk_index))
+        if r is None:
+            continue
+        if r.content is not None:
+            results.append((doc_id, r.content))
+            continue
+        if r.filepath not in legacy_chunks:
+            legacy_chunks[r.filepath] = legacy_chunk_document(r.filepath, r.content_hash)
+        chunks = legacy_chunks[r.filepath]
+        text_chunk = chunks[chunk_index] if chunk_index < len(chunks) else ""
+        results.append((doc_id, text_chunk))
     return results
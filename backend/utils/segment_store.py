@@ -0,0 +1,414 @@
+# backend/utils/segment_store.py
+
+"""
+基于内存映射 .npy 段文件的文档向量存储（VECTOR_BACKEND="segment"）。
+
+每个文档的块向量（已归一化）写成文档目录下的 vectors.npy，行号即 chunk_index。
+每个 scope（与 vector_cache 相同）有一个清单 DOC_STORAGE_DIR/segments/{scope}.json：
+
+    {"segments": [{"path": "3/12/vectors.npy", "doc_id": 12, "rows": 40, "token": "..."},
+                  {"path": "segments/3-ab12.npy", "ids": "segments/3-ab12.ids.npy", ...}],
+     "deleted": [7]}
+
+合并段由 compact() 生成，ids 文件是 (n, 2) 的 (doc_id, chunk_index)。段文件只追加不修改，
+删除已合并的文档时只记入 deleted，下次合并时清除。
+
+检索时以 np.load(mmap_mode="r") 打开段文件，多个 worker 进程共享同一份页缓存，
+也无需从数据库读取向量。清单按文件修改时间重新加载，写入时用文件锁串行化
+（POSIX 用 fcntl.flock，Windows 用 msvcrt.locking）。
+
+Windows 不能删除或覆盖仍被映射的文件：删除段文件前先丢弃本进程缓存的映射，
+若文件仍被占用（其它进程或尚未释放的检索结果），记入待删列表，下次写清单时重试。
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from backend.config import settings
+from backend.utils import vector_cache, vector_codec
+from backend.utils.vector_cache import PUBLIC_SCOPE, ScopeKey
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+SEGMENT_FILE = "vectors.npy"
+
+_lock = threading.RLock()
+# scope -> (清单, (mtime_ns, size))
+_manifests: Dict[ScopeKey, Tuple[dict, Tuple[int, int]]] = {}
+# (相对路径, token) -> 内存映射数组
+_arrays: Dict[Tuple[str, str], np.ndarray] = {}
+# 仍被映射、暂时删不掉的段文件
+_pending: Set[Path] = set()
+
+
+def _root() -> Path:
+    return Path(settings.DOC_STORAGE_DIR)
+
+
+def _segment_dir() -> Path:
+    return _root() / "segments"
+
+
+def _manifest_path(scope: ScopeKey) -> Path:
+    return _segment_dir() / f"{scope}.json"
+
+
+def _relative(path: Path) -> str:
+    return Path(os.path.relpath(path, _root())).as_posix()
+
+
+def _dtype():
+    # int8 需要逐行缩放系数，段文件只支持 float16 / float32
+    if settings.VECTOR_STORAGE_DTYPE == vector_codec.FLOAT16:
+        return np.float16
+    return np.float32
+
+
+@contextmanager
+def _locked(scope: ScopeKey) -> Iterator[dict]:
+    """Serialise manifest updates across threads and worker processes.
+
+    Yields the current manifest read from disk; the caller mutates it and
+    ``_write`` persists it.
+    """
+    path = _manifest_path(scope)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _lock, open(path.with_suffix(".lock"), "a+") as fh:
+        _lock_file(fh)
+        try:
+            _retry_pending()
+            yield _load(path)
+        finally:
+            _unlock_file(fh)
+
+
+def _lock_file(fh) -> None:
+    if fcntl:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+    elif msvcrt:
+        # 锁住第一个字节；LK_LOCK 重试约 10 秒后抛 OSError，继续等待
+        fh.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+
+def _unlock_file(fh) -> None:
+    if fcntl:
+        fcntl.flock(fh, fcntl.LOCK_UN)
+    elif msvcrt:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _load(path: Path) -> dict:
+    if not path.exists():
+        return {"segments": [], "deleted": []}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _write(scope: ScopeKey, manifest: dict) -> None:
+    path = _manifest_path(scope)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest), encoding="utf-8")
+    tmp.replace(path)
+    stat = path.stat()
+    _manifests[scope] = (manifest, (stat.st_mtime_ns, stat.st_size))
+
+
+def _read(scope: ScopeKey) -> dict:
+    path = _manifest_path(scope)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {"segments": [], "deleted": []}
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _manifests.get(scope)
+        if cached is not None and cached[1] == key:
+            return cached[0]
+    manifest = _load(path)
+    with _lock:
+        _manifests[scope] = (manifest, key)
+    return manifest
+
+
+def _array(rel: str, token: str) -> np.ndarray:
+    key = (rel, token)
+    with _lock:
+        arr = _arrays.get(key)
+    if arr is None:
+        arr = np.load(_root() / rel, mmap_mode="r")
+        with _lock:
+            _arrays[key] = arr
+    return arr
+
+
+def _forget(segments: Sequence[dict]) -> None:
+    with _lock:
+        for seg in segments:
+            _arrays.pop((seg["path"], seg["token"]), None)
+            if "ids" in seg:
+                _arrays.pop((seg["ids"], seg["token"]), None)
+
+
+def _forget_path(rel: str) -> None:
+    with _lock:
+        for key in [k for k in _arrays if k[0] == rel]:
+            del _arrays[key]
+
+
+def _unlink(segments: Sequence[dict]) -> None:
+    """Drop the cached maps of ``segments`` and delete their files."""
+    _forget(segments)
+    for seg in segments:
+        _remove(_root() / seg["path"])
+        if "ids" in seg:
+            _remove(_root() / seg["ids"])
+
+
+def _remove(path: Path) -> None:
+    try:
+        path.unlink(missing_ok=True)
+    except PermissionError:
+        # Windows：文件仍被映射，稍后再删
+        logging.info("Segment file %s is still mapped, deferring removal", path)
+        with _lock:
+            _pending.add(path)
+
+
+def _retry_pending() -> None:
+    with _lock:
+        paths = list(_pending)
+        _pending.clear()
+    for path in paths:
+        _remove(path)
+
+
+def _save(path: Path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.stem + ".tmp.npy")
+    np.save(tmp, arr)
+    tmp.replace(path)
+
+
+def write_document(
+    scope: ScopeKey, doc_id: int, doc_dir: Path, vecs: np.ndarray
+) -> None:
+    """Write the chunk vectors of a document as its segment and register it."""
+    mat = vector_cache.normalize(vecs).astype(_dtype())
+    path = Path(doc_dir) / SEGMENT_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 覆盖旧段文件前释放本进程对它的映射
+    _forget_path(_relative(path))
+    _save(path, mat)
+    with _locked(scope) as manifest:
+        old = [s for s in manifest["segments"] if s.get("doc_id") == doc_id]
+        manifest["segments"] = [
+            s for s in manifest["segments"] if s.get("doc_id") != doc_id
+        ]
+        manifest["segments"].append(
+            {
+                "path": _relative(path),
+                "doc_id": doc_id,
+                "rows": len(mat),
+                "token": uuid.uuid4().hex,
+            }
+        )
+        _write(scope, manifest)
+    _forget(old)
+
+
+def remove_document(scope: ScopeKey, doc_id: int) -> None:
+    """Unregister a document; rows inside merged segments are tombstoned."""
+    with _locked(scope) as manifest:
+        own = [s for s in manifest["segments"] if s.get("doc_id") == doc_id]
+        manifest["segments"] = [
+            s for s in manifest["segments"] if s.get("doc_id") != doc_id
+        ]
+        if any("ids" in s for s in manifest["segments"]):
+            manifest["deleted"] = sorted(set(manifest["deleted"]) | {doc_id})
+        _write(scope, manifest)
+    _unlink(own)
+
+
+def drop_scope(scope: ScopeKey) -> None:
+    """Remove the manifest and every segment of ``scope``."""
+    with _locked(scope) as manifest:
+        _unlink(manifest["segments"])
+        _manifest_path(scope).unlink(missing_ok=True)
+        _manifests.pop(scope, None)
+
+
+def document_vectors(scope: ScopeKey, doc_id: int) -> Optional[np.ndarray]:
+    """Return a copy of the chunk vectors of ``doc_id``, ordered by chunk index."""
+    manifest = _read(scope)
+    if doc_id in manifest["deleted"]:
+        return None
+    for seg in manifest["segments"]:
+        if seg.get("doc_id") == doc_id:
+            return np.array(_array(seg["path"], seg["token"]), dtype=np.float32)
+        if "ids" in seg:
+            ids = _array(seg["ids"], seg["token"])
+            rows = np.flatnonzero(ids[:, 0] == doc_id)
+            if len(rows):
+                rows = rows[np.argsort(ids[rows, 1])]
+                return np.array(_array(seg["path"], seg["token"])[rows], dtype=np.float32)
+    return None
+
+
+def compact(scope: ScopeKey, min_rows: Optional[int] = None) -> int:
+    """
+    Merge per-document segments smaller than ``min_rows`` and merged
+    segments holding deleted rows into one new segment.  Returns the number
+    of segments merged away.
+    """
+    min_rows = settings.SEGMENT_COMPACT_MIN_ROWS if min_rows is None else min_rows
+    with _locked(scope) as manifest:
+        deleted = np.array(manifest["deleted"], dtype=np.int64)
+        picked, kept = [], []
+        for seg in manifest["segments"]:
+            if "ids" in seg:
+                ids = _array(seg["ids"], seg["token"])
+                dirty = len(deleted) and np.isin(ids[:, 0], deleted).any()
+                small = seg["rows"] < min_rows
+                (picked if dirty or small else kept).append(seg)
+            else:
+                (picked if seg["rows"] < min_rows else kept).append(seg)
+        if len(picked) < 2 and not (picked and "ids" in picked[0] and len(deleted)):
+            return 0
+
+        mats: List[np.ndarray] = []
+        id_parts: List[np.ndarray] = []
+        for seg in picked:
+            mat = _array(seg["path"], seg["token"])
+            if "ids" in seg:
+                ids = np.asarray(_array(seg["ids"], seg["token"]))
+                keep = ~np.isin(ids[:, 0], deleted)
+                mats.append(np.asarray(mat)[keep])
+                id_parts.append(ids[keep])
+            else:
+                mats.append(np.asarray(mat))
+                id_parts.append(
+                    np.column_stack(
+                        (
+                            np.full(len(mat), seg["doc_id"], dtype=np.int64),
+                            np.arange(len(mat), dtype=np.int64),
+                        )
+                    )
+                )
+
+        if any(len(m) for m in mats):
+            token = uuid.uuid4().hex
+            base = _segment_dir() / f"{scope}-{token[:12]}"
+            vec_path = base.with_suffix(".npy")
+            ids_path = base.with_name(base.name + ".ids.npy")
+            dim = max(m.shape[1] for m in mats if len(m))
+            merged = np.concatenate([m for m in mats if len(m)]).astype(_dtype())
+            _save(vec_path, merged.reshape(-1, dim))
+            _save(ids_path, np.concatenate(id_parts))
+            kept.append(
+                {
+                    "path": _relative(vec_path),
+                    "ids": _relative(ids_path),
+                    "rows": len(merged),
+                    "token": token,
+                }
+            )
+        manifest["segments"] = kept
+        manifest["deleted"] = []
+        _write(scope, manifest)
+
+    # POSIX 上其它进程已打开的内存映射不受删除影响，会在重新读取清单后切换到新段
+    mat = ids = mats = None  # 释放对旧段的引用
+    _unlink(picked)
+    logging.info("Compacted %d segments of scope %s", len(picked), scope)
+    return len(picked)
+
+
+def scopes() -> List[ScopeKey]:
+    """Return every scope that has a manifest."""
+    if not _segment_dir().exists():
+        return []
+    found: List[ScopeKey] = []
+    for path in _segment_dir().glob("*.json"):
+        found.append(PUBLIC_SCOPE if path.stem == PUBLIC_SCOPE else int(path.stem))
+    return found
+
+
+def search(
+    session,
+    q_vec: np.ndarray,
+    teacher_ids: Sequence[int],
+    top_k: int = 5,
+    include_inactive: bool = False,
+) -> List[Tuple[int, int, float]]:
+    """Same contract as ``vector_cache.search`` over the memory-mapped segments."""
+    allowed = vector_cache.allowed_documents(session, teacher_ids, include_inactive)
+    if not allowed or top_k <= 0:
+        return []
+    allowed_arr = np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+
+    q = np.asarray(q_vec, dtype=np.float32)
+    q_norm = float(np.linalg.norm(q))
+    if q_norm:
+        q = q / q_norm
+
+    sims_parts, doc_parts, chunk_parts = [], [], []
+    for scope in [*dict.fromkeys(teacher_ids), PUBLIC_SCOPE]:
+        manifest = _read(scope)
+        deleted = np.array(manifest["deleted"], dtype=np.int64)
+        for seg in manifest["segments"]:
+            if "doc_id" in seg:
+                # 单文档段：未激活的文档整段跳过，不触及其页面
+                if seg["doc_id"] not in allowed or not seg["rows"]:
+                    continue
+                mat = _array(seg["path"], seg["token"])
+                sims_parts.append(vector_codec.scores(vector_codec.CompactMatrix(mat, None), q))
+                doc_parts.append(np.full(len(mat), seg["doc_id"], dtype=np.int64))
+                chunk_parts.append(np.arange(len(mat), dtype=np.int64))
+                continue
+            ids = _array(seg["ids"], seg["token"])
+            mask = np.isin(ids[:, 0], allowed_arr)
+            if len(deleted):
+                mask &= ~np.isin(ids[:, 0], deleted)
+            if not mask.any():
+                continue
+            mat = _array(seg["path"], seg["token"])
+            sims = vector_codec.scores(vector_codec.CompactMatrix(mat, None), q)
+            sims[~mask] = -np.inf
+            sims_parts.append(sims)
+            doc_parts.append(np.asarray(ids[:, 0]))
+            chunk_parts.append(np.asarray(ids[:, 1]))
+    if not sims_parts:
+        return []
+
+    sims = np.concatenate(sims_parts)
+    doc_ids = np.concatenate(doc_parts)
+    chunk_indexes = np.concatenate(chunk_parts)
+
+    k = min(top_k, len(sims))
+    idxs = np.argpartition(-sims, k - 1)[:k]
+    idxs = idxs[np.argsort(-sims[idxs])]
+    return [
+        (int(doc_ids[i]), int(chunk_indexes[i]), float(sims[i]))
+        for i in idxs
+        if np.isfinite(sims[i])
+    ]
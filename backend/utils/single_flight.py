@@ -0,0 +1,382 @@
+# backend/utils/single_flight.py
+
+"""
+合并同时进行的相同大模型请求（single-flight）。
+
+同一个键（请求内容的哈希）在上一次请求完成前再次出现时，不再发起新的上游
+调用，而是等待第一次调用（leader）的结果：
+ - ``do`` / ``ado``：非流式调用，所有等待者得到同一份结果或同一个异常；
+ - ``stream`` / ``astream``：流式调用，由后台线程 / 任务读取上游，把 token
+   分发给所有订阅者，晚加入的订阅者先收到已产生的部分。订阅者读完、出错或
+   关闭迭代器（包括还没开始读就关闭）时离开，所有订阅者都离开后停止读取上游
+   （async 版本立即取消读取任务并关闭上游响应）。
+
+async 版本的上游调用在独立任务中执行，发起者断开（任务被取消）不影响其他等待者。
+"""
+
+import asyncio
+import copy
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from backend.config import settings
+
+_lock = threading.Lock()
+_flights: Dict[str, "_Flight"] = {}
+_streams: Dict[str, "_SyncBroadcast"] = {}
+_astreams: Dict[str, "_AsyncBroadcast"] = {}
+_counters = {"calls": 0, "coalesced": 0, "streams": 0, "streamsCoalesced": 0}
+
+
+def _resolve(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class _Flight:
+    """One in-flight non-streaming call; waitable from threads and event loops."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Future] = None  # async leader 的上游任务
+
+    def finish(self, result=None, error: Optional[BaseException] = None) -> None:
+        with _lock:
+            self.result, self.error = result, error
+            self._done.set()
+            futures, self._futures = self._futures, []
+        for loop, fut in futures:
+            loop.call_soon_threadsafe(_resolve, fut)
+
+    def _outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self):
+        self._done.wait()
+        return self._outcome()
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        with _lock:
+            fut = None
+            if not self._done.is_set():
+                fut = loop.create_future()
+                self._futures.append((loop, fut))
+        if fut is not None:
+            await fut
+        return self._outcome()
+
+
+def _join(key: str) -> Tuple[_Flight, bool]:
+    with _lock:
+        _counters["calls"] += 1
+        flight = _flights.get(key)
+        if flight is not None:
+            _counters["coalesced"] += 1
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _finish(key: str, flight: _Flight, result=None, error: Optional[BaseException] = None) -> None:
+    with _lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+    flight.finish(result, error)
+
+
+def do(key: str, fn: Callable[[], dict]) -> dict:
+    """Run ``fn`` unless an identical call is in flight; then share its result."""
+    if not settings.LLM_SINGLE_FLIGHT:
+        return fn()
+    flight, leader = _join(key)
+    if not leader:
+        return copy.deepcopy(flight.wait())
+    try:
+        result = fn()
+    except BaseException as e:
+        _finish(key, flight, error=e)
+        raise
+    _finish(key, flight, result=result)
+    return result
+
+
+async def ado(key: str, fn: Callable[[], Awaitable[dict]]) -> dict:
+    """Async ``do``; the upstream call survives cancellation of its initiator."""
+    if not settings.LLM_SINGLE_FLIGHT:
+        return await fn()
+    flight, leader = _join(key)
+    if not leader:
+        return copy.deepcopy(await flight.wait_async())
+
+    def done(task: asyncio.Future) -> None:
+        if task.cancelled():
+            _finish(key, flight, error=RuntimeError("LLM request cancelled"))
+        elif task.exception() is not None:
+            _finish(key, flight, error=task.exception())
+        else:
+            _finish(key, flight, result=task.result())
+
+    flight.task = asyncio.ensure_future(fn())
+    flight.task.add_done_callback(done)
+    return await flight.wait_async()
+
+
+# ---- 流式 ----
+class _Broadcast:
+    """Tokens of one upstream stream, replayed to every subscriber."""
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        # leader 自己算一个订阅者；降到 0 后不再接受新订阅，上游随之关闭
+        self.subscribers = 1
+        self.abandoned = False
+
+    def leave(self) -> None:
+        with _lock:
+            self.subscribers -= 1
+            if self.subscribers <= 0:
+                self.abandoned = True
+
+
+class _SyncBroadcast(_Broadcast):
+    def __init__(self):
+        super().__init__()
+        self.cond = threading.Condition()
+
+    def publish(self, token: str) -> None:
+        with self.cond:
+            self.tokens.append(token)
+            self.cond.notify_all()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self.cond.notify_all()
+
+    def iterate(self) -> Iterator[str]:
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.tokens) and not self.finished:
+                    self.cond.wait()
+                batch = self.tokens[i:]
+                finished, error = self.finished, self.error
+            i += len(batch)
+            yield from batch
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class _AsyncBroadcast(_Broadcast):
+    """Event-loop bound broadcast; all access happens on one loop."""
+
+    def __init__(self):
+        super().__init__()
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Future] = None
+        self.started = False
+
+    def leave(self) -> None:
+        super().leave()
+        # 没有订阅者后立即取消读取任务，不必等到下一个 token；
+        # 还没开始运行的任务被取消时不会执行 finally，交给它开始后自行关闭上游
+        if self.abandoned and self.started and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def publish(self, token: str) -> None:
+        self.tokens.append(token)
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    async def iterate(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i >= len(self.tokens) and not self.finished:
+                await self.changed.wait()
+            batch = self.tokens[i:]
+            i += len(batch)
+            for token in batch:
+                yield token
+            if self.finished and i >= len(self.tokens):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _Subscription:
+    """
+    One subscriber of a ``_SyncBroadcast``. Unlike a bare generator, ``close()``
+    leaves the broadcast even before the first token was read.
+    """
+
+    def __init__(self, bc: _SyncBroadcast):
+        self._bc = bc
+        self._tokens = bc.iterate()
+        self._left = False
+
+    def __iter__(self) -> "_Subscription":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._tokens)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._left:
+            return
+        self._left = True
+        self._bc.leave()
+        self._tokens.close()
+
+    def __del__(self):
+        self.close()
+
+
+class _AsyncSubscription:
+    """Async ``_Subscription`` of an ``_AsyncBroadcast``."""
+
+    def __init__(self, bc: _AsyncBroadcast):
+        self._bc = bc
+        self._tokens = bc.iterate()
+        self._left = False
+
+    def __aiter__(self) -> "_AsyncSubscription":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._tokens.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        if self._left:
+            return
+        self._left = True
+        self._bc.leave()
+        await self._tokens.aclose()
+
+
+def _join_stream(registry: dict, key: str, factory) -> Tuple[_Broadcast, bool]:
+    with _lock:
+        _counters["streams"] += 1
+        bc = registry.get(key)
+        # 已被所有订阅者放弃的流会提前结束，不能再加入
+        if bc is not None and not bc.abandoned:
+            bc.subscribers += 1
+            _counters["streamsCoalesced"] += 1
+            return bc, False
+        bc = registry[key] = factory()
+        return bc, True
+
+
+def _end_stream(registry: dict, key: str, bc: _Broadcast, error: Optional[BaseException] = None) -> None:
+    with _lock:
+        if registry.get(key) is bc:
+            del registry[key]
+    bc.close(error)
+
+
+def _pump(key: str, bc: _SyncBroadcast, upstream: Iterator[str]) -> None:
+    error = None
+    try:
+        # 开始读取前订阅者可能已全部离开
+        if not bc.abandoned:
+            for token in upstream:
+                bc.publish(token)
+                if bc.abandoned:
+                    break
+    except BaseException as e:
+        error = e
+    finally:
+        close = getattr(upstream, "close", None)
+        if close is not None:
+            close()
+        _end_stream(_streams, key, bc, error)
+
+
+def stream(key: str, open_fn: Callable[[], Iterator[str]]) -> Iterator[str]:
+    """
+    Subscribe to the identical in-flight stream, or open it with ``open_fn``
+    (in the caller's thread, so request errors raise here) and pump it from
+    a background thread.
+    """
+    if not settings.LLM_SINGLE_FLIGHT:
+        return open_fn()
+    bc, leader = _join_stream(_streams, key, _SyncBroadcast)
+    if not leader:
+        return _Subscription(bc)
+    try:
+        upstream = open_fn()
+    except BaseException as e:
+        _end_stream(_streams, key, bc, e)
+        raise
+    threading.Thread(
+        target=_pump, args=(key, bc, upstream), name="llm-stream", daemon=True
+    ).start()
+    return _Subscription(bc)
+
+
+async def _apump(key: str, bc: _AsyncBroadcast, upstream: AsyncIterator[str]) -> None:
+    bc.started = True
+    error = None
+    try:
+        if not bc.abandoned:
+            async for token in upstream:
+                bc.publish(token)
+                if bc.abandoned:
+                    break
+    except asyncio.CancelledError:
+        error = RuntimeError("LLM stream cancelled")
+        raise
+    except Exception as e:
+        error = e
+    finally:
+        aclose = getattr(upstream, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        _end_stream(_astreams, key, bc, error)
+
+
+async def astream(key: str, open_fn: Callable[[], Awaitable[AsyncIterator[str]]]) -> AsyncIterator[str]:
+    """Async ``stream``; the upstream is read by a task on the current loop."""
+    if not settings.LLM_SINGLE_FLIGHT:
+        return await open_fn()
+    bc, leader = _join_stream(_astreams, key, _AsyncBroadcast)
+    if not leader:
+        return _AsyncSubscription(bc)
+    try:
+        upstream = await open_fn()
+    except BaseException as e:
+        _end_stream(_astreams, key, bc, e)
+        raise
+    bc.task = asyncio.ensure_future(_apump(key, bc, upstream))
+    return _AsyncSubscription(bc)
+
+
+def stats() -> dict:
+    with _lock:
+        return {**_counters, "inFlight": len(_flights), "streamsInFlight": len(_streams) + len(_astreams)}
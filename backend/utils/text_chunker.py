@@ -0,0 +1,217 @@
+# backend/utils/text_chunker.py
+
+"""
+面向中英文混排文本的流式切分器。
+
+- 先按段落（空行）和句子（。！？；!?; 以及英文句点）切分，再把句子
+  合并成不超过 ``max_tokens`` 个 embedding 模型 token 的块，块之间保留
+  约 ``overlap_tokens`` 的句子级重叠；
+- 单个句子超过上限时按字符/单词硬切；
+- 输入是文本片段的可迭代对象（整篇文本或逐页文本均可），以生成器方式
+  产出块，内存只与当前块大小相关。
+"""
+
+import re
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+
+# 句子边界：段落空行、换行、中英文句末标点（含其后的引号/括号）、后接空白的英文句点
+_BOUNDARY = re.compile(
+    r"\n[ \t\r\f\v]*\n\s*|\n|[。！？!?；;…]+[”’\"'」』）)\]]*|\.(?=\s)"
+)
+_PARAGRAPH = re.compile(r"\n[ \t\r\f\v]*\n")
+# 硬切单位：单个 CJK 字符、一个拉丁单词/数字串、或单个标点
+_CJK_CLASS = (
+    "[\u3040-\u30ff"  # 日文假名
+    "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"  # 中日韩统一表意文字
+    "\uac00-\ud7af]"  # 韩文音节
+)
+_UNIT = re.compile(_CJK_CLASS + r"|[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+_CJK = re.compile(_CJK_CLASS)
+
+
+class Chunk(NamedTuple):
+    """A chunk of extracted text plus its character span in the source text."""
+
+    text: str
+    start: int
+    end: int
+    token_count: int
+
+
+class _Sentence(NamedTuple):
+    text: str
+    start: int
+    tokens: int
+    new_paragraph: bool
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count when no tokenizer is available: CJK chars count one each."""
+    cjk = len(_CJK.findall(text))
+    words = len(re.findall(r"[A-Za-z0-9_]+", text))
+    return cjk + words + len(re.findall(r"[^\sA-Za-z0-9_]", _CJK.sub("", text)))
+
+
+def _split_sentences(text: str, base: int, final: bool, new_para: bool):
+    """Split ``text`` into complete sentences.
+
+    Returns ``(sentences, consumed, new_para)`` where each sentence is
+    ``(text, start, new_paragraph)``; the unconsumed tail (an unfinished
+    sentence) is left for the next piece unless ``final`` is set.
+    """
+    out = []
+    pos = 0
+    for m in _BOUNDARY.finditer(text):
+        end = m.end()
+        # 边界位于片段末尾时，后续片段可能延续该边界（如 "\n" + "\n"），留待下次处理
+        if end == len(text) and not final:
+            break
+        if _PARAGRAPH.search(m.group()):
+            new_para = True
+        seg = text[pos:end]
+        # 纯空白片段并入下一句开头，保证块文本与原文切片一致
+        if not seg.strip():
+            continue
+        out.append((seg, base + pos, new_para))
+        new_para = False
+        pos = end
+    if final and pos < len(text):
+        seg = text[pos:]
+        if seg.strip():
+            out.append((seg, base + pos, new_para))
+        pos = len(text)
+    return out, pos, new_para
+
+
+def _hard_split(sent: _Sentence, max_tokens: int, count_tokens) -> List[_Sentence]:
+    """Split an over-long sentence into pieces of at most ``max_tokens``."""
+    pieces: List[_Sentence] = []
+    units = list(_UNIT.finditer(sent.text))
+    begin = 0
+    budget = 0
+    for i, m in enumerate(units):
+        cost = 1 if len(m.group()) == 1 else max(1, len(m.group()) // 4 + 1)
+        if budget + cost > max_tokens and budget:
+            cut = m.start()
+            part = sent.text[begin:cut]
+            pieces.append(_Sentence(part, sent.start + begin, count_tokens(part), False))
+            begin, budget = cut, 0
+        budget += cost
+    part = sent.text[begin:]
+    if part.strip():
+        pieces.append(_Sentence(part, sent.start + begin, count_tokens(part), False))
+    if pieces:
+        pieces[0] = pieces[0]._replace(new_paragraph=sent.new_paragraph)
+    return pieces
+
+
+def _make_chunk(sents: List[_Sentence]) -> Chunk:
+    raw = "".join(s.text for s in sents)
+    stripped = raw.strip()
+    start = sents[0].start + (len(raw) - len(raw.lstrip()))
+    return Chunk(stripped, start, start + len(stripped), sum(s.tokens for s in sents))
+
+
+def iter_chunks(
+    pieces: Iterable[str],
+    count_tokens: Callable[[str], int] = estimate_tokens,
+    max_tokens: int = 250,
+    overlap_tokens: int = 40,
+) -> Iterator[Chunk]:
+    """
+    Yield chunks of at most ``max_tokens`` tokens from a stream of text pieces.
+
+    Offsets are relative to the concatenation of all ``pieces``.  Chunks end
+    on sentence boundaries and prefer paragraph boundaries once at least half
+    full; consecutive chunks share trailing sentences worth up to
+    ``overlap_tokens`` tokens.
+    """
+    current: List[_Sentence] = []
+    current_tokens = 0
+
+    def sentences() -> Iterator[_Sentence]:
+        buf = ""
+        base = 0
+        new_para = True
+        for piece in pieces:
+            buf += piece
+            found, consumed, new_para = _split_sentences(buf, base, False, new_para)
+            for seg, start, para in found:
+                yield _Sentence(seg, start, count_tokens(seg), para)
+            buf = buf[consumed:]
+            base += consumed
+        found, _, _ = _split_sentences(buf, base, True, new_para)
+        for seg, start, para in found:
+            yield _Sentence(seg, start, count_tokens(seg), para)
+
+    for sent in sentences():
+        parts = (
+            _hard_split(sent, max_tokens, count_tokens)
+            if sent.tokens > max_tokens
+            else [sent]
+        )
+        for part in parts:
+            full = current_tokens + part.tokens > max_tokens
+            para_break = part.new_paragraph and current_tokens >= max_tokens // 2
+            if current and (full or para_break):
+                yield _make_chunk(current)
+                # 句子级重叠：保留末尾若干句作为下一块的开头
+                keep: List[_Sentence] = []
+                kept = 0
+                for prev in reversed(current):
+                    if kept + prev.tokens > overlap_tokens or kept + prev.tokens + part.tokens > max_tokens:
+                        break
+                    keep.insert(0, prev)
+                    kept += prev.tokens
+                if len(keep) == len(current):
+                    keep, kept = [], 0
+                current, current_tokens = keep, kept
+            current.append(part)
+            current_tokens += part.tokens
+
+    if current:
+        yield _make_chunk(current)
+
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def _paragraph(raw: str, pos: int):
+    stripped = raw.strip()
+    if not stripped:
+        return None
+    start = pos + (len(raw) - len(raw.lstrip()))
+    return Chunk(stripped, start, start + len(stripped), len(stripped.split()))
+
+
+def iter_paragraphs(pieces: Iterable[str], max_chars: int = 20000) -> Iterator[Chunk]:
+    """
+    Yield blank-line separated paragraphs from a stream of text pieces, with
+    offsets relative to their concatenation.  Text without a blank line for
+    more than ``max_chars`` characters is emitted as its own paragraph so
+    memory stays bounded.
+    """
+    buf = ""
+    base = 0
+    for piece in pieces:
+        buf += piece
+        pos = 0
+        for m in _PARAGRAPH_BREAK.finditer(buf):
+            # 分隔符位于末尾时可能延续到下一片段
+            if m.end() == len(buf):
+                break
+            para = _paragraph(buf[pos : m.start()], base + pos)
+            if para:
+                yield para
+            pos = m.end()
+        buf = buf[pos:]
+        base += pos
+        if len(buf) > max_chars:
+            para = _paragraph(buf, base)
+            if para:
+                yield para
+            base += len(buf)
+            buf = ""
+    para = _paragraph(buf, base)
+    if para:
+        yield para
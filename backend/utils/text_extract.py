@@ -0,0 +1,133 @@
+# backend/utils/text_extract.py
+
+"""
+从上传的文档中提取纯文本。
+
+单独成模块、不依赖 embedding 模型，以便在 extract_pool 的子进程中轻量加载。
+PDF 用 pdfminer 逐页解析并逐页写入文件，内存占用只与单页大小相关。
+"""
+
+import os
+import logging
+import platform
+from pathlib import Path
+from typing import Iterator
+
+import textract
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+
+# Try to import pywin32 COM if available
+try:
+    import win32com.client
+    from win32com.client import gencache, constants
+except ImportError:
+    win32com = None
+
+
+class ExtractionError(RuntimeError):
+    """Raised when no text could be extracted from a document."""
+
+
+def _reason(e: Exception) -> str:
+    # MemoryError 等异常的 str() 为空，退回异常类名
+    return str(e) or type(e).__name__
+
+
+def extract_text_strict(path: str) -> str:
+    """
+    Extract plain text from a document, raising ``ExtractionError`` on failure.
+     - .txt/.md: read directly
+     - .doc: on Windows, convert to .docx via COM then use textract
+     - others (.docx, .pdf, etc.): use textract directly
+    """
+    suffix = Path(path).suffix.lower()
+
+    if suffix in {".txt", ".md"}:
+        try:
+            return Path(path).read_text(encoding="utf-8", errors="ignore")
+        except Exception as e:
+            raise ExtractionError(f"Failed to read {path}: {_reason(e)}") from e
+
+    if suffix == ".doc":
+        if platform.system() != "Windows" or win32com is None:
+            raise ExtractionError(
+                f"Cannot extract .doc on non-Windows or missing pywin32: {path}"
+            )
+        tmp_path = str(path) + "x"  # abc.doc -> abc.docx
+        word = None
+        doc = None
+        try:
+            word = gencache.EnsureDispatch("Word.Application")
+            word.Visible = False
+            doc = word.Documents.Open(os.path.abspath(path), ReadOnly=True)
+            doc.SaveAs(os.path.abspath(tmp_path), FileFormat=constants.wdFormatXMLDocument)
+            doc.Close(False)
+            text_bytes = textract.process(tmp_path)
+            return text_bytes.decode("utf-8", errors="ignore")
+        except Exception as e:
+            raise ExtractionError(f"Failed to extract from .doc {path}: {_reason(e)}") from e
+        finally:
+            if doc:
+                try:
+                    doc.Close(False)
+                except Exception:
+                    pass
+            if word:
+                try:
+                    word.Quit()
+                except Exception:
+                    pass
+            if os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except Exception:
+                    pass
+
+    # fallback for .docx, .pdf, etc.
+    try:
+        raw = textract.process(path)
+        return raw.decode("utf-8", errors="ignore")
+    except Exception as e:
+        raise ExtractionError(f"textract failed on {path}: {_reason(e)}") from e
+
+
+def extract_text(path: str) -> str:
+    """Extract plain text from a document; logs and returns "" on failure."""
+    try:
+        return extract_text_strict(path)
+    except ExtractionError as e:
+        logging.error("%s", e)
+        return ""
+
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """Yield the text of each PDF page; text boxes are separated by blank lines."""
+    for page in extract_pages(path):
+        parts = [el.get_text() for el in page if isinstance(el, LTTextContainer)]
+        yield "\n".join(parts)
+
+
+def extract_to_file(path: str, out_path: str) -> int:
+    """
+    Extract the text of ``path`` into ``out_path`` and return its length.
+    PDFs are written page by page with "\f" between pages; other formats
+    are extracted in one go.  Raises ``ExtractionError`` on failure.
+    """
+    written = 0
+    with open(out_path, "w", encoding="utf-8", newline="") as out:
+        if Path(path).suffix.lower() == ".pdf":
+            try:
+                for i, page in enumerate(iter_pdf_pages(path)):
+                    if i:
+                        out.write("\f")
+                        written += 1
+                    out.write(page)
+                    written += len(page)
+            except Exception as e:
+                raise ExtractionError(f"pdfminer failed on {path}: {_reason(e)}") from e
+        else:
+            text = extract_text_strict(path)
+            out.write(text)
+            written = len(text)
+    return written
@@ -0,0 +1,276 @@
+# backend/utils/vector_cache.py
+
+"""
+进程级向量矩阵缓存。
+
+每个教师的私有文档、以及所有公共文档各自组成一个 "scope"，
+缓存一份连续的、已归一化的矩阵以及对应的 doc_id / chunk_index 数组。
+矩阵按 VECTOR_CACHE_DTYPE 以 float32 / float16 / int8 保存；压缩格式下先粗排，
+再从数据库取回候选向量按 float32 精排（VECTOR_RESCORE）。精排只在库中的格式
+（VECTOR_STORAGE_DTYPE）比缓存格式更精确时进行：两者相同（或库中更粗）时，
+取回的向量与缓存中的一样，多一次数据库查询也得不到更准的分数。
+教师的文档激活状态也单独缓存，检索时只需一次矩阵乘法，无需访问数据库。
+
+块级（document_vector）与段落级（document_paragraph）两种粒度分别缓存。
+缓存由 document_service 在文档上传、激活切换、删除时精确失效。
+"""
+
+import threading
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from sqlalchemy import text
+
+from backend.config import settings
+from backend.utils import vector_codec
+
+PUBLIC_SCOPE = "public"
+
+ScopeKey = Union[int, str]
+
+
+class Granularity(NamedTuple):
+    table: str
+    index_column: str
+
+
+CHUNKS = Granularity("document_vector", "chunk_index")
+PARAGRAPHS = Granularity("document_paragraph", "para_index")
+
+
+class ScopeMatrix(NamedTuple):
+    matrix: vector_codec.CompactMatrix  # (n, dim)，行已归一化
+    doc_ids: np.ndarray  # (n,) int64
+    chunk_indexes: np.ndarray  # (n,) int64，段落粒度下为段落序号
+
+
+class Activations(NamedTuple):
+    all_docs: FrozenSet[int]
+    active_docs: FrozenSet[int]
+
+
+_lock = threading.Lock()
+_scopes: Dict[Tuple[Granularity, ScopeKey], ScopeMatrix] = {}
+_activations: Dict[int, Activations] = {}
+# 失效计数：构建期间如发生失效，则丢弃构建结果，避免缓存旧数据
+_scope_gen: Dict[ScopeKey, int] = {}
+_act_gen: Dict[int, int] = {}
+
+
+def normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(mat / norms, dtype=np.float32)
+
+
+def scope_of(owner_id: int, is_public: bool) -> ScopeKey:
+    """Return the scope a document belongs to."""
+    return PUBLIC_SCOPE if is_public else owner_id
+
+
+def scope_filter(scope: ScopeKey) -> str:
+    """SQL condition on ``document d`` selecting the documents of ``scope``."""
+    if scope == PUBLIC_SCOPE:
+        return "d.is_public=1"
+    return f"d.owner_id={int(scope)} AND d.is_public=0"
+
+
+def _load_scope(session, scope: ScopeKey, granularity: Granularity) -> ScopeMatrix:
+    table, index_col = granularity
+    sql = (
+        f"SELECT v.doc_id, v.{index_col} AS idx, "
+        "v.vector_blob, v.vector_dtype, v.vector_scale "
+        f"FROM {table} v "
+        "JOIN document d ON v.doc_id=d.id "
+        f"WHERE {scope_filter(scope)} AND v.vector_blob IS NOT NULL "
+        f"ORDER BY v.doc_id, v.{index_col}"
+    )
+    rows = session.exec(text(sql)).all()
+
+    cache_dtype = settings.VECTOR_CACHE_DTYPE
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return ScopeMatrix(
+            vector_codec.compress(np.empty((0, 0), dtype=np.float32), cache_dtype),
+            empty,
+            empty,
+        )
+
+    return ScopeMatrix(
+        vector_codec.compress(normalize(vector_codec.decode_rows(rows)), cache_dtype),
+        np.fromiter((r.doc_id for r in rows), dtype=np.int64, count=len(rows)),
+        np.fromiter((r.idx for r in rows), dtype=np.int64, count=len(rows)),
+    )
+
+
+def _load_activations(session, teacher_id: int) -> Activations:
+    rows = session.exec(
+        text(
+            "SELECT doc_id, is_active FROM document_activation "
+            f"WHERE teacher_id={int(teacher_id)}"
+        )
+    ).all()
+    return Activations(
+        frozenset(r.doc_id for r in rows),
+        frozenset(r.doc_id for r in rows if r.is_active),
+    )
+
+
+def get_scope(
+    session, scope: ScopeKey, granularity: Granularity = CHUNKS
+) -> ScopeMatrix:
+    with _lock:
+        cached = _scopes.get((granularity, scope))
+        gen = _scope_gen.get(scope, 0)
+    if cached is not None:
+        return cached
+    built = _load_scope(session, scope, granularity)
+    with _lock:
+        if _scope_gen.get(scope, 0) == gen:
+            _scopes[(granularity, scope)] = built
+    return built
+
+
+def get_activations(session, teacher_id: int) -> Activations:
+    with _lock:
+        cached = _activations.get(teacher_id)
+        gen = _act_gen.get(teacher_id, 0)
+    if cached is not None:
+        return cached
+    built = _load_activations(session, teacher_id)
+    with _lock:
+        if _act_gen.get(teacher_id, 0) == gen:
+            _activations[teacher_id] = built
+    return built
+
+
+def invalidate_scope(scope: ScopeKey) -> None:
+    """Drop the cached matrices of a teacher id or ``PUBLIC_SCOPE``."""
+    with _lock:
+        for granularity in (CHUNKS, PARAGRAPHS):
+            _scopes.pop((granularity, scope), None)
+        _scope_gen[scope] = _scope_gen.get(scope, 0) + 1
+
+
+def invalidate_activations(teacher_id: Optional[int] = None) -> None:
+    """Drop cached activation state for one teacher, or for all when ``None``."""
+    with _lock:
+        ids = list(_activations) if teacher_id is None else [teacher_id]
+        for tid in ids:
+            _activations.pop(tid, None)
+            _act_gen[tid] = _act_gen.get(tid, 0) + 1
+
+
+def clear() -> None:
+    with _lock:
+        for _, scope in list(_scopes):
+            _scope_gen[scope] = _scope_gen.get(scope, 0) + 1
+        for tid in list(_activations):
+            _act_gen[tid] = _act_gen.get(tid, 0) + 1
+        _scopes.clear()
+        _activations.clear()
+
+
+def allowed_documents(
+    session, teacher_ids: Sequence[int], include_inactive: bool = False
+) -> FrozenSet[int]:
+    """Return ids of documents visible to the given teachers."""
+    allowed = set()
+    for tid in teacher_ids:
+        acts = get_activations(session, tid)
+        allowed |= acts.all_docs if include_inactive else acts.active_docs
+    return frozenset(allowed)
+
+
+def search(
+    session,
+    q_vec: np.ndarray,
+    teacher_ids: Sequence[int],
+    top_k: int = 5,
+    include_inactive: bool = False,
+    granularity: Granularity = CHUNKS,
+) -> List[Tuple[int, int, float]]:
+    """
+    Return the ``top_k`` ``(doc_id, chunk_index, score)`` hits for ``q_vec``
+    among documents activated by ``teacher_ids``.  With ``PARAGRAPHS`` the
+    second element is the paragraph index instead.
+    """
+    allowed = allowed_documents(session, teacher_ids, include_inactive)
+    if not allowed or top_k <= 0:
+        return []
+    allowed_arr = np.fromiter(allowed, dtype=np.int64, count=len(allowed))
+
+    q = np.asarray(q_vec, dtype=np.float32)
+    q_norm = float(np.linalg.norm(q))
+    if q_norm:
+        q = q / q_norm
+
+    sims_parts, doc_parts, chunk_parts = [], [], []
+    for scope in [*dict.fromkeys(teacher_ids), PUBLIC_SCOPE]:
+        sm = get_scope(session, scope, granularity)
+        if not len(sm.doc_ids):
+            continue
+        mask = np.isin(sm.doc_ids, allowed_arr)
+        if not mask.any():
+            continue
+        sims = vector_codec.scores(sm.matrix, q)
+        sims[~mask] = -np.inf
+        sims_parts.append(sims)
+        doc_parts.append(sm.doc_ids)
+        chunk_parts.append(sm.chunk_indexes)
+    if not sims_parts:
+        return []
+
+    sims = np.concatenate(sims_parts)
+    doc_ids = np.concatenate(doc_parts)
+    chunk_indexes = np.concatenate(chunk_parts)
+
+    rescore = settings.VECTOR_RESCORE and vector_codec.more_precise(
+        settings.VECTOR_STORAGE_DTYPE, settings.VECTOR_CACHE_DTYPE
+    )
+    wanted = top_k * max(1, settings.VECTOR_RESCORE_CANDIDATES) if rescore else top_k
+    k = min(wanted, len(sims))
+    idxs = np.argpartition(-sims, k - 1)[:k]
+    idxs = idxs[np.isfinite(sims[idxs])]
+    if rescore and len(idxs):
+        sims[idxs] = _exact_scores(
+            session, granularity, q, doc_ids[idxs], chunk_indexes[idxs], sims[idxs]
+        )
+    idxs = idxs[np.argsort(-sims[idxs])][:top_k]
+    return [(int(doc_ids[i]), int(chunk_indexes[i]), float(sims[i])) for i in idxs]
+
+
+def _exact_scores(
+    session,
+    granularity: Granularity,
+    q: np.ndarray,
+    doc_ids: np.ndarray,
+    indexes: np.ndarray,
+    approx: np.ndarray,
+) -> np.ndarray:
+    """Re-score candidates against their stored (more precise) vectors in float32.
+
+    Candidates whose row has disappeared keep their approximate score.
+    """
+    table, index_col = granularity
+    doc_clause = ",".join(str(int(d)) for d in set(doc_ids.tolist()))
+    idx_clause = ",".join(str(int(i)) for i in set(indexes.tolist()))
+    rows = session.exec(
+        text(
+            f"SELECT doc_id, {index_col} AS idx, vector_blob, vector_dtype, vector_scale "
+            f"FROM {table} "
+            f"WHERE doc_id IN ({doc_clause}) AND {index_col} IN ({idx_clause}) "
+            "AND vector_blob IS NOT NULL"
+        )
+    ).all()
+    if not rows:
+        return approx
+    exact = normalize(vector_codec.decode_rows(rows)) @ q
+    by_key = {(r.doc_id, r.idx): float(score) for r, score in zip(rows, exact)}
+    return np.array(
+        [
+            by_key.get((int(d), int(i)), float(a))
+            for d, i, a in zip(doc_ids, indexes, approx)
+        ],
+        dtype=np.float32,
+    )
@@ -0,0 +1,119 @@
+# backend/utils/vector_codec.py
+
+"""
+向量的存储 / 缓存格式。
+
+- float32：原始格式，vector_dtype 为 NULL 的旧数据也按此解析；
+- float16：体积减半；
+- int8：每个向量单独缩放（scale = max|v| / 127），vector_scale 记录缩放系数，体积约为 1/4。
+"""
+
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+INT8 = "int8"
+DTYPES = (FLOAT32, FLOAT16, INT8)
+
+_NUMPY = {FLOAT32: np.float32, FLOAT16: np.float16, INT8: np.int8}
+# 精度由低到高
+_PRECISION = {INT8: 0, FLOAT16: 1, FLOAT32: 2}
+# 打分时每次反量化的行数，限制临时 float32 内存
+_BLOCK_ROWS = 8192
+
+
+class CompactMatrix(NamedTuple):
+    data: np.ndarray  # (n, dim)，float32 / float16 / int8
+    scales: Optional[np.ndarray]  # (n,) float32，仅 int8 使用
+
+
+def check_dtype(dtype: Optional[str]) -> str:
+    dtype = dtype or FLOAT32
+    if dtype not in _NUMPY:
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    return dtype
+
+
+def more_precise(dtype: Optional[str], than: Optional[str]) -> bool:
+    """Whether vectors stored as ``dtype`` carry more precision than ``than``."""
+    return _PRECISION[check_dtype(dtype)] > _PRECISION[check_dtype(than)]
+
+
+def _int8_scales(mat: np.ndarray) -> np.ndarray:
+    scales = np.abs(mat).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return scales.astype(np.float32)
+
+
+def compress(mat: np.ndarray, dtype: str) -> CompactMatrix:
+    """Convert a float32 ``(n, dim)`` matrix to ``dtype``."""
+    dtype = check_dtype(dtype)
+    mat = np.asarray(mat, dtype=np.float32)
+    if dtype == INT8:
+        scales = _int8_scales(mat) if len(mat) else np.empty(0, dtype=np.float32)
+        codes = np.clip(np.rint(mat / scales[:, None]), -127, 127).astype(np.int8)
+        return CompactMatrix(codes, scales)
+    return CompactMatrix(np.ascontiguousarray(mat, dtype=_NUMPY[dtype]), None)
+
+
+def decompress(cm: CompactMatrix) -> np.ndarray:
+    mat = cm.data.astype(np.float32)
+    if cm.scales is not None:
+        mat *= cm.scales[:, None]
+    return mat
+
+
+def scores(cm: CompactMatrix, q: np.ndarray) -> np.ndarray:
+    """Return ``cm @ q`` in float32, dequantising block by block."""
+    out = np.empty(len(cm.data), dtype=np.float32)
+    for start in range(0, len(cm.data), _BLOCK_ROWS):
+        block = cm.data[start : start + _BLOCK_ROWS]
+        if block.dtype == np.float32:
+            part = block @ q
+        else:
+            part = block.astype(np.float32) @ q
+        if cm.scales is not None:
+            part *= cm.scales[start : start + _BLOCK_ROWS]
+        out[start : start + _BLOCK_ROWS] = part
+    return out
+
+
+def nbytes(cm: CompactMatrix) -> int:
+    return cm.data.nbytes + (cm.scales.nbytes if cm.scales is not None else 0)
+
+
+def encode(vec: np.ndarray, dtype: str) -> Tuple[bytes, Optional[float]]:
+    """Encode one vector as ``(vector_blob, vector_scale)``."""
+    cm = compress(np.asarray(vec, dtype=np.float32).reshape(1, -1), dtype)
+    scale = float(cm.scales[0]) if cm.scales is not None else None
+    return cm.data.tobytes(), scale
+
+
+def encode_many(mat: np.ndarray, dtype: str) -> Iterable[Tuple[bytes, Optional[float]]]:
+    cm = compress(mat, dtype)
+    for i, row in enumerate(cm.data):
+        yield row.tobytes(), (float(cm.scales[i]) if cm.scales is not None else None)
+
+
+def decode(blob: bytes, dtype: Optional[str], scale: Optional[float]) -> np.ndarray:
+    """Decode a stored ``vector_blob`` back to float32."""
+    dtype = check_dtype(dtype)
+    vec = np.frombuffer(blob, dtype=_NUMPY[dtype]).astype(np.float32)
+    if dtype == INT8:
+        vec *= scale if scale else 1.0
+    return vec
+
+
+def decode_rows(rows) -> np.ndarray:
+    """Decode rows with ``vector_blob``/``vector_dtype``/``vector_scale`` into a matrix."""
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+    first = decode(rows[0].vector_blob, rows[0].vector_dtype, rows[0].vector_scale)
+    mat = np.empty((len(rows), len(first)), dtype=np.float32)
+    mat[0] = first
+    for i in range(1, len(rows)):
+        r = rows[i]
+        mat[i] = decode(r.vector_blob, r.vector_dtype, r.vector_scale)
+    return mat
@@ -16,6 +16,7 @@ export default function StudentHomeworks() {
     not_submitted: { text: "未提交", icon: "✏️" },
     grading:       { text: "批改中", icon: "🕒" },
     completed:     { text: "已完成", icon: "✅" },
+    failed:        { text: "批改失败", icon: "⚠️" },
   };
 
   useEffect(() => {